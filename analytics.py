@@ -0,0 +1,135 @@
+"""
+Nutrition analytics: cached per-day plan totals and goal adherence
+"""
+import threading
+from collections import deque
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+
+from indexes import PlanIndex
+from nutrition import NutritionTable, rounded
+from records import GOAL_TOLERANCE, NUTRITION_FIELDS, nutrition_dict
+from store import Collection
+
+DayTotals = Tuple[int, Tuple[float, ...]]  # (plan count, totals in NUTRITION_FIELDS order)
+
+
+class DailyTotals:
+    """Per (customer, day) nutrition totals, computed from the plan index on
+    demand and cached until a plan of that day or a recipe it uses changes.
+
+    `version` is bumped on every invalidation; a total computed while an
+    invalidation raced with it is returned but not cached.
+    """
+
+    def __init__(self, plans: Collection, nutrition: NutritionTable, index: PlanIndex):
+        self.plans = plans
+        self.nutrition = nutrition
+        self.index = index
+        self.cache: Dict[Tuple[int, str], DayTotals] = {}
+        self.version = 0
+        self._lock = threading.Lock()
+        index.listeners.append(self.invalidate)
+
+    def invalidate(self, customer_id: Optional[int], day: Optional[str]):
+        with self._lock:
+            self.version += 1
+            if customer_id is None:
+                self.cache.clear()
+            else:
+                self.cache.pop((customer_id, day), None)
+
+    def on_recipe_change(self, collection, op: str, recipe):
+        """Recipe collection listener: drop the days whose plans use the recipe"""
+        if op == 'clear':
+            self.invalidate(None, None)
+            return
+        if not self.cache or not collection.changed(op, 'nutrition'):
+            return
+        for plan_id in self.index.plans_using_recipe(recipe.id):
+            entry = self.index.entry(plan_id)
+            if entry is not None:
+                self.invalidate(entry[0], entry[1])
+
+    def _compute(self, plan_ids) -> DayTotals:
+        plans = [plan for plan in map(self.plans.get, plan_ids) if plan is not None]
+        per_plan = self.nutrition.totals_many((plan.meal_recipes, plan.meal_portions) for plan in plans)
+        return len(plans), rounded(map(sum, zip(*per_plan))) if plans else (0,) * len(NUTRITION_FIELDS)
+
+    def days(self, customer_id: int, date_from: Optional[str] = None,
+             date_to: Optional[str] = None) -> List[Tuple[str, DayTotals]]:
+        """(date, (plan count, totals)) for each day with plans in the range"""
+        result = []
+        self.index.ensure_built()
+        version = self.version  # before the plan ids: totals of ids read after a change are not cached as current
+        for day, plan_ids in self.index.plan_ids(customer_id, date_from, date_to):
+            key = (customer_id, day)
+            totals = self.cache.get(key)
+            if totals is None:
+                totals = self._compute(plan_ids)
+                with self._lock:
+                    if version == self.version:
+                        self.cache[key] = totals
+            result.append((day, totals))
+        return result
+
+
+def adherence(days: List[Tuple[str, DayTotals]], goal: Tuple[int, ...], date_from: date,
+              window: int, within_goal: Optional[Callable[[Tuple[float, ...]], bool]] = None) -> dict:
+    """Daily totals, deviation from `goal` and trailing `window`-day averages.
+
+    A day is within the goal when `within_goal(totals)` holds (by default:
+    every macro within GOAL_TOLERANCE of the goal).
+
+    `days` may start up to `window - 1` days before `date_from` so the
+    first reported averages cover a full window; only days from
+    `date_from` on are reported. Days whose date is not ISO formatted are
+    skipped.
+    """
+    width = len(NUTRITION_FIELDS)
+    trailing = deque()
+    sums = [0] * width
+    reported = []
+    for day_text, (count, totals) in days:
+        try:
+            day = date.fromisoformat(day_text)
+        except ValueError:
+            continue
+        trailing.append((day.toordinal(), totals))
+        for i in range(width):
+            sums[i] += totals[i]
+        oldest = day.toordinal() - window  # ordinals: no overflow next to date.min
+        while trailing[0][0] <= oldest:
+            _, dropped = trailing.popleft()
+            for i in range(width):
+                sums[i] -= dropped[i]
+        if day < date_from:
+            continue
+        deviation = rounded(totals[i] - goal[i] for i in range(width))
+        reported.append({
+            'date': day_text,
+            'plans': count,
+            'total_nutrition': nutrition_dict(totals),
+            'deviation': nutrition_dict(deviation),
+            'rolling_average': nutrition_dict(round(s / len(trailing), 2) for s in sums),
+            'within_goal': within_goal(totals) if within_goal else
+            all(abs(deviation[i]) <= goal[i] * GOAL_TOLERANCE for i in range(width)),
+        })
+
+    n = len(reported)
+    columns = [[r['total_nutrition'][f] for r in reported] for f in NUTRITION_FIELDS]
+    deviations = [[r['deviation'][f] for r in reported] for f in NUTRITION_FIELDS]
+    return {
+        'goal': nutrition_dict(goal),
+        'window': window,
+        'days': reported,
+        'summary': {
+            'days': n,
+            'days_within_goal': sum(r['within_goal'] for r in reported),
+            'adherence_rate': round(sum(r['within_goal'] for r in reported) / n, 4) if n else None,
+            'average_nutrition': nutrition_dict(round(sum(c) / n, 2) for c in columns) if n else None,
+            'average_deviation': nutrition_dict(round(sum(c) / n, 2) for c in deviations) if n else None,
+            'mean_absolute_deviation':
+                nutrition_dict(round(sum(map(abs, c)) / n, 2) for c in deviations) if n else None,
+        },
+    }
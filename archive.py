@@ -0,0 +1,258 @@
+"""
+Cold tier: old days of a partitioned collection in compressed, immutable segments
+
+Moving days out of RAM (see the retention endpoint) writes them to a new
+segment file `<directory>/<collection>/seg-<seq>.seg`:
+
+    MAGIC | block* | footer (msgpack) | <u32 footer length> | MAGIC
+
+Records are sorted by id and packed `BLOCK_RECORDS` at a time; every block
+is a zlib-compressed msgpack list of `Record.to_state()`. The footer is the
+sparse index: per block its offset, length, first/last id and first/last
+day. Only footers stay in memory, so a lookup by id is a bisect over the
+block first-ids of each segment (newest first) and one block read; date
+ranges read only blocks whose days overlap. Decompressed blocks are kept
+in a small LRU shared by the segments of a tier.
+
+Segments are never modified: they are written to a temporary file, fsynced
+and renamed into place, and removed whole once every day they hold is
+past retention.
+"""
+import os
+import struct
+import threading
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import msgpack
+
+from partitions import PartitionedCollection
+from persistence import _fsync_dir
+from records import Record
+
+MAGIC = b'DIETSEG1'
+_TRAILER = struct.Struct('<I')
+BLOCK_RECORDS = 256
+ZLIB_LEVEL = 6
+
+
+class BlockInfo:
+    __slots__ = ('offset', 'length', 'first_id', 'last_id', 'first_day', 'last_day')
+
+    def __init__(self, offset, length, first_id, last_id, first_day, last_day):
+        self.offset = offset
+        self.length = length
+        self.first_id = first_id
+        self.last_id = last_id
+        self.first_day = first_day
+        self.last_day = last_day
+
+
+class Block:
+    """A decompressed block: record ids (sorted) and their states"""
+    __slots__ = ('ids', 'states')
+
+    def __init__(self, states: list):
+        self.states = states
+        self.ids = [state[0] for state in states]
+
+
+def encode_segment(records: List[Record], day_field: str) -> bytes:
+    """Segment bytes for `records` (sorted by id here)"""
+    records = sorted(records, key=lambda r: r.id)
+    parts = [MAGIC]
+    offset = len(MAGIC)
+    index = []
+    for start in range(0, len(records), BLOCK_RECORDS):
+        chunk = records[start:start + BLOCK_RECORDS]
+        data = zlib.compress(msgpack.packb([r.to_state() for r in chunk], use_bin_type=True), ZLIB_LEVEL)
+        days = [getattr(r, day_field) for r in chunk]
+        index.append([offset, len(data), chunk[0].id, chunk[-1].id, min(days), max(days)])
+        parts.append(data)
+        offset += len(data)
+    footer = msgpack.packb({'blocks': index, 'records': len(records)}, use_bin_type=True)
+    parts += [footer, _TRAILER.pack(len(footer)), MAGIC]
+    return b''.join(parts)
+
+
+class Segment:
+    """An open segment file: its footer in memory, blocks read on demand"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            self.size = os.fstat(self.fd).st_size
+            tail = os.pread(self.fd, _TRAILER.size + len(MAGIC), self.size - _TRAILER.size - len(MAGIC))
+            if os.pread(self.fd, len(MAGIC), 0) != MAGIC or tail[_TRAILER.size:] != MAGIC:
+                raise ValueError(f'{path} is not a segment file')
+            (footer_length,) = _TRAILER.unpack_from(tail)
+            footer_offset = self.size - len(tail) - footer_length
+            footer = msgpack.unpackb(os.pread(self.fd, footer_length, footer_offset), raw=False)
+        except BaseException:
+            os.close(self.fd)
+            raise
+        self.blocks = [BlockInfo(*entry) for entry in footer['blocks']]
+        self.count = footer['records']
+        self.first_ids = [b.first_id for b in self.blocks]
+        self.first_day = min((b.first_day for b in self.blocks), default=None)
+        self.last_day = max((b.last_day for b in self.blocks), default=None)
+
+    def block_for(self, record_id: int) -> Optional[int]:
+        i = bisect_right(self.first_ids, record_id) - 1
+        if i < 0 or self.blocks[i].last_id < record_id:
+            return None
+        return i
+
+    def read_block(self, i: int) -> Block:
+        info = self.blocks[i]
+        return Block(msgpack.unpackb(zlib.decompress(os.pread(self.fd, info.length, info.offset)), raw=False))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ColdTier:
+    """The cold segments of one partitioned collection, read through a block LRU"""
+
+    def __init__(self, directory: str, collection: PartitionedCollection, cache_blocks: int = 64):
+        self.directory = os.path.join(directory, collection.name)
+        self.name = collection.name
+        self.record_type = collection.record_type
+        self.day_field = collection.day_field
+        self.cache_blocks = cache_blocks
+        self.lock = threading.RLock()
+        self._cache: 'OrderedDict[tuple, Block]' = OrderedDict()
+        self.hits = self.misses = 0
+        self.generation = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.segments: List[Segment] = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.seg'):
+                self.segments.append(Segment(os.path.join(self.directory, name)))
+            elif name.endswith('.tmp'):
+                os.unlink(os.path.join(self.directory, name))  # a write that never completed
+
+    @property
+    def record_count(self) -> int:
+        return sum(s.count for s in self.segments)
+
+    @property
+    def bytes(self) -> int:
+        return sum(s.size for s in self.segments)
+
+    @property
+    def max_id(self) -> int:
+        return max((s.blocks[-1].last_id for s in self.segments if s.blocks), default=0)
+
+    def _next_path(self) -> str:
+        last = os.path.basename(self.segments[-1].path) if self.segments else 'seg-00000000.seg'
+        return os.path.join(self.directory, f'seg-{int(last[4:12]) + 1:08d}.seg')
+
+    def write(self, partitions: Dict[str, Dict[int, Record]]) -> Optional[Segment]:
+        """Persist the given day partitions as one new segment (durable on return)"""
+        records = [record for partition in partitions.values() for record in partition.values()]
+        if not records:
+            return None
+        with self.lock:
+            path = self._next_path()
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(encode_segment(records, self.day_field))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            _fsync_dir(self.directory)
+            segment = Segment(path)
+            self.segments.append(segment)
+            self.generation += 1
+            return segment
+
+    def _block(self, segment: Segment, i: int) -> Block:
+        # callers hold the lock, so segments cannot be closed underneath a read
+        key = (segment.path, i)
+        block = self._cache.get(key)
+        if block is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return block
+        self.misses += 1
+        block = self._cache[key] = segment.read_block(i)
+        while len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return block
+
+    def get(self, record_id: int) -> Optional[Record]:
+        """The archived record with this id, newest segment first"""
+        with self.lock:
+            for segment in reversed(self.segments):
+                i = segment.block_for(record_id)
+                if i is None:
+                    continue
+                block = self._block(segment, i)
+                j = bisect_left(block.ids, record_id)
+                if j < len(block.ids) and block.ids[j] == record_id:
+                    return self.record_type.from_state(block.states[j])
+        return None
+
+    def between(self, first: Optional[str] = None, last: Optional[str] = None) -> List[Record]:
+        """Archived records dated within [first, last], by day then id"""
+        found: Dict[int, Record] = {}
+        seen = set()
+        with self.lock:
+            for segment in reversed(self.segments):
+                for i, info in enumerate(segment.blocks):
+                    if (last is not None and info.first_day > last) or (first is not None and info.last_day < first):
+                        continue
+                    for state in self._block(segment, i).states:
+                        if state[0] in seen:
+                            continue  # a newer segment holds this record
+                        seen.add(state[0])
+                        record = self.record_type.from_state(state)
+                        day = getattr(record, self.day_field)
+                        if (first is None or day >= first) and (last is None or day <= last):
+                            found[record.id] = record
+        return sorted(found.values(), key=lambda r: (getattr(r, self.day_field), r.id))
+
+    def drop_before(self, day: str) -> int:
+        """Delete the segments whose days are all before `day`; returns how many"""
+        with self.lock:
+            expired = [s for s in self.segments if s.last_day is not None and s.last_day < day]
+            if not expired:
+                return 0
+            self.segments = [s for s in self.segments if s not in expired]
+            for segment in expired:
+                segment.close()
+                os.unlink(segment.path)
+                for key in [k for k in self._cache if k[0] == segment.path]:
+                    del self._cache[key]
+            _fsync_dir(self.directory)
+            self.generation += 1
+            return len(expired)
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+            self.segments = []
+            self._cache.clear()
+
+
+def render(tiers: Iterable[ColdTier]) -> str:
+    """Prometheus text for the cold tiers"""
+    tiers = list(tiers)
+    lines = []
+    for name, kind, help_text, value in (
+        ('diet_api_cold_segments', 'gauge', 'Segment files in the cold tier.', lambda t: len(t.segments)),
+        ('diet_api_cold_records', 'gauge', 'Records held in cold segments.', lambda t: t.record_count),
+        ('diet_api_cold_bytes', 'gauge', 'Size of the cold segment files.', lambda t: t.bytes),
+        ('diet_api_cold_block_hits_total', 'counter', 'Cold reads served from the decompressed block cache.',
+         lambda t: t.hits),
+        ('diet_api_cold_block_misses_total', 'counter', 'Cold reads that read and decompressed a block.',
+         lambda t: t.misses),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        lines += [f'{name}{{collection="{t.name}"}} {value(t)}' for t in tiers]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,85 @@
+"""
+Compression benchmark: CPU cost versus bytes saved per encoding and level
+
+    python -m benchmarks.bench_compression [--plans N] [--repeat K]
+
+Payloads are serialized exactly like the API does (compact JSON) from the
+synthetic benchmark data: one record, a 100-record page and the full
+lists. For every installed encoding (gzip always; br and zstd when the
+optional brotli / zstandard packages are installed) and a few levels,
+reports the compressed size, ratio, median compression time and the
+bytes saved per millisecond of CPU. Levels marked * are the ones
+compression.py uses.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LEVELS = {'gzip': (1, 5, 6, 9), 'br': (1, 4, 6, 11), 'zstd': (1, 3, 9, 19)}
+
+
+def payloads(plans: int):
+    from benchmarks import data
+    from idempotency import serialize
+
+    sizes = data.sizes(plans)
+    customers = [data.customer(i) for i in range(1, sizes['customers'] + 1)]
+    recipes = [data.recipe(i) for i in range(1, sizes['recipes'] + 1)]
+    diet_plans = [data.diet_plan(i, sizes['customers'], sizes['recipes']) for i in range(1, plans + 1)]
+    return {
+        'customer': serialize(customers[0]),
+        'diet_plans_page': serialize(diet_plans[:100]),
+        'customers': serialize(customers),
+        'recipes': serialize(recipes),
+        'diet_plans': serialize(diet_plans),
+    }
+
+
+def measure(encoding: str, level: int, body: bytes, repeat: int):
+    from compression import compress
+
+    runs = max(1, min(1000, (1 << 20) // max(len(body), 1)))
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time_ns()
+        for _ in range(runs):
+            out = compress(encoding, body, level)
+        samples.append((time.process_time_ns() - start) / runs)
+    return len(out), statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--plans', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import compression
+
+    defaults = {'gzip': compression.GZIP_LEVEL, 'br': compression.BROTLI_QUALITY, 'zstd': compression.ZSTD_LEVEL}
+    results = []
+    for name, body in payloads(args.plans).items():
+        for encoding in compression.AVAILABLE:
+            for level in LEVELS[encoding]:
+                size, ns = measure(encoding, level, body, args.repeat)
+                results.append({
+                    'payload': name,
+                    'bytes': len(body),
+                    'encoding': f'{encoding}-{level}' + ('*' if level == defaults[encoding] else ''),
+                    'compressed': size,
+                    'ratio': round(len(body) / size, 2),
+                    'cpu_us': round(ns / 1000, 1),
+                    'mb_per_s': round(len(body) / ns * 1000, 1),
+                    'saved_per_cpu_ms': round((len(body) - size) / (ns / 1e6)),
+                })
+    print(json.dumps({'available': list(compression.AVAILABLE), 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
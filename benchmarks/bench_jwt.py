@@ -0,0 +1,61 @@
+"""
+JWT benchmark: sign and verify cost per algorithm, cached key objects versus raw keys
+
+    python -m benchmarks.bench_jwt [--runs N] [--repeat K]
+
+For HS256 and ES256 reports the median microseconds to sign an access
+token and to verify it through `KeyRing` (key objects parsed once), next
+to verifying with the raw secret / PEM the way the app did before, which
+makes jose parse the key on every call. Token size is included since
+ES256 signatures are longer than HMACs. EdDSA is not measured: python-jose
+cannot sign or verify it.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.bench_wire import timed  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from jose import jwt
+    from keys import KeyRing, _generate_pem
+
+    claims = {'sub': 'admin', 'exp': int(time.time()) + 1800}
+    pem = _generate_pem()
+    results = []
+    for algorithm, raw_sign, raw_verify in (
+        ('HS256', 'benchmark-secret', 'benchmark-secret'),
+        ('ES256', pem, None),
+    ):
+        ring = KeyRing(algorithm, raw_sign if algorithm == 'HS256' else None)
+        if algorithm == 'ES256':
+            from jose import jwk
+            ring._add('bench', pem)
+            raw_verify = jwk.construct(pem, 'ES256').public_key().to_pem()
+        token = ring.sign(claims)
+        results.append({
+            'algorithm': algorithm,
+            'token_bytes': len(token),
+            'sign_us': round(timed(lambda: ring.sign(claims), args.runs, args.repeat), 2),
+            'verify_us': round(timed(lambda: ring.verify(token), args.runs, args.repeat), 2),
+            'sign_raw_key_us': round(timed(lambda: jwt.encode(claims, raw_sign, algorithm=algorithm),
+                                           args.runs, args.repeat), 2),
+            'verify_raw_key_us': round(timed(lambda: jwt.decode(token, raw_verify, algorithms=[algorithm]),
+                                             args.runs, args.repeat), 2),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Memory benchmark: bytes per record for the old dict layout vs slotted records
+
+    python -m benchmarks.bench_memory [--rows N]
+
+Each entity type is built N times as the nested dicts the API used to store
+and as its record class, measured with tracemalloc, and reported as MB per
+million records (numerically the same as bytes per record).
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+from benchmarks.data import customer, diet_plan, production_batch, recipe
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(build, rows):
+    """Bytes retained per row by `build(i)` for i in 1..rows"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(i) for i in range(1, rows + 1)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from records import CustomerRecord, DietPlanRecord, ProductionBatchRecord, RecipeRecord
+
+    entities = [
+        ('customers', customer, CustomerRecord),
+        ('recipes', recipe, RecipeRecord),
+        ('diet_plans', diet_plan, DietPlanRecord),
+        ('production_batches', production_batch, ProductionBatchRecord),
+    ]
+    result = {'rows': args.rows}
+    for name, make, record_type in entities:
+        as_dict = measure(make, args.rows)
+        as_record = measure(lambda i: record_type.from_dict(make(i)), args.rows)
+        result[name] = {
+            'dict_mb_per_million': round(as_dict, 1),
+            'record_mb_per_million': round(as_record, 1),
+            'saving': f'{1 - as_record / as_dict:.0%}',
+        }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Metrics overhead benchmark: per-request cost of MetricsRoute + timers
+
+    python -m benchmarks.bench_metrics [--requests N] [--repeat K]
+
+Two identical FastAPI apps (one plain, one with MetricsRoute and
+MetricsJSONResponse) are called directly through ASGI, without a network
+or test client in between, and the median per-request difference is
+reported. The budget is < 20 µs per request.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_app(instrumented):
+    from fastapi import FastAPI
+    from metrics import MetricsJSONResponse, MetricsRoute, metrics
+
+    if instrumented:
+        app = FastAPI(default_response_class=MetricsJSONResponse)
+        app.router.route_class = MetricsRoute
+    else:
+        app = FastAPI()
+    record = {'id': 1, 'name': 'Alma', 'goal': {'calories': 1900, 'protein': 90, 'carbs': 220, 'fat': 60}}
+
+    @app.get('/customers/{customer_id}')
+    def get_customer(customer_id: int):
+        if instrumented:
+            with metrics.timer('store_lookup'):
+                return record
+        return record
+
+    return app
+
+
+async def drive(app, requests):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': '/customers/1', 'raw_path': b'/customers/1', 'root_path': '',
+        'query_string': b'', 'headers': [], 'client': ('127.0.0.1', 1), 'server': ('127.0.0.1', 80),
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    plain, instrumented = build_app(False), build_app(True)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(drive(plain, 1000))
+    loop.run_until_complete(drive(instrumented, 1000))
+    base, timed = [], []
+    for _ in range(args.repeat):
+        base.append(loop.run_until_complete(drive(plain, args.requests)))
+        timed.append(loop.run_until_complete(drive(instrumented, args.requests)))
+    loop.close()
+    result = {
+        'requests': args.requests,
+        'plain_us': round(statistics.median(base) * 1e6, 2),
+        'instrumented_us': round(statistics.median(timed) * 1e6, 2),
+    }
+    result['overhead_us'] = round(result['instrumented_us'] - result['plain_us'], 2)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
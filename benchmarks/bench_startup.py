@@ -0,0 +1,95 @@
+"""
+Startup-time benchmark: import of main.py + seed data load, cold and warm
+
+    python -m benchmarks.bench_startup [--rows N] [--repeat K]
+
+cold: fresh interpreter with an empty bytecode cache (every module compiled)
+warm: fresh interpreter reusing the bytecode cache from a previous run
+
+For each case the child process reports how long `import main` took with
+DIET_API_SEED_SNAPSHOT pointing at a synthetic snapshot, and how long the
+first access to the recipe/customer collections took (lazy materialization).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.data import customer, recipe
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import time, sys
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+len(main.recipes); len(main.customers)
+t2 = time.perf_counter()
+main.recipe_index.search(['chicken'])
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2, 'jose' in sys.modules, 'passlib.context' in sys.modules)
+"""
+
+
+def synthetic_tables(rows):
+    return {
+        'customers': [customer(i) for i in range(1, rows + 1)],
+        'recipes': [recipe(i) for i in range(1, rows + 1)],
+    }
+
+
+def run_child(snapshot, pycache):
+    env = dict(os.environ, DIET_API_SEED_SNAPSHOT=snapshot, PYTHONPYCACHEPREFIX=pycache)
+    env.pop('DIET_API_DATA_DIR', None)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout.split()
+    return {
+        'import_s': float(out[0]),
+        'first_access_s': float(out[1]),
+        'first_search_s': float(out[2]),
+        'jose_loaded': out[3] == 'True',
+        'passlib_loaded': out[4] == 'True',
+    }
+
+
+def summarize(samples):
+    keys = ('import_s', 'first_access_s', 'first_search_s')
+    summary = {k: statistics.median(s[k] for s in samples) for k in keys}
+    summary['jose_loaded'] = any(s['jose_loaded'] for s in samples)
+    summary['passlib_loaded'] = any(s['passlib_loaded'] for s in samples)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from columnar import write_snapshot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, 'seed.col')
+        write_snapshot(snapshot, synthetic_tables(args.rows))
+        cold, warm = [], []
+        for i in range(args.repeat):
+            pycache = os.path.join(tmp, f'pycache-{i}')
+            cold.append(run_child(snapshot, pycache))
+            warm.append(run_child(snapshot, pycache))
+        result = {
+            'rows': args.rows,
+            'snapshot_bytes': os.path.getsize(snapshot),
+            'cold': summarize(cold),
+            'warm': summarize(warm),
+        }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Wire format benchmark: JSON versus MessagePack encode/decode cost and size
+
+    python -m benchmarks.bench_wire [--plans N] [--repeat K]
+
+Uses the synthetic benchmark data serialized the way the API does it
+(wire.encode) for one record, a 100-plan page and the full lists, and
+reports body size plus the median encode and decode time per format.
+Decoding is what a client (or the API, for request bodies) pays before
+Pydantic validation, which is the same for both formats.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(fn, runs: int, repeat: int) -> float:
+    """Median microseconds per call"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(runs):
+            fn()
+        samples.append((time.perf_counter_ns() - start) / runs / 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--plans', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import msgpack
+    from benchmarks import data
+    from wire import JSON, MSGPACK, encode
+
+    sizes = data.sizes(args.plans)
+    customers = [data.customer(i) for i in range(1, sizes['customers'] + 1)]
+    recipes = [data.recipe(i) for i in range(1, sizes['recipes'] + 1)]
+    plans = [data.diet_plan(i, sizes['customers'], sizes['recipes']) for i in range(1, args.plans + 1)]
+    payloads = {'customer': customers[0], 'diet_plans_page': plans[:100], 'customers': customers,
+                'recipes': recipes, 'diet_plans': plans}
+    decoders = {JSON: json.loads, MSGPACK: msgpack.unpackb}
+
+    results = []
+    for name, content in payloads.items():
+        row = {'payload': name}
+        for media_type, label in ((JSON, 'json'), (MSGPACK, 'msgpack')):
+            body = encode(content, media_type)
+            runs = max(1, min(10_000, (4 << 20) // len(body)))
+            decode = decoders[media_type]
+            row[f'{label}_bytes'] = len(body)
+            row[f'{label}_encode_us'] = round(timed(lambda: encode(content, media_type), runs, args.repeat), 2)
+            row[f'{label}_decode_us'] = round(timed(lambda: decode(body), runs, args.repeat), 2)
+        row['encode_speedup'] = round(row['json_encode_us'] / row['msgpack_encode_us'], 2)
+        row['decode_speedup'] = round(row['json_decode_us'] / row['msgpack_decode_us'], 2)
+        results.append(row)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
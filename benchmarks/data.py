@@ -0,0 +1,104 @@
+"""
+Deterministic synthetic data for benchmarks
+
+A scale is the number of diet plans; the other collections are sized from
+it so every reference (customerId, recipeId, dietPlans) points at a record
+that exists. Customer c gets one plan per consecutive day starting at
+START_DATE, so each customer has plans / customers days of history.
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterator
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+START_DATE = date(2025, 1, 1)
+MEAL_TYPES = ('BREAKFAST', 'LUNCH', 'DINNER')
+
+
+def sizes(plans: int) -> Dict[str, int]:
+    return {
+        'customers': max(plans // 10, 10),
+        'recipes': max(plans // 100, 30),
+        'diet_plans': plans,
+        'production_batches': max(plans // 100, 1),
+    }
+
+
+def customer(i: int) -> dict:
+    return {
+        'id': i,
+        'name': f'Customer {i}',
+        'email': f'customer{i}@example.com',
+        'phone': '123-456-7890',
+        'restrictions': [{'type': 'Allergy', 'description': 'Cashew allergy'}] if i % 3 == 0 else [],
+        'goal': {'calories': 1800 + i % 700, 'protein': 80 + i % 70, 'carbs': 200 + i % 80, 'fat': 60 + i % 20},
+    }
+
+
+def recipe(i: int) -> dict:
+    return {
+        'id': i,
+        'name': f'Recipe {i}',
+        'ingredients': ['chicken breast' if i % 2 else 'salmon fillet', 'lettuce', 'olive oil'],
+        'nutrition': {'calories': 200 + i % 600, 'protein': i % 60, 'carbs': i % 90, 'fat': i % 40},
+    }
+
+
+def plan_date(i: int, customers: int) -> str:
+    return (START_DATE + timedelta(days=(i - 1) // customers)).isoformat()
+
+
+def diet_plan(i: int, customers: int = 5000, recipes: int = 300) -> dict:
+    return {
+        'id': i,
+        'customerId': (i - 1) % customers + 1,
+        'date': plan_date(i, customers),
+        'meals': [
+            {'type': meal_type, 'recipeId': (i + k) % recipes + 1, 'portion': 1 + (k == 2)}
+            for k, meal_type in enumerate(MEAL_TYPES)
+        ],
+    }
+
+
+def production_batch(i: int, plans: int = 300_000, recipes: int = 300) -> dict:
+    first = (i - 1) * 100 % plans + 1
+    return {
+        'id': i,
+        'productionDate': plan_date(first, max(plans // 10, 10)),
+        'dietPlans': [first, first + 1, first + 2],
+        'recipeBatches': [
+            {'recipeId': i % recipes + 1, 'portions': 10},
+            {'recipeId': (i + 1) % recipes + 1, 'portions': 8},
+        ],
+    }
+
+
+def tables(plans: int) -> Dict[str, Iterator[dict]]:
+    """Record dicts per collection, generated lazily"""
+    n = sizes(plans)
+    return {
+        'customers': (customer(i) for i in range(1, n['customers'] + 1)),
+        'recipes': (recipe(i) for i in range(1, n['recipes'] + 1)),
+        'diet_plans': (diet_plan(i, n['customers'], n['recipes']) for i in range(1, plans + 1)),
+        'production_batches': (production_batch(i, plans, n['recipes'])
+                               for i in range(1, n['production_batches'] + 1)),
+    }
+
+
+def populate(main, plans: int) -> Dict[str, int]:
+    """Replace the app's collections with a synthetic dataset; returns collection sizes"""
+    targets = {
+        'customers': (main.customers, main.CustomerRecord),
+        'recipes': (main.recipes, main.RecipeRecord),
+        'diet_plans': (main.diet_plans, main.DietPlanRecord),
+        'production_batches': (main.production_batches, main.ProductionBatchRecord),
+    }
+    n = sizes(plans)
+    for name, rows in tables(plans).items():
+        collection, record_type = targets[name]
+        collection.clear()
+        collection.extend(map(record_type.from_dict, rows))
+    main.next_customer_id = n['customers'] + 1
+    main.next_recipe_id = n['recipes'] + 1
+    main.next_diet_plan_id = n['diet_plans'] + 1
+    main.next_production_batch_id = n['production_batches'] + 1
+    return n
@@ -0,0 +1,170 @@
+"""
+In-process ASGI load driver
+
+Requests are sent straight into the ASGI app (no sockets, no HTTP client),
+from `concurrency` asyncio workers per endpoint, so the numbers measure
+routing, auth, handlers and serialization only. Each endpoint runs until
+`requests` responses or `duration` seconds, whichever comes first.
+"""
+import asyncio
+import json
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# (name, method, path(rng, sizes), body(rng, sizes) or None)
+Endpoint = Tuple[str, str, Callable, Optional[Callable]]
+
+
+def _customer_body(rng, n):
+    return {
+        'name': 'Load Test',
+        'email': 'load@example.com',
+        'phone': '555-0100',
+        'restrictions': [],
+        'goal': {'calories': 2000, 'protein': 100, 'carbs': 250, 'fat': 70},
+    }
+
+
+def _recipe_body(rng, n):
+    return {
+        'name': 'Load Test Bowl',
+        'ingredients': ['rice', 'tofu'],
+        'nutrition': {'calories': 500, 'protein': 25, 'carbs': 60, 'fat': 15},
+    }
+
+
+def _plan_body(rng, n):
+    return {
+        'customerId': rng.randint(1, n['customers']),
+        'date': '2025-06-01',
+        'meals': [{'type': 'LUNCH', 'recipeId': rng.randint(1, n['recipes']), 'portion': 1}],
+    }
+
+
+def _batch_body(rng, n):
+    return {
+        'productionDate': '2025-06-01',
+        'dietPlans': [rng.randint(1, n['diet_plans'])],
+        'recipeBatches': [{'recipeId': rng.randint(1, n['recipes']), 'portions': 5}],
+    }
+
+
+def _id(name):
+    return lambda rng, n: rng.randint(1, n[name])
+
+
+ENDPOINTS: List[Endpoint] = [
+    ('GET /users/me', 'GET', lambda rng, n: '/users/me', None),
+    ('GET /customers', 'GET', lambda rng, n: '/customers', None),
+    ('GET /customers/{customer_id}', 'GET', lambda rng, n: f"/customers/{_id('customers')(rng, n)}", None),
+    ('POST /customers', 'POST', lambda rng, n: '/customers', _customer_body),
+    ('GET /customers/{customer_id}/adherence', 'GET',
+     lambda rng, n: f"/customers/{_id('customers')(rng, n)}/adherence?from=2025-01-01&to=2025-01-30", None),
+    ('GET /recipes', 'GET', lambda rng, n: '/recipes', None),
+    ('GET /recipes/search', 'GET',
+     lambda rng, n: '/recipes/search?ingredient=chicken&max_calories=500&sort=-protein&limit=20', None),
+    ('GET /recipes/{recipe_id}', 'GET', lambda rng, n: f"/recipes/{_id('recipes')(rng, n)}", None),
+    ('POST /recipes', 'POST', lambda rng, n: '/recipes', _recipe_body),
+    ('GET /diet-plans', 'GET', lambda rng, n: '/diet-plans', None),
+    ('GET /diet-plans?customerId', 'GET', lambda rng, n: f"/diet-plans?customerId={_id('customers')(rng, n)}", None),
+    ('GET /diet-plans/{plan_id}', 'GET', lambda rng, n: f"/diet-plans/{_id('diet_plans')(rng, n)}", None),
+    ('POST /diet-plans', 'POST', lambda rng, n: '/diet-plans', _plan_body),
+    ('POST /diet-plans/{plan_id}/validate', 'POST',
+     lambda rng, n: f"/diet-plans/{_id('diet_plans')(rng, n)}/validate", None),
+    ('GET /production-batches', 'GET', lambda rng, n: '/production-batches', None),
+    ('GET /production-batches/{batch_id}', 'GET',
+     lambda rng, n: f"/production-batches/{_id('production_batches')(rng, n)}", None),
+    ('POST /production-batches', 'POST', lambda rng, n: '/production-batches', _batch_body),
+    ('GET /production/forecast', 'GET', lambda rng, n: '/production/forecast?from=2025-01-01&to=2025-03-31', None),
+]
+
+
+async def asgi_request(app, method: str, url: str, headers: List[Tuple[bytes, bytes]], body: bytes = b''):
+    """Send one request into `app`; returns (status, response body)"""
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': parts.path, 'raw_path': parts.path.encode(), 'root_path': '',
+        'query_string': parts.query.encode(), 'headers': headers,
+        'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 80),
+    }
+    sent = False
+    status_code = None
+    chunks = []
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {'type': 'http.disconnect'}
+        sent = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        nonlocal status_code
+        if message['type'] == 'http.response.start':
+            status_code = message['status']
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return status_code, b''.join(chunks)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))]
+
+
+async def run_endpoint(app, endpoint: Endpoint, sizes: Dict[str, int], token: str,
+                       requests: int, concurrency: int, duration: float, seed: int = 0) -> dict:
+    name, method, path, make_body = endpoint
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0 and time.perf_counter() < deadline:
+            remaining -= 1
+            headers = [(b'authorization', f'Bearer {token}'.encode())]
+            body = b''
+            if make_body is not None:
+                body = json.dumps(make_body(rng, sizes)).encode()
+                headers.append((b'content-type', b'application/json'))
+            start = time.perf_counter()
+            status_code, _ = await asgi_request(app, method, path(rng, sizes), headers, body)
+            latencies.append(time.perf_counter() - start)
+            if status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / wall if wall else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def run(app, sizes: Dict[str, int], token: str, requests: int = 200, concurrency: int = 8,
+        duration: float = 10.0, endpoints: Optional[List[Endpoint]] = None) -> Dict[str, dict]:
+    """Drive every endpoint in turn; endpoint name -> rps/latency summary"""
+    loop = asyncio.new_event_loop()
+    try:
+        return {
+            endpoint[0]: loop.run_until_complete(
+                run_endpoint(app, endpoint, sizes, token, requests, concurrency, duration))
+            for endpoint in (endpoints or ENDPOINTS)
+        }
+    finally:
+        loop.close()
@@ -0,0 +1,73 @@
+"""
+Micro-benchmarks of the hot internals, against the populated app state
+
+Each benchmark is a zero-argument callable doing `ops` operations; the
+median of `repeat` runs is reported in nanoseconds per operation.
+"""
+import random
+import statistics
+import time
+from typing import Callable, Dict, Tuple
+
+
+def measure(run: Callable[[], None], ops: int, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        run()
+        samples.append((time.perf_counter_ns() - start) / ops)
+    return statistics.median(samples)
+
+
+def benchmarks(main, sizes: Dict[str, int], token: str, seed: int = 0) -> Dict[str, Tuple[Callable, int]]:
+    """name -> (callable, operations per call)"""
+    rng = random.Random(seed)
+    plan_ids = [rng.randint(1, sizes['diet_plans']) for _ in range(1000)]
+    plans = [main.diet_plans.get(i) for i in plan_ids]
+    pairs = [(p, main.customers.get(p.customerId)) for p in plans]
+    dates = sorted({p.date for p in plans})[:10]
+    page = [r.to_dict() for r in list(main.recipes)[:100]]
+    response_class = getattr(main.app.router.default_response_class, 'value',
+                             main.app.router.default_response_class)
+
+    def lookup():
+        for plan_id in plan_ids:
+            main.lookup(main.diet_plans, plan_id)
+
+    def validation():
+        for plan, customer in pairs:
+            main.evaluate_plan(plan, customer)
+
+    def batch_validation():
+        main.evaluate_plans(pairs)
+
+    def aggregation():
+        # portions per recipe for a production date: what a kitchen needs to cook
+        for day in dates:
+            totals: Dict[int, int] = {}
+            for plan in main.diet_plans:
+                if plan.date == day:
+                    for recipe_id, portion in zip(plan.meal_recipes, plan.meal_portions):
+                        totals[recipe_id] = totals.get(recipe_id, 0) + portion
+
+    def json_encode():
+        for _ in range(100):
+            response_class(page)
+
+    def jwt_verify():
+        for _ in range(100):
+            main.keyring.verify(token)
+
+    return {
+        'lookup': (lookup, len(plan_ids)),
+        'validation': (validation, len(pairs)),
+        'batch_validation': (batch_validation, len(pairs)),
+        'aggregation': (aggregation, len(dates)),
+        'json_encode_100_recipes': (json_encode, 100),
+        'jwt_verify': (jwt_verify, 100),
+    }
+
+
+def run(main, sizes: Dict[str, int], token: str, repeat: int = 5) -> Dict[str, float]:
+    """name -> median ns per operation"""
+    return {name: measure(fn, ops, repeat) for name, (fn, ops) in benchmarks(main, sizes, token).items()}
@@ -0,0 +1,124 @@
+"""
+Benchmark suite: synthetic data + micro-benchmarks + ASGI load, with baselines
+
+    python -m benchmarks.suite run --scale 1k --out benchmarks/results/1k.json
+    python -m benchmarks.suite compare BASELINE.json CURRENT.json [--threshold 0.10]
+
+`run` populates the app with a synthetic dataset (benchmarks/data.py;
+scales 1k / 100k / 1m diet plans), runs the micro-benchmarks and the load
+driver over every endpoint, and writes a flat JSON result file.
+
+`compare` checks every metric present in both files and exits with status
+1 when any regresses by more than `threshold` (relative). Throughput
+metrics (`*.rps`) regress when they drop; everything else when it rises.
+Compare results from the same machine and scale only.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith('.rps')
+
+
+def run_suite(plans: int, requests: int, concurrency: int, duration: float, repeat: int,
+              endpoints=None) -> dict:
+    """Populate the app, run micro and load benchmarks; returns the result document"""
+    os.environ.pop('DIET_API_DATA_DIR', None)
+    sys.path.insert(0, ROOT)
+    import main
+    from benchmarks import data, load, micro
+
+    started = time.perf_counter()
+    sizes = data.populate(main, plans)
+    populate_s = time.perf_counter() - started
+    token = main.create_access_token({'sub': 'admin'})
+
+    metrics: Dict[str, float] = {'data.populate_s': populate_s}
+    for name, ns in micro.run(main, sizes, token, repeat).items():
+        metrics[f'micro.{name}.ns_per_op'] = ns
+    for name, summary in load.run(main.app, sizes, token, requests, concurrency, duration, endpoints).items():
+        for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            metrics[f'load.{name}.{key}'] = summary[key]
+        metrics[f'load.{name}.errors'] = summary['errors']
+    return {
+        'plans': plans,
+        'sizes': sizes,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created': datetime.now(timezone.utc).isoformat(),
+        'settings': {'requests': requests, 'concurrency': concurrency, 'duration': duration, 'repeat': repeat},
+        'metrics': metrics,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> Tuple[List[str], List[str]]:
+    """(report lines, regressed metric names)"""
+    lines, regressions = [], []
+    base, cur = baseline['metrics'], current['metrics']
+    for metric in sorted(base.keys() & cur.keys()):
+        old, new = base[metric], cur[metric]
+        if old == 0:
+            change = 0.0 if new == 0 else float('inf')
+        else:
+            change = (new - old) / old
+        worse = -change if higher_is_better(metric) else change
+        regressed = worse > threshold
+        if regressed:
+            regressions.append(metric)
+        marker = 'REGRESSION' if regressed else ''
+        lines.append(f'{metric:<60} {old:>14.3f} {new:>14.3f} {change:>+8.1%} {marker}'.rstrip())
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the suite and write a result file')
+    run_parser.add_argument('--scale', default='1k', help='1k, 100k, 1m or a number of diet plans')
+    run_parser.add_argument('--out', help='result file (default: benchmarks/results/<scale>.json)')
+    run_parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--duration', type=float, default=10.0, help='max seconds per endpoint')
+    run_parser.add_argument('--repeat', type=int, default=5, help='micro-benchmark repetitions')
+
+    compare_parser = commands.add_parser('compare', help='fail if CURRENT regressed against BASELINE')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        from benchmarks.data import SCALES
+        plans = SCALES.get(args.scale.lower()) or int(args.scale)
+        result = run_suite(plans, args.requests, args.concurrency, args.duration, args.repeat)
+        out = args.out or os.path.join(ROOT, 'benchmarks', 'results', f'{args.scale}.json')
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        print(f'wrote {out}')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    lines, regressions = compare(baseline, current, args.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print(f'{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Change feed: store mutations as a resumable, sequence-numbered event stream
+
+Every write to a watched collection becomes an event with the next
+sequence number, serialized to JSON once and kept in a fixed-size ring
+buffer (slot = seq % capacity). Subscribers remember the last sequence
+they saw and ask for what came after it, so reconnecting clients resume
+exactly where they stopped as long as the buffer still reaches back that
+far; otherwise they are told they missed events and must reload.
+
+Writes happen on worker threads, subscribers wait on the event loop. Each
+loop with waiting subscribers has one shared asyncio.Event; the first
+write after they started waiting sets it (thread-safely) and every waiter
+of that loop wakes, so there is no thread or queue per subscriber.
+"""
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class Change(NamedTuple):
+    seq: int
+    collection: str
+    customer_id: Optional[int]
+    json: str  # the whole event, serialized once
+
+
+class ChangeFilter(NamedTuple):
+    collections: Optional[frozenset] = None
+    customer_id: Optional[int] = None
+
+    def matches(self, change: Change) -> bool:
+        return ((self.collections is None or change.collection in self.collections)
+                and (self.customer_id is None or change.customer_id == self.customer_id))
+
+
+def customer_of(collection: str, record) -> Optional[int]:
+    """The customer a record belongs to, for filtering"""
+    if collection == 'customers':
+        return record.id
+    return getattr(record, 'customerId', None)
+
+
+class ChangeFeed:
+    def __init__(self, capacity: int = 10_000):
+        self.capacity = capacity
+        self.seq = 0
+        self._buffer: List[Optional[Change]] = [None] * capacity
+        self._lock = threading.Lock()
+        self._signals: Dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
+
+    @property
+    def oldest(self) -> int:
+        """Lowest sequence number still in the buffer"""
+        return max(1, self.seq - self.capacity + 1)
+
+    def on_change(self, collection, op: str, record):
+        """Collection listener: publish the write"""
+        payload = {'collection': collection.name, 'op': op}
+        if op == 'drop':
+            payload['days'] = list(collection.dropped)
+        if record is not None:
+            payload['id'] = record.id
+            if op != 'delete':
+                payload['data'] = record.to_dict()
+        customer_id = None if record is None else customer_of(collection.name, record)
+        self.publish(collection.name, customer_id, payload)
+
+    def publish(self, collection: str, customer_id: Optional[int], payload: dict) -> int:
+        with self._lock:
+            seq = self.seq + 1
+            text = json.dumps({'seq': seq, **payload}, separators=(',', ':'))
+            self._buffer[seq % self.capacity] = Change(seq, collection, customer_id, text)
+            self.seq = seq
+            signals, self._signals = self._signals, {}
+        for loop, signal in signals.items():
+            try:
+                loop.call_soon_threadsafe(signal.set)
+            except RuntimeError:  # loop already closed
+                pass
+        return seq
+
+    def since(self, after: int, where: ChangeFilter = ChangeFilter(),
+              limit: Optional[int] = None) -> Tuple[List[Change], int, bool]:
+        """Matching changes after `after`: (changes, last sequence scanned, missed).
+
+        `missed` is true when events after `after` have already left the
+        buffer (or `after` predates a restart); nothing is returned then and
+        the caller should reload its state and resume from the returned sequence.
+        """
+        with self._lock:
+            last = self.seq
+            if after > last or after + 1 < self.oldest:
+                return [], last, True
+            found = []
+            for seq in range(after + 1, last + 1):
+                change = self._buffer[seq % self.capacity]
+                if where.matches(change):
+                    found.append(change)
+                    if limit is not None and len(found) >= limit:
+                        return found, seq, False
+        return found, last, False
+
+    async def wait(self, after: int, timeout: float) -> bool:
+        """Wait until something is published after `after`; False on timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._lock:
+                if self.seq > after:
+                    return True
+                signal = self._signals.get(loop)
+                if signal is None:
+                    signal = self._signals[loop] = asyncio.Event()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                async with asyncio.timeout(remaining):  # unlike wait_for, no task per waiter
+                    await signal.wait()
+            except TimeoutError:
+                return False
+
+    async def poll(self, after: int, where: ChangeFilter, timeout: float,
+                   limit: Optional[int] = None) -> Tuple[List[Change], int, bool]:
+        """Like `since`, but waits up to `timeout` for a matching change"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            found, after, missed = self.since(after, where, limit)
+            if found or missed:
+                return found, after, missed
+            if not await self.wait(after, deadline - loop.time()):
+                return [], after, False
+
+    async def stream(self, after: int, where: ChangeFilter, duration: float,
+                     heartbeat: float = 15.0) -> AsyncIterator[str]:
+        """Server-sent events for changes after `after`, for `duration` seconds.
+
+        A gap is announced with a `reset` event carrying the sequence the
+        stream continues from; idle periods send comment heartbeats.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        yield 'retry: 1000\n\n'
+        while True:
+            found, last, missed = self.since(after, where)
+            if missed:
+                yield f'id: {last}\nevent: reset\ndata: {{"seq":{last}}}\n\n'
+            for change in found:
+                yield f'id: {change.seq}\nevent: change\ndata: {change.json}\n\n'
+            after = last
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            if not await self.wait(after, min(heartbeat, remaining)):
+                yield ': keepalive\n\n'
+
+
+def render_poll(changes: Iterable[Change], seq: int, missed: bool) -> str:
+    """Long-poll response body, reusing each event's serialized JSON"""
+    events = ','.join(change.json for change in changes)
+    return f'{{"seq":{seq},"missed":{"true" if missed else "false"},"events":[{events}]}}'
@@ -0,0 +1,233 @@
+"""
+Memory-mapped columnar snapshot for seed/reference data (customers, recipes)
+
+File layout:
+    b'DIETCOL1' | u32 header length | JSON header | 8-byte aligned column buffers
+
+Each table stores one buffer set per column path. Integers are int64
+arrays, floats float64 arrays (NaN for a missing value), strings are an offsets array plus a UTF-8 blob, and string lists
+add a per-row offsets array on top of a string column. Opening a snapshot
+only maps the file and parses the header; rows are decoded when a table is
+first materialized.
+"""
+import gc
+import json
+import math
+import mmap
+import struct
+from array import array
+from typing import Dict, List
+
+from records import compact_number
+
+MAGIC = b'DIETCOL1'
+_HEADER_LEN = struct.Struct('<I')
+
+# column path -> kind; 'a[].b' is field b of every element of list a
+SCHEMAS = {
+    'customers': [
+        ('id', 'int'),
+        ('name', 'str'),
+        ('email', 'str'),
+        ('phone', 'str'),
+        ('restrictions[].type', 'strlist'),
+        ('restrictions[].description', 'strlist'),
+        ('goal.calories', 'int'),
+        ('goal.protein', 'int'),
+        ('goal.carbs', 'int'),
+        ('goal.fat', 'int'),
+        ('goal.tolerance', 'float'),
+        ('goal.rules', 'strlist'),
+    ],
+    'recipes': [
+        ('id', 'int'),
+        ('name', 'str'),
+        ('ingredients', 'strlist'),
+        ('nutrition.calories', 'float'),
+        ('nutrition.protein', 'float'),
+        ('nutrition.carbs', 'float'),
+        ('nutrition.fat', 'float'),
+        ('portionGrams', 'float'),
+    ],
+}
+
+
+def _extract(record: dict, path: str):
+    if '[]' in path:
+        list_name, field = path.split('[].')
+        return [item[field] for item in record[list_name]]
+    value = record
+    for part in path.split('.'):
+        value = value.get(part)
+    return value
+
+
+def _string_buffers(values: List[str]):
+    offsets = array('q', [0])
+    blob = bytearray()
+    for value in values:
+        blob += (value or '').encode('utf-8')
+        offsets.append(len(blob))
+    return [offsets.tobytes(), bytes(blob)]
+
+
+def _column_buffers(kind: str, values: list) -> List[bytes]:
+    if kind == 'int':
+        return [array('q', values).tobytes()]
+    if kind == 'float':
+        return [array('d', (math.nan if v is None else v for v in values)).tobytes()]
+    if kind == 'str':
+        return _string_buffers(values)
+    row_offsets = array('q', [0])
+    flat = []
+    for items in values:
+        flat.extend(items or ())
+        row_offsets.append(len(flat))
+    return [row_offsets.tobytes()] + _string_buffers(flat)
+
+
+def write_snapshot(path: str, tables: Dict[str, List[dict]]):
+    """Write `tables` (name -> records) as a columnar snapshot"""
+    header = {'tables': {}}
+    buffers: List[bytes] = []
+    position = 0
+    for name, records in tables.items():
+        columns = []
+        for column_path, kind in SCHEMAS[name]:
+            spans = []
+            for buffer in _column_buffers(kind, [_extract(r, column_path) for r in records]):
+                spans.append([position, len(buffer)])
+                padding = -len(buffer) % 8
+                buffers.append(buffer + b'\0' * padding)
+                position += len(buffer) + padding
+            columns.append({'path': column_path, 'kind': kind, 'buffers': spans})
+        header['tables'][name] = {
+            'rows': len(records),
+            'max_id': max((r['id'] for r in records), default=0),
+            'columns': columns,
+        }
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix_len = len(MAGIC) + _HEADER_LEN.size + len(header_bytes)
+    header_padding = -prefix_len % 8
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header_bytes) + header_padding))
+        f.write(header_bytes + b' ' * header_padding)
+        for buffer in buffers:
+            f.write(buffer)
+
+
+class MappedTable:
+    """Read-only view of one table inside a mapped snapshot"""
+
+    def __init__(self, view: memoryview, base: int, meta: dict):
+        self.rows = meta['rows']
+        self.max_id = meta['max_id']
+        self._view = view
+        self._base = base
+        self._columns = meta['columns']
+
+    def __len__(self):
+        return self.rows
+
+    def _buffer(self, span) -> memoryview:
+        offset, length = span
+        start = self._base + offset
+        return self._view[start:start + length]
+
+    def _strings(self, offsets_span, blob_span) -> List[str]:
+        offsets = self._buffer(offsets_span).cast('q').tolist()
+        blob = bytes(self._buffer(blob_span))
+        return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+    def column(self, column: dict) -> list:
+        spans = column['buffers']
+        if column['kind'] == 'int':
+            return self._buffer(spans[0]).cast('q').tolist()
+        if column['kind'] == 'float':
+            return [None if math.isnan(v) else compact_number(v) for v in self._buffer(spans[0]).cast('d')]
+        if column['kind'] == 'str':
+            return self._strings(spans[0], spans[1])
+        row_offsets = self._buffer(spans[0]).cast('q').tolist()
+        flat = self._strings(spans[1], spans[2])
+        return [flat[row_offsets[i]:row_offsets[i + 1]] for i in range(self.rows)]
+
+    def materialize(self) -> List[dict]:
+        """Decode every row back into the record dict shape"""
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._materialize()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _materialize(self) -> List[dict]:
+        # group columns by top-level field, then build each level with zip()
+        fields: Dict[str, list] = {}
+        for column in self._columns:
+            path = column['path']
+            if '[]' in path:
+                name, leaf = path.split('[].')
+                fields.setdefault(name, ('list', []))[1].append((leaf, self.column(column)))
+            elif '.' in path:
+                name, leaf = path.split('.', 1)
+                fields.setdefault(name, ('dict', []))[1].append((leaf, self.column(column)))
+            else:
+                fields[path] = ('value', self.column(column))
+        names, columns = [], []
+        for name, (kind, data) in fields.items():
+            names.append(name)
+            if kind == 'value':
+                columns.append(data)
+            elif kind == 'dict':
+                leaves = [leaf for leaf, _ in data]
+                columns.append([dict(zip(leaves, row)) for row in zip(*(values for _, values in data))])
+            else:
+                leaves = [leaf for leaf, _ in data]
+                columns.append([
+                    [dict(zip(leaves, item)) for item in zip(*row)]
+                    for row in zip(*(values for _, values in data))
+                ])
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+class ColumnarSnapshot:
+    """Memory-mapped snapshot file; cheap to open, decoded table by table"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            view.release()
+            self.close()
+            raise ValueError(f'{path} is not a columnar snapshot')
+        (header_len,) = _HEADER_LEN.unpack_from(self._mmap, len(MAGIC))
+        start = len(MAGIC) + _HEADER_LEN.size
+        header = json.loads(bytes(view[start:start + header_len]))
+        base = start + header_len
+        self._view = view
+        self.tables = {name: MappedTable(view, base, meta) for name, meta in header['tables'].items()}
+
+    def __contains__(self, name):
+        return name in self.tables
+
+    def __getitem__(self, name) -> MappedTable:
+        return self.tables[name]
+
+    def close(self):
+        if hasattr(self, '_view'):
+            self.tables = {}
+            self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 3:
+        sys.exit('usage: python columnar.py SEED.json OUT.col')
+    with open(sys.argv[1]) as f:
+        write_snapshot(sys.argv[2], json.load(f))
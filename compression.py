@@ -0,0 +1,367 @@
+"""
+Response compression negotiated from Accept-Encoding
+
+`CompressionMiddleware` compresses JSON and text responses of at least
+`minimum_size` bytes with the best encoding both sides support: zstd and
+br when the optional `zstandard` / `brotli` packages are installed, gzip
+(stdlib zlib) always. Bodies sent in one piece are compressed in one
+call; streamed bodies (StreamingResponse) go through an incremental
+compressor that is flushed after every chunk, so server-sent events still
+reach the client as they are produced.
+
+Responses that carry an ETag are the same bytes for as long as the ETag
+holds, so their compressed variants are kept in an LRU bounded by total
+bytes, keyed by (path, query, ETag, content type, encoding), and served again without
+recompressing.
+"""
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from anyio import to_thread
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+# levels picked for throughput on small-to-medium JSON: ratios close to the
+# defaults at a fraction of the CPU (see benchmarks/bench_compression.py)
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# bodies at least this big are compressed on a worker thread (zlib releases
+# the GIL) instead of blocking the event loop
+OFFLOAD_SIZE = 256 << 10
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/merge-patch+json', 'application/msgpack', 'text/')
+
+
+class _Gzip:
+    def __init__(self, level: int = GZIP_LEVEL):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16+15: gzip framing
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def flush(self) -> bytes:
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+
+class _Brotli:
+    def __init__(self, level: int = BROTLI_QUALITY):
+        self._c = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+class _Zstd:
+    def __init__(self, level: int = ZSTD_LEVEL):
+        self._c = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._c.flush()
+
+
+# encoding -> compressor class, in server preference order
+COMPRESSORS = {'gzip': _Gzip}
+if brotli is not None:
+    COMPRESSORS = {'br': _Brotli, **COMPRESSORS}
+if zstandard is not None:
+    COMPRESSORS = {'zstd': _Zstd, **COMPRESSORS}
+AVAILABLE = tuple(COMPRESSORS)
+
+
+def compress(encoding: str, data: bytes, level: Optional[int] = None) -> bytes:
+    compressor = COMPRESSORS[encoding]() if level is None else COMPRESSORS[encoding](level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def parse_encodings(spec: str) -> Tuple[str, ...]:
+    """Configured encodings, e.g. "zstd,br,gzip", minus those not installed.
+
+    "" means every installed encoding, "identity" none (compression off).
+    """
+    wanted = [e.strip().lower() for e in spec.split(',') if e.strip()]
+    for encoding in wanted:
+        if encoding not in ('zstd', 'br', 'gzip', 'identity'):
+            raise ValueError(f'Unknown content encoding {encoding!r}')
+    return tuple(e for e in wanted if e in COMPRESSORS) if wanted else AVAILABLE
+
+
+def negotiate(accept_encoding: str, supported: Tuple[str, ...]) -> Optional[str]:
+    """Best of `supported` (in preference order) acceptable per Accept-Encoding, or None for identity"""
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, *params = item.strip().split(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class VariantCache:
+    """LRU of compressed bodies, bounded by total bytes"""
+
+    def __init__(self, max_bytes: int = 16 << 20):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self._entries: 'OrderedDict[Hashable, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return body
+
+    def put(self, key: Hashable, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._entries[key] = body
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self.bytes -= len(self._entries.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class Compression:
+    """Settings, variant cache and counters shared by every request"""
+
+    def __init__(self, minimum_size: int = 1024, encodings: Tuple[str, ...] = AVAILABLE,
+                 cache_bytes: int = 16 << 20):
+        self.minimum_size = minimum_size
+        self.encodings = encodings
+        self.cache = VariantCache(cache_bytes)
+        self.responses: Dict[str, int] = {}
+        self.bytes_in: Dict[str, int] = {}
+        self.bytes_out: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, encoding: str, bytes_in: int, bytes_out: int, seconds: float, response: bool = True):
+        with self._lock:
+            if response:
+                self.responses[encoding] = self.responses.get(encoding, 0) + 1
+            self.bytes_in[encoding] = self.bytes_in.get(encoding, 0) + bytes_in
+            self.bytes_out[encoding] = self.bytes_out.get(encoding, 0) + bytes_out
+            self.seconds[encoding] = self.seconds.get(encoding, 0.0) + seconds
+
+    def reset(self):
+        self.cache.clear()
+        with self._lock:
+            self.responses.clear()
+            self.bytes_in.clear()
+            self.bytes_out.clear()
+            self.seconds.clear()
+
+    def render(self) -> str:
+        lines = [
+            '# HELP diet_api_compressed_responses_total Responses compressed, by content encoding.',
+            '# TYPE diet_api_compressed_responses_total counter',
+        ]
+        lines += [f'diet_api_compressed_responses_total{{encoding="{e}"}} {n}' for e, n in sorted(self.responses.items())]
+        lines += [
+            '# HELP diet_api_compression_bytes_total Bytes into and out of the compressor, by content encoding.',
+            '# TYPE diet_api_compression_bytes_total counter',
+        ]
+        for encoding in sorted(self.bytes_in):
+            lines.append(f'diet_api_compression_bytes_total{{encoding="{encoding}",direction="in"}} '
+                         f'{self.bytes_in[encoding]}')
+            lines.append(f'diet_api_compression_bytes_total{{encoding="{encoding}",direction="out"}} '
+                         f'{self.bytes_out[encoding]}')
+        lines += [
+            '# HELP diet_api_compression_seconds_total Time spent compressing, by content encoding.',
+            '# TYPE diet_api_compression_seconds_total counter',
+        ]
+        lines += [f'diet_api_compression_seconds_total{{encoding="{e}"}} {s:.6f}' for e, s in sorted(self.seconds.items())]
+        lines += [
+            '# HELP diet_api_compression_cache_hits_total Responses served from a cached compressed variant.',
+            '# TYPE diet_api_compression_cache_hits_total counter',
+            f'diet_api_compression_cache_hits_total {self.cache.hits}',
+            '# HELP diet_api_compression_cache_bytes Memory held by cached compressed variants.',
+            '# TYPE diet_api_compression_cache_bytes gauge',
+            f'diet_api_compression_cache_bytes {self.cache.bytes}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing eligible responses (see module docstring)"""
+
+    def __init__(self, app, compression: Compression):
+        self.app = app
+        self.compression = compression
+
+    async def __call__(self, scope, receive, send):
+        encodings = self.compression.encodings
+        if scope['type'] != 'http' or not encodings:
+            return await self.app(scope, receive, send)
+        accept = _header(scope['headers'], b'accept-encoding')
+        encoding = negotiate(accept.decode('latin-1'), encodings) if accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, _Responder(self.compression, scope, encoding, send).send)
+
+
+class _Responder:
+    """Per-request send wrapper: decides on the first body message, then passes through,
+    compresses the whole body, or compresses chunk by chunk"""
+
+    def __init__(self, compression: Compression, scope, encoding: str, send):
+        self.compression = compression
+        self.scope = scope
+        self.encoding = encoding
+        self._send = send
+        self.start = None
+        self.mode = None  # None until the first body message, then 'identity' / 'stream'
+        self.compressor = None
+
+    def eligible(self) -> bool:
+        headers = self.start['headers']
+        if self.start['status'] < 200 or self.start['status'] in (204, 206, 304):
+            return False
+        if _header(headers, b'content-encoding') is not None:
+            return False
+        content_type = (_header(headers, b'content-type') or b'').decode('latin-1')
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def headers(self, length: Optional[int]) -> List[Tuple[bytes, bytes]]:
+        headers = [(k, v) for k, v in self.start['headers'] if k.lower() != b'content-length']
+        headers.append((b'content-encoding', self.encoding.encode()))
+        if length is not None:
+            headers.append((b'content-length', str(length).encode()))
+        return headers
+
+    def vary(self):
+        headers = self.start['headers']
+        vary = _header(headers, b'vary')
+        if vary is None:
+            headers.append((b'vary', b'Accept-Encoding'))
+        elif b'accept-encoding' not in vary.lower():
+            headers[:] = [(k, v) for k, v in headers if k.lower() != b'vary']
+            headers.append((b'vary', vary + b', Accept-Encoding'))
+
+    async def send(self, message):
+        kind = message['type']
+        if kind == 'http.response.start':
+            self.start = dict(message, headers=list(message.get('headers', [])))
+            return
+        if kind != 'http.response.body':
+            return await self._send(message)
+        if self.mode is None:
+            await self.first(message)
+        elif self.mode == 'identity':
+            await self._send(message)
+        else:
+            await self.chunk(message)
+
+    async def first(self, message):
+        body = message.get('body', b'')
+        more = message.get('more_body', False)
+        if not self.eligible():
+            self.mode = 'identity'
+            await self._send(self.start)
+            return await self._send(message)
+        self.vary()
+        if not more:
+            self.mode = 'identity'
+            if len(body) < self.compression.minimum_size:
+                await self._send(self.start)
+                return await self._send(message)
+            body = await self.compressed(body)
+            await self._send(dict(self.start, headers=self.headers(len(body))))
+            return await self._send({'type': 'http.response.body', 'body': body})
+        self.mode = 'stream'
+        self.compressor = COMPRESSORS[self.encoding]()
+        await self._send(dict(self.start, headers=self.headers(None)))
+        await self.chunk(message)
+
+    async def compressed(self, body: bytes) -> bytes:
+        compression = self.compression
+        etag = _header(self.start['headers'], b'etag')
+        key = None
+        if etag is not None and self.scope['method'] == 'GET':
+            content_type = _header(self.start['headers'], b'content-type')
+            key = (self.scope['path'], self.scope['query_string'], etag, content_type, self.encoding)
+            cached = compression.cache.get(key)
+            if cached is not None:
+                return cached
+        started = time.perf_counter()
+        if len(body) >= OFFLOAD_SIZE:
+            out = await to_thread.run_sync(compress, self.encoding, body)
+        else:
+            out = compress(self.encoding, body)
+        compression.record(self.encoding, len(body), len(out), time.perf_counter() - started)
+        if key is not None:
+            compression.cache.put(key, out)
+        return out
+
+    async def chunk(self, message):
+        body = message.get('body', b'')
+        more = message.get('more_body', False)
+        started = time.perf_counter()
+        out = self.compressor.compress(body) + (self.compressor.flush() if more else self.compressor.finish())
+        self.compression.record(self.encoding, len(body), len(out), time.perf_counter() - started,
+                                     response=not more)
+        await self._send({'type': 'http.response.body', 'body': out, 'more_body': more})
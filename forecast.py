@@ -0,0 +1,253 @@
+"""
+Kitchen demand forecast: portions per day and recipe, maintained incrementally
+
+Each day with plans holds one dense int64 column indexed by recipe id
+(portions of that recipe planned for the day, in the fixed-point units of
+`DietPlanRecord.meal_portions`, so fractional portions add up exactly) and
+the day's ingredient demand. Plan writes add or subtract their meals from
+both; recipe writes move their portions from the old ingredients to the
+new ones. A forecast adds up the columns of the days in range as packed
+big integers (one C-level addition per day; portions are never negative,
+so the 64-bit slots do not borrow from each other) and reuses each day's
+rendered demand until that day changes, so it depends neither on the
+number of plans nor, for unchanged days, on the number of recipes.
+
+Columns are only as wide as the largest existing recipe id. Meals naming
+an id beyond that (no such recipe, or one the index has not seen yet) are
+kept in a small per-day dict, so a single odd recipe id cannot blow up
+every day's column.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import compress
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from records import PORTION_SCALE, DietPlanRecord, portion_value
+from store import Collection
+
+# recipe ids are small sequential integers; meals pointing outside this range
+# cannot name a real recipe and are left out
+MAX_RECIPE_ID = 1 << 24
+
+
+def _portion_values(units: List[int]) -> list:
+    # whole portions (the common case) are converted without a Python call per value
+    if any(map(PORTION_SCALE.__rmod__, units)):
+        return list(map(portion_value, units))
+    return list(map(PORTION_SCALE.__rfloordiv__, units))
+
+
+def _distinct(ingredients: Iterable[str]) -> Tuple[str, ...]:
+    return tuple(dict.fromkeys(ingredients))
+
+
+class DayDemand:
+    __slots__ = ('plans', 'portions', 'extra', 'ingredients', 'version', 'result')
+
+    def __init__(self, width: int):
+        self.plans = 0
+        self.version = 0
+        self.result: Optional[dict] = None  # rendered demand, until the day changes
+        self.portions = array('q', bytes(8 * width))
+        self.extra: Dict[int, int] = {}  # recipe id -> units, for ids beyond the column
+        self.ingredients: Dict[str, int] = {}  # ingredient -> units
+
+    def units(self, recipe_id: int) -> int:
+        return self.portions[recipe_id] if recipe_id < len(self.portions) else self.extra.get(recipe_id, 0)
+
+    def changed(self):
+        self.version += 1
+        self.result = None
+
+
+class ForecastIndex:
+    """Per-day recipe portion columns and ingredient demand over all diet plans.
+
+    Like the other indexes it remembers what it counted for each plan
+    (plans are updated in place) and, with a `source`, is built on first use.
+    The recipe id -> ingredients mapping follows the recipe collection and is
+    read from it again after a clear.
+    """
+
+    def __init__(self, recipes: Collection, source: Optional[Iterable[DietPlanRecord]] = None):
+        self.recipes = recipes
+        self.days: Dict[str, DayDemand] = {}
+        self.dates: List[str] = []
+        self.width = 64
+        self._entries: Dict[int, Tuple[str, Tuple[int, ...], Tuple[int, ...]]] = {}
+        self._recipe_ingredients: Dict[int, Tuple[str, ...]] = {}
+        self._recipes_stale = True
+        self.lock = threading.RLock()
+        self.source = source
+        self._stale = source is not None
+
+    def _ensure_built(self):
+        while self._stale or self._recipes_stale:
+            # read the recipes outside our lock (their listeners take it); a write
+            # notified in between bumps the generation and we read again
+            generation = self.recipes.generation
+            recipes = list(self.recipes) if self._recipes_stale else None
+            with self.lock:
+                if self._recipes_stale and recipes is not None and generation == self.recipes.generation:
+                    self._load_recipes(recipes)
+                if self._stale:
+                    self.rebuild(self.source)
+
+    def _load_recipes(self, recipes):
+        self._recipe_ingredients = {r.id: _distinct(r.ingredients) for r in recipes if 0 <= r.id < MAX_RECIPE_ID}
+        self._recipes_stale = False
+        self._grow(max(self._recipe_ingredients, default=0))
+        for day in self.days.values():
+            day.changed()
+            day.ingredients = {}
+            counted = list(compress(range(len(day.portions)), day.portions)) + list(day.extra)
+            for recipe_id in counted:
+                self._count(day, self._recipe_ingredients.get(recipe_id, ()), day.units(recipe_id))
+
+    def _grow(self, recipe_id: int):
+        if recipe_id < self.width:
+            return
+        width = self.width
+        while width <= recipe_id:
+            width *= 2
+        padding = array('q', bytes(8 * (width - self.width)))
+        for day in self.days.values():
+            day.portions.extend(padding)
+            for moved in [r for r in day.extra if r < width]:
+                day.portions[moved] = day.extra.pop(moved)
+        self.width = width
+
+    @staticmethod
+    def _count(day: DayDemand, ingredients: Tuple[str, ...], units: int):
+        counts = day.ingredients
+        for ingredient in ingredients:
+            total = counts.get(ingredient, 0) + units
+            if total:
+                counts[ingredient] = total
+            else:
+                del counts[ingredient]
+
+    def _apply(self, day_text: str, recipe_ids, portions, sign: int):
+        day = self.days.get(day_text)
+        if day is None:
+            day = self.days[day_text] = DayDemand(self.width)
+            insort(self.dates, day_text)
+        day.plans += sign
+        day.changed()
+        column, width, extra = day.portions, self.width, day.extra
+        recipe_ingredients = None if self._recipes_stale else self._recipe_ingredients
+        for recipe_id, portion in zip(recipe_ids, portions):
+            if recipe_id < width:
+                column[recipe_id] += sign * portion
+            else:
+                units = extra.get(recipe_id, 0) + sign * portion
+                if units:
+                    extra[recipe_id] = units
+                else:
+                    del extra[recipe_id]
+            if recipe_ingredients is not None:
+                self._count(day, recipe_ingredients.get(recipe_id, ()), sign * portion)
+        if not day.plans:
+            del self.days[day_text]
+            del self.dates[bisect_left(self.dates, day_text)]
+
+    def _add(self, plan: DietPlanRecord):
+        meals = [(r, p) for r, p in zip(plan.meal_recipes, plan.meal_portions) if 0 <= r < MAX_RECIPE_ID]
+        recipe_ids, portions = tuple(r for r, _ in meals), tuple(p for _, p in meals)
+        self._entries[plan.id] = (plan.date, recipe_ids, portions)
+        self._apply(plan.date, recipe_ids, portions, 1)
+
+    def _remove(self, plan_id: int):
+        entry = self._entries.pop(plan_id, None)
+        if entry is not None:
+            self._apply(*entry, -1)
+
+    def rebuild(self, plans: Iterable[DietPlanRecord]):
+        with self.lock:
+            self._stale = False
+            self.days.clear()
+            self.dates.clear()
+            self._entries.clear()
+            for plan in plans:
+                self._add(plan)
+
+    def on_change(self, collection, op: str, plan: Optional[DietPlanRecord]):
+        """Diet plan collection listener"""
+        if self._stale or not collection.changed(op, 'date', 'meal_recipes', 'meal_portions'):
+            return
+        if op == 'clear':
+            self.rebuild(())
+            self._stale = self.source is not None
+            return
+        with self.lock:
+            if op == 'drop':
+                for dropped in collection.dropped_records():
+                    self._remove(dropped.id)
+                return
+            self._remove(plan.id)
+            if op != 'delete':
+                self._add(plan)
+
+    def on_recipe_change(self, collection, op: str, recipe):
+        """Recipe collection listener: moves planned portions onto the recipe's new ingredients"""
+        with self.lock:
+            if op == 'clear':
+                self._recipes_stale = True
+            if self._recipes_stale or not collection.changed(op, 'ingredients') or not 0 <= recipe.id < MAX_RECIPE_ID:
+                return
+            old = self._recipe_ingredients.pop(recipe.id, ())
+            new = () if op == 'delete' else _distinct(recipe.ingredients)
+            if op != 'delete':
+                self._recipe_ingredients[recipe.id] = new
+                self._grow(recipe.id)
+            for day in self.days.values():
+                units = day.units(recipe.id)
+                if units:
+                    day.changed()
+                    self._count(day, old, -units)
+                    self._count(day, new, units)
+
+    @staticmethod
+    def _demand(column: array, extra: Dict[int, int], ingredients: Dict[str, int]) -> dict:
+        extra_ids = sorted(extra)
+        # parallel columns: portions[i] is planned for recipeIds[i]
+        return {
+            'recipeIds': list(compress(range(len(column)), column)) + extra_ids,
+            'portions': _portion_values(list(filter(None, column)) + [extra[r] for r in extra_ids]),
+            'ingredients': {i: portion_value(u) for i, u in sorted(ingredients.items())},
+        }
+
+    def forecast(self, date_from: str, date_to: str) -> dict:
+        """Per-day and total recipe portions and ingredient demand for [date_from, date_to]"""
+        self._ensure_built()
+        total_extra: Dict[int, int] = {}
+        total_ingredients: Dict[str, int] = {}
+        with self.lock:
+            dates = self.dates[bisect_left(self.dates, date_from):bisect_right(self.dates, date_to)]
+            days = [self.days[d] for d in dates]
+            width = self.width
+            packed = sum(int.from_bytes(day.portions, 'little') for day in days)
+            for day in days:
+                for key, units in day.extra.items():
+                    total_extra[key] = total_extra.get(key, 0) + units
+                for key, units in day.ingredients.items():
+                    total_ingredients[key] = total_ingredients.get(key, 0) + units
+            rendered = [(day, day.version, day.result or (day_text, day.plans, day.portions[:], dict(day.extra),
+                                                          dict(day.ingredients)))
+                        for day_text, day in zip(dates, days)]
+        result_days = []
+        for day, version, result in rendered:
+            if isinstance(result, tuple):
+                day_text, plans, column, extra, ingredients = result
+                result = {'date': day_text, 'plans': plans, **self._demand(column, extra, ingredients)}
+                with self.lock:
+                    if day.version == version:
+                        day.result = result
+            result_days.append(result)
+        total = array('q')
+        total.frombytes(packed.to_bytes(8 * width, 'little'))
+        return {'days': result_days, 'total': {
+            'plans': sum(day['plans'] for day in result_days),
+            **self._demand(total, total_extra, total_ingredients),
+        }}
@@ -0,0 +1,192 @@
+"""
+Customer goal rules: a small expression DSL compiled to Python functions
+
+A plan meets a customer's goal when every rule holds. Rules are boolean
+expressions over the plan's nutrition totals:
+
+    calories >= 1500 and calories <= 2200                bounds
+    abs(protein - goal.protein) <= 0.05 * goal.protein   a tighter tolerance
+    max(meal.calories) <= 800                            a per-meal cap
+    protein * 4 >= 0.25 * calories                       anything else
+    meals >= 3
+
+Names are `calories`, `protein`, `carbs`, `fat` (plan totals),
+`goal.<field>` (the customer's goal), `meal.<field>` (one value per meal,
+only inside `max`/`min`/`sum`) and `meals` (the number of meals). Allowed
+are numbers, + - *, / by a number, comparisons, and/or/not, `abs` and
+`min`/`max`. The goal's tolerance band (every macro within `tolerance` of
+its goal) is checked as the first rules, written in the same DSL.
+
+Rules are parsed with `ast`, checked against that whitelist and compiled
+once per customer into a single function (goal values inlined), so
+checking a plan is one call with no interpretation per plan. `GoalChecks`
+keeps the compiled checks per customer and drops them when the
+customer's goal changes.
+"""
+import ast
+import threading
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from records import NUTRITION_FIELDS, CustomerRecord
+from store import Collection
+
+MAX_RULE_LENGTH = 500
+
+_FIELDS = {field: i for i, field in enumerate(NUTRITION_FIELDS)}
+_COMPARISONS = (ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+_ARITHMETIC = (ast.Add, ast.Sub, ast.Mult, ast.Div)
+_AGGREGATES = ('max', 'min', 'sum')
+_NAMESPACE = {'__builtins__': {}, 'abs': abs, 'max': max, 'min': min, 'sum': sum, 'tuple': tuple, 'zip': zip}
+
+
+class RuleError(ValueError):
+    """A goal rule that does not parse or uses something outside the DSL"""
+
+
+def _number(node) -> bool:
+    return isinstance(node, ast.Constant) and type(node.value) in (int, float)
+
+
+def _load(name: str, index: Optional[int] = None):
+    node = ast.Name(name, ast.Load())
+    return node if index is None else ast.Subscript(node, ast.Constant(index), ast.Load())
+
+
+def _attribute(node, owner: str) -> Optional[int]:
+    # index of `owner.<field>`
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == owner:
+        return _FIELDS.get(node.attr)
+    return None
+
+
+class _Rewriter:
+    """Checks one rule against the DSL and rewrites it to read `t` (totals), `m` (meal values) and `n` (meals)"""
+
+    def __init__(self, goal: Sequence[float]):
+        self.goal = goal
+        self.per_plan = False  # reads meal values or the meal count, so it needs a plan
+        self.meal_values = False
+
+    def rule(self, node):
+        if isinstance(node, ast.BoolOp):
+            return ast.BoolOp(node.op, [self.rule(value) for value in node.values])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return ast.UnaryOp(node.op, self.rule(node.operand))
+        if isinstance(node, ast.Compare) and all(isinstance(op, _COMPARISONS) for op in node.ops):
+            return ast.Compare(self.value(node.left), node.ops, [self.value(c) for c in node.comparators])
+        raise RuleError('A rule must be a comparison, optionally combined with and/or/not')
+
+    def value(self, node):
+        if _number(node):
+            return node
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+            return ast.UnaryOp(node.op, self.value(node.operand))
+        if isinstance(node, ast.BinOp) and isinstance(node.op, _ARITHMETIC):
+            if isinstance(node.op, ast.Div) and not (_number(node.right) and node.right.value):
+                raise RuleError('Only division by a non-zero number is allowed')
+            return ast.BinOp(self.value(node.left), node.op, self.value(node.right))
+        if isinstance(node, ast.Name) and node.id in _FIELDS:
+            return _load('t', _FIELDS[node.id])
+        if isinstance(node, ast.Name) and node.id == 'meals':
+            self.per_plan = True
+            return _load('n')
+        if _attribute(node, 'goal') is not None:
+            return ast.Constant(self.goal[_attribute(node, 'goal')])
+        if _attribute(node, 'meal') is not None:
+            raise RuleError(f'{ast.unparse(node)} is only allowed inside max(), min() or sum()')
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            name, args = node.func.id, node.args
+            if name in _AGGREGATES and len(args) == 1 and _attribute(args[0], 'meal') is not None:
+                self.per_plan = self.meal_values = True
+                keywords = [] if name == 'sum' else [ast.keyword('default', ast.Constant(0))]
+                return ast.Call(_load(name), [_load('m', _attribute(args[0], 'meal'))], keywords)
+            if (name == 'abs' and len(args) == 1) or (name in ('max', 'min') and len(args) >= 2):
+                return ast.Call(_load(name), [self.value(arg) for arg in args], [])
+        raise RuleError(f'{ast.unparse(node)} is not allowed in goal rules')
+
+
+def parse_rule(text: str) -> ast.expr:
+    """The expression of one rule; raises RuleError"""
+    if len(text) > MAX_RULE_LENGTH:
+        raise RuleError(f'Goal rules are limited to {MAX_RULE_LENGTH} characters')
+    try:
+        return ast.parse(text.strip(), mode='eval').body
+    except (SyntaxError, ValueError, RecursionError):
+        raise RuleError(f'Cannot parse goal rule {text!r}') from None
+
+
+def check_rule(text: str) -> str:
+    """`text` if it is a valid rule; raises RuleError"""
+    _Rewriter((0,) * len(NUTRITION_FIELDS)).rule(parse_rule(text))
+    return text
+
+
+def band_rules(tolerance: float) -> Tuple[str, ...]:
+    """The tolerance band as rules: every macro within `tolerance` of its goal"""
+    return tuple(f'abs({f} - goal.{f}) <= {tolerance!r} * goal.{f}' for f in NUTRITION_FIELDS)
+
+
+class GoalCheck:
+    """One goal (band and rules) compiled into functions"""
+
+    __slots__ = ('rules', 'uses_meals', 'failures', 'within')
+
+    def __init__(self, goal: Sequence[float], tolerance: float, rules: Iterable[str] = ()):
+        self.rules = band_rules(tolerance) + tuple(rules)
+        expressions, totals_only = [], []
+        self.uses_meals = False
+        for text in self.rules:
+            rewriter = _Rewriter(goal)
+            expression = f'({ast.unparse(rewriter.rule(parse_rule(text)))})'
+            expressions.append(expression)
+            self.uses_meals = self.uses_meals or rewriter.meal_values
+            if not rewriter.per_plan:
+                totals_only.append(expression)
+        namespace = {**_NAMESPACE, 'RULES': self.rules}
+        # failures(totals, meal values or None, meal count): the failed rules, () when the goal is met
+        self.failures: Callable[..., Tuple[str, ...]] = eval(
+            f'lambda t, m, n: () if {" and ".join(expressions)} else '
+            f'tuple(rule for rule, ok in zip(RULES, ({", ".join(expressions)},)) if not ok)', namespace)
+        # within(totals): whether totals without a plan behind them (a day) meet the rules needing no plan
+        self.within: Callable[[Sequence[float]], bool] = eval(
+            f'lambda t: {" and ".join(totals_only) or "True"}', namespace)
+
+
+class GoalChecks:
+    """customer id -> compiled GoalCheck, dropped when the customer's goal changes"""
+
+    def __init__(self, customers: Collection):
+        self.customers = customers
+        self.checks: Dict[int, GoalCheck] = {}
+        self.compiled = 0
+        self.lock = threading.Lock()
+
+    def get(self, customer: CustomerRecord) -> GoalCheck:
+        check = self.checks.get(customer.id)
+        if check is None:
+            generation = self.customers.generation
+            check = GoalCheck(customer.goal, customer.tolerance, customer.rules)
+            with self.lock:
+                self.compiled += 1
+                # a customer written meanwhile may have been read half-updated; compile again next time
+                if generation == self.customers.generation:
+                    self.checks[customer.id] = check
+        return check
+
+    def on_change(self, collection, op: str, customer: Optional[CustomerRecord]):
+        """Customer collection listener"""
+        with self.lock:
+            if op == 'clear':
+                self.checks.clear()
+            elif collection.changed(op, 'goal', 'tolerance', 'rules'):
+                self.checks.pop(customer.id, None)
+
+    def render(self) -> str:
+        return '\n'.join([
+            '# HELP diet_api_goal_rules_compiled_total Customer goal rule sets compiled.',
+            '# TYPE diet_api_goal_rules_compiled_total counter',
+            f'diet_api_goal_rules_compiled_total {self.compiled}',
+            '# HELP diet_api_goal_rules_cached Compiled goal rule sets cached.',
+            '# TYPE diet_api_goal_rules_cached gauge',
+            f'diet_api_goal_rules_cached {len(self.checks)}',
+        ]) + '\n'
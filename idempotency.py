@@ -0,0 +1,129 @@
+"""
+Idempotency keys: run a create once per key and replay its response on retries
+
+Completed responses are kept serialized in an LRU ordered dict bounded by
+total bytes, and expire after `ttl` seconds. A request arriving while the
+first one with the same key is still running waits for it and replays
+its result instead of creating a duplicate. Failed requests are not
+stored, so a retry after an error runs again.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from pydantic_core import to_json
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body"""
+
+
+class _Pending:
+    __slots__ = ('fingerprint', 'done')
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+
+
+class _Stored:
+    __slots__ = ('fingerprint', 'body', 'expires')
+
+    def __init__(self, fingerprint, body: bytes, expires: float):
+        self.fingerprint = fingerprint
+        self.body = body
+        self.expires = expires
+
+
+def serialize(content: Any) -> bytes:
+    """Compact UTF-8 JSON of plain data, via pydantic-core's serializer (the bytes
+    the API's responses are rendered as)"""
+    return to_json(content)
+
+
+class IdempotencyCache:
+    # rough per-entry overhead on top of the body: key tuple, entry object, dict slot
+    ENTRY_OVERHEAD = 300
+
+    def __init__(self, ttl: float = 24 * 3600, max_bytes: int = 32 << 20):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.replayed = 0
+        self.coalesced = 0
+        self._stored: 'OrderedDict[Hashable, _Stored]' = OrderedDict()
+        self._pending: Dict[Hashable, _Pending] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._stored)
+
+    def clear(self):
+        with self._lock:
+            self._stored.clear()
+            self.bytes = 0
+
+    def _drop(self, key):
+        self.bytes -= len(self._stored.pop(key).body) + self.ENTRY_OVERHEAD
+
+    def _evict(self, now: float):
+        """Drop expired entries from the cold end, then least recently used ones over the cap"""
+        while self._stored:
+            key, entry = next(iter(self._stored.items()))
+            if entry.expires > now and self.bytes <= self.max_bytes:
+                break
+            self._drop(key)
+
+    def run(self, key: Hashable, fingerprint: Hashable, create: Callable[[], Any]) -> Tuple[bytes, bool]:
+        """(serialized response, replayed) for `key`, calling `create` only if nobody has"""
+        while True:
+            with self._lock:
+                stored = self._stored.get(key)
+                if stored is not None and stored.expires <= time.monotonic():
+                    self._drop(key)
+                    stored = None
+                if stored is not None:
+                    if stored.fingerprint != fingerprint:
+                        raise IdempotencyKeyReused(key)
+                    self._stored.move_to_end(key)
+                    self.replayed += 1
+                    return stored.body, True
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = _Pending(fingerprint)
+                    break
+                if pending.fingerprint != fingerprint:
+                    raise IdempotencyKeyReused(key)
+                self.coalesced += 1
+            # a duplicate in flight: wait for it, then replay (or take over if it failed)
+            pending.done.wait()
+
+        try:
+            body = serialize(create())
+            with self._lock:
+                now = time.monotonic()
+                self._stored[key] = _Stored(fingerprint, body, now + self.ttl)
+                self.bytes += len(body) + self.ENTRY_OVERHEAD
+                self._evict(now)
+            return body, False
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+
+    def render(self) -> str:
+        return '\n'.join([
+            '# HELP diet_api_idempotency_replays_total Create requests answered from a stored response.',
+            '# TYPE diet_api_idempotency_replays_total counter',
+            f'diet_api_idempotency_replays_total {self.replayed}',
+            '# HELP diet_api_idempotency_coalesced_total Duplicate create requests that waited for one in flight.',
+            '# TYPE diet_api_idempotency_coalesced_total counter',
+            f'diet_api_idempotency_coalesced_total {self.coalesced}',
+            '# HELP diet_api_idempotency_entries Stored idempotent responses.',
+            '# TYPE diet_api_idempotency_entries gauge',
+            f'diet_api_idempotency_entries {len(self._stored)}',
+            '# HELP diet_api_idempotency_bytes Approximate memory held by stored responses.',
+            '# TYPE diet_api_idempotency_bytes gauge',
+            f'diet_api_idempotency_bytes {self.bytes}',
+        ]) + '\n'
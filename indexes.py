@@ -0,0 +1,227 @@
+"""
+Secondary indexes over diet plans (by customer and date, by recipe) and
+reverse references from production batches (by plan, by recipe)
+"""
+import threading
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from records import DietPlanRecord, ProductionBatchRecord
+
+# listener(customer_id, date) for every (customer, day) whose plans changed;
+# (None, None) means everything may have changed
+KeyListener = Callable[[Optional[int], Optional[str]], None]
+
+
+class PlanIndex:
+    """Incrementally maintained plan indexes.
+
+    `by_customer` maps a customer id to {date: plan ids}, with the dates
+    also kept sorted in `dates` so a date range is two bisects.
+    `by_recipe` maps a recipe id to the plans with a meal using it.
+
+    Plan records are updated in place, so the index remembers what it
+    indexed for every plan (`_entries`) to be able to remove the old keys.
+    Like RecipeIndex, with a `source` it is built on first use.
+    """
+
+    def __init__(self, source: Optional[Iterable[DietPlanRecord]] = None):
+        self.by_customer: Dict[int, Dict[str, Set[int]]] = {}
+        self.dates: Dict[int, List[str]] = {}
+        self.by_recipe: Dict[int, Set[int]] = {}
+        self._entries: Dict[int, Tuple[int, str, Tuple[int, ...]]] = {}
+        self.listeners: List[KeyListener] = []
+        self.lock = threading.RLock()
+        self.source = source
+        self._stale = source is not None
+
+    def ensure_built(self):
+        """Build from `source` if not built yet (listeners are told about the rebuild)"""
+        if self._stale:
+            with self.lock:
+                if self._stale:
+                    self.rebuild(self.source)
+
+    def _notify(self, customer_id, date):
+        for listener in self.listeners:
+            listener(customer_id, date)
+
+    def _add(self, plan: DietPlanRecord):
+        recipe_ids = tuple(set(plan.meal_recipes))
+        self._entries[plan.id] = (plan.customerId, plan.date, recipe_ids)
+        days = self.by_customer.setdefault(plan.customerId, {})
+        ids = days.get(plan.date)
+        if ids is None:
+            ids = days[plan.date] = set()
+            insort(self.dates.setdefault(plan.customerId, []), plan.date)
+        ids.add(plan.id)
+        for recipe_id in recipe_ids:
+            self.by_recipe.setdefault(recipe_id, set()).add(plan.id)
+
+    def _remove(self, plan_id: int) -> Optional[Tuple[int, str, Tuple[int, ...]]]:
+        entry = self._entries.pop(plan_id, None)
+        if entry is None:
+            return None
+        customer_id, date, recipe_ids = entry
+        days = self.by_customer[customer_id]
+        ids = days[date]
+        ids.discard(plan_id)
+        if not ids:
+            del days[date]
+            dates = self.dates[customer_id]
+            del dates[bisect_left(dates, date)]
+            if not days:
+                del self.by_customer[customer_id]
+                del self.dates[customer_id]
+        for recipe_id in recipe_ids:
+            plans = self.by_recipe[recipe_id]
+            plans.discard(plan_id)
+            if not plans:
+                del self.by_recipe[recipe_id]
+        return entry
+
+    def rebuild(self, plans: Iterable[DietPlanRecord]):
+        with self.lock:
+            self._stale = False
+            self.by_customer.clear()
+            self.dates.clear()
+            self.by_recipe.clear()
+            self._entries.clear()
+            for plan in plans:
+                self._add(plan)
+        self._notify(None, None)
+
+    def on_change(self, collection, op: str, plan: Optional[DietPlanRecord]):
+        """Collection listener keeping the index in step with plan writes"""
+        if self._stale or not collection.changed(op, 'customerId', 'date', 'meal_recipes', 'meal_portions'):
+            return
+        if op == 'clear':
+            self.rebuild(())
+            self._stale = self.source is not None
+            return
+        if op == 'drop':
+            with self.lock:
+                removed = [self._remove(dropped.id) for dropped in collection.dropped_records()]
+            for customer_id, date in {entry[:2] for entry in removed if entry is not None}:
+                self._notify(customer_id, date)
+            return
+        with self.lock:
+            old = self._remove(plan.id)
+            if op != 'delete':
+                self._add(plan)
+        if old is not None:
+            self._notify(old[0], old[1])
+        if op != 'delete':
+            self._notify(plan.customerId, plan.date)
+
+    def plan_ids(self, customer_id: int, date_from: Optional[str] = None,
+                 date_to: Optional[str] = None) -> List[Tuple[str, Set[int]]]:
+        """(date, plan ids) for a customer's days within [date_from, date_to], by date"""
+        self.ensure_built()
+        with self.lock:
+            days = self.by_customer.get(customer_id)
+            if not days:
+                return []
+            dates = self.dates[customer_id]
+            start = 0 if date_from is None else bisect_left(dates, date_from)
+            end = len(dates) if date_to is None else bisect_right(dates, date_to)
+            return [(date, set(days[date])) for date in dates[start:end]]
+
+    def plans_using_recipe(self, recipe_id: int) -> Set[int]:
+        self.ensure_built()
+        with self.lock:
+            return set(self.by_recipe.get(recipe_id, ()))
+
+    def customer_plans(self, customer_id: int) -> Set[int]:
+        """Ids of all plans of a customer, any date"""
+        self.ensure_built()
+        with self.lock:
+            return {plan_id for ids in self.by_customer.get(customer_id, {}).values() for plan_id in ids}
+
+    def entry(self, plan_id: int) -> Optional[Tuple[int, str, Tuple[int, ...]]]:
+        """(customer id, date, recipe ids) the plan is indexed under"""
+        self.ensure_built()
+        return self._entries.get(plan_id)
+
+
+class BatchIndex:
+    """Reverse references from production batches.
+
+    `by_plan` maps a diet plan id to the batches listing it and `by_recipe`
+    a recipe id to the batches with a line for it. Maintained like PlanIndex.
+    """
+
+    def __init__(self, source: Optional[Iterable[ProductionBatchRecord]] = None):
+        self.by_plan: Dict[int, Set[int]] = {}
+        self.by_recipe: Dict[int, Set[int]] = {}
+        self._entries: Dict[int, Tuple[Tuple[int, ...], Tuple[int, ...]]] = {}
+        self.lock = threading.RLock()
+        self.source = source
+        self._stale = source is not None
+
+    def _ensure_built(self):
+        if self._stale:
+            with self.lock:
+                if self._stale:
+                    self.rebuild(self.source)
+
+    @staticmethod
+    def _link(index: Dict[int, Set[int]], keys, batch_id: int):
+        for key in keys:
+            index.setdefault(key, set()).add(batch_id)
+
+    @staticmethod
+    def _unlink(index: Dict[int, Set[int]], keys, batch_id: int):
+        for key in keys:
+            batches = index[key]
+            batches.discard(batch_id)
+            if not batches:
+                del index[key]
+
+    def _add(self, batch: ProductionBatchRecord):
+        plan_ids, recipe_ids = tuple(set(batch.dietPlans)), tuple(set(batch.batch_recipes))
+        self._entries[batch.id] = (plan_ids, recipe_ids)
+        self._link(self.by_plan, plan_ids, batch.id)
+        self._link(self.by_recipe, recipe_ids, batch.id)
+
+    def _remove(self, batch_id: int):
+        entry = self._entries.pop(batch_id, None)
+        if entry is not None:
+            self._unlink(self.by_plan, entry[0], batch_id)
+            self._unlink(self.by_recipe, entry[1], batch_id)
+
+    def rebuild(self, batches: Iterable[ProductionBatchRecord]):
+        with self.lock:
+            self._stale = False
+            self.by_plan.clear()
+            self.by_recipe.clear()
+            self._entries.clear()
+            for batch in batches:
+                self._add(batch)
+
+    def on_change(self, collection, op: str, batch: Optional[ProductionBatchRecord]):
+        """Production batch collection listener"""
+        if self._stale or not collection.changed(op, 'dietPlans', 'batch_recipes'):
+            return
+        if op == 'clear':
+            self.rebuild(())
+            self._stale = self.source is not None
+            return
+        with self.lock:
+            if op == 'drop':
+                for dropped in collection.dropped_records():
+                    self._remove(dropped.id)
+                return
+            self._remove(batch.id)
+            if op != 'delete':
+                self._add(batch)
+
+    def batches_with_plan(self, plan_id: int) -> Set[int]:
+        self._ensure_built()
+        with self.lock:
+            return set(self.by_plan.get(plan_id, ()))
+
+    def batches_using_recipe(self, recipe_id: int) -> Set[int]:
+        self._ensure_built()
+        with self.lock:
+            return set(self.by_recipe.get(recipe_id, ()))
@@ -0,0 +1,161 @@
+"""
+JWT signing keys: key ids, rotation, cached key objects, JWKS
+
+`KeyRing` holds the keys access tokens are signed and verified with, as
+parsed jose key objects built once (handing jose a PEM or secret string
+makes it parse the key again on every call). Every token carries the
+`kid` of the key that signed it; the newest key signs, older ones only
+verify until they fall out of the ring.
+
+- HS256 (default): one key, the shared secret. Nothing to publish.
+- ES256: P-256 key pairs, one `<kid>.pem` per key in `directory` (or a
+  process-local key when there is none). `rotate()` adds a new signing
+  key and keeps the newest `keep` keys. The public halves are published
+  as a JWKS, so other services verify tokens locally with
+  `KeyRing.from_jwks(...)` and never need a secret.
+
+jose and cryptography are imported on first use, like in main.py.
+"""
+import hashlib
+import os
+import secrets
+import threading
+from typing import Dict, List, Optional, Tuple
+
+ALGORITHMS = ('HS256', 'ES256')
+
+
+def _new_kid(newest: Optional[str]) -> str:
+    # a sequence number first, so kids (and key file names) sort by age
+    prefix = newest.split('-')[0] if newest else ''
+    return f'{int(prefix) + 1 if prefix.isdigit() else 1:06d}-{secrets.token_hex(4)}'
+
+
+def _generate_pem() -> bytes:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    return ec.generate_private_key(ec.SECP256R1()).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+
+
+class KeyRing:
+    """kid -> verification key, plus the (kid, key) that signs"""
+
+    def __init__(self, algorithm: str = 'HS256', secret: Optional[str] = None,
+                 directory: Optional[str] = None, keep: int = 3):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f'Unsupported JWT algorithm {algorithm!r} (one of {", ".join(ALGORITHMS)})')
+        if algorithm == 'HS256' and not secret:
+            raise ValueError('HS256 needs a secret')
+        self.algorithm = algorithm
+        self.secret = secret
+        self.directory = directory
+        self.keep = max(1, keep)
+        self._lock = threading.Lock()
+        self._signing: Optional[Tuple[str, object]] = None
+        self._verifying: Dict[str, object] = {}
+        self._jwks: Optional[dict] = None
+
+    @classmethod
+    def from_jwks(cls, jwks: dict) -> 'KeyRing':
+        """A verify-only ring from a published JWKS (what a sidecar runs)"""
+        from jose import jwk
+        ring = cls('ES256')
+        ring._verifying = {entry['kid']: jwk.construct(entry, entry.get('alg', 'ES256')) for entry in jwks['keys']}
+        return ring
+
+    # loading and rotation
+
+    def _ensure(self):
+        if self._verifying:
+            return
+        with self._lock:
+            if self._verifying:
+                return
+            if self.algorithm == 'HS256':
+                from jose import jwk
+                kid = 'hs-' + hashlib.sha256(self.secret.encode()).hexdigest()[:8]
+                key = jwk.construct(self.secret, 'HS256')
+                self._signing, self._verifying = (kid, key), {kid: key}
+                return
+            pems: List[Tuple[str, bytes]] = []
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+                for name in sorted(os.listdir(self.directory)):
+                    if name.endswith('.pem'):
+                        with open(os.path.join(self.directory, name), 'rb') as f:
+                            pems.append((name[:-4], f.read()))
+            if not pems:
+                pems.append(self._create())
+            for kid, pem in pems[-self.keep:]:
+                self._add(kid, pem)
+
+    def _create(self) -> Tuple[str, bytes]:
+        kid, pem = _new_kid(max(self._verifying, default=None)), _generate_pem()
+        if self.directory:
+            path = os.path.join(self.directory, kid + '.pem')
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pem)
+        return kid, pem
+
+    def _add(self, kid: str, pem: bytes):
+        from jose import jwk
+        key = jwk.construct(pem, self.algorithm)
+        self._signing = (kid, key)
+        self._verifying = {**self._verifying, kid: key.public_key()}
+        self._jwks = None
+
+    def rotate(self) -> str:
+        """Start signing with a new key; keys beyond `keep` are retired (and deleted). Returns the new kid"""
+        if self.algorithm == 'HS256':
+            raise ValueError('HS256 has a single shared secret; rotate it by changing SECRET_KEY')
+        self._ensure()
+        with self._lock:
+            kid, pem = self._create()
+            self._add(kid, pem)
+            for old in sorted(self._verifying)[:-self.keep]:
+                self._verifying = {k: v for k, v in self._verifying.items() if k != old}
+                if self.directory and os.path.exists(os.path.join(self.directory, old + '.pem')):
+                    os.unlink(os.path.join(self.directory, old + '.pem'))
+            self._jwks = None
+            return kid
+
+    @property
+    def kids(self) -> List[str]:
+        self._ensure()
+        return sorted(self._verifying)
+
+    # signing and verification
+
+    def sign(self, claims: dict) -> str:
+        from jose import jwt
+        self._ensure()
+        if self._signing is None:
+            raise ValueError('This key ring only verifies')
+        kid, key = self._signing
+        return jwt.encode(claims, key, algorithm=self.algorithm, headers={'kid': kid})
+
+    def verify(self, token: str) -> dict:
+        """The claims of a valid token; raises jose.JWTError otherwise"""
+        from jose import JWTError, jwt
+        self._ensure()
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None and self._signing is not None:
+            kid = self._signing[0]  # issued before tokens carried a kid
+        if not isinstance(kid, str):
+            raise JWTError('Invalid key id')
+        key = self._verifying.get(kid)
+        if key is None:
+            raise JWTError('Unknown signing key')
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+    def jwks(self) -> dict:
+        """The public verification keys as a JSON Web Key Set (empty for HS256)"""
+        self._ensure()
+        if self._jwks is None:
+            keys = []
+            if self.algorithm != 'HS256':
+                keys = [{**key.to_dict(), 'kid': kid, 'use': 'sig'} for kid, key in sorted(self._verifying.items())]
+            self._jwks = {'keys': keys}
+        return self._jwks
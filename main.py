@@ -1,20 +1,158 @@
-from fastapi import FastAPI, HTTPException, Query, Depends, status
+import asyncio
+import logging
+import math
+import os
+import secrets
+import sys
+from contextlib import asynccontextmanager
+
+from fastapi import Body, FastAPI, Header, HTTPException, Query, Depends, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+from typing import Annotated, Any, Callable, Dict, Hashable, Literal, Optional, List, Set
+from datetime import date, datetime, timedelta
+from operator import sub
+
+from analytics import DailyTotals, adherence
+from changes import ChangeFeed, ChangeFilter, render_poll
+from archive import ColdTier, render as render_cold_tiers
+from columnar import ColumnarSnapshot
+from compression import Compression, CompressionMiddleware, parse_encodings
+from forecast import ForecastIndex
+from goals import GoalChecks, check_rule
+from idempotency import IdempotencyCache, IdempotencyKeyReused
+from indexes import BatchIndex, PlanIndex
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
+from nutrition import NutritionTable, rounded
+from keys import KeyRing
+from partitions import PartitionedCollection
+from patch import merge_patch
+from persistence import DurableWritesMiddleware, Persistence
+from profiling import profiler, tracer
+from ratelimit import admission, rate_limiter
+from records import (
+    GOAL_TOLERANCE, NUTRITION_FIELDS, PORTION_SCALE, CustomerRecord, DietPlanRecord, ProductionBatchRecord, RecipeRecord,
+    nutrition_dict,
+)
+from search import RecipeIndex
+from singleflight import SingleFlight
+from store import Collection
+from sessions import InvalidRefreshToken, RefreshTokenStore
+from users import UserStore
+from wire import NegotiatedResponse, WireFormatRoute, encode, transcode, wire_format
 
 # JWT Configuration
 SECRET_KEY = "your-secret-key-change-this-in-production"  # Change this to a secure random key
-ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Signing (see keys.py): HS256 with SECRET_KEY, or ES256 key pairs kept in DIET_API_JWT_KEY_DIR
+# (newest DIET_API_JWT_KEYS_KEPT keys verify) and published on /.well-known/jwks.json
+ALGORITHM = os.getenv("DIET_API_JWT_ALGORITHM", "HS256")
+JWT_KEY_DIR = os.getenv("DIET_API_JWT_KEY_DIR")
+JWT_KEYS_KEPT = int(os.getenv("DIET_API_JWT_KEYS_KEPT", "3"))
+JWKS_MAX_AGE = 300
+# Refresh tokens (see sessions.py) renew access tokens without the password for this long
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.getenv("DIET_API_REFRESH_TOKEN_DAYS", "30"))
+
+# Persistence: set DIET_API_DATA_DIR to keep a write-ahead log + snapshots of the store
+DATA_DIR = os.getenv("DIET_API_DATA_DIR")
+WAL_SYNC = os.getenv("DIET_API_WAL_SYNC", "1") != "0"
+SNAPSHOT_EVERY = int(os.getenv("DIET_API_SNAPSHOT_EVERY", "100000"))
+
+# User accounts: set DIET_API_USERS_DB to a SQLite file to keep them across restarts
+# (default: in memory), and how many parsed users the auth path keeps cached
+USERS_DB = os.getenv("DIET_API_USERS_DB", ":memory:")
+USER_CACHE_SIZE = int(os.getenv("DIET_API_USER_CACHE", "10000"))
+
+# Seed data: set DIET_API_SEED_SNAPSHOT to a columnar snapshot (see columnar.py) of customers/recipes
+SEED_SNAPSHOT = os.getenv("DIET_API_SEED_SNAPSHOT")
+
+# Debugging: users allowed on /debug/*, and the share of requests traced into the ring buffer
+ADMIN_USERS = set(os.getenv("DIET_API_ADMIN_USERS", "admin").split(","))
+tracer.configure(
+    float(os.getenv("DIET_API_TRACE_SAMPLE_RATE", "0")),
+    int(os.getenv("DIET_API_TRACE_BUFFER", "1000")),
+)
+MAX_PROFILE_SECONDS = 60
+
+# Load shedding (see ratelimit.py for the spec format); both are off unless set
+#   DIET_API_RATE_LIMITS   per-user token buckets, e.g. "*=20:40,GET /diet-plans=2:5"
+#   DIET_API_CONCURRENCY   requests in flight, e.g. "*=64,GET /diet-plans=4"
+rate_limiter.configure(os.getenv("DIET_API_RATE_LIMITS", ""))
+admission.configure(os.getenv("DIET_API_CONCURRENCY", ""))
+
+# Change feed: how many recent store mutations /changes can replay
+CHANGES_BUFFER = int(os.getenv("DIET_API_CHANGES_BUFFER", "10000"))
+
+# Idempotency-Key on create endpoints: how long responses are replayable and the memory they may use
+idempotency = IdempotencyCache(
+    float(os.getenv("DIET_API_IDEMPOTENCY_TTL", str(24 * 3600))),
+    int(os.getenv("DIET_API_IDEMPOTENCY_MAX_BYTES", str(32 << 20))),
+)
+MAX_IDEMPOTENCY_KEY = 255
+
+# Response compression: encodings offered in preference order (default: all installed,
+# zstd > br > gzip; "identity" turns it off), the smallest body worth compressing and
+# the memory for compressed variants of ETag-stable responses
+compression = Compression(
+    int(os.getenv("DIET_API_COMPRESS_MIN_BYTES", "1024")),
+    parse_encodings(os.getenv("DIET_API_COMPRESSION", "")),
+    int(os.getenv("DIET_API_COMPRESSION_CACHE_BYTES", str(16 << 20))),
+)
+
+# Tiering of diet plans and production batches (see archive.py): with DIET_API_ARCHIVE_DIR
+# set, days older than DIET_API_COLD_DAYS move to compressed on-disk segments every
+# DIET_API_TIERING_INTERVAL seconds (0: only through POST /admin/retention) and stay
+# readable by id through a cache of decompressed blocks. Days older than
+# DIET_API_RETENTION_DAYS (0: never) are deleted, from RAM and disk.
+ARCHIVE_DIR = os.getenv("DIET_API_ARCHIVE_DIR")
+COLD_DAYS = int(os.getenv("DIET_API_COLD_DAYS", "90"))
+TIERING_INTERVAL = float(os.getenv("DIET_API_TIERING_INTERVAL", "3600"))
+
+logger = logging.getLogger('diet_api')
+COLD_CACHE_BLOCKS = int(os.getenv("DIET_API_COLD_CACHE_BLOCKS", "64"))
+RETENTION_DAYS = int(os.getenv("DIET_API_RETENTION_DAYS", "0"))
+
+# Longest date range /production/forecast accepts
+MAX_FORECAST_DAYS = 366
+
+# What deleting a referenced customer/recipe/diet plan does when the request
+# does not say (?references=): 'allow' leaves the references dangling,
+# 'restrict' refuses with 409, 'cascade' removes them
+DeletePolicy = Literal['allow', 'restrict', 'cascade']
+DELETE_POLICY: DeletePolicy = os.getenv("DIET_API_DELETE_POLICY", "allow")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-app = FastAPI(title="Personalized Diet Planning API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tiering = asyncio.create_task(tier_periodically()) if cold_tiers and TIERING_INTERVAL else None
+    yield
+    if tiering is not None:
+        tiering.cancel()
+    disable_persistence()
+    disable_cold_tier()
+
+app = FastAPI(
+    title="Personalized Diet Planning API",
+    lifespan=lifespan,
+    default_response_class=NegotiatedResponse,
+)
+# every route below records count / latency / in-flight metrics for its path template,
+# passes the admission gate and speaks JSON or MessagePack (see wire.py)
+app.router.route_class = WireFormatRoute
+app.add_middleware(CompressionMiddleware, compression=compression)
+# responses wait for their write-ahead log fsync here, after the endpoint released the collection locks
+app.add_middleware(DurableWritesMiddleware)
+
+@app.exception_handler(RequestValidationError)
+async def request_validation_error(request: Request, exc: RequestValidationError):
+    """FastAPI's 422, but NaN/Infinity inputs (which JSON cannot carry) are echoed as text"""
+    errors = jsonable_encoder(exc.errors(), custom_encoder={float: lambda v: v if math.isfinite(v) else str(v)})
+    return JSONResponse(status_code=422, content={'detail': errors})
 
 # ===================== AUTH MODELS =====================
 
@@ -30,6 +168,10 @@ class UserInDB(User):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class UserRegister(BaseModel):
     username: str
@@ -39,11 +181,37 @@ class UserRegister(BaseModel):
 
 # ===================== DATA MODELS =====================
 
+# dates are validated as `date` at ingest and stored as interned ISO text, which
+# sorts like the date itself and is what the day partitions are keyed by
+def day_text(day: date) -> str:
+    return sys.intern(day.isoformat())
+
+def shift_day(day: date, days: int) -> date:
+    """`day` moved by `days`, clamped to [date.min, date.max]"""
+    return date.fromordinal(min(max(day.toordinal() + days, 1), date.max.toordinal()))
+
+MAX_GOAL_RULES = 50
+
+# goals and per-portion nutrition are bounded so that totals and differences stay finite floats
+MAX_NUTRITION = 1_000_000
+Nutrient = Annotated[int, Field(ge=-MAX_NUTRITION, le=MAX_NUTRITION)]
+
+# `tolerance`: share of the goal each macro may deviate; `rules`: extra checks (see goals.py)
 class NutritionalGoal(BaseModel):
-    calories: int
-    protein: int
-    carbs: int
-    fat: int
+    calories: Nutrient
+    protein: Nutrient
+    carbs: Nutrient
+    fat: Nutrient
+    tolerance: float = Field(GOAL_TOLERANCE, ge=0, allow_inf_nan=False)
+    rules: List[str] = Field([], max_length=MAX_GOAL_RULES)
+
+    @field_validator('rules')
+    @classmethod
+    def check_rules(cls, rules: List[str]) -> List[str]:
+        return [check_rule(rule) for rule in rules]
+
+    def as_tuple(self):
+        return (self.calories, self.protein, self.carbs, self.fat)
 
 class DietaryRestriction(BaseModel):
     type: str
@@ -57,63 +225,117 @@ class Customer(BaseModel):
     restrictions: List[DietaryRestriction] = []
     goal: NutritionalGoal
 
+    def record_fields(self) -> dict:
+        restrictions = [(r.type, r.description) for r in self.restrictions]
+        return CustomerRecord.fields(self.name, self.email, self.phone, restrictions, self.goal.as_tuple(),
+                                     self.goal.tolerance, self.goal.rules)
+
+# nutrition and portions may be fractional; NaN/Infinity are refused (they cannot be sent as JSON)
 class NutritionalFacts(BaseModel):
-    calories: int
-    protein: int
-    carbs: int
-    fat: int
+    calories: float = Field(ge=-MAX_NUTRITION, le=MAX_NUTRITION, allow_inf_nan=False)
+    protein: float = Field(ge=-MAX_NUTRITION, le=MAX_NUTRITION, allow_inf_nan=False)
+    carbs: float = Field(ge=-MAX_NUTRITION, le=MAX_NUTRITION, allow_inf_nan=False)
+    fat: float = Field(ge=-MAX_NUTRITION, le=MAX_NUTRITION, allow_inf_nan=False)
+
+    def as_tuple(self):
+        return (self.calories, self.protein, self.carbs, self.fat)
 
 class Recipe(BaseModel):
     id: Optional[int] = None
     name: str
     ingredients: List[str] = []
-    nutrition: NutritionalFacts
+    nutrition: NutritionalFacts  # per portion
+    portionGrams: Optional[float] = Field(None, gt=0, allow_inf_nan=False)
+
+    def record_fields(self) -> dict:
+        return RecipeRecord.fields(self.name, self.ingredients, self.nutrition.as_tuple(), self.portionGrams)
+
+MAX_PORTION = 1000
+MIN_PORTION = 1 / PORTION_SCALE  # the smallest portion that does not round to 0 when stored
+
+# ids and batch portions are stored in int64 columns
+StoredInt = Annotated[int, Field(ge=0, lt=2**63)]
 
 class MealPlan(BaseModel):
     type: str
-    recipeId: int
-    portion: int = 1
+    recipeId: StoredInt
+    portion: float = Field(1, ge=MIN_PORTION, le=MAX_PORTION, allow_inf_nan=False)
+    grams: Optional[float] = Field(None, gt=0, allow_inf_nan=False)  # instead of portion, for recipes with portionGrams
+
+    @model_validator(mode='after')
+    def portion_or_grams(self) -> 'MealPlan':
+        if self.grams is not None and 'portion' in self.model_fields_set:
+            raise ValueError('Give either portion or grams, not both')
+        return self
 
 class DietPlan(BaseModel):
     id: Optional[int] = None
     customerId: int
-    date: str
+    date: date
     meals: List[MealPlan] = []
 
+    def day(self) -> str:
+        return day_text(self.date)
+
+MAX_VALIDATE_BATCH = 10_000
+
+class PlanBatch(BaseModel):
+    planIds: List[int] = Field(..., max_length=MAX_VALIDATE_BATCH)
+
 class RecipeBatch(BaseModel):
-    recipeId: int
-    portions: int
+    recipeId: StoredInt
+    portions: StoredInt
 
 class ProductionBatch(BaseModel):
     id: Optional[int] = None
-    productionDate: str
-    dietPlans: List[int] = []
+    productionDate: date
+    dietPlans: List[StoredInt] = []
     recipeBatches: List[RecipeBatch] = []
 
+    def record_fields(self) -> dict:
+        lines = ((rb.recipeId, rb.portions) for rb in self.recipeBatches)
+        return ProductionBatchRecord.fields(day_text(self.productionDate), self.dietPlans, lines)
+
 # ===================== AUTH UTILITIES =====================
 
-# In-memory user database (for demo purposes)
-users_db = {
-    "admin": {
-        "username": "admin",
-        "full_name": "Admin User",
-        "email": "admin@example.com",
-        "hashed_password": "$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW",  # password: secret
-        "disabled": False,
-    }
-}
+# User accounts (see users.py); the default admin is created unless it already exists
+users_db = UserStore(USERS_DB, lambda fields: UserInDB(**fields), USER_CACHE_SIZE)
+users_db.add({
+    "username": "admin",
+    "full_name": "Admin User",
+    "email": "admin@example.com",
+    "hashed_password": "$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW",  # password: secret
+    "disabled": False,
+})
+
+# Signing keys, parsed once on first use
+keyring = KeyRing(ALGORITHM, SECRET_KEY, JWT_KEY_DIR, JWT_KEYS_KEPT)
+
+# Refresh token sessions, next to the accounts (same SQLite file when DIET_API_USERS_DB is set)
+refresh_tokens = RefreshTokenStore(USERS_DB, REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600)
+
+# jose and passlib/bcrypt are imported on first use to keep process startup fast
+_pwd_context = None
+
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    pwd_context = get_pwd_context()
+    with metrics.timer('bcrypt_verify'):
+        return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    pwd_context = get_pwd_context()
+    with metrics.timer('bcrypt_hash'):
+        return pwd_context.hash(password)
 
 def get_user(username: str):
-    if username in users_db:
-        user_dict = users_db[username]
-        return UserInDB(**user_dict)
-    return None
+    return users_db.get_user(username)
 
 def authenticate_user(username: str, password: str):
     user = get_user(username)
@@ -130,8 +352,15 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    with metrics.timer('jwt_encode'):
+        return keyring.sign(to_encode)
+
+def issue_tokens(username: str, refresh_token: str) -> dict:
+    """Token response: a fresh access token next to the session's refresh token"""
+    access_token = create_access_token(
+        data={"sub": username}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
@@ -139,8 +368,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    from jose import JWTError
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with metrics.timer('jwt_decode'):
+            payload = keyring.verify(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -151,14 +382,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
     return user
 
-async def get_current_active_user(current_user: User = Depends(get_current_user)):
+async def get_current_active_user(request: Request, current_user: User = Depends(get_current_user)):
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
+    rate_limiter.check(current_user.username, request.method, request.scope['route'].path)
+    return current_user
+
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)):
+    if current_user.username not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
     return current_user
 
 # ===================== DATA STORAGE =====================
 
-customers = [
+customers = Collection('customers', CustomerRecord, map(CustomerRecord.from_dict, [
     {
         'id': 1, 
         'name': 'Alma', 
@@ -188,9 +425,9 @@ customers = [
         ], 
         'goal': {'calories': 2500, 'protein': 150, 'carbs': 280, 'fat': 80}
     }
-]
+]))
 
-recipes = [
+recipes = Collection('recipes', RecipeRecord, map(RecipeRecord.from_dict, [
     {
         'id': 1,
         'name': 'Grilled Chicken Salad',
@@ -209,9 +446,9 @@ recipes = [
         'ingredients': ['salmon fillet', 'broccoli', 'carrots', 'lemon'],
         'nutrition': {'calories': 450, 'protein': 38, 'carbs': 20, 'fat': 25}
     }
-]
+]))
 
-diet_plans = [
+diet_plans = PartitionedCollection('diet_plans', DietPlanRecord, 'date', map(DietPlanRecord.from_dict, [
     {
         'id': 1,
         'customerId': 1,
@@ -222,9 +459,9 @@ diet_plans = [
             {'type': 'DINNER', 'recipeId': 3, 'portion': 1}
         ]
     }
-]
+]))
 
-production_batches = [
+production_batches = PartitionedCollection('production_batches', ProductionBatchRecord, 'productionDate', map(ProductionBatchRecord.from_dict, [
     {
         'id': 1,
         'productionDate': '2025-11-17',
@@ -235,13 +472,227 @@ production_batches = [
             {'recipeId': 3, 'portions': 10}
         ]
     }
-]
+]))
+
+# cold tier per collection name, when enabled (see enable_cold_tier)
+cold_tiers: Dict[str, ColdTier] = {}
+
+def lookup(collection: Collection, record_id: int):
+    """Fetch a record by id, timed as a store lookup; falls back to the cold tier"""
+    with metrics.timer('store_lookup'):
+        record = collection.get(record_id)
+    if record is None and collection.name in cold_tiers:
+        with metrics.timer('cold_lookup'):
+            record = cold_tiers[collection.name].get(record_id)
+    return record
+
+def not_found(collection: Collection, record_id: int, entity: str) -> HTTPException:
+    """404 for a missing record, 409 for one that only exists in the read-only cold tier"""
+    cold = cold_tiers.get(collection.name)
+    if cold is not None and cold.get(record_id) is not None:
+        return HTTPException(status_code=409, detail=f'{entity} is archived (read-only)')
+    return HTTPException(status_code=404, detail=f'{entity} not found')
+
+# ETags are "<epoch>-<version>"; record versions are not persisted, so the
+# epoch changes on every start and older ETags stop matching
+ETAG_EPOCH = secrets.token_hex(4)
+MERGE_PATCH = 'application/merge-patch+json'
+
+def record_etag(collection: Collection, record_id: int) -> str:
+    return f'"{ETAG_EPOCH}-{collection.version(record_id)}"'
+
+def stored(record, etag: Optional[str] = None, status_code: int = 200) -> Response:
+    """Response for a stored record. Records were validated on the way in, so this
+    skips response-model validation and FastAPI's generic encoder and serializes
+    to_dict() directly; the route's response_model only documents the shape."""
+    return NegotiatedResponse(record.to_dict(), status_code=status_code, headers={'ETag': etag} if etag else None)
+
+def check_if_match(if_match: Optional[str], collection: Collection, record_id: int):
+    """412 unless If-Match is absent, '*' or lists the record's current ETag"""
+    if if_match is None:
+        return
+    tags = {tag.strip() for tag in if_match.split(',')}
+    if '*' not in tags and record_etag(collection, record_id) not in tags:
+        raise HTTPException(status_code=412, detail='Record was modified (ETag mismatch)')
+
+def merge_into(model, current: dict, patch: dict):
+    """Apply a JSON Merge Patch to `current` and validate the result as `model`"""
+    try:
+        return model.model_validate(merge_patch(current, patch))
+    except ValidationError as exc:
+        raise RequestValidationError(exc.errors())
+
+def idempotent(key: Optional[str], user: User, route: str, payload: BaseModel, create: Callable[[], dict]):
+    """Run `create` once per (user, route, Idempotency-Key); retries replay the stored 201 response"""
+    if key is None:
+        return NegotiatedResponse(create(), status_code=201)
+    if not 0 < len(key) <= MAX_IDEMPOTENCY_KEY:
+        raise HTTPException(status_code=400, detail=f'Idempotency-Key must be 1-{MAX_IDEMPOTENCY_KEY} characters')
+    try:
+        body, replayed = idempotency.run((user.username, route, key), payload.model_dump_json(), create)
+    except IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail='Idempotency-Key was already used with a different request body')
+    headers = {'Idempotent-Replayed': 'true'} if replayed else None
+    media_type = wire_format.get()
+    return Response(transcode(body, media_type), status_code=201, media_type=media_type, headers=headers)
+
+# identical concurrent reads (same op, arguments and data generation) share one computation
+single_flight = SingleFlight()
+
+def generations(*collections: Collection) -> tuple:
+    return tuple(c.generation for c in collections)
+
+# the latest serialized body per (op, format) is kept while its key (and so the
+# data generation) is current; bodies over this size are recomputed instead
+MAX_KEPT_BODY = 8 << 20
+kept_bodies: Dict[tuple, tuple] = {}
+
+def shared_response(op: str, key: Hashable, compute: Callable[[], Any]) -> Response:
+    """Response for compute() in the negotiated wire format, computed and serialized
+    once per data generation and shared by concurrent identical requests.
+
+    The key pins the data generation, so it also makes a stable ETag (which
+    lets the compression middleware reuse compressed variants).
+    """
+    media_type = wire_format.get()
+
+    def run():
+        content = compute()
+        with metrics.timer('serialize'):
+            return encode(content, media_type)
+    key = (key, media_type)
+    kept = kept_bodies.get((op, media_type))
+    if kept is not None and kept[0] == key:
+        body = kept[1]
+    else:
+        body = single_flight.do(op, key, run)
+        if len(body) <= MAX_KEPT_BODY:
+            kept_bodies[(op, media_type)] = (key, body)
+    etag = '"%s-%s-%s"' % (ETAG_EPOCH, op, repr(key).replace(' ', ''))
+    return Response(body, media_type=media_type, headers={'ETag': etag})
+
+recipe_index = RecipeIndex(recipes)
+recipes.listeners.append(recipe_index.on_change)
+
+goal_checks = GoalChecks(customers)
+customers.listeners.append(goal_checks.on_change)
+
+plan_index = PlanIndex(diet_plans)
+diet_plans.listeners.append(plan_index.on_change)
+nutrition_table = NutritionTable(recipes)
+recipes.listeners.append(nutrition_table.on_change)
+daily_totals = DailyTotals(diet_plans, nutrition_table, plan_index)
+recipes.listeners.append(daily_totals.on_recipe_change)
+
+forecast_index = ForecastIndex(recipes, diet_plans)
+diet_plans.listeners.append(forecast_index.on_change)
+recipes.listeners.append(forecast_index.on_recipe_change)
+
+batch_index = BatchIndex(production_batches)
+production_batches.listeners.append(batch_index.on_change)
+
+change_feed = ChangeFeed(CHANGES_BUFFER)
+COLLECTIONS = {c.name: c for c in (customers, recipes, diet_plans, production_batches)}
+for collection in COLLECTIONS.values():
+    collection.listeners.append(change_feed.on_change)
+
+def check_unreferenced(entity: str, references: Dict[str, Set[int]]):
+    """409 if any of the referencing id sets is non-empty"""
+    in_use = [f'{len(ids)} {kind}' for kind, ids in references.items() if ids]
+    if in_use:
+        raise HTTPException(status_code=409, detail=f'{entity} is referenced by ' + ', '.join(in_use))
+
+def delete_plan_cascading(plan_id: int):
+    """Delete a diet plan and drop it from the production batches listing it"""
+    for batch_id in batch_index.batches_with_plan(plan_id):
+        batch = production_batches.get(batch_id)
+        production_batches.update(batch_id, ProductionBatchRecord.fields(
+            batch.productionDate, [p for p in batch.dietPlans if p != plan_id],
+            zip(batch.batch_recipes, batch.batch_portions),
+        ))
+    diet_plans.delete(plan_id)
 
 next_customer_id = 4
 next_recipe_id = 4
 next_diet_plan_id = 2
 next_production_batch_id = 2
 
+seed_snapshot: Optional[ColumnarSnapshot] = None
+
+def load_seed_snapshot(path: str):
+    """Serve customers/recipes from a mapped columnar snapshot, decoded on first access"""
+    global seed_snapshot, next_customer_id, next_recipe_id
+    seed_snapshot = ColumnarSnapshot(path)
+    if 'customers' in seed_snapshot:
+        table = seed_snapshot['customers']
+        customers.defer(lambda table=table: map(CustomerRecord.from_dict, table.materialize()))
+        next_customer_id = table.max_id + 1
+    if 'recipes' in seed_snapshot:
+        table = seed_snapshot['recipes']
+        recipes.defer(lambda table=table: map(RecipeRecord.from_dict, table.materialize()))
+        next_recipe_id = table.max_id + 1
+    return seed_snapshot
+
+if SEED_SNAPSHOT:
+    load_seed_snapshot(SEED_SNAPSHOT)
+
+persistence: Optional[Persistence] = None
+
+def enable_persistence(data_dir: str):
+    """Recover the store from `data_dir` and log every further mutation there"""
+    global persistence, next_customer_id, next_recipe_id, next_diet_plan_id, next_production_batch_id
+    persistence = Persistence(
+        data_dir,
+        [customers, recipes, diet_plans, production_batches],
+        sync=WAL_SYNC,
+        snapshot_every=SNAPSHOT_EVERY,
+    )
+    # replaying the log is not news: the change feed is detached while recovering
+    for collection in COLLECTIONS.values():
+        collection.listeners.remove(change_feed.on_change)
+    try:
+        counters = persistence.recover({
+            'customers': next_customer_id,
+            'recipes': next_recipe_id,
+            'diet_plans': next_diet_plan_id,
+            'production_batches': next_production_batch_id,
+        })
+    finally:
+        for collection in COLLECTIONS.values():
+            collection.listeners.append(change_feed.on_change)
+    next_customer_id = counters['customers']
+    next_recipe_id = counters['recipes']
+    next_diet_plan_id = counters['diet_plans']
+    next_production_batch_id = counters['production_batches']
+    return persistence
+
+def disable_persistence():
+    global persistence
+    if persistence is not None:
+        persistence.close()
+        persistence = None
+
+if DATA_DIR:
+    enable_persistence(DATA_DIR)
+
+def enable_cold_tier(directory: str):
+    """Open (or create) the cold segments of diet plans and production batches in `directory`"""
+    global next_diet_plan_id, next_production_batch_id
+    disable_cold_tier()
+    for collection in (diet_plans, production_batches):
+        cold_tiers[collection.name] = ColdTier(directory, collection, COLD_CACHE_BLOCKS)
+    # archived ids stay taken, so new records never shadow them
+    next_diet_plan_id = max(next_diet_plan_id, cold_tiers['diet_plans'].max_id + 1)
+    next_production_batch_id = max(next_production_batch_id, cold_tiers['production_batches'].max_id + 1)
+
+def disable_cold_tier():
+    for tier in cold_tiers.values():
+        tier.close()
+    cold_tiers.clear()
+
+if ARCHIVE_DIR:
+    enable_cold_tier(ARCHIVE_DIR)
+
 # ===================== AUTH ENDPOINTS =====================
 
 @app.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
@@ -261,7 +712,11 @@ async def register(user: UserRegister):
         "hashed_password": hashed_password,
         "disabled": False,
     }
-    users_db[user.username] = user_dict
+    if not users_db.add(user_dict):  # registered concurrently while hashing
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered"
+        )
     return User(**user_dict)
 
 @app.post("/login", response_model=Token)
@@ -274,11 +729,52 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+    return issue_tokens(user.username, refresh_tokens.issue(user.username))
+
+@app.post("/token/refresh", response_model=Token)
+async def refresh_access_token(body: RefreshRequest):
+    """Trade a refresh token for a new access token and a new refresh token (no password check)"""
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    try:
+        with metrics.timer('refresh_rotate'):
+            username, refresh_token = refresh_tokens.rotate(body.refresh_token)
+    except InvalidRefreshToken:
+        raise invalid
+    user = get_user(username)
+    if user is None or user.disabled:
+        refresh_tokens.revoke(refresh_token)
+        raise invalid
+    return issue_tokens(username, refresh_token)
+
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_refresh_token(body: RefreshRequest):
+    """Logout: end the session of a refresh token (unknown tokens are ignored)"""
+    refresh_tokens.revoke(body.refresh_token)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@app.delete("/users/me/sessions")
+async def revoke_my_sessions(current_user: User = Depends(get_current_active_user)):
+    """Logout everywhere: end every refresh token session of the current user"""
+    return {"revoked": refresh_tokens.revoke_user(current_user.username)}
+
+@app.get("/.well-known/jwks.json")
+def get_jwks(response: Response):
+    """Public keys that verify access tokens (JWKS); empty with HS256"""
+    response.headers["Cache-Control"] = f"public, max-age={JWKS_MAX_AGE}"
+    return keyring.jwks()
+
+@app.post("/admin/keys/rotate")
+def rotate_signing_key(current_user: User = Depends(get_current_admin_user)):
+    """Sign new tokens with a fresh key; the newest DIET_API_JWT_KEYS_KEPT keys keep verifying"""
+    try:
+        kid = keyring.rotate()
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"kid": kid, "keys": keyring.kids}
 
 @app.get("/users/me", response_model=User)
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
@@ -287,227 +783,664 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 
 # ===================== CUSTOMER ENDPOINTS =====================
 
-@app.get('/customers')
+@app.get('/customers', response_model=List[Customer])
 def get_customers(current_user: User = Depends(get_current_active_user)):
-    return customers
+    return shared_response('list_customers', customers.generation, lambda: [c.to_dict() for c in customers])
 
-@app.get('/customers/{customer_id}')
+@app.get('/customers/{customer_id}', response_model=Customer)
 def get_customer_by_id(customer_id: int, current_user: User = Depends(get_current_active_user)):
-    customer = next((c for c in customers if c['id'] == customer_id), None)
+    customer = lookup(customers, customer_id)
     if customer:
-        return customer
+        return stored(customer, record_etag(customers, customer_id))
     raise HTTPException(status_code=404, detail='Customer not found')
 
-@app.post('/customers', status_code=201)
-def add_customer(customer: Customer, current_user: User = Depends(get_current_active_user)):
-    global next_customer_id
-    
-    new_customer = {
-        'id': next_customer_id,
-        'name': customer.name,
-        'email': customer.email,
-        'phone': customer.phone,
-        'restrictions': [r.model_dump() for r in customer.restrictions],
-        'goal': customer.goal.model_dump()
-    }
-    customers.append(new_customer)
-    next_customer_id += 1
-    return new_customer
-
-@app.put('/customers/{customer_id}')
-def update_customer(customer_id: int, customer: Customer, current_user: User = Depends(get_current_active_user)):
-    existing_customer = next((c for c in customers if c['id'] == customer_id), None)
-    if not existing_customer:
-        raise HTTPException(status_code=404, detail='Customer not found')
+@app.post('/customers', status_code=201, response_model=Customer)
+def add_customer(
+    customer: Customer,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    def create():
+        global next_customer_id
+        new_customer = CustomerRecord(next_customer_id, **customer.record_fields())
+        customers.insert(new_customer)
+        next_customer_id += 1
+        return new_customer.to_dict()
     
-    existing_customer.update({
-        'name': customer.name,
-        'email': customer.email,
-        'phone': customer.phone,
-        'restrictions': [r.model_dump() for r in customer.restrictions],
-        'goal': customer.goal.model_dump()
-    })
-    return existing_customer
+    return idempotent(idempotency_key, current_user, 'POST /customers', customer, create)
+
+@app.put('/customers/{customer_id}', response_model=Customer)
+def update_customer(
+    customer_id: int,
+    customer: Customer,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    with customers.lock:
+        if customer_id not in customers:
+            raise HTTPException(status_code=404, detail='Customer not found')
+        check_if_match(if_match, customers, customer_id)
+        record = customers.update(customer_id, customer.record_fields())
+        etag = record_etag(customers, customer_id)
+    return stored(record, etag)
+
+@app.patch('/customers/{customer_id}', response_model=Customer)
+def patch_customer(
+    customer_id: int,
+    patch: Dict[str, Any] = Body(..., media_type=MERGE_PATCH),
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Partial update (JSON Merge Patch); only changed fields are written"""
+    with customers.lock:
+        customer = customers.get(customer_id)
+        if not customer:
+            raise HTTPException(status_code=404, detail='Customer not found')
+        check_if_match(if_match, customers, customer_id)
+        merged = merge_into(Customer, customer.to_dict(), patch)
+        record = customers.update(customer_id, merged.record_fields())
+        etag = record_etag(customers, customer_id)
+    return stored(record, etag)
 
 @app.delete('/customers/{customer_id}')
-def delete_customer(customer_id: int, current_user: User = Depends(get_current_active_user)):
-    global customers
-    customer = next((c for c in customers if c['id'] == customer_id), None)
-    if not customer:
-        raise HTTPException(status_code=404, detail='Customer not found')
+def delete_customer(
+    customer_id: int,
+    references: Optional[DeletePolicy] = None,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    policy = references or DELETE_POLICY
+    with customers.lock, diet_plans.lock, production_batches.lock:
+        if customer_id not in customers:
+            raise HTTPException(status_code=404, detail='Customer not found')
+        check_if_match(if_match, customers, customer_id)
+        plan_ids = plan_index.customer_plans(customer_id)
+        if policy == 'restrict':
+            check_unreferenced('Customer', {'diet plans': plan_ids})
+        elif policy == 'cascade':
+            for plan_id in plan_ids:
+                delete_plan_cascading(plan_id)
+        customers.delete(customer_id)
     
-    customers = [c for c in customers if c['id'] != customer_id]
     return {'message': 'Customer deleted successfully'}
 
+@app.get('/customers/{customer_id}/adherence')
+def get_customer_adherence(
+    customer_id: int,
+    date_from: Optional[date] = Query(None, alias='from'),
+    date_to: Optional[date] = Query(None, alias='to'),
+    window: int = Query(7, ge=1, le=90),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Daily plan totals vs. the customer's goal over [from, to] (default: the last 30 days)"""
+    customer = lookup(customers, customer_id)
+    if not customer:
+        raise HTTPException(status_code=404, detail='Customer not found')
+    if date_to is None:
+        date_to = shift_day(date_from, 29) if date_from else datetime.utcnow().date()
+    if date_from is None:
+        date_from = shift_day(date_to, -29)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+    def compute():
+        first_day = shift_day(date_from, 1 - window).isoformat()
+        days = daily_totals.days(customer_id, first_day, date_to.isoformat())
+        return adherence(days, customer.goal, date_from, window, goal_checks.get(customer).within)
+
+    with metrics.timer('adherence'):
+        key = (customer_id, date_from, date_to, window, generations(customers, diet_plans, recipes))
+        result = single_flight.do('adherence', key, compute)
+    return {'customerId': customer_id, 'from': date_from.isoformat(), 'to': date_to.isoformat(), **result}
+
 # ===================== RECIPE ENDPOINTS =====================
 
-@app.get('/recipes')
+@app.get('/recipes', response_model=List[Recipe])
 def get_recipes(current_user: User = Depends(get_current_active_user)):
-    return recipes
+    return shared_response('list_recipes', recipes.generation, lambda: [r.to_dict() for r in recipes])
 
-@app.get('/recipes/{recipe_id}')
+@app.get('/recipes/search', response_model=List[Recipe])
+def search_recipes(
+    ingredient: List[str] = Query([]),
+    min_calories: Optional[float] = None,
+    max_calories: Optional[float] = None,
+    min_protein: Optional[float] = None,
+    max_protein: Optional[float] = None,
+    min_carbs: Optional[float] = None,
+    max_carbs: Optional[float] = None,
+    min_fat: Optional[float] = None,
+    max_fat: Optional[float] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Search recipes by ingredient and nutrition ranges, in ranked order"""
+    if sort and sort.lstrip('-') not in NUTRITION_FIELDS:
+        raise HTTPException(status_code=400, detail=f'Invalid sort field: {sort}')
+    ranges = {
+        'calories': (min_calories, max_calories),
+        'protein': (min_protein, max_protein),
+        'carbs': (min_carbs, max_carbs),
+        'fat': (min_fat, max_fat),
+    }
+    results = recipe_index.search(ingredient, ranges, sort)
+    return NegotiatedResponse([r.to_dict() for r in (results[:limit] if limit else results)])
+
+@app.get('/recipes/{recipe_id}', response_model=Recipe)
 def get_recipe_by_id(recipe_id: int, current_user: User = Depends(get_current_active_user)):
-    recipe = next((r for r in recipes if r['id'] == recipe_id), None)
+    recipe = lookup(recipes, recipe_id)
     if recipe:
-        return recipe
+        return stored(recipe, record_etag(recipes, recipe_id))
     raise HTTPException(status_code=404, detail='Recipe not found')
 
-@app.post('/recipes', status_code=201)
-def add_recipe(recipe: Recipe, current_user: User = Depends(get_current_active_user)):
-    global next_recipe_id
+@app.post('/recipes', status_code=201, response_model=Recipe)
+def add_recipe(
+    recipe: Recipe,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    def create():
+        global next_recipe_id
+        new_recipe = RecipeRecord(next_recipe_id, **recipe.record_fields())
+        recipes.insert(new_recipe)
+        next_recipe_id += 1
+        return new_recipe.to_dict()
     
-    new_recipe = {
-        'id': next_recipe_id,
-        'name': recipe.name,
-        'ingredients': recipe.ingredients,
-        'nutrition': recipe.nutrition.model_dump()
-    }
-    recipes.append(new_recipe)
-    next_recipe_id += 1
-    return new_recipe
-
-@app.put('/recipes/{recipe_id}')
-def update_recipe(recipe_id: int, recipe: Recipe, current_user: User = Depends(get_current_active_user)):
-    existing_recipe = next((r for r in recipes if r['id'] == recipe_id), None)
-    if not existing_recipe:
+    return idempotent(idempotency_key, current_user, 'POST /recipes', recipe, create)
+
+@app.put('/recipes/{recipe_id}', response_model=Recipe)
+def update_recipe(
+    recipe_id: int,
+    recipe: Recipe,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    with recipes.lock:
+        if recipe_id not in recipes:
+            raise HTTPException(status_code=404, detail='Recipe not found')
+        check_if_match(if_match, recipes, recipe_id)
+        record = recipes.update(recipe_id, recipe.record_fields())
+        etag = record_etag(recipes, recipe_id)
+    return stored(record, etag)
+
+@app.patch('/recipes/{recipe_id}', response_model=Recipe)
+def patch_recipe(
+    recipe_id: int,
+    patch: Dict[str, Any] = Body(..., media_type=MERGE_PATCH),
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Partial update (JSON Merge Patch); only changed fields are written"""
+    with recipes.lock:
+        recipe = recipes.get(recipe_id)
+        if not recipe:
+            raise HTTPException(status_code=404, detail='Recipe not found')
+        check_if_match(if_match, recipes, recipe_id)
+        merged = merge_into(Recipe, recipe.to_dict(), patch)
+        record = recipes.update(recipe_id, merged.record_fields())
+        etag = record_etag(recipes, recipe_id)
+    return stored(record, etag)
+
+@app.get('/recipes/{recipe_id}/usage')
+def get_recipe_usage(recipe_id: int, current_user: User = Depends(get_current_active_user)):
+    """Diet plans and production batches referencing the recipe"""
+    if recipe_id not in recipes:
         raise HTTPException(status_code=404, detail='Recipe not found')
-    
-    existing_recipe.update({
-        'name': recipe.name,
-        'ingredients': recipe.ingredients,
-        'nutrition': recipe.nutrition.model_dump()
-    })
-    return existing_recipe
+    plan_ids = plan_index.plans_using_recipe(recipe_id)
+    batch_ids = batch_index.batches_using_recipe(recipe_id)
+    return {
+        'recipeId': recipe_id,
+        'inUse': bool(plan_ids or batch_ids),
+        'dietPlans': sorted(plan_ids),
+        'productionBatches': sorted(batch_ids),
+    }
 
 @app.delete('/recipes/{recipe_id}')
-def delete_recipe(recipe_id: int, current_user: User = Depends(get_current_active_user)):
-    global recipes
-    recipe = next((r for r in recipes if r['id'] == recipe_id), None)
-    if not recipe:
-        raise HTTPException(status_code=404, detail='Recipe not found')
+def delete_recipe(
+    recipe_id: int,
+    references: Optional[DeletePolicy] = None,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    policy = references or DELETE_POLICY
+    with recipes.lock, diet_plans.lock, production_batches.lock:
+        if recipe_id not in recipes:
+            raise HTTPException(status_code=404, detail='Recipe not found')
+        check_if_match(if_match, recipes, recipe_id)
+        if policy == 'restrict':
+            check_unreferenced('Recipe', {
+                'diet plans': plan_index.plans_using_recipe(recipe_id),
+                'production batches': batch_index.batches_using_recipe(recipe_id),
+            })
+        elif policy == 'cascade':
+            for plan_id in plan_index.plans_using_recipe(recipe_id):
+                plan = diet_plans.get(plan_id)
+                diet_plans.update(plan_id, DietPlanRecord.meal_fields(m for m in plan.meals if m[1] != recipe_id))
+            for batch_id in batch_index.batches_using_recipe(recipe_id):
+                batch = production_batches.get(batch_id)
+                lines = [(r, p) for r, p in zip(batch.batch_recipes, batch.batch_portions) if r != recipe_id]
+                production_batches.update(batch_id, ProductionBatchRecord.fields(batch.productionDate, batch.dietPlans, lines))
+        recipes.delete(recipe_id)
     
-    recipes = [r for r in recipes if r['id'] != recipe_id]
     return {'message': 'Recipe deleted successfully'}
 
 # ===================== DIET PLAN ENDPOINTS =====================
 
-@app.get('/diet-plans')
-def get_diet_plans(customerId: Optional[int] = Query(None), current_user: User = Depends(get_current_active_user)):
+def day_bounds(date_from: Optional[date], date_to: Optional[date]) -> tuple:
+    """ISO bounds of an optional [from, to] range; 400 if it is reversed"""
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    return (date_from and date_from.isoformat(), date_to and date_to.isoformat())
+
+def in_range(collection: PartitionedCollection, bounds: tuple):
+    """All records in RAM, or with a range only those in its day partitions, preceded
+    by the archived ones in range (ordered by day). A record both archived and in RAM
+    (replayed from the log after a crash during tiering) is served from RAM."""
+    if bounds == (None, None):
+        return collection
+    cold = cold_tiers.get(collection.name)
+    if cold is None:
+        return collection.between(*bounds)
+    archived = [record for record in cold.between(*bounds) if record.id not in collection]
+    return archived + collection.between(*bounds)
+
+def tier_generation(collection: Collection) -> int:
+    cold = cold_tiers.get(collection.name)
+    return 0 if cold is None else cold.generation
+
+@app.get('/diet-plans', response_model=List[DietPlan])
+def get_diet_plans(
+    customerId: Optional[int] = Query(None),
+    date_from: Optional[date] = Query(None, alias='from'),
+    date_to: Optional[date] = Query(None, alias='to'),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Diet plans, optionally of one customer and/or dated within [from, to]"""
+    bounds = day_bounds(date_from, date_to)
     if customerId:
-        filtered = [dp for dp in diet_plans if dp['customerId'] == customerId]
-        return filtered
-    return diet_plans
+        compute = lambda: [dp.to_dict() for dp in in_range(diet_plans, bounds) if dp.customerId == customerId]
+    else:
+        compute = lambda: [dp.to_dict() for dp in in_range(diet_plans, bounds)]
+    key = (customerId or None, bounds, diet_plans.generation, tier_generation(diet_plans))
+    return shared_response('list_diet_plans', key, compute)
 
-@app.get('/diet-plans/{plan_id}')
+@app.get('/diet-plans/{plan_id}', response_model=DietPlan)
 def get_diet_plan_by_id(plan_id: int, current_user: User = Depends(get_current_active_user)):
-    plan = next((dp for dp in diet_plans if dp['id'] == plan_id), None)
+    plan = lookup(diet_plans, plan_id)
     if plan:
-        return plan
+        return stored(plan, record_etag(diet_plans, plan_id))
     raise HTTPException(status_code=404, detail='Diet plan not found')
 
-@app.post('/diet-plans', status_code=201)
-def create_diet_plan(diet_plan: DietPlan, current_user: User = Depends(get_current_active_user)):
-    global next_diet_plan_id
-    
-    customer = next((c for c in customers if c['id'] == diet_plan.customerId), None)
-    if not customer:
-        raise HTTPException(status_code=404, detail='Customer not found')
+def meal_fields(diet_plan: DietPlan) -> dict:
+    """Meal columns of a plan; meals given in grams become portions of their recipe"""
+    rows = []
+    for meal in diet_plan.meals:
+        portion = meal.portion
+        if meal.grams is not None:
+            recipe = lookup(recipes, meal.recipeId)
+            if recipe is None or not recipe.portionGrams:
+                raise HTTPException(status_code=422, detail=f'Recipe {meal.recipeId} has no portionGrams; '
+                                                            'give the meal in portions')
+            portion = meal.grams / recipe.portionGrams
+            if not MIN_PORTION <= portion <= MAX_PORTION:
+                raise HTTPException(status_code=422, detail=f'A meal is {MIN_PORTION} to {MAX_PORTION} portions')
+        rows.append((meal.type, meal.recipeId, portion))
+    return DietPlanRecord.meal_fields(rows)
+
+@app.post('/diet-plans', status_code=201, response_model=DietPlan)
+def create_diet_plan(
+    diet_plan: DietPlan,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    def create():
+        global next_diet_plan_id
+        # customers.lock (taken by customer deletes) keeps the customer from going away before the insert
+        with customers.lock:
+            customer = lookup(customers, diet_plan.customerId)
+            if not customer:
+                raise HTTPException(status_code=404, detail='Customer not found')
+
+            new_plan = DietPlanRecord(
+                next_diet_plan_id, diet_plan.customerId, diet_plan.day(), **meal_fields(diet_plan)
+            )
+            diet_plans.insert(new_plan)
+            next_diet_plan_id += 1
+        return new_plan.to_dict()
     
-    new_plan = {
-        'id': next_diet_plan_id,
-        'customerId': diet_plan.customerId,
-        'date': diet_plan.date,
-        'meals': [m.model_dump() for m in diet_plan.meals]
+    return idempotent(idempotency_key, current_user, 'POST /diet-plans', diet_plan, create)
+
+def evaluate_totals(totals: tuple, goal: tuple, violations: tuple) -> dict:
+    """Nutrition totals compared with a goal, given the goal rules they fail"""
+    return {
+        'valid': not violations,
+        'total_nutrition': nutrition_dict(rounded(totals)),
+        'goal': nutrition_dict(goal),
+        'differences': nutrition_dict(rounded(map(abs, map(sub, totals, goal)))),
+        'violations': list(violations),
+        'restrictions_met': True
+    }
+
+def evaluate_plans(pairs: List[tuple]) -> List[dict]:
+    """evaluate_plan for (plan, customer) pairs: totals in one pass over the nutrition columns,
+    then each customer's compiled goal rules (the check uses the unrounded totals)"""
+    totals = nutrition_table.totals_many((plan.meal_recipes, plan.meal_portions) for plan, _ in pairs)
+    check_of, meal_values = goal_checks.get, nutrition_table.meal_values
+    results = []
+    for t, (plan, customer) in zip(totals, pairs):
+        check = check_of(customer)
+        meals = meal_values(plan.meal_recipes, plan.meal_portions) if check.uses_meals else None
+        results.append(evaluate_totals(t, customer.goal, check.failures(t, meals, len(plan.meal_recipes))))
+    return results
+
+def evaluate_plan(plan: DietPlanRecord, customer: CustomerRecord) -> dict:
+    """Plan nutrition totals compared with the customer's goal"""
+    return evaluate_plans([(plan, customer)])[0]
+
+@app.post('/diet-plans/validate')
+def validate_diet_plans(batch: PlanBatch, current_user: User = Depends(get_current_active_user)):
+    """BC1 for many plans at once; ids without a plan (or its customer) are listed in `missing`"""
+    pairs, missing = [], []
+    for plan_id in dict.fromkeys(batch.planIds):
+        plan = lookup(diet_plans, plan_id)
+        customer = plan and lookup(customers, plan.customerId)
+        if customer:
+            pairs.append((plan, customer))
+        else:
+            missing.append(plan_id)
+    with metrics.timer('plan_validation_batch'):
+        results = evaluate_plans(pairs)
+    return {
+        'results': [{'id': plan.id, 'customerId': plan.customerId, **result}
+                    for (plan, _), result in zip(pairs, results)],
+        'missing': missing,
     }
-    diet_plans.append(new_plan)
-    next_diet_plan_id += 1
-    return new_plan
 
 @app.post('/diet-plans/{plan_id}/validate')
 def validate_diet_plan(plan_id: int, current_user: User = Depends(get_current_active_user)):
     """BC1: Validate DietPlan against Customer's NutritionalGoal and DietaryRestriction"""
-    plan = next((dp for dp in diet_plans if dp['id'] == plan_id), None)
+    plan = lookup(diet_plans, plan_id)
     if not plan:
         raise HTTPException(status_code=404, detail='Diet plan not found')
     
-    customer = next((c for c in customers if c['id'] == plan['customerId']), None)
+    customer = lookup(customers, plan.customerId)
     if not customer:
         raise HTTPException(status_code=404, detail='Customer not found')
     
-    total_nutrition = {'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0}
-    for meal in plan['meals']:
-        recipe = next((r for r in recipes if r['id'] == meal['recipeId']), None)
-        if recipe:
-            portion = meal.get('portion', 1)
-            for key in total_nutrition:
-                total_nutrition[key] += recipe['nutrition'][key] * portion
-    
-    goal = customer['goal']
-    validation_result = {
-        'valid': True,
-        'total_nutrition': total_nutrition,
-        'goal': goal,
-        'differences': {},
-        'restrictions_met': True
-    }
-    
-    for key in total_nutrition:
-        diff = abs(total_nutrition[key] - goal[key])
-        validation_result['differences'][key] = diff
-        if diff > goal[key] * 0.1:
-            validation_result['valid'] = False
-    
-    return validation_result
+    with metrics.timer('plan_validation'):
+        key = (plan_id, generations(diet_plans, customers, recipes))
+        return single_flight.do('validate', key, lambda: evaluate_plan(plan, customer))
 
-@app.put('/diet-plans/{plan_id}')
-def update_diet_plan(plan_id: int, diet_plan: DietPlan, current_user: User = Depends(get_current_active_user)):
-    plan = next((dp for dp in diet_plans if dp['id'] == plan_id), None)
-    if not plan:
-        raise HTTPException(status_code=404, detail='Diet plan not found')
-    
-    plan.update({
-        'date': diet_plan.date,
-        'meals': [m.model_dump() for m in diet_plan.meals]
-    })
-    return plan
+@app.put('/diet-plans/{plan_id}', response_model=DietPlan)
+def update_diet_plan(
+    plan_id: int,
+    diet_plan: DietPlan,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    with diet_plans.lock:
+        if plan_id not in diet_plans:
+            raise not_found(diet_plans, plan_id, 'Diet plan')
+        check_if_match(if_match, diet_plans, plan_id)
+        record = diet_plans.update(plan_id, {
+            'date': diet_plan.day(),
+            **meal_fields(diet_plan)
+        })
+        etag = record_etag(diet_plans, plan_id)
+    return stored(record, etag)
+
+@app.patch('/diet-plans/{plan_id}', response_model=DietPlan)
+def patch_diet_plan(
+    plan_id: int,
+    patch: Dict[str, Any] = Body(..., media_type=MERGE_PATCH),
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Partial update (JSON Merge Patch); only changed fields are written"""
+    with customers.lock, diet_plans.lock:  # same order as customer deletes
+        plan = diet_plans.get(plan_id)
+        if not plan:
+            raise not_found(diet_plans, plan_id, 'Diet plan')
+        check_if_match(if_match, diet_plans, plan_id)
+        merged = merge_into(DietPlan, plan.to_dict(), patch)
+        if merged.customerId != plan.customerId and merged.customerId not in customers:
+            raise HTTPException(status_code=404, detail='Customer not found')
+        record = diet_plans.update(plan_id, {
+            'customerId': merged.customerId,
+            'date': merged.day(),
+            **meal_fields(merged)
+        })
+        etag = record_etag(diet_plans, plan_id)
+    return stored(record, etag)
 
 @app.delete('/diet-plans/{plan_id}')
-def delete_diet_plan(plan_id: int, current_user: User = Depends(get_current_active_user)):
-    global diet_plans
-    plan = next((dp for dp in diet_plans if dp['id'] == plan_id), None)
-    if not plan:
-        raise HTTPException(status_code=404, detail='Diet plan not found')
+def delete_diet_plan(
+    plan_id: int,
+    references: Optional[DeletePolicy] = None,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    policy = references or DELETE_POLICY
+    with diet_plans.lock, production_batches.lock:
+        if plan_id not in diet_plans:
+            raise not_found(diet_plans, plan_id, 'Diet plan')
+        check_if_match(if_match, diet_plans, plan_id)
+        if policy == 'restrict':
+            check_unreferenced('Diet plan', {'production batches': batch_index.batches_with_plan(plan_id)})
+        if policy == 'cascade':
+            delete_plan_cascading(plan_id)
+        else:
+            diet_plans.delete(plan_id)
     
-    diet_plans = [dp for dp in diet_plans if dp['id'] != plan_id]
     return {'message': 'Diet plan deleted successfully'}
 
 # ===================== PRODUCTION BATCH ENDPOINTS =====================
 
-@app.get('/production-batches')
-def get_production_batches(current_user: User = Depends(get_current_active_user)):
-    return production_batches
+@app.get('/production-batches', response_model=List[ProductionBatch])
+def get_production_batches(
+    date_from: Optional[date] = Query(None, alias='from'),
+    date_to: Optional[date] = Query(None, alias='to'),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Production batches, optionally with a production date within [from, to]"""
+    bounds = day_bounds(date_from, date_to)
+    return shared_response(
+        'list_production_batches', (bounds, production_batches.generation, tier_generation(production_batches)),
+        lambda: [pb.to_dict() for pb in in_range(production_batches, bounds)]
+    )
 
-@app.get('/production-batches/{batch_id}')
+@app.get('/production-batches/{batch_id}', response_model=ProductionBatch)
 def get_production_batch_by_id(batch_id: int, current_user: User = Depends(get_current_active_user)):
-    batch = next((pb for pb in production_batches if pb['id'] == batch_id), None)
+    batch = lookup(production_batches, batch_id)
     if batch:
-        return batch
+        return stored(batch)
     raise HTTPException(status_code=404, detail='Production batch not found')
 
-@app.post('/production-batches', status_code=201)
-def create_production_batch(batch: ProductionBatch, current_user: User = Depends(get_current_active_user)):
+@app.post('/production-batches', status_code=201, response_model=ProductionBatch)
+def create_production_batch(
+    batch: ProductionBatch,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
     """BC4: Daily Production Fulfillment - Create production batch from validated diet plans"""
-    global next_production_batch_id
+    def create():
+        global next_production_batch_id
+        new_batch = ProductionBatchRecord(next_production_batch_id, **batch.record_fields())
+        production_batches.insert(new_batch)
+        next_production_batch_id += 1
+        return new_batch.to_dict()
     
-    new_batch = {
-        'id': next_production_batch_id,
-        'productionDate': batch.productionDate,
-        'dietPlans': batch.dietPlans,
-        'recipeBatches': [rb.model_dump() for rb in batch.recipeBatches]
-    }
-    production_batches.append(new_batch)
-    next_production_batch_id += 1
-    return new_batch
+    return idempotent(idempotency_key, current_user, 'POST /production-batches', batch, create)
+
+@app.get('/production/forecast')
+def get_production_forecast(
+    date_from: Optional[date] = Query(None, alias='from'),
+    date_to: Optional[date] = Query(None, alias='to'),
+    current_user: User = Depends(get_current_active_user),
+):
+    """BC4: Portions per recipe and ingredient demand from planned meals, per day in [from, to] (default: next 7 days)"""
+    if date_from is None:
+        date_from = datetime.utcnow().date()
+    if date_to is None:
+        date_to = shift_day(date_from, 6)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if (date_to - date_from).days >= MAX_FORECAST_DAYS:
+        raise HTTPException(status_code=400, detail=f'Forecast range is limited to {MAX_FORECAST_DAYS} days')
+
+    with metrics.timer('forecast'):
+        key = (date_from, date_to, generations(diet_plans, recipes))
+        result = single_flight.do(
+            'forecast', key, lambda: forecast_index.forecast(date_from.isoformat(), date_to.isoformat())
+        )
+    return {'from': date_from.isoformat(), 'to': date_to.isoformat(), **result}
+
+# ===================== TIERING & RETENTION =====================
+
+def move_to_cold_tier(before: date) -> dict:
+    """Write the days before `before` to a new cold segment per collection, then drop them from RAM"""
+    result = {'before': before.isoformat(), 'archived': True}
+    for collection in (diet_plans, production_batches):
+        with collection.lock:
+            days = collection.days_before(before.isoformat())
+            cold_tiers[collection.name].write({day: collection.partitions[day] for day in days})
+            dropped = collection.drop(days)
+        result[collection.name] = {'days': len(dropped), 'records': sum(map(len, dropped.values()))}
+    return result
+
+def expire(before: date) -> dict:
+    """Delete the days before `before`: day partitions in RAM and whole cold segments"""
+    result = {'before': before.isoformat(), 'archived': False}
+    for collection in (diet_plans, production_batches):
+        with collection.lock:
+            dropped = collection.drop(collection.days_before(before.isoformat()))
+        cold = cold_tiers.get(collection.name)
+        result[collection.name] = {
+            'days': len(dropped),
+            'records': sum(map(len, dropped.values())),
+            'segments': cold.drop_before(before.isoformat()) if cold is not None else 0,
+        }
+    return result
+
+async def tier_periodically():
+    """Background tiering: move cold days to disk, then apply retention, every TIERING_INTERVAL"""
+    while True:
+        today = datetime.utcnow().date()
+        try:
+            await run_in_threadpool(move_to_cold_tier, today - timedelta(days=COLD_DAYS))
+            if RETENTION_DAYS:
+                await run_in_threadpool(expire, today - timedelta(days=RETENTION_DAYS))
+        except Exception:  # e.g. a full disk: try again next round instead of ending the task
+            logger.exception('Background tiering failed')
+        await asyncio.sleep(TIERING_INTERVAL)
+
+@app.post('/admin/retention')
+def apply_retention(
+    before: Optional[date] = None,
+    archive: Optional[bool] = None,
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Move diet plans and production batches dated before `before` to the cold tier
+    (`archive`, the default when DIET_API_ARCHIVE_DIR is set; `before` defaults to today
+    minus DIET_API_COLD_DAYS), or delete them (default: today minus DIET_API_RETENTION_DAYS)"""
+    if archive is None:
+        archive = bool(cold_tiers)
+    if archive and not cold_tiers:
+        raise HTTPException(status_code=400, detail='DIET_API_ARCHIVE_DIR is not set')
+    if before is None:
+        days = COLD_DAYS if archive else RETENTION_DAYS
+        if not days:
+            raise HTTPException(status_code=400, detail="'before' is required when DIET_API_RETENTION_DAYS is not set")
+        before = datetime.utcnow().date() - timedelta(days=days)
+    return move_to_cold_tier(before) if archive else expire(before)
+
+# ===================== CHANGE FEED =====================
+
+def change_filter(collection: List[str], customer_id: Optional[int]) -> ChangeFilter:
+    unknown = set(collection) - COLLECTIONS.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f'Unknown collection: {", ".join(sorted(unknown))}')
+    return ChangeFilter(frozenset(collection) or None, customer_id)
+
+@app.get('/changes')
+async def get_changes(
+    since: Optional[int] = Query(None, ge=0),
+    collection: List[str] = Query([]),
+    customerId: Optional[int] = None,
+    timeout: float = Query(25, ge=0, le=60),
+    limit: int = Query(1000, ge=1, le=10000),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Long-poll for store changes after `since` (default: from now); pass back `seq` to resume"""
+    where = change_filter(collection, customerId)
+    after = change_feed.seq if since is None else since
+    found, seq, missed = await change_feed.poll(after, where, timeout, limit)
+    media_type = wire_format.get()
+    return Response(transcode(render_poll(found, seq, missed).encode(), media_type), media_type=media_type)
+
+@app.get('/changes/stream')
+async def stream_changes(
+    since: Optional[int] = Query(None, ge=0),
+    collection: List[str] = Query([]),
+    customerId: Optional[int] = None,
+    duration: float = Query(300, gt=0, le=3600),
+    last_event_id: Optional[int] = Header(None),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Server-sent events of store changes; reconnects resume from Last-Event-ID"""
+    where = change_filter(collection, customerId)
+    after = last_event_id if last_event_id is not None else since
+    if after is None:
+        after = change_feed.seq
+    return StreamingResponse(
+        change_feed.stream(after, where, duration),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+# ===================== METRICS =====================
+
+@app.get('/metrics', include_in_schema=False)
+def get_metrics():
+    """Prometheus text exposition of request and internal-operation metrics"""
+    text = (metrics.render() + rate_limiter.render() + admission.render() + idempotency.render()
+            + single_flight.render() + compression.render() + render_cold_tiers(cold_tiers.values())
+            + users_db.render() + refresh_tokens.render() + goal_checks.render())
+    return Response(text, media_type=METRICS_CONTENT_TYPE)
+
+# ===================== DEBUG ENDPOINTS =====================
+
+@app.get('/debug/profile', response_class=PlainTextResponse, include_in_schema=False)
+async def debug_profile(
+    seconds: float = Query(5, gt=0, le=MAX_PROFILE_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Sample every thread's stack for `seconds`; returns collapsed stacks for flamegraph tools"""
+    stacks = await run_in_threadpool(profiler.profile, seconds, interval_ms / 1000)
+    if stacks is None:
+        raise HTTPException(status_code=409, detail='A profile is already running')
+    return stacks
+
+@app.get('/debug/traces', include_in_schema=False)
+def get_traces(
+    limit: Optional[int] = Query(None, ge=0),
+    clear: bool = False,
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Dump sampled request traces from the ring buffer, oldest first"""
+    traces = tracer.dump(limit)
+    if clear:
+        tracer.clear()
+    return {'sample_rate': tracer.sample_rate, 'traces': traces}
+
+@app.put('/debug/traces/sample-rate', include_in_schema=False)
+def set_trace_sample_rate(
+    rate: float = Query(..., ge=0, le=1),
+    current_user: User = Depends(get_current_admin_user),
+):
+    tracer.configure(rate)
+    return {'sample_rate': tracer.sample_rate}
 
 # ===================== MAIN =====================
 
@@ -0,0 +1,257 @@
+"""
+Request metrics: per-route counters, latency histograms and in-flight gauges
+
+Latencies go into HDR-style log-linear histograms: integer nanoseconds,
+16 linear sub-buckets per power of two (at most ~6% relative error), so
+recording is a bit_length() and a list increment. Everything is rendered
+in the Prometheus text format by `Metrics.render()`.
+
+Routes are instrumented by `MetricsRoute` (set as the router's route
+class), so the route template is known without re-matching the path.
+Hot internals are timed with `metrics.timer(op)`; when the request is
+being traced (see profiling.py) each timed block also becomes a span.
+"""
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from starlette.exceptions import HTTPException
+
+from profiling import current_trace, tracer
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_SHIFT = 36  # values above ~2^41 ns (~36 min) land in the last bucket
+BUCKETS = (MAX_SHIFT + 2) * SUB_BUCKETS
+
+# Prometheus `le` bounds: powers of two from ~1 µs to ~17 s, exact bucket edges
+EXPORT_EXPONENTS = range(10, 35)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def bucket_index(value: int) -> int:
+    if value < SUB_BUCKETS:
+        return max(value, 0)
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    if shift > MAX_SHIFT:
+        return BUCKETS - 1
+    return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_upper(index: int) -> int:
+    """Exclusive upper bound (ns) of bucket `index`"""
+    if index < SUB_BUCKETS:
+        return index + 1
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS + 1) << shift
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'lock')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def record(self, value_ns: int):
+        index = bucket_index(value_ns)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value_ns
+
+    def quantile(self, q: float) -> float:
+        """Approximate `q` quantile in seconds (upper edge of its bucket)"""
+        with self.lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return 0.0
+        rank = max(1, round(q * count))
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return bucket_upper(index) / 1e9
+        return bucket_upper(BUCKETS - 1) / 1e9  # pragma: no cover
+
+    def cumulative(self) -> Tuple[List[Tuple[str, int]], int, int]:
+        """(le, cumulative count) pairs, count and sum for exposition"""
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.total
+        buckets = []
+        seen, index = 0, 0
+        for exponent in EXPORT_EXPONENTS:
+            edge = bucket_index(1 << exponent)
+            seen += sum(counts[index:edge])
+            index = edge
+            buckets.append((repr((1 << exponent) / 1e9), seen))
+        buckets.append(('+Inf', count))
+        return buckets, count, total
+
+
+class RouteStats:
+    __slots__ = ('latency', 'in_flight', 'statuses', 'lock')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.in_flight = 0
+        self.statuses: Dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self, status_code: int, elapsed_ns: int):
+        with self.lock:
+            self.in_flight -= 1
+            self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+        self.latency.record(elapsed_ns)
+
+
+class Timer:
+    __slots__ = ('op', 'histogram', 'start')
+
+    def __init__(self, op: str, histogram: Histogram):
+        self.op = op
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.histogram.record(end - self.start)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(self.op, self.start, end)
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> List[str]:
+    buckets, count, total = histogram.cumulative()
+    lines = [f'{name}_bucket{{{labels},le="{le}"}} {n}' for le, n in buckets]
+    lines.append(f'{name}_sum{{{labels}}} {total / 1e9!r}')
+    lines.append(f'{name}_count{{{labels}}} {count}')
+    return lines
+
+
+class Metrics:
+    """Registry of route and internal-operation metrics"""
+
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+        self.operations: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def route(self, method: str, template: str) -> RouteStats:
+        stats = self.routes.get((method, template))
+        if stats is None:
+            with self._lock:
+                stats = self.routes.setdefault((method, template), RouteStats())
+        return stats
+
+    def operation(self, op: str) -> Histogram:
+        histogram = self.operations.get(op)
+        if histogram is None:
+            with self._lock:
+                histogram = self.operations.setdefault(op, Histogram())
+        return histogram
+
+    def timer(self, op: str) -> Timer:
+        return Timer(op, self.operation(op))
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+            self.operations = {}
+
+    def render(self) -> str:
+        routes = sorted(self.routes.items())
+        operations = sorted(self.operations.items())
+        lines = [
+            '# HELP diet_api_requests_total Requests handled, by route template and status code.',
+            '# TYPE diet_api_requests_total counter',
+        ]
+        for (method, template), stats in routes:
+            with stats.lock:
+                statuses = sorted(stats.statuses.items())
+            for status_code, n in statuses:
+                lines.append(f'diet_api_requests_total{{method="{method}",route="{_label(template)}",'
+                             f'status="{status_code}"}} {n}')
+        lines += [
+            '# HELP diet_api_requests_in_flight Requests currently being handled.',
+            '# TYPE diet_api_requests_in_flight gauge',
+        ]
+        for (method, template), stats in routes:
+            lines.append(f'diet_api_requests_in_flight{{method="{method}",route="{_label(template)}"}} '
+                         f'{stats.in_flight}')
+        lines += [
+            '# HELP diet_api_request_duration_seconds Request latency, by route template.',
+            '# TYPE diet_api_request_duration_seconds histogram',
+        ]
+        for (method, template), stats in routes:
+            labels = f'method="{method}",route="{_label(template)}"'
+            lines += _histogram_lines('diet_api_request_duration_seconds', labels, stats.latency)
+        lines += [
+            '# HELP diet_api_operation_duration_seconds Time spent in instrumented internals.',
+            '# TYPE diet_api_operation_duration_seconds histogram',
+        ]
+        for op, histogram in operations:
+            lines += _histogram_lines('diet_api_operation_duration_seconds', f'op="{_label(op)}"', histogram)
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class MetricsRoute(APIRoute):
+    """APIRoute that records count, latency and in-flight requests for its template,
+    and traces the request when the tracer samples it"""
+
+    async def handle(self, scope, receive, send):
+        stats = metrics.route(scope['method'], self.path)
+        trace = tracer.start(scope['method'], self.path)
+        token = current_trace.set(trace) if trace is not None else None
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        stats.start()
+        start = time.perf_counter_ns()
+        try:
+            await super().handle(scope, receive, send_with_status)
+        except HTTPException as exc:
+            status_code = exc.status_code
+            raise
+        except RequestValidationError:
+            status_code = 422
+            raise
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            stats.finish(status_code, elapsed)
+            if trace is not None:
+                tracer.finish(trace, status_code, elapsed)
+                current_trace.reset(token)
+
+
+class MetricsJSONResponse(JSONResponse):
+    """JSONResponse that times body encoding as the `serialize` operation"""
+
+    def render(self, content) -> bytes:
+        with metrics.timer('serialize'):
+            return super().render(content)
@@ -0,0 +1,121 @@
+"""
+Plan nutrition totals from dense per-recipe float columns
+
+`NutritionTable` keeps one float64 column per nutrition field, indexed by
+recipe id (nutrition of one portion; 0 for ids without a recipe), so a
+plan's totals are one multiply-and-sum over its meal columns per field
+instead of a recipe lookup and an inner loop per meal. Portions arrive in
+the fixed-point units of `DietPlanRecord.meal_portions`.
+
+Like the other indexes it follows the recipe collection through a
+listener and is built from the collection on first use.
+"""
+import threading
+from array import array
+from operator import mul
+from typing import Iterable, List, Optional, Tuple
+
+from records import NUTRITION_FIELDS, PORTION_SCALE, RecipeRecord
+from store import Collection
+
+# recipe ids are small sequential integers (see forecast.MAX_RECIPE_ID)
+MAX_RECIPE_ID = 1 << 24
+
+Totals = Tuple[float, ...]  # in NUTRITION_FIELDS order
+
+
+def rounded(values: Iterable[float]) -> tuple:
+    """Totals as reported: two decimals, whole values as ints"""
+    return tuple([v if v.__class__ is int else int(v) if v.is_integer() else round(v, 2) for v in values])
+
+
+class NutritionTable:
+    """Per-portion nutrition columns over all recipes"""
+
+    def __init__(self, recipes: Collection):
+        self.recipes = recipes
+        self.width = 0
+        self.columns: List[array] = [array('d') for _ in NUTRITION_FIELDS]
+        self.lock = threading.Lock()
+        self._stale = True
+
+    def _ensure_built(self):
+        while self._stale:
+            # read the recipes outside our lock (the collection's listeners take it);
+            # a write notified in between bumps the generation and we read again
+            generation = self.recipes.generation
+            recipes = list(self.recipes)
+            with self.lock:
+                if self._stale and generation == self.recipes.generation:
+                    self._rebuild(recipes)
+
+    def _rebuild(self, recipes: Iterable[RecipeRecord]):
+        recipes = [r for r in recipes if 0 <= r.id < MAX_RECIPE_ID]
+        width = max((r.id for r in recipes), default=-1) + 1
+        columns = [array('d', bytes(8 * width)) for _ in NUTRITION_FIELDS]
+        for recipe in recipes:
+            for column, value in zip(columns, recipe.nutrition):
+                column[recipe.id] = value
+        self.columns, self.width = columns, width
+        self._stale = False
+
+    def _set(self, recipe_id: int, values: Iterable[float]):
+        if not 0 <= recipe_id < MAX_RECIPE_ID:
+            return
+        if recipe_id >= self.width:
+            width = max(64, self.width)
+            while width <= recipe_id:
+                width *= 2
+            padding = bytes(8 * (width - self.width))
+            # grow copies, so readers holding the old columns keep a consistent view
+            columns = [array('d', column) for column in self.columns]
+            for column in columns:
+                column.frombytes(padding)
+            self.columns, self.width = columns, width
+        for column, value in zip(self.columns, values):
+            column[recipe_id] = value
+
+    def on_change(self, collection, op: str, recipe: Optional[RecipeRecord]):
+        """Recipe collection listener"""
+        with self.lock:
+            if self._stale:
+                return
+            if op == 'clear':
+                self._stale = True
+            elif op == 'delete':
+                self._set(recipe.id, (0.0,) * len(NUTRITION_FIELDS))
+            elif collection.changed(op, 'nutrition'):
+                self._set(recipe.id, recipe.nutrition)
+
+    def totals(self, recipe_ids, portions) -> Totals:
+        """Nutrition of meals given as parallel recipe id / portion unit columns"""
+        return self.totals_many([(recipe_ids, portions)])[0]
+
+    def totals_many(self, meals: Iterable[Tuple[Iterable[int], Iterable[int]]]) -> List[Totals]:
+        """totals() for many plans, sharing one view of the columns"""
+        self._ensure_built()
+        columns = self.columns
+        width = len(columns[0])
+        result = []
+        for recipe_ids, portions in meals:
+            recipe_ids, portions = _known(recipe_ids, portions, width)
+            result.append(tuple(
+                sum(map(mul, map(column.__getitem__, recipe_ids), portions)) / PORTION_SCALE for column in columns
+            ))
+        return result
+
+    def meal_values(self, recipe_ids, portions) -> List[List[float]]:
+        """Nutrition of every meal, one list per field (meals naming no known recipe left out)"""
+        self._ensure_built()
+        columns = self.columns
+        recipe_ids, portions = _known(recipe_ids, portions, len(columns[0]))
+        return [[v / PORTION_SCALE for v in map(mul, map(column.__getitem__, recipe_ids), portions)]
+                for column in columns]
+
+
+def _known(recipe_ids, portions, width: int):
+    # meals naming no known recipe contribute nothing
+    if recipe_ids and not (0 <= min(recipe_ids) and max(recipe_ids) < width):
+        pairs = [(r, p) for r, p in zip(recipe_ids, portions) if 0 <= r < width]
+        recipe_ids, portions = [r for r, _ in pairs], [p for _, p in pairs]
+    return recipe_ids, portions
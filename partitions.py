@@ -0,0 +1,144 @@
+"""
+Date-partitioned collections
+
+Records whose lifecycle follows a calendar day (diet plans, production
+batches) are also grouped into one partition per day, keyed by the ISO
+date (validated as a `date` at ingest, so text order is date order), with
+the days kept sorted. A date range is two bisects and reads only the
+partitions inside it; the rest of the history is never touched.
+
+Retention drops whole days: the partitions are detached in one step and
+listeners get a single 'drop' notification with the detached partitions
+in `collection.dropped` (like `changes` for updates), so the cost follows
+the data dropped, not the size of the collection. Dropped days can be
+moved to the on-disk cold tier first (see archive.py).
+"""
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+from records import Record
+from store import Collection
+
+
+class PartitionedCollection(Collection):
+    """Collection that also keeps its records in per-day partitions.
+
+    `day_field` names the record slot holding the day; updates that change
+    it move the record to its new partition.
+    """
+
+    def __init__(self, name: str, record_type: Type[Record], day_field: str, records: Iterable[Record] = ()):
+        self.day_field = day_field
+        self.partitions: Dict[str, Dict[int, Record]] = {}
+        self.days: List[str] = []
+        self.dropped: Optional[Dict[str, Dict[int, Record]]] = None  # day -> records, during 'drop'
+        super().__init__(name, record_type)
+        for record in records:
+            self._store(record)
+
+    def _place(self, record: Record):
+        day = getattr(record, self.day_field)
+        partition = self.partitions.get(day)
+        if partition is None:
+            partition = self.partitions[day] = {}
+            insort(self.days, day)
+        partition[record.id] = record
+
+    def _displace(self, record: Record):
+        day = getattr(record, self.day_field)
+        partition = self.partitions[day]
+        del partition[record.id]
+        if not partition:
+            del self.partitions[day]
+            del self.days[bisect_left(self.days, day)]
+
+    def _store(self, record: Record):
+        old = self._records.get(record.id)
+        if old is not None:
+            self._displace(old)
+        self._records[record.id] = record
+        self._place(record)
+
+    def _unstore(self, record_id: int) -> Optional[Record]:
+        record = self._records.pop(record_id, None)
+        if record is not None:
+            self._displace(record)
+        return record
+
+    def _modify(self, record: Record, changes: dict):
+        if self.day_field not in changes:
+            record.update(changes)
+            return
+        self._displace(record)
+        record.update(changes)
+        self._place(record)
+
+    def extend(self, records: Iterable[Record]):
+        with self.lock:
+            if self.listeners:
+                return super().extend(records)
+            for record in records:
+                self._store(record)
+            self.generation += 1
+
+    def defer(self, loader: Callable[[], Iterable[Record]]):
+        raise NotImplementedError('Partitioned collections are loaded eagerly')
+
+    def clear(self):
+        with self.lock:
+            self.partitions.clear()
+            self.days.clear()
+            super().clear()
+
+    def day_range(self, first: Optional[str] = None, last: Optional[str] = None) -> List[str]:
+        """Days with records within [first, last] (None = open-ended), in order"""
+        with self.lock:
+            start = 0 if first is None else bisect_left(self.days, first)
+            end = len(self.days) if last is None else bisect_right(self.days, last)
+            return self.days[start:end]
+
+    def between(self, first: Optional[str] = None, last: Optional[str] = None) -> List[Record]:
+        """Records of the days within [first, last], by day; only those partitions are read"""
+        with self.lock:
+            return [record for day in self.day_range(first, last) for record in self.partitions[day].values()]
+
+    def partition_sizes(self) -> List[Tuple[str, int]]:
+        with self.lock:
+            return [(day, len(self.partitions[day])) for day in self.days]
+
+    def dropped_records(self) -> Iterator[Record]:
+        """During a 'drop' notification: every record being dropped"""
+        for partition in self.dropped.values():
+            yield from partition.values()
+
+    def drop(self, days: Iterable[str]) -> Dict[str, Dict[int, Record]]:
+        """Detach whole days; listeners get one 'drop' with the partitions in `dropped`"""
+        with self.lock:
+            dropped = {}
+            for day in sorted(set(days)):
+                partition = self.partitions.pop(day, None)
+                if partition is None:
+                    continue
+                dropped[day] = partition
+                for record_id in partition:
+                    del self._records[record_id]
+                    self.versions.pop(record_id, None)
+            if not dropped:
+                return dropped
+            count = len(dropped)
+            if self.days[count - 1] == next(reversed(dropped)):
+                del self.days[:count]  # the usual retention case: a prefix of the history
+            else:
+                self.days[:] = [day for day in self.days if day not in dropped]
+            self.dropped = dropped
+            try:
+                self._notify('drop', None)
+            finally:
+                self.dropped = None
+            return dropped
+
+    def days_before(self, day: str) -> List[str]:
+        """Days with records before `day`, for retention"""
+        with self.lock:
+            return self.days[:bisect_left(self.days, day)]
+
@@ -0,0 +1,21 @@
+"""
+JSON Merge Patch (RFC 7386)
+"""
+from typing import Any
+
+
+def merge_patch(target: Any, patch: Any) -> Any:
+    """Return `target` with `patch` applied; neither argument is modified.
+
+    Objects are merged key by key, a null value removes the key, and
+    anything else (arrays included) replaces the target value.
+    """
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
@@ -0,0 +1,344 @@
+"""
+Write-ahead log + snapshots for the in-memory collections
+
+Layout of the data directory:
+    snapshot.msgpack        latest full snapshot (seq, counters, record states)
+    wal-<first seq>.log     append-only log segments, one frame per mutation
+
+A frame is `<u32 length><u32 crc32><msgpack [seq, collection, op, payload]>`
+where the payload is `Record.to_state()` for inserts/updates and the id for
+deletes.
+Writers hand frames to a single flusher thread which writes and fsyncs
+everything queued since its last fsync in one go (group commit). Frames
+are queued from collection listeners, under the collection lock; inside a
+request the wait for the fsync happens in `DurableWritesMiddleware`, after
+the endpoint has released its locks, so concurrent writers to the same
+collection share fsyncs. A snapshot holds the collection locks only to roll
+the log and copy the record references; records are serialized after
+that, so it may also contain writes made after its seq; that is harmless
+since replaying a frame is idempotent (inserts and updates carry the full
+record state). Recovery loads the snapshot, then replays newer frames and
+stops at the first torn or corrupt frame.
+"""
+import gc
+import os
+import struct
+import threading
+import zlib
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional
+
+import msgpack
+from anyio import to_thread
+
+from records import Record
+from store import Collection
+
+SNAPSHOT_FILE = 'snapshot.msgpack'
+SNAPSHOT_MAGIC = b'DIETSNP1'
+_FRAME_HEADER = struct.Struct('<II')
+
+# [log, last seq] written by the current request, waited for before its response
+_pending: ContextVar[Optional[list]] = ContextVar('wal_pending', default=None)
+
+
+def _segment_name(first_seq: int) -> str:
+    return f'wal-{first_seq:020d}.log'
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_frame(entry) -> bytes:
+    payload = msgpack.packb(entry, use_bin_type=True)
+    return _FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_frames(path: str) -> List[list]:
+    """Decode all intact frames of a segment, ignoring a torn tail"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    entries = []
+    view = memoryview(data)
+    pos = 0
+    header_size = _FRAME_HEADER.size
+    while pos + header_size <= len(data):
+        length, crc = _FRAME_HEADER.unpack_from(data, pos)
+        start = pos + header_size
+        payload = view[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        entries.append(msgpack.unpackb(payload, raw=False))
+        pos = start + length
+    return entries
+
+
+class WriteAheadLog:
+    """Append-only, group-committed mutation log.
+
+    `append` only queues the entry; `wait` returns once it is durable when
+    `sync` is True and at once with `sync` False.
+    """
+
+    def __init__(self, directory: str, next_seq: int = 1, sync: bool = True):
+        self.directory = directory
+        self.sync = sync
+        self.seq = next_seq - 1
+        self.durable_seq = self.seq
+        self.fsyncs = 0
+        self._buffer: List[bytes] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._file = open(os.path.join(directory, _segment_name(next_seq)), 'ab')
+        self._flusher = threading.Thread(target=self._flush_loop, name='wal-flusher', daemon=True)
+        self._flusher.start()
+
+    def append(self, collection: str, op: str, payload) -> int:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('write-ahead log is closed')
+            self.seq += 1
+            seq = self.seq
+            self._buffer.append(encode_frame([seq, collection, op, payload]))
+            self._cond.notify_all()
+        return seq
+
+    def wait(self, seq: int):
+        """Block until `seq` is durable (sync mode only)"""
+        if not self.sync:
+            return
+        with self._cond:
+            while self.durable_seq < seq:
+                self._cond.wait()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer and self._closed:
+                    return
+                batch, self._buffer = self._buffer, []
+                batch_seq = self.seq
+                f = self._file
+            f.write(b''.join(batch))
+            f.flush()
+            os.fsync(f.fileno())
+            with self._cond:
+                self.durable_seq = batch_seq
+                self.fsyncs += 1
+                self._cond.notify_all()
+
+    def flush(self):
+        """Block until everything appended so far is durable"""
+        with self._cond:
+            target = self.seq
+            while self.durable_seq < target:
+                self._cond.wait()
+
+    def roll(self) -> int:
+        """Start a new segment; returns the last seq of the closed segment"""
+        with self._cond:
+            target = self.seq
+            while self.durable_seq < target:
+                self._cond.wait()
+            self._file.close()
+            self._file = open(os.path.join(self.directory, _segment_name(target + 1)), 'ab')
+            return target
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self._file.close()
+
+
+class Persistence:
+    """Durability for a set of collections: recovery, logging, snapshots"""
+
+    def __init__(self, directory: str, collections: Iterable[Collection],
+                 sync: bool = True, snapshot_every: int = 100_000):
+        self.directory = directory
+        self.collections: Dict[str, Collection] = {c.name: c for c in collections}
+        self.sync = sync
+        self.snapshot_every = snapshot_every
+        self.counters: Dict[str, int] = {}
+        self.wal: Optional[WriteAheadLog] = None
+        self._snapshot_seq = 0
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_thread: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self) -> List[str]:
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith('wal-') and n.endswith('.log'))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def recover(self, counters: Dict[str, int]) -> Dict[str, int]:
+        """Load snapshot + log into the collections and start logging.
+
+        `counters` are the current next-id values; the returned dict holds
+        the values to continue from after recovery. With an empty directory
+        the current contents are kept and written out as the first snapshot,
+        before any log segment exists.
+        """
+        gc_was_enabled = gc.isenabled()
+        gc.disable()  # millions of fresh container objects would trigger repeated full collections
+        try:
+            return self._recover(counters)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _recover(self, counters: Dict[str, int]) -> Dict[str, int]:
+        self.counters = dict(counters)
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        seq = 0
+        has_state = os.path.exists(snapshot_path)
+        if has_state:
+            with open(snapshot_path, 'rb') as f:
+                if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                    raise ValueError(f'{snapshot_path} is not a snapshot file')
+                state = msgpack.unpackb(f.read(), raw=False)
+            seq = state['seq']
+            self.counters.update(state['counters'])
+            for name, states in state['records'].items():
+                collection = self.collections[name]
+                collection.clear()
+                collection.extend(map(collection.record_type.from_state, states))
+        else:
+            records = {name: [r.to_state() for r in c] for name, c in self.collections.items()}
+            self._write_snapshot(0, self.counters, records)
+        for path in self._segments():
+            for entry_seq, name, op, payload in read_frames(path):
+                if entry_seq <= seq:
+                    continue
+                self._apply(name, op, payload)
+                seq = entry_seq
+        self._snapshot_seq = seq
+
+        for name, collection in self.collections.items():
+            top = max((r.id for r in collection), default=0)
+            self.counters[name] = max(self.counters.get(name, 1), top + 1)
+
+        self.wal = WriteAheadLog(self.directory, next_seq=seq + 1, sync=self.sync)
+        for collection in self.collections.values():
+            collection.listeners.append(self.on_change)
+        return dict(self.counters)
+
+    def _apply(self, name: str, op: str, payload):
+        collection = self.collections[name]
+        if op in ('insert', 'update'):
+            record = collection.record_type.from_state(payload)
+            if record.id >= self.counters.get(name, 1):
+                self.counters[name] = record.id + 1
+            collection.insert(record)
+        elif op == 'delete':
+            collection.delete(payload)
+        elif op == 'clear':
+            collection.clear()
+        elif op == 'drop':
+            collection.drop(payload)
+
+    def on_change(self, collection: Collection, op: str, record: Optional[Record]):
+        if op == 'delete':
+            payload = record.id
+        elif op == 'clear':
+            payload = None
+        elif op == 'drop':
+            payload = list(collection.dropped)
+        else:
+            payload = record.to_state()
+            if record.id >= self.counters.get(collection.name, 1):
+                self.counters[collection.name] = record.id + 1
+        seq = self.wal.append(collection.name, op, payload)
+        pending = _pending.get()
+        if pending is None:
+            self.wal.wait(seq)  # not in a request: durable before the write returns
+        else:
+            pending[:] = (self.wal, seq)
+        if seq - self._snapshot_seq >= self.snapshot_every:
+            self.snapshot_async()
+
+    def snapshot(self):
+        """Write a full snapshot and drop log segments it supersedes"""
+        with self._snapshot_lock:
+            locks = [c.lock for c in self.collections.values()]
+            for lock in locks:
+                lock.acquire()
+            try:
+                seq = self.wal.roll()
+                records = {name: list(c) for name, c in self.collections.items()}
+                counters = dict(self.counters)
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+            # serialized without the locks: a record written meanwhile (even half-way through
+            # to_state) has a frame after `seq`, which recovery replays on top of this snapshot
+            states = {name: [r.to_state() for r in rs] for name, rs in records.items()}
+            self._write_snapshot(seq, counters, states)
+            self._snapshot_seq = seq
+            current = _segment_name(seq + 1)
+            for segment in self._segments():
+                if os.path.basename(segment) < current:
+                    os.remove(segment)
+
+    def _write_snapshot(self, seq: int, counters: Dict[str, int], records: Dict[str, List[dict]]):
+        data = msgpack.packb({'seq': seq, 'counters': counters, 'records': records}, use_bin_type=True)
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_dir(self.directory)
+
+    def snapshot_async(self):
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return
+        self._snapshot_seq = self.wal.seq
+        self._snapshot_thread = threading.Thread(target=self.snapshot, name='wal-snapshot', daemon=True)
+        self._snapshot_thread.start()
+
+    def close(self, snapshot: bool = True):
+        for collection in self.collections.values():
+            if self.on_change in collection.listeners:
+                collection.listeners.remove(self.on_change)
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        if snapshot:
+            self.snapshot()
+        self.wal.close()
+        self.wal = None
+
+
+class DurableWritesMiddleware:
+    """ASGI middleware holding back each response until the request's logged writes are durable"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        pending = []
+        token = _pending.set(pending)
+
+        async def durable_send(message):
+            if pending:
+                wal, seq = pending
+                pending.clear()
+                await to_thread.run_sync(wal.wait, seq)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, durable_send)
+        finally:
+            _pending.reset(token)
@@ -0,0 +1,154 @@
+"""
+On-demand sampling profiler and sampled per-request tracing
+
+`sample_stacks()` polls every thread's current frame at a fixed interval
+and returns the stacks in collapsed format ("root;caller;callee count"),
+which flamegraph.pl, speedscope and inferno read directly.
+
+`Tracer` keeps recent request traces in a bounded ring buffer. A request
+is traced with probability `sample_rate`; while it runs, the trace is
+reachable through the `current_trace` context variable so `metrics.timer`
+blocks (auth, lookup, compute, serialize) append spans to it.
+"""
+import collections
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+# metrics.timer op -> span name shown in traces
+SPAN_NAMES = {
+    'jwt_decode': 'auth',
+    'bcrypt_verify': 'auth',
+    'bcrypt_hash': 'auth',
+    'store_lookup': 'lookup',
+    'plan_validation': 'compute',
+    'serialize': 'serialize',
+}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)})'
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> Dict[str, int]:
+    """Sample all other threads for `seconds`; collapsed stack -> sample count"""
+    own = threading.get_ident()
+    counts: Dict[str, int] = collections.Counter()
+    deadline = time.perf_counter() + seconds
+    while True:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f'thread-{thread_id}'))
+            counts[';'.join(label.replace(';', ':') for label in reversed(stack))] += 1
+        if time.perf_counter() + interval > deadline:
+            return counts
+        time.sleep(interval)
+
+
+def collapse(counts: Dict[str, int]) -> str:
+    return ''.join(f'{stack} {n}\n' for stack, n in sorted(counts.items()))
+
+
+class Profiler:
+    """Runs one sampling session at a time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, seconds: float, interval: float) -> Optional[str]:
+        """Collapsed stacks, or None if another session is in progress"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return collapse(sample_stacks(seconds, interval))
+        finally:
+            self._lock.release()
+
+
+class Trace:
+    __slots__ = ('method', 'route', 'started', 'start_ns', 'spans', 'status', 'duration_ns')
+
+    def __init__(self, method: str, route: str):
+        self.method = method
+        self.route = route
+        self.started = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.spans: List[tuple] = []
+        self.status = None
+        self.duration_ns = None
+
+    def add(self, op: str, start_ns: int, end_ns: int):
+        self.spans.append((op, start_ns, end_ns))
+
+    def to_dict(self) -> dict:
+        return {
+            'method': self.method,
+            'route': self.route,
+            'status': self.status,
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            'duration_us': self.duration_ns / 1000,
+            'spans': [
+                {
+                    'name': SPAN_NAMES.get(op, op),
+                    'op': op,
+                    'start_us': (start - self.start_ns) / 1000,
+                    'duration_us': (end - start) / 1000,
+                }
+                for op, start, end in self.spans
+            ],
+        }
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('current_trace', default=None)
+
+
+class Tracer:
+    """Samples requests into a ring buffer of the most recent `capacity` traces"""
+
+    def __init__(self, sample_rate: float = 0.0, capacity: int = 1000):
+        self.configure(sample_rate, capacity)
+
+    def configure(self, sample_rate: float, capacity: Optional[int] = None):
+        self.sample_rate = sample_rate
+        if capacity is not None:
+            self.traces = collections.deque(maxlen=capacity)
+
+    def start(self, method: str, route: str) -> Optional[Trace]:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return Trace(method, route)
+
+    def finish(self, trace: Trace, status_code: int, duration_ns: int):
+        trace.status = status_code
+        trace.duration_ns = duration_ns
+        self.traces.append(trace)
+
+    def dump(self, limit: Optional[int] = None) -> List[dict]:
+        """Most recent traces, oldest first"""
+        traces = list(self.traces)
+        if limit is not None:
+            traces = traces[-limit:] if limit else []
+        return [t.to_dict() for t in traces]
+
+    def clear(self):
+        self.traces.clear()
+
+
+profiler = Profiler()
+tracer = Tracer()
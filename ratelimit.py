@@ -0,0 +1,212 @@
+"""
+Per-user rate limiting and global admission control
+
+`RateLimiter` keeps one token bucket per (username, route): a bucket holds
+up to `burst` tokens, refills at `rate` tokens per second and each request
+takes one. Buckets are refilled lazily from the time of their last use, so
+an idle bucket costs nothing but its dict entry.
+
+`AdmissionGate` caps how many requests run at once, overall and per
+route, and turns the excess away immediately instead of letting it queue
+on the threadpool. `AdmissionRoute` applies it to every route.
+
+Both read their limits from a compact spec, e.g.
+"*=20:40,GET /diet-plans=2:5" (route=rate:burst) or "*=64,GET /diet-plans=4"
+(route=requests in flight), where `*` is the default for all routes.
+"""
+import math
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+
+from metrics import MetricsRoute
+
+RouteKey = Tuple[str, str]  # (method, route template)
+
+
+class Limit(NamedTuple):
+    rate: float  # tokens per second
+    burst: int
+
+
+def parse_spec(spec: str) -> Tuple[Optional[str], Dict[RouteKey, str]]:
+    """Split "*=v,METHOD /path=v" into the default value and per-route values"""
+    default = None
+    routes = {}
+    for entry in filter(None, (e.strip() for e in spec.split(','))):
+        route, _, value = entry.rpartition('=')
+        if not route:
+            raise ValueError(f'Expected route=value, got {entry!r}')
+        if route.strip() == '*':
+            default = value
+        else:
+            method, _, template = route.strip().partition(' ')
+            routes[(method.upper(), template.strip())] = value
+    return default, routes
+
+
+def parse_limit(value: str) -> Limit:
+    rate, _, burst = value.partition(':')
+    rate = float(rate)
+    return Limit(rate, int(burst) if burst else max(1, math.ceil(rate)))
+
+
+def retry_after(seconds: float) -> Dict[str, str]:
+    return {'Retry-After': str(max(1, math.ceil(seconds)))}
+
+
+class RateLimiter:
+    """Token buckets keyed by (user, route); routes without a limit are not tracked"""
+
+    def __init__(self, max_buckets: int = 100_000):
+        self.default: Optional[Limit] = None
+        self.routes: Dict[RouteKey, Limit] = {}
+        self.max_buckets = max_buckets
+        self.buckets: Dict[Tuple[str, RouteKey], List[float]] = {}  # -> [tokens, last refill]
+        self.limited: Dict[RouteKey, int] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, spec: str):
+        default, routes = parse_spec(spec)
+        with self._lock:
+            self.default = parse_limit(default) if default else None
+            self.routes = {route: parse_limit(value) for route, value in routes.items()}
+            self.buckets.clear()
+
+    def reset(self):
+        with self._lock:
+            self.buckets.clear()
+            self.limited.clear()
+
+    def _prune(self, now: float):
+        """Drop buckets that have refilled completely; they are recreated full"""
+        for key, (tokens, last) in list(self.buckets.items()):
+            limit = self.routes.get(key[1], self.default)
+            if limit is None or tokens + (now - last) * limit.rate >= limit.burst:
+                del self.buckets[key]
+
+    def acquire(self, user: str, route: RouteKey) -> float:
+        """Take a token; 0 if the request may proceed, else seconds until one is available"""
+        limit = self.routes.get(route, self.default)
+        if limit is None:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self.buckets.get((user, route))
+            if bucket is None:
+                if len(self.buckets) >= self.max_buckets:
+                    self._prune(now)
+                bucket = self.buckets[(user, route)] = [limit.burst, now]
+            tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            self.limited[route] = self.limited.get(route, 0) + 1
+        return (1 - tokens) / limit.rate if limit.rate > 0 else 60.0
+
+    def check(self, user: str, method: str, template: str):
+        """Raise 429 with Retry-After when `user` is over the route's limit"""
+        wait = self.acquire(user, (method, template))
+        if wait:
+            raise HTTPException(status_code=429, detail='Rate limit exceeded', headers=retry_after(wait))
+
+    def render(self) -> str:
+        lines = [
+            '# HELP diet_api_rate_limited_total Requests rejected by per-user rate limits, by route template.',
+            '# TYPE diet_api_rate_limited_total counter',
+        ]
+        for (method, template), n in sorted(self.limited.items()):
+            lines.append(f'diet_api_rate_limited_total{{method="{method}",route="{template}"}} {n}')
+        lines += [
+            '# HELP diet_api_rate_limit_per_second Configured per-user token refill rate, by route template.',
+            '# TYPE diet_api_rate_limit_per_second gauge',
+        ]
+        if self.default is not None:
+            lines.append(f'diet_api_rate_limit_per_second{{method="*",route="*"}} {self.default.rate}')
+        for (method, template), limit in sorted(self.routes.items()):
+            lines.append(f'diet_api_rate_limit_per_second{{method="{method}",route="{template}"}} {limit.rate}')
+        return '\n'.join(lines) + '\n'
+
+
+class AdmissionGate:
+    """Global and per-route caps on requests in flight; 0 means no cap"""
+
+    def __init__(self):
+        self.max_in_flight = 0
+        self.routes: Dict[RouteKey, int] = {}
+        self.in_flight = 0
+        self.route_in_flight: Dict[RouteKey, int] = {}
+        self.rejected: Dict[RouteKey, int] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, spec: str):
+        default, routes = parse_spec(spec)
+        with self._lock:
+            self.max_in_flight = int(default) if default else 0
+            self.routes = {route: int(value) for route, value in routes.items()}
+
+    def reset(self):
+        with self._lock:
+            self.rejected.clear()
+
+    def enter(self, route: RouteKey) -> bool:
+        with self._lock:
+            cap = self.routes.get(route, 0)
+            running = self.route_in_flight.get(route, 0)
+            if (self.max_in_flight and self.in_flight >= self.max_in_flight) or (cap and running >= cap):
+                self.rejected[route] = self.rejected.get(route, 0) + 1
+                return False
+            self.in_flight += 1
+            self.route_in_flight[route] = running + 1
+        return True
+
+    def leave(self, route: RouteKey):
+        with self._lock:
+            self.in_flight -= 1
+            self.route_in_flight[route] -= 1
+
+    def render(self) -> str:
+        lines = [
+            '# HELP diet_api_admission_in_flight Requests admitted and still running.',
+            '# TYPE diet_api_admission_in_flight gauge',
+            f'diet_api_admission_in_flight {self.in_flight}',
+            '# HELP diet_api_admission_limit Maximum requests in flight (0 = unlimited), by route template.',
+            '# TYPE diet_api_admission_limit gauge',
+            f'diet_api_admission_limit{{method="*",route="*"}} {self.max_in_flight}',
+        ]
+        for (method, template), cap in sorted(self.routes.items()):
+            lines.append(f'diet_api_admission_limit{{method="{method}",route="{template}"}} {cap}')
+        lines += [
+            '# HELP diet_api_admission_rejected_total Requests shed by the admission gate, by route template.',
+            '# TYPE diet_api_admission_rejected_total counter',
+        ]
+        for (method, template), n in sorted(self.rejected.items()):
+            lines.append(f'diet_api_admission_rejected_total{{method="{method}",route="{template}"}} {n}')
+        return '\n'.join(lines) + '\n'
+
+
+rate_limiter = RateLimiter()
+admission = AdmissionGate()
+
+
+class AdmissionRoute(MetricsRoute):
+    """MetricsRoute whose handler is only entered when `admission` lets the
+    request in; shed requests get 503 and still show up in route metrics"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def admitted(request):
+            route = (request.method, self.path)
+            if not admission.enter(route):
+                raise HTTPException(status_code=503, detail='Server busy, retry later', headers=retry_after(1))
+            try:
+                return await handler(request)
+            finally:
+                admission.leave(route)
+
+        return admitted
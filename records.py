@@ -0,0 +1,294 @@
+"""
+Compact internal representation of stored entities
+
+Records are `__slots__` classes holding nutrition vectors as tuples and
+meals / batch lines as struct-of-arrays columns. Repeated strings (meal
+types, dates, restriction types, ingredients) are interned. They are turned
+into the public JSON shape only at the response boundary via `to_dict()`,
+and into a msgpack-friendly list via `to_state()` for persistence.
+
+Meal portions may be fractional; they are stored as fixed-point int64
+thousandths of a portion (`PORTION_SCALE`) so per-day sums stay exact.
+"""
+import sys
+from array import array
+from typing import Dict, Iterable, Tuple
+
+NUTRITION_FIELDS = ('calories', 'protein', 'carbs', 'fat')
+
+# a plan (or day) meets the goal when every macro is within this share of it,
+# unless the customer's goal sets its own tolerance
+GOAL_TOLERANCE = 0.1
+
+# meal portions are stored in thousandths: 1.5 portions -> 1500
+PORTION_SCALE = 1000
+
+# meal type code -> name for the usual types, stored one byte per meal;
+# a plan with any other type keeps its types as a tuple of interned names
+MEAL_TYPES: Tuple[str, ...] = ('BREAKFAST', 'LUNCH', 'DINNER', 'SNACK')
+_MEAL_TYPE_CODES: Dict[str, int] = {t: i for i, t in enumerate(MEAL_TYPES)}
+
+
+def meal_type_column(types: Iterable[str]):
+    """bytes of meal type codes, or a tuple of names when a type has no code"""
+    types = list(types)
+    if all(t in _MEAL_TYPE_CODES for t in types):
+        return bytes(_MEAL_TYPE_CODES[t] for t in types)
+    return tuple(map(sys.intern, types))
+
+
+def meal_type_names(column) -> Iterable[str]:
+    return (MEAL_TYPES[c] for c in column) if isinstance(column, bytes) else column
+
+
+def compact_number(value):
+    """Whole floats as ints, so integral values keep their JSON shape (350, not 350.0)"""
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def portion_units(portion) -> int:
+    return round(portion * PORTION_SCALE)
+
+
+def portion_value(units: int):
+    return units // PORTION_SCALE if units % PORTION_SCALE == 0 else units / PORTION_SCALE
+
+
+def nutrition_tuple(values: dict) -> Tuple[int, ...]:
+    return tuple(values[f] for f in NUTRITION_FIELDS)
+
+
+def nutrition_dict(values: Tuple[int, ...]) -> dict:
+    return dict(zip(NUTRITION_FIELDS, values))
+
+
+def _ids(values) -> array:
+    return array('q', values)
+
+
+def _ids_from_bytes(data: bytes) -> array:
+    values = array('q')
+    values.frombytes(data)
+    return values
+
+
+class Record:
+    __slots__ = ('id',)
+
+    def update(self, changes: dict):
+        for name, value in changes.items():
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self.to_state() == other.to_state()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+class CustomerRecord(Record):
+    __slots__ = ('name', 'email', 'phone', 'restrictions', 'goal', 'tolerance', 'rules')
+
+    def __init__(self, id, name, email, phone, restrictions, goal, tolerance=GOAL_TOLERANCE, rules=()):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.phone = phone
+        self.restrictions = restrictions  # tuple of (type, description)
+        self.goal = goal  # tuple in NUTRITION_FIELDS order
+        self.tolerance = tolerance  # share of the goal each macro may deviate
+        self.rules = rules  # tuple of goal rule expressions (see goals.py)
+
+    @staticmethod
+    def fields(name, email, phone, restrictions, goal, tolerance=None, rules=()) -> dict:
+        """Slot values from plain data; `restrictions` yields (type, description)"""
+        return {
+            'name': name,
+            'email': email,
+            'phone': phone,
+            'restrictions': tuple((sys.intern(t), d) for t, d in restrictions),
+            'goal': tuple(goal),
+            'tolerance': GOAL_TOLERANCE if tolerance is None else compact_number(tolerance),
+            'rules': tuple(rules),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'CustomerRecord':
+        restrictions = [(r['type'], r['description']) for r in data.get('restrictions', [])]
+        goal = data['goal']
+        return cls(data['id'], **cls.fields(
+            data['name'], data['email'], data.get('phone', ''), restrictions, nutrition_tuple(goal),
+            goal.get('tolerance'), goal.get('rules') or ()))
+
+    def goal_dict(self) -> dict:
+        # tolerance and rules only when the customer has their own
+        goal = nutrition_dict(self.goal)
+        if self.tolerance != GOAL_TOLERANCE:
+            goal['tolerance'] = self.tolerance
+        if self.rules:
+            goal['rules'] = list(self.rules)
+        return goal
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'email': self.email,
+            'phone': self.phone,
+            'restrictions': [{'type': t, 'description': d} for t, d in self.restrictions],
+            'goal': self.goal_dict(),
+        }
+
+    def to_state(self) -> list:
+        return [self.id, self.name, self.email, self.phone, [list(r) for r in self.restrictions], list(self.goal),
+                self.tolerance, list(self.rules)]
+
+    @classmethod
+    def from_state(cls, state: list) -> 'CustomerRecord':
+        id, name, email, phone, restrictions, goal, *rules = state  # no tolerance and rules before goal rules
+        tolerance, rules = rules or (GOAL_TOLERANCE, ())
+        return cls(id, name, email, phone, tuple((sys.intern(t), d) for t, d in restrictions), tuple(goal),
+                   tolerance, tuple(rules))
+
+
+class RecipeRecord(Record):
+    __slots__ = ('name', 'ingredients', 'nutrition', 'portionGrams')
+
+    def __init__(self, id, name, ingredients, nutrition, portionGrams=None):
+        self.id = id
+        self.name = name
+        self.ingredients = ingredients  # tuple of interned strings
+        self.nutrition = nutrition  # per portion, tuple in NUTRITION_FIELDS order
+        self.portionGrams = portionGrams  # weight of one portion, for gram-based meals
+
+    @staticmethod
+    def fields(name, ingredients, nutrition, portion_grams=None) -> dict:
+        return {
+            'name': name,
+            'ingredients': tuple(sys.intern(i) for i in ingredients),
+            'nutrition': tuple(map(compact_number, nutrition)),
+            'portionGrams': compact_number(portion_grams),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RecipeRecord':
+        return cls(data['id'], **cls.fields(
+            data['name'], data.get('ingredients', []), nutrition_tuple(data['nutrition']), data.get('portionGrams')))
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'ingredients': list(self.ingredients),
+            'nutrition': nutrition_dict(self.nutrition),
+            'portionGrams': self.portionGrams,
+        }
+
+    def to_state(self) -> list:
+        return [self.id, self.name, list(self.ingredients), list(self.nutrition), self.portionGrams]
+
+    @classmethod
+    def from_state(cls, state: list) -> 'RecipeRecord':
+        id, name, ingredients, nutrition, *portion_grams = state  # no portion weight before fractional portions
+        return cls(id, name, tuple(sys.intern(i) for i in ingredients), tuple(nutrition), *portion_grams)
+
+
+class DietPlanRecord(Record):
+    __slots__ = ('customerId', 'date', 'meal_types', 'meal_recipes', 'meal_portions')
+
+    def __init__(self, id, customerId, date, meal_types, meal_recipes, meal_portions):
+        self.id = id
+        self.customerId = customerId
+        self.date = date
+        self.meal_types = meal_types  # see meal_type_column
+        self.meal_recipes = meal_recipes  # array('q') of recipe ids
+        self.meal_portions = meal_portions  # array('q') of portions in 1/PORTION_SCALE
+
+    @staticmethod
+    def meal_fields(meals: Iterable[tuple]) -> dict:
+        """Meal columns from (type, recipe_id, portion) rows"""
+        meals = list(meals)
+        return {
+            'meal_types': meal_type_column(m[0] for m in meals),
+            'meal_recipes': _ids(m[1] for m in meals),
+            'meal_portions': _ids(portion_units(m[2]) for m in meals),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DietPlanRecord':
+        meals = [(m['type'], m['recipeId'], m.get('portion', 1)) for m in data.get('meals', [])]
+        return cls(data['id'], data['customerId'], sys.intern(data['date']), **cls.meal_fields(meals))
+
+    @property
+    def meals(self):
+        """(type, recipe_id, portion) per meal"""
+        return zip(meal_type_names(self.meal_types), self.meal_recipes, map(portion_value, self.meal_portions))
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'customerId': self.customerId,
+            'date': self.date,
+            'meals': [{'type': t, 'recipeId': r, 'portion': p} for t, r, p in self.meals],
+        }
+
+    def to_state(self) -> list:
+        types = list(meal_type_names(self.meal_types))
+        return [self.id, self.customerId, self.date, types, self.meal_recipes.tobytes(), self.meal_portions.tobytes(),
+                PORTION_SCALE]
+
+    @classmethod
+    def from_state(cls, state: list) -> 'DietPlanRecord':
+        id, customer_id, date, types, recipe_ids, portions, *scale = state
+        portions = _ids_from_bytes(portions)
+        if not scale:  # written before fractional portions: whole portions
+            portions = _ids(p * PORTION_SCALE for p in portions)
+        return cls(id, customer_id, sys.intern(date), meal_type_column(types),
+                   _ids_from_bytes(recipe_ids), portions)
+
+
+class ProductionBatchRecord(Record):
+    __slots__ = ('productionDate', 'dietPlans', 'batch_recipes', 'batch_portions')
+
+    def __init__(self, id, productionDate, dietPlans, batch_recipes, batch_portions):
+        self.id = id
+        self.productionDate = productionDate
+        self.dietPlans = dietPlans  # array('q') of diet plan ids
+        self.batch_recipes = batch_recipes  # array('q') of recipe ids
+        self.batch_portions = batch_portions  # array('q') of portions
+
+    @staticmethod
+    def fields(production_date, diet_plans, recipe_batches) -> dict:
+        """Slot values from plain data; `recipe_batches` yields (recipe_id, portions)"""
+        recipe_batches = list(recipe_batches)
+        return {
+            'productionDate': sys.intern(production_date),
+            'dietPlans': _ids(diet_plans),
+            'batch_recipes': _ids(b[0] for b in recipe_batches),
+            'batch_portions': _ids(b[1] for b in recipe_batches),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ProductionBatchRecord':
+        batches = [(b['recipeId'], b['portions']) for b in data.get('recipeBatches', [])]
+        return cls(data['id'], **cls.fields(data['productionDate'], data.get('dietPlans', []), batches))
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'productionDate': self.productionDate,
+            'dietPlans': self.dietPlans.tolist(),
+            'recipeBatches': [
+                {'recipeId': r, 'portions': p} for r, p in zip(self.batch_recipes, self.batch_portions)
+            ],
+        }
+
+    def to_state(self) -> list:
+        return [self.id, self.productionDate, self.dietPlans.tobytes(),
+                self.batch_recipes.tobytes(), self.batch_portions.tobytes()]
+
+    @classmethod
+    def from_state(cls, state: list) -> 'ProductionBatchRecord':
+        id, production_date, plans, recipe_ids, portions = state
+        return cls(id, sys.intern(production_date), _ids_from_bytes(plans),
+                   _ids_from_bytes(recipe_ids), _ids_from_bytes(portions))
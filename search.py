@@ -0,0 +1,167 @@
+"""
+Recipe search indexes: inverted ingredient index + sorted nutrition indexes
+"""
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from records import NUTRITION_FIELDS, RecipeRecord
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalize free text into lowercase alphanumeric tokens"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class RecipeIndex:
+    """Incrementally maintained search index over recipe records.
+
+    `ingredients` maps a normalized token to the set of recipe ids whose
+    ingredient list contains it. `nutrition` keeps one sorted list of
+    (value, recipe_id) pairs per nutrition field so range filters are two
+    bisects instead of a scan.
+
+    With a `source` the index is built from it on the first search rather
+    than up front, and writes arriving before that are simply picked up by
+    the build. Like PlanIndex, writes and searches hold `lock`.
+    """
+
+    def __init__(self, source: Optional[Iterable[RecipeRecord]] = None):
+        self.ingredients: Dict[str, Set[int]] = {}
+        self.nutrition: Dict[str, List[Tuple[int, int]]] = {f: [] for f in NUTRITION_FIELDS}
+        self._entries: Dict[int, Tuple[List[Set[str]], Dict[str, int], RecipeRecord]] = {}
+        self.lock = threading.RLock()
+        self.source = source
+        self._stale = source is not None
+
+    def __len__(self):
+        self._ensure_built()
+        with self.lock:
+            return len(self._entries)
+
+    def _ensure_built(self):
+        if self._stale:
+            with self.lock:
+                if self._stale:
+                    self.rebuild(self.source)
+
+    def _add_entry(self, recipe: RecipeRecord) -> Dict[str, int]:
+        recipe_id = recipe.id
+        ingredient_tokens = [set(tokenize(i)) for i in recipe.ingredients]
+        nutrition = dict(zip(NUTRITION_FIELDS, recipe.nutrition))
+        self._entries[recipe_id] = (ingredient_tokens, nutrition, recipe)
+        for token in set().union(*ingredient_tokens):
+            self.ingredients.setdefault(token, set()).add(recipe_id)
+        return nutrition
+
+    def add(self, recipe: RecipeRecord):
+        recipe_id = recipe.id
+        with self.lock:
+            if recipe_id in self._entries:
+                self.remove(recipe_id)
+            for field, value in self._add_entry(recipe).items():
+                insort(self.nutrition[field], (value, recipe_id))
+
+    def remove(self, recipe_id: int):
+        with self.lock:
+            entry = self._entries.pop(recipe_id, None)
+            if entry is None:
+                return
+            ingredient_tokens, nutrition, _ = entry
+            for token in set().union(*ingredient_tokens):
+                ids = self.ingredients.get(token)
+                if ids is not None:
+                    ids.discard(recipe_id)
+                    if not ids:
+                        del self.ingredients[token]
+            for field, value in nutrition.items():
+                column = self.nutrition[field]
+                pos = bisect_left(column, (value, recipe_id))
+                if pos < len(column) and column[pos] == (value, recipe_id):
+                    del column[pos]
+
+    def update(self, recipe: RecipeRecord):
+        self.add(recipe)
+
+    def rebuild(self, recipes: Iterable[RecipeRecord]):
+        with self.lock:
+            self._stale = False
+            self.ingredients.clear()
+            self._entries.clear()
+            for column in self.nutrition.values():
+                column.clear()
+            for recipe in recipes:
+                for field, value in self._add_entry(recipe).items():
+                    self.nutrition[field].append((value, recipe.id))
+            for column in self.nutrition.values():
+                column.sort()
+
+    def on_change(self, collection, op: str, recipe: Optional[RecipeRecord]):
+        """Collection listener keeping the index in step with recipe writes"""
+        if not collection.changed(op, 'ingredients', 'nutrition'):
+            return
+        with self.lock:
+            if self._stale:
+                return
+            if op == 'delete':
+                self.remove(recipe.id)
+            elif op == 'clear':
+                self.rebuild(())
+                self._stale = self.source is not None
+            else:
+                self.add(recipe)
+
+    def _range(self, field: str, low: Optional[int], high: Optional[int]) -> Set[int]:
+        column = self.nutrition[field]
+        start = 0 if low is None else bisect_left(column, (low, float('-inf')))
+        end = len(column) if high is None else bisect_right(column, (high, float('inf')))
+        return {recipe_id for _, recipe_id in column[start:end]}
+
+    def search(self, ingredients: Iterable[str] = (),
+               ranges: Optional[Dict[str, Tuple[Optional[int], Optional[int]]]] = None,
+               sort: Optional[str] = None) -> List[RecipeRecord]:
+        """Return matching recipes in ranked order.
+
+        Every query token must appear in the recipe's ingredients. Without
+        `sort`, recipes with more matching ingredients rank first (ties by
+        id); `sort` orders by a nutrition field, prefixed with '-' for
+        descending.
+        """
+        self._ensure_built()
+        with self.lock:
+            terms = {t for text in ingredients for t in tokenize(text)}
+            candidate_sets = []
+            for term in terms:
+                candidate_sets.append(self.ingredients.get(term, set()))
+            for field, (low, high) in (ranges or {}).items():
+                if low is not None or high is not None:
+                    candidate_sets.append(self._range(field, low, high))
+
+            if candidate_sets:
+                candidate_sets.sort(key=len)
+                matches = set(candidate_sets[0])
+                for ids in candidate_sets[1:]:
+                    matches &= ids
+                    if not matches:
+                        break
+            else:
+                matches = set(self._entries)
+
+            if sort:
+                field = sort.lstrip('-')
+                ranked = sorted(
+                    matches,
+                    key=lambda i: (self._entries[i][1][field], i),
+                    reverse=sort.startswith('-'),
+                )
+            else:
+                def relevance(recipe_id):
+                    ingredient_tokens = self._entries[recipe_id][0]
+                    matched = sum(1 for tokens in ingredient_tokens if tokens & terms)
+                    return (-matched, recipe_id)
+
+                ranked = sorted(matches, key=relevance)
+            return [self._entries[i][2] for i in ranked]
@@ -0,0 +1,143 @@
+"""
+Rotating refresh tokens: long-lived sessions without a bcrypt verify per renewal
+
+`/login` starts a session (a token family) and returns a refresh token
+next to the short-lived access token. `/token/refresh` trades a refresh
+token for a new access token and a new refresh token; the old one is
+spent. Renewal costs one SHA-256 and an indexed lookup instead of a
+password hash.
+
+Only the SHA-256 of each token is stored (tokens are 256 random bits, so
+no salt or slow hash is needed). Presenting a spent token means it leaked
+or was replayed: the whole family is revoked, which logs out both the
+thief and the legitimate client. Families can also be revoked directly
+(logout, "log out everywhere"). Rows live in SQLite, indexed by family,
+user and expiry, so purging expired tokens is a range delete.
+"""
+import hashlib
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refresh_tokens (
+    token_hash BLOB PRIMARY KEY,
+    family TEXT NOT NULL,
+    username TEXT NOT NULL,
+    expires REAL NOT NULL,
+    spent INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS refresh_tokens_family ON refresh_tokens (family);
+CREATE INDEX IF NOT EXISTS refresh_tokens_username ON refresh_tokens (username);
+CREATE INDEX IF NOT EXISTS refresh_tokens_expires ON refresh_tokens (expires);
+"""
+
+PURGE_INTERVAL = 60.0
+
+
+class InvalidRefreshToken(Exception):
+    """Unknown, expired, revoked or reused refresh token"""
+
+
+def _digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+class RefreshTokenStore:
+    """Refresh token digests -> (session, user, expiry), in SQLite"""
+
+    def __init__(self, path: str = ':memory:', ttl: float = 30 * 24 * 3600):
+        self.ttl = ttl
+        self.rotated = self.reused = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._purged = 0.0
+
+    def _insert(self, family: str, username: str, now: float) -> str:
+        token = secrets.token_urlsafe(32)
+        self._db.execute('INSERT INTO refresh_tokens VALUES (?, ?, ?, ?, 0)',
+                         (_digest(token), family, username, now + self.ttl))
+        if now - self._purged >= PURGE_INTERVAL:
+            self._db.execute('DELETE FROM refresh_tokens WHERE expires <= ?', (now,))
+            self._purged = now
+        return token
+
+    def issue(self, username: str) -> str:
+        """A refresh token starting a new session for `username`"""
+        with self._lock:
+            return self._insert(secrets.token_hex(16), username, time.time())
+
+    def rotate(self, token: str) -> Tuple[str, str]:
+        """Spend `token`; (username, its replacement in the same session).
+
+        Raises InvalidRefreshToken, revoking the session if the token was already spent.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT family, username, expires, spent FROM refresh_tokens WHERE token_hash = ?',
+                                   (_digest(token),)).fetchone()
+            if row is None or row[2] <= now:
+                raise InvalidRefreshToken()
+            family, username, _, spent = row
+            if spent:
+                self.reused += 1
+                self._db.execute('DELETE FROM refresh_tokens WHERE family = ?', (family,))
+                raise InvalidRefreshToken()
+            self._db.execute('BEGIN')
+            try:
+                self._db.execute('UPDATE refresh_tokens SET spent = 1 WHERE token_hash = ?', (_digest(token),))
+                replacement = self._insert(family, username, now)
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self.rotated += 1
+            return username, replacement
+
+    def revoke(self, token: str) -> bool:
+        """End the session `token` belongs to; False if it is unknown"""
+        with self._lock:
+            row = self._db.execute('SELECT family FROM refresh_tokens WHERE token_hash = ?',
+                                   (_digest(token),)).fetchone()
+            if row is None:
+                return False
+            self._db.execute('DELETE FROM refresh_tokens WHERE family = ?', row)
+            return True
+
+    def revoke_user(self, username: str) -> int:
+        """End every session of `username`; how many there were"""
+        with self._lock:
+            families = self._db.execute('SELECT COUNT(DISTINCT family) FROM refresh_tokens WHERE username = ?',
+                                        (username,)).fetchone()[0]
+            self._db.execute('DELETE FROM refresh_tokens WHERE username = ?', (username,))
+            return families
+
+    def sessions(self, username: Optional[str] = None) -> int:
+        """Live sessions, of one user or all"""
+        query = 'SELECT COUNT(DISTINCT family) FROM refresh_tokens WHERE spent = 0 AND expires > ?'
+        params = [time.time()]
+        if username is not None:
+            query += ' AND username = ?'
+            params.append(username)
+        with self._lock:
+            return self._db.execute(query, params).fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM refresh_tokens')
+
+    def render(self) -> str:
+        return '\n'.join([
+            '# HELP diet_api_refresh_rotations_total Refresh tokens exchanged for new tokens.',
+            '# TYPE diet_api_refresh_rotations_total counter',
+            f'diet_api_refresh_rotations_total {self.rotated}',
+            '# HELP diet_api_refresh_reuse_total Spent refresh tokens presented again (session revoked).',
+            '# TYPE diet_api_refresh_reuse_total counter',
+            f'diet_api_refresh_reuse_total {self.reused}',
+        ]) + '\n'
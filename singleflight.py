@@ -0,0 +1,71 @@
+"""
+Single-flight: concurrent identical computations share one execution
+
+While a call for (op, key) is running, further calls with the same op
+and key wait for it and get its result (or its exception) instead of
+computing it again. Nothing is cached once the call returns, so callers
+only ever see a result computed after they asked, provided the key
+captures everything the result depends on (handlers include the
+generation of the collections they read).
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.executed: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+        self._calls: Dict[Tuple[str, Hashable], _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, op: str, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """fn(), unless a call for (op, key) is already running; then its outcome"""
+        with self._lock:
+            call = self._calls.get((op, key))
+            leader = call is None
+            if leader:
+                call = self._calls[(op, key)] = _Call()
+                self.executed[op] = self.executed.get(op, 0) + 1
+            else:
+                self.coalesced[op] = self.coalesced.get(op, 0) + 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[(op, key)]
+            call.done.set()
+
+    def reset(self):
+        with self._lock:
+            self.executed.clear()
+            self.coalesced.clear()
+
+    def render(self) -> str:
+        lines = [
+            '# HELP diet_api_singleflight_calls_total Coalescable computations, by operation and whether they '
+            'ran or shared a call already in flight.',
+            '# TYPE diet_api_singleflight_calls_total counter',
+        ]
+        for op in sorted(self.executed.keys() | self.coalesced.keys()):
+            lines.append(f'diet_api_singleflight_calls_total{{op="{op}",result="executed"}} {self.executed.get(op, 0)}')
+            lines.append(f'diet_api_singleflight_calls_total{{op="{op}",result="coalesced"}} {self.coalesced.get(op, 0)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,151 @@
+"""
+In-memory record collections with an id index and mutation listeners
+"""
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Type
+
+from records import Record
+
+# listener(collection, op, record) where op is 'insert', 'update', 'delete' or 'clear'
+# (partitioned collections also send 'drop', see partitions.py)
+Listener = Callable[['Collection', str, Optional[Record]], None]
+
+
+class Collection:
+    """Ordered id -> record mapping that behaves like the old record lists.
+
+    Every write goes through `insert`, `update` or `delete` so indexes,
+    the write-ahead log and other observers can follow along through
+    `listeners` without the handlers knowing about them.
+
+    Updates only write the slots whose value actually differs; while
+    listeners run, `changes` holds those slots so they can skip updates
+    that do not touch what they derive from (see `changed`). Every
+    effective update bumps the record's `version`, and every write bumps
+    the collection's `generation`.
+
+    A collection built with `loader` starts empty and calls it to fetch its
+    records on first access, so expensive seed data is only decoded when a
+    request actually needs it.
+    """
+
+    def __init__(self, name: str, record_type: Type[Record], records: Iterable[Record] = (),
+                 loader: Optional[Callable[[], Iterable[Record]]] = None):
+        self.name = name
+        self.record_type = record_type
+        self.listeners: List[Listener] = []
+        self.lock = threading.RLock()
+        self._records: Dict[int, Record] = {r.id: r for r in records}
+        self._loader = loader
+        self.changes: Optional[dict] = None
+        self.generation = 0
+        self.versions: Dict[int, int] = {}  # only records updated since start; others are at 1
+
+    @property
+    def records(self) -> Dict[int, Record]:
+        if self._loader is not None:
+            with self.lock:
+                if self._loader is not None:
+                    loaded = self._loader()
+                    self._loader = None
+                    self._records.update((r.id, r) for r in loaded)
+        return self._records
+
+    @property
+    def loaded(self) -> bool:
+        return self._loader is None
+
+    def __iter__(self) -> Iterator[Record]:
+        return iter(list(self.records.values()))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, record_id):
+        return record_id in self.records
+
+    def get(self, record_id: int) -> Optional[Record]:
+        return self.records.get(record_id)
+
+    def version(self, record_id: int) -> int:
+        return self.versions.get(record_id, 1)
+
+    def changed(self, op: str, *fields: str) -> bool:
+        """Whether the write being notified may have changed any of `fields`"""
+        return op != 'update' or self.changes is None or not self.changes.keys().isdisjoint(fields)
+
+    def _notify(self, op: str, record: Optional[Record]):
+        self.generation += 1
+        for listener in self.listeners:
+            listener(self, op, record)
+
+    # where records live; subclasses with extra placement (partitions) override these
+
+    def _store(self, record: Record):
+        self.records[record.id] = record
+
+    def _unstore(self, record_id: int) -> Optional[Record]:
+        return self.records.pop(record_id, None)
+
+    def _modify(self, record: Record, changes: dict):
+        record.update(changes)
+
+    def insert(self, record: Record) -> Record:
+        with self.lock:
+            self._store(record)
+            self._notify('insert', record)
+        return record
+
+    def update(self, record_id: int, changes: dict) -> Optional[Record]:
+        with self.lock:
+            record = self.records.get(record_id)
+            if record is None:
+                return None
+            changes = {name: value for name, value in changes.items() if getattr(record, name) != value}
+            if not changes:
+                return record
+            self._modify(record, changes)
+            self.versions[record_id] = self.versions.get(record_id, 1) + 1
+            self.changes = changes
+            try:
+                self._notify('update', record)
+            finally:
+                self.changes = None
+        return record
+
+    def delete(self, record_id: int) -> Optional[Record]:
+        with self.lock:
+            record = self._unstore(record_id)
+            if record is not None:
+                self.versions.pop(record_id, None)
+                self._notify('delete', record)
+        return record
+
+    # list-style helpers kept for bulk loading and test fixtures
+
+    def append(self, record: Record):
+        self.insert(record)
+
+    def extend(self, records: Iterable[Record]):
+        with self.lock:
+            if not self.listeners:
+                self.records.update((r.id, r) for r in records)
+                self.generation += 1
+                return
+            for record in records:
+                self.insert(record)
+
+    def defer(self, loader: Callable[[], Iterable[Record]]):
+        """Replace the contents with records fetched by `loader` on first access"""
+        with self.lock:
+            self._records.clear()
+            self.versions.clear()
+            self._loader = loader
+            self._notify('clear', None)
+
+    def clear(self):
+        with self.lock:
+            self._loader = None
+            self._records.clear()
+            self.versions.clear()
+            self._notify('clear', None)
@@ -40,6 +40,12 @@ def reset_data():
     
     main.users_db.clear()
     main.users_db.update(original_users)
+    main.refresh_tokens.clear()
+    
+    main.rate_limiter.reset()
+    main.admission.reset()
+    main.idempotency.clear()
+    main.compression.reset()
     
     # Reset counters
     main.next_customer_id = 4
@@ -0,0 +1,214 @@
+"""
+Unit tests for the customer adherence endpoint and plan indexes
+Coverage: daily totals, deviation, rolling averages, cache invalidation, plan index
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import status
+
+import main
+from indexes import PlanIndex
+from records import DietPlanRecord
+from store import Collection
+
+GOAL = {"calories": 2000, "protein": 100, "carbs": 250, "fat": 70}
+
+
+def plan(plan_id, customer_id, day, recipe_ids):
+    meals = [('LUNCH', recipe_id, 1) for recipe_id in recipe_ids]
+    return DietPlanRecord(plan_id, customer_id, day, **DietPlanRecord.meal_fields(meals))
+
+
+@pytest.fixture
+def tracked(client, auth_headers):
+    """A customer with two recipes and plans on 2025-03-01..03"""
+    response = client.post("/customers", json={
+        "name": "Tracked", "email": "tracked@example.com", "restrictions": [], "goal": GOAL
+    }, headers=auth_headers)
+    customer_id = response.json()["id"]
+    recipe_ids = []
+    for nutrition in ({"calories": 1000, "protein": 50, "carbs": 125, "fat": 35},
+                      {"calories": 500, "protein": 20, "carbs": 60, "fat": 20}):
+        response = client.post("/recipes", json={"name": "R", "nutrition": nutrition}, headers=auth_headers)
+        recipe_ids.append(response.json()["id"])
+    big, small = recipe_ids
+    plan_ids = []
+    for day, meals in (("2025-03-01", [(big, 2)]), ("2025-03-02", [(small, 2)]), ("2025-03-03", [(big, 1)])):
+        response = client.post("/diet-plans", json={
+            "customerId": customer_id, "date": day,
+            "meals": [{"type": "LUNCH", "recipeId": r, "portion": p} for r, p in meals]
+        }, headers=auth_headers)
+        plan_ids.append(response.json()["id"])
+    return customer_id, recipe_ids, plan_ids
+
+
+def get_adherence(client, auth_headers, customer_id, query="from=2025-03-01&to=2025-03-03&window=2"):
+    response = client.get(f"/customers/{customer_id}/adherence?{query}", headers=auth_headers)
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()
+
+
+class TestAdherence:
+    """Test the adherence endpoint"""
+
+    def test_daily_totals_and_deviation(self, client, auth_headers, tracked):
+        """Test per-day totals, deviation from goal and the goal check"""
+        customer_id, _, _ = tracked
+        result = get_adherence(client, auth_headers, customer_id)
+        assert result["customerId"] == customer_id
+        assert result["goal"] == GOAL
+        assert [d["date"] for d in result["days"]] == ["2025-03-01", "2025-03-02", "2025-03-03"]
+
+        first, second, third = result["days"]
+        assert first["plans"] == 1
+        assert first["total_nutrition"] == {"calories": 2000, "protein": 100, "carbs": 250, "fat": 70}
+        assert first["deviation"] == {"calories": 0, "protein": 0, "carbs": 0, "fat": 0}
+        assert first["within_goal"] is True
+        assert second["deviation"] == {"calories": -1000, "protein": -60, "carbs": -130, "fat": -30}
+        assert second["within_goal"] is False
+        assert third["total_nutrition"]["calories"] == 1000
+
+    def test_rolling_average(self, client, auth_headers, tracked):
+        """Test trailing-window averages, including days before `from`"""
+        customer_id, _, _ = tracked
+        result = get_adherence(client, auth_headers, customer_id)
+        averages = [d["rolling_average"]["calories"] for d in result["days"]]
+        assert averages == [2000, 1500, 1000]
+
+        result = get_adherence(client, auth_headers, customer_id, "from=2025-03-02&to=2025-03-03&window=3")
+        assert [d["rolling_average"]["calories"] for d in result["days"]] == [1500, pytest.approx(1333.33)]
+
+    def test_summary(self, client, auth_headers, tracked):
+        """Test range summary statistics"""
+        customer_id, _, _ = tracked
+        summary = get_adherence(client, auth_headers, customer_id)["summary"]
+        assert summary["days"] == 3
+        assert summary["days_within_goal"] == 1
+        assert summary["adherence_rate"] == pytest.approx(1 / 3, abs=1e-4)
+        assert summary["average_nutrition"]["calories"] == pytest.approx(4000 / 3, abs=0.01)
+        assert summary["mean_absolute_deviation"]["calories"] == pytest.approx(2000 / 3, abs=0.01)
+
+    def test_recipe_change_invalidates_cached_days(self, client, auth_headers, tracked):
+        """Test that editing a recipe refreshes days that use it"""
+        customer_id, (big, _), _ = tracked
+        get_adherence(client, auth_headers, customer_id)
+        client.put(f"/recipes/{big}", json={
+            "name": "R", "nutrition": {"calories": 900, "protein": 50, "carbs": 125, "fat": 35}
+        }, headers=auth_headers)
+        days = get_adherence(client, auth_headers, customer_id)["days"]
+        assert [d["total_nutrition"]["calories"] for d in days] == [1800, 1000, 900]
+
+    def test_plan_changes_invalidate_cached_days(self, client, auth_headers, tracked):
+        """Test that moving, editing and deleting plans is reflected"""
+        customer_id, (big, small), plan_ids = tracked
+        get_adherence(client, auth_headers, customer_id)
+        client.put(f"/diet-plans/{plan_ids[0]}", json={
+            "customerId": customer_id, "date": "2025-03-02",
+            "meals": [{"type": "DINNER", "recipeId": small, "portion": 1}]
+        }, headers=auth_headers)
+        client.delete(f"/diet-plans/{plan_ids[2]}", headers=auth_headers)
+        days = get_adherence(client, auth_headers, customer_id)["days"]
+        assert [(d["date"], d["plans"], d["total_nutrition"]["calories"]) for d in days] == [
+            ("2025-03-02", 2, 1500)
+        ]
+
+    def test_plan_added_after_ids_are_read_is_not_cached_stale(self, client, auth_headers, tracked, monkeypatch):
+        """Test that a day total computed from plan ids read before a change is not cached"""
+        customer_id, (big, _), _ = tracked
+        read_ids = main.plan_index.plan_ids
+
+        def ids_then_change(*args):
+            days = read_ids(*args)
+            main.diet_plans.insert(plan(999, customer_id, '2025-03-01', [big]))  # lands after the ids were read
+            return days
+
+        main.daily_totals.cache.clear()
+        monkeypatch.setattr(main.plan_index, 'plan_ids', ids_then_change)
+        main.daily_totals.days(customer_id, '2025-03-01', '2025-03-01')
+        assert (customer_id, '2025-03-01') not in main.daily_totals.cache
+
+    def test_ends_of_the_date_range(self, client, auth_headers, tracked):
+        """Test that default ranges and windows reaching past date.min / date.max are clamped, not a 500"""
+        customer_id, (big, _), _ = tracked
+        for day in ("0001-01-02", "9999-12-31"):
+            client.post("/diet-plans", json={"customerId": customer_id, "date": day,
+                                             "meals": [{"type": "LUNCH", "recipeId": big}]}, headers=auth_headers)
+        first = get_adherence(client, auth_headers, customer_id, "from=0001-01-01&window=7")
+        assert first["to"] == "0001-01-30" and [d["date"] for d in first["days"]] == ["0001-01-02"]
+        assert get_adherence(client, auth_headers, customer_id, "to=0001-01-01")["from"] == "0001-01-01"
+        last = get_adherence(client, auth_headers, customer_id, "to=9999-12-31&window=90")
+        assert last["from"] == "9999-12-02" and [d["date"] for d in last["days"]] == ["9999-12-31"]
+        assert get_adherence(client, auth_headers, customer_id, "from=9999-12-31")["to"] == "9999-12-31"
+
+    def test_empty_range(self, client, auth_headers, tracked):
+        """Test a range without plans"""
+        customer_id, _, _ = tracked
+        result = get_adherence(client, auth_headers, customer_id, "from=2024-01-01&to=2024-01-31")
+        assert result["days"] == []
+        assert result["summary"]["days"] == 0
+        assert result["summary"]["adherence_rate"] is None
+
+    def test_default_range_is_last_30_days(self, client, auth_headers):
+        """Test that without dates the last 30 days up to today are used"""
+        result = get_adherence(client, auth_headers, 1, "")
+        today = datetime.utcnow().date()
+        assert result["to"] == today.isoformat()
+        assert result["from"] == (today - timedelta(days=29)).isoformat()
+
+        result = get_adherence(client, auth_headers, 1, "from=2025-11-01")
+        assert (result["from"], result["to"]) == ("2025-11-01", "2025-11-30")
+        assert [d["date"] for d in result["days"]] == ["2025-11-17"]
+
+    def test_errors(self, client, auth_headers):
+        """Test unknown customer, reversed range and bad dates"""
+        response = client.get("/customers/999/adherence", headers=auth_headers)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        response = client.get("/customers/1/adherence?from=2025-02-01&to=2025-01-01", headers=auth_headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = client.get("/customers/1/adherence?from=yesterday", headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = client.get("/customers/1/adherence")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestPlanIndex:
+    """Test the customer/date and recipe plan indexes"""
+
+    def test_incremental_maintenance(self):
+        """Test that inserts, in-place updates and deletes keep the index exact"""
+        plans = Collection('diet_plans', DietPlanRecord, [plan(1, 7, '2025-01-02', [1, 2])])
+        index = PlanIndex(plans)
+        plans.listeners.append(index.on_change)
+        changed = []
+        index.listeners.append(lambda customer_id, day: changed.append((customer_id, day)))
+
+        assert index.plan_ids(7) == [('2025-01-02', {1})]
+        plans.insert(plan(2, 7, '2025-01-01', [2]))
+        assert [d for d, _ in index.plan_ids(7)] == ['2025-01-01', '2025-01-02']
+        assert index.plans_using_recipe(2) == {1, 2}
+
+        plans.update(1, {'date': '2025-01-05', **DietPlanRecord.meal_fields([('LUNCH', 3, 1)])})
+        assert index.plan_ids(7, '2025-01-02', '2025-01-05') == [('2025-01-05', {1})]
+        assert index.plans_using_recipe(1) == set()
+        assert changed[-2:] == [(7, '2025-01-02'), (7, '2025-01-05')]
+
+        plans.delete(2)
+        plans.delete(1)
+        assert index.plan_ids(7) == []
+        assert index.by_recipe == {}
+
+        plans.insert(plan(3, 8, '2025-02-01', [1]))
+        plans.clear()
+        assert changed[-1] == (None, None)
+        assert index.plan_ids(8) == []
+
+    def test_non_iso_dates_are_skipped(self, client, auth_headers):
+        """Test that free-form dates are rejected at ingest and stored legacy ones do not break adherence"""
+        response = client.post("/diet-plans", json={
+            "customerId": 2, "date": "2025-01-0x", "meals": []
+        }, headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        main.diet_plans.insert(plan(100, 2, "2025-01-0x", [1]))
+        result = get_adherence(client, auth_headers, 2, "from=2025-01-01&to=2025-01-31")
+        assert result["days"] == []
@@ -0,0 +1,242 @@
+"""
+Unit tests for the cold tier (compressed on-disk segments)
+Coverage: segment format, sparse id/date index, block LRU, reopening, expiry,
+transparent reads through the API, read-only archived records, tiering, metrics
+"""
+import asyncio
+import os
+
+import pytest
+from fastapi import status
+
+import archive
+import main
+from archive import ColdTier, Segment, encode_segment
+from partitions import PartitionedCollection
+from records import DietPlanRecord
+from tests.test_metrics import sample
+
+
+def plan(plan_id, day, customer_id=1):
+    return DietPlanRecord(plan_id, customer_id, day, **DietPlanRecord.meal_fields([('LUNCH', 1, 2)]))
+
+
+def plans(*records):
+    return PartitionedCollection('diet_plans', DietPlanRecord, 'date', records)
+
+
+def tier_with(tmp_path, records):
+    """A cold tier holding `records` in one segment"""
+    collection = plans(*records)
+    tier = ColdTier(str(tmp_path), collection, cache_blocks=2)
+    tier.write(collection.partitions)
+    return tier
+
+
+@pytest.fixture
+def cold(tmp_path):
+    """The app with its cold tier in tmp_path"""
+    main.enable_cold_tier(str(tmp_path))
+    yield tmp_path
+    main.disable_cold_tier()
+
+
+class TestSegments:
+    """Test the segment file and its sparse index"""
+
+    def test_blocks_and_footer(self, tmp_path, monkeypatch):
+        """Test that records are split into id-sorted blocks with id and day bounds"""
+        monkeypatch.setattr(archive, "BLOCK_RECORDS", 2)
+        path = tmp_path / "one.seg"
+        path.write_bytes(encode_segment([plan(3, '2025-01-02'), plan(1, '2025-01-05'), plan(2, '2025-01-01')], 'date'))
+        segment = Segment(str(path))
+        assert segment.count == 3
+        assert [(b.first_id, b.last_id, b.first_day, b.last_day) for b in segment.blocks] == [
+            (1, 2, '2025-01-01', '2025-01-05'), (3, 3, '2025-01-02', '2025-01-02')]
+        assert (segment.first_day, segment.last_day) == ('2025-01-01', '2025-01-05')
+        assert segment.block_for(0) is None and segment.block_for(3) == 1 and segment.block_for(9) is None
+        assert segment.read_block(0).ids == [1, 2]
+        segment.close()
+
+    def test_invalid_file(self, tmp_path):
+        """Test that anything but a complete segment is refused"""
+        path = tmp_path / "bad.seg"
+        path.write_bytes(b"x" * 64)
+        with pytest.raises(ValueError):
+            Segment(str(path))
+
+    def test_compressed_smaller_than_states(self, tmp_path):
+        """Test that blocks are compressed"""
+        records = [plan(i, '2025-01-01', i % 7) for i in range(1, 2001)]
+        tier = tier_with(tmp_path, records)
+        raw = sum(len(repr(r.to_state())) for r in records)
+        assert tier.bytes < raw / 3
+        tier.close()
+
+
+class TestColdTier:
+    """Test reads, caching and expiry"""
+
+    def test_get_uses_block_cache(self, tmp_path, monkeypatch):
+        """Test lookups by id, misses and the decompressed block LRU"""
+        monkeypatch.setattr(archive, "BLOCK_RECORDS", 10)
+        tier = tier_with(tmp_path, [plan(i, '2025-01-01') for i in range(1, 51)])
+        assert tier.get(7) == plan(7, '2025-01-01')
+        assert tier.get(3).id == 3
+        assert (tier.hits, tier.misses) == (1, 1)
+        assert tier.get(99) is None and tier.get(0) is None
+        for record_id in (15, 25, 35):
+            tier.get(record_id)
+        assert len(tier._cache) == 2
+        tier.get(7)
+        assert tier.misses == 5
+        tier.close()
+
+    def test_between_reads_overlapping_blocks(self, tmp_path, monkeypatch):
+        """Test date ranges across blocks and segments, newest copy of a record winning"""
+        monkeypatch.setattr(archive, "BLOCK_RECORDS", 2)
+        tier = tier_with(tmp_path, [plan(i, f'2025-01-{i:02d}') for i in range(1, 9)])
+        tier.write({'2025-01-03': {3: plan(3, '2025-01-03', customer_id=5)}})
+        found = tier.between('2025-01-03', '2025-01-04')
+        assert [(p.id, p.customerId) for p in found] == [(3, 5), (4, 1)]
+        assert len(tier.between()) == 8
+        before = tier.misses
+        tier.between('2025-01-08', None)
+        assert tier.misses - before <= 1  # only the last block of the first segment overlaps
+        tier.close()
+
+    def test_reopen_and_expire(self, tmp_path):
+        """Test that segments survive a restart and expire whole"""
+        tier = tier_with(tmp_path, [plan(1, '2025-01-01'), plan(2, '2025-01-02')])
+        tier.write({'2025-02-01': {3: plan(3, '2025-02-01')}})
+        generation = tier.generation
+        tier.close()
+        (tmp_path / "diet_plans" / "seg-00000009.seg.tmp").write_bytes(b"torn")
+
+        tier = ColdTier(str(tmp_path), plans())
+        assert (tier.record_count, tier.max_id) == (3, 3)
+        assert not (tmp_path / "diet_plans" / "seg-00000009.seg.tmp").exists()
+        assert tier.drop_before('2025-01-02') == 0  # 2025-01-02 still in the first segment
+        assert tier.drop_before('2025-01-03') == 1
+        assert tier.get(1) is None and tier.get(3).id == 3
+        assert tier.generation == 1 and generation == 2
+        assert sorted(os.listdir(tmp_path / "diet_plans")) == ["seg-00000002.seg"]
+        assert tier.write({}) is None
+        tier.close()
+
+
+class TestAppColdTier:
+    """Test the cold tier behind the API"""
+
+    def create_plans(self, client, auth_headers, days):
+        ids = []
+        for day in days:
+            response = client.post("/diet-plans", json={
+                "customerId": 1, "date": day, "meals": [{"type": "LUNCH", "recipeId": 1, "portion": 1}]
+            }, headers=auth_headers)
+            ids.append(response.json()["id"])
+        return ids
+
+    def test_archived_plans_read_transparently(self, client, auth_headers, cold):
+        """Test that moved plans leave RAM but are still served by id, validated and ranged"""
+        old, recent = self.create_plans(client, auth_headers, ["2001-05-01", "2001-06-01"])
+        response = client.post("/admin/retention?before=2001-05-02", headers=auth_headers)
+        assert response.json()["archived"] is True
+        assert response.json()["diet_plans"] == {"days": 1, "records": 1}
+        assert old not in main.diet_plans and recent in main.diet_plans
+
+        by_id = client.get(f"/diet-plans/{old}", headers=auth_headers)
+        assert by_id.status_code == status.HTTP_200_OK
+        assert by_id.json()["date"] == "2001-05-01" and by_id.headers["etag"]
+        assert client.post(f"/diet-plans/{old}/validate", headers=auth_headers).status_code == status.HTTP_200_OK
+        ranged = client.get("/diet-plans?from=2001-01-01&to=2001-12-31", headers=auth_headers)
+        assert [p["id"] for p in ranged.json()] == [old, recent]
+        assert old not in [p["id"] for p in client.get("/diet-plans", headers=auth_headers).json()]
+
+    def test_replayed_archived_plan_is_listed_once(self, client, auth_headers, cold):
+        """Test that a plan archived and also back in RAM (log replay after a crash) is ranged once, from RAM"""
+        (old,) = self.create_plans(client, auth_headers, ["2001-05-01"])
+        client.post("/admin/retention?before=2001-05-02", headers=auth_headers)
+        main.diet_plans.insert(DietPlanRecord(old, 1, "2001-05-01", **DietPlanRecord.meal_fields([("LUNCH", 1, 2)])))
+        ranged = client.get("/diet-plans?from=2001-01-01&to=2001-12-31", headers=auth_headers).json()
+        assert [(p["id"], p["meals"][0]["portion"]) for p in ranged] == [(old, 2)]
+
+    def test_archived_plans_are_read_only(self, client, auth_headers, cold):
+        """Test that writes to archived plans get 409, unknown ids still 404"""
+        (old,) = self.create_plans(client, auth_headers, ["2001-05-01"])
+        client.post("/admin/retention?before=2001-05-02", headers=auth_headers)
+        put = client.put(f"/diet-plans/{old}", json={"customerId": 1, "date": "2001-05-01"}, headers=auth_headers)
+        assert put.status_code == status.HTTP_409_CONFLICT
+        patch = client.patch(f"/diet-plans/{old}", json={}, headers={**auth_headers, "Content-Type": main.MERGE_PATCH})
+        assert patch.status_code == status.HTTP_409_CONFLICT
+        assert client.delete(f"/diet-plans/{old}", headers=auth_headers).status_code == status.HTTP_409_CONFLICT
+        assert client.delete("/diet-plans/99999", headers=auth_headers).status_code == status.HTTP_404_NOT_FOUND
+
+    def test_ids_stay_taken_after_restart(self, client, auth_headers, cold):
+        """Test that reopening the tier moves id counters past archived ids"""
+        ids = self.create_plans(client, auth_headers, ["2001-05-01"] * 3)
+        client.post("/admin/retention?before=2001-05-02", headers=auth_headers)
+        main.next_diet_plan_id = 2
+        main.enable_cold_tier(str(cold))
+        assert main.next_diet_plan_id == max(ids) + 1
+
+    def test_expire_deletes_segments(self, client, auth_headers, cold):
+        """Test that retention without archive deletes cold segments older than the cutoff"""
+        (old,) = self.create_plans(client, auth_headers, ["2001-05-01"])
+        client.post("/admin/retention?before=2001-05-02", headers=auth_headers)
+        response = client.post("/admin/retention?before=2001-06-01&archive=false", headers=auth_headers)
+        assert response.json()["diet_plans"] == {"days": 0, "records": 0, "segments": 1}
+        assert client.get(f"/diet-plans/{old}", headers=auth_headers).status_code == status.HTTP_404_NOT_FOUND
+
+    def test_default_cutoffs(self, client, auth_headers, cold, monkeypatch):
+        """Test that archiving defaults to DIET_API_COLD_DAYS ago"""
+        monkeypatch.setattr(main, "COLD_DAYS", 10000)
+        response = client.post("/admin/retention", headers=auth_headers)
+        assert response.json()["archived"] is True
+        assert response.json()["before"] < "2000-01-01"
+
+    def test_periodic_tiering(self, client, auth_headers, cold, monkeypatch):
+        """Test one round of the background task: tier, then expire"""
+        (old,) = self.create_plans(client, auth_headers, ["2001-05-01"])
+        monkeypatch.setattr(main, "RETENTION_DAYS", 100000)
+
+        async def one_round():
+            task = asyncio.create_task(main.tier_periodically())
+            while old in main.diet_plans:
+                await asyncio.sleep(0.01)
+            task.cancel()
+
+        asyncio.run(one_round())
+        assert main.cold_tiers["diet_plans"].get(old).id == old
+
+    def test_periodic_tiering_survives_failures(self, client, auth_headers, cold, monkeypatch, caplog):
+        """Test that a failed round is logged and the task keeps going"""
+        rounds = []
+
+        def failing(before):
+            rounds.append(before)
+            raise OSError(28, 'No space left on device')
+
+        monkeypatch.setattr(main, "move_to_cold_tier", failing)
+        monkeypatch.setattr(main, "TIERING_INTERVAL", 0.01)
+
+        async def two_rounds():
+            task = asyncio.create_task(main.tier_periodically())
+            while len(rounds) < 2:
+                await asyncio.sleep(0.01)
+            assert not task.done()
+            task.cancel()
+
+        asyncio.run(two_rounds())
+        assert "Background tiering failed" in caplog.text
+
+    def test_metrics(self, client, auth_headers, cold):
+        """Test that segment and block cache metrics are exported per collection"""
+        (old,) = self.create_plans(client, auth_headers, ["2001-05-01"])
+        client.post("/admin/retention?before=2001-05-02", headers=auth_headers)
+        client.get(f"/diet-plans/{old}", headers=auth_headers)
+        text = client.get("/metrics").text
+        assert sample(text, "diet_api_cold_segments", collection="diet_plans") == 1
+        assert sample(text, "diet_api_cold_records", collection="diet_plans") == 1
+        assert sample(text, "diet_api_cold_block_misses_total", collection="diet_plans") >= 1
+        assert sample(text, "diet_api_cold_segments", collection="production_batches") == 0
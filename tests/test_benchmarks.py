@@ -0,0 +1,68 @@
+"""
+Smoke tests for the benchmark suite
+Coverage: data generator integrity, suite run, regression comparison
+"""
+from benchmarks import data, suite
+
+
+def result(**metrics):
+    return {'metrics': metrics}
+
+
+class TestSyntheticData:
+    """Test the synthetic dataset"""
+
+    def test_references_are_valid(self):
+        """Test that generated plans and batches only reference existing records"""
+        n = data.sizes(500)
+        rows = {name: list(records) for name, records in data.tables(500).items()}
+        assert {name: len(records) for name, records in rows.items()} == n
+        for plan in rows['diet_plans']:
+            assert 1 <= plan['customerId'] <= n['customers']
+            assert all(1 <= m['recipeId'] <= n['recipes'] for m in plan['meals'])
+        for batch in rows['production_batches']:
+            assert all(1 <= p <= n['diet_plans'] for p in batch['dietPlans'])
+
+    def test_one_plan_per_customer_per_day(self):
+        """Test that each customer gets consecutive days of plans"""
+        plans = list(data.tables(100)['diet_plans'])
+        days = {}
+        for plan in plans:
+            days.setdefault(plan['customerId'], []).append(plan['date'])
+        assert days[1] == ['2025-01-01', '2025-01-02', '2025-01-03', '2025-01-04', '2025-01-05',
+                           '2025-01-06', '2025-01-07', '2025-01-08', '2025-01-09', '2025-01-10']
+
+
+class TestSuite:
+    """Test running and comparing benchmark results"""
+
+    def test_run_small_scale(self, reset_data):
+        """Test a tiny end-to-end run of micro and load benchmarks"""
+        document = suite.run_suite(plans=50, requests=3, concurrency=2, duration=5, repeat=1)
+        metrics = document['metrics']
+        assert document['sizes']['diet_plans'] == 50
+        for name in ('lookup', 'validation', 'batch_validation', 'aggregation', 'json_encode_100_recipes', 'jwt_verify'):
+            assert metrics[f'micro.{name}.ns_per_op'] > 0
+        assert metrics['load.GET /customers/{customer_id}.rps'] > 0
+        assert metrics['load.POST /diet-plans/{plan_id}/validate.p99_ms'] > 0
+        assert sum(v for k, v in metrics.items() if k.endswith('.errors')) == 0
+
+    def test_compare_flags_regressions(self):
+        """Test direction-aware regression detection"""
+        baseline = result(**{'load.x.rps': 100.0, 'load.x.p99_ms': 10.0, 'micro.y.ns_per_op': 50.0})
+        current = result(**{'load.x.rps': 80.0, 'load.x.p99_ms': 10.5, 'micro.y.ns_per_op': 40.0, 'new': 1})
+        lines, regressions = suite.compare(baseline, current, threshold=0.10)
+        assert regressions == ['load.x.rps']
+        assert len(lines) == 3
+
+        assert suite.compare(result(a=0), result(a=0), 0.1)[1] == []
+        assert suite.compare(result(a=0), result(a=1), 0.1)[1] == ['a']
+
+    def test_compare_command_exit_status(self, tmp_path):
+        """Test that the compare command fails only on regression"""
+        import json
+        baseline, current = tmp_path / 'base.json', tmp_path / 'cur.json'
+        baseline.write_text(json.dumps(result(**{'micro.y.ns_per_op': 50.0})))
+        current.write_text(json.dumps(result(**{'micro.y.ns_per_op': 60.0})))
+        assert suite.main(['compare', str(baseline), str(current)]) == 1
+        assert suite.main(['compare', str(baseline), str(current), '--threshold', '0.25']) == 0
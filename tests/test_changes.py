@@ -0,0 +1,180 @@
+"""
+Unit tests for the change feed
+Coverage: long-poll, SSE stream, filters, resumption, ring buffer overflow, wakeups
+"""
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from fastapi import status
+
+import main
+from changes import ChangeFeed, ChangeFilter
+from records import ProductionBatchRecord
+from store import Collection
+
+GOAL = {"calories": 2000, "protein": 100, "carbs": 250, "fat": 70}
+
+
+def poll(client, auth_headers, query):
+    response = client.get(f"/changes?timeout=0&{query}", headers=auth_headers)
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()
+
+
+def sse_events(text):
+    """(event type, id, data) for each event in an SSE body"""
+    events = []
+    for block in text.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], int(fields["id"]), json.loads(fields["data"])))
+    return events
+
+
+@pytest.fixture
+def writes(client, auth_headers):
+    """Feed position before a customer, their plan, an update and a delete"""
+    start = main.change_feed.seq
+    customer_id = client.post("/customers", json={
+        "name": "Fed", "email": "fed@example.com", "goal": GOAL
+    }, headers=auth_headers).json()["id"]
+    plan_id = client.post("/diet-plans", json={"customerId": customer_id, "date": "2025-07-01"},
+                          headers=auth_headers).json()["id"]
+    client.patch(f"/diet-plans/{plan_id}", json={"date": "2025-07-02"}, headers=auth_headers)
+    client.delete(f"/diet-plans/{plan_id}", headers=auth_headers)
+    return start, customer_id, plan_id
+
+
+class TestLongPoll:
+    """Test GET /changes"""
+
+    def test_events_in_order(self, client, auth_headers, writes):
+        """Test that every write is reported once, in order, with its data"""
+        start, customer_id, plan_id = writes
+        result = poll(client, auth_headers, f"since={start}")
+        events = result["events"]
+        assert [(e["collection"], e["op"], e["id"]) for e in events] == [
+            ("customers", "insert", customer_id),
+            ("diet_plans", "insert", plan_id),
+            ("diet_plans", "update", plan_id),
+            ("diet_plans", "delete", plan_id),
+        ]
+        assert [e["seq"] for e in events] == list(range(start + 1, start + 5))
+        assert events[0]["data"]["name"] == "Fed"
+        assert events[2]["data"]["date"] == "2025-07-02"
+        assert "data" not in events[3]
+        assert result["seq"] == start + 4
+        assert result["missed"] is False
+
+    def test_filters(self, client, auth_headers, writes):
+        """Test filtering by collection and customer"""
+        start, customer_id, _ = writes
+        client.post("/recipes", json={"name": "Other", "nutrition": GOAL}, headers=auth_headers)
+        events = poll(client, auth_headers, f"since={start}&collection=customers&collection=recipes")["events"]
+        assert [e["collection"] for e in events] == ["customers", "recipes"]
+        events = poll(client, auth_headers, f"since={start}&customerId={customer_id}")["events"]
+        assert [e["op"] for e in events] == ["insert", "insert", "update", "delete"]
+
+    def test_resume_with_limit(self, client, auth_headers, writes):
+        """Test paging through the feed by passing back `seq`"""
+        start, _, _ = writes
+        first = poll(client, auth_headers, f"since={start}&limit=3")
+        assert len(first["events"]) == 3
+        second = poll(client, auth_headers, f"since={first['seq']}")
+        assert [e["op"] for e in second["events"]] == ["delete"]
+        assert poll(client, auth_headers, f"since={second['seq']}")["events"] == []
+
+    def test_timeout_without_changes(self, client, auth_headers):
+        """Test that an idle long-poll returns the current position"""
+        response = client.get("/changes?timeout=0.05", headers=auth_headers)
+        assert response.json() == {"seq": main.change_feed.seq, "missed": False, "events": []}
+
+    def test_errors(self, client, auth_headers):
+        """Test unknown collections and missing auth"""
+        response = client.get("/changes?collection=orders", headers=auth_headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert client.get("/changes").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestStream:
+    """Test GET /changes/stream"""
+
+    def test_stream(self, client, auth_headers, writes):
+        """Test SSE framing and filtering"""
+        start, _, plan_id = writes
+        response = client.get(f"/changes/stream?since={start}&collection=diet_plans&duration=0.05",
+                              headers=auth_headers)
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.text.startswith("retry: 1000")
+        events = sse_events(response.text)
+        assert [(kind, data["op"]) for kind, _, data in events] == [
+            ("change", "insert"), ("change", "update"), ("change", "delete")
+        ]
+        assert all(seq == data["seq"] for _, seq, data in events)
+
+    def test_last_event_id_wins(self, client, auth_headers, writes):
+        """Test that a reconnect resumes after Last-Event-ID"""
+        start, _, _ = writes
+        response = client.get(f"/changes/stream?since={start}&duration=0.05",
+                              headers={**auth_headers, "Last-Event-ID": str(start + 3)})
+        assert [data["op"] for _, _, data in sse_events(response.text)] == ["delete"]
+
+    def test_reset_after_restart(self, client, auth_headers):
+        """Test that a sequence the feed has not reached yet triggers a reset"""
+        seq = main.change_feed.seq
+        response = client.get(f"/changes/stream?since={seq + 100}&duration=0.05", headers=auth_headers)
+        assert sse_events(response.text) == [("reset", seq, {"seq": seq})]
+
+
+class TestChangeFeed:
+    """Test the ring buffer and wakeups"""
+
+    def test_overflow_reports_missed(self):
+        """Test that resuming from an overwritten position asks for a reload"""
+        feed = ChangeFeed(capacity=3)
+        for i in range(5):
+            feed.publish("recipes", None, {"id": i})
+        assert feed.oldest == 3
+        assert feed.since(1) == ([], 5, True)
+        found, last, missed = feed.since(2)
+        assert [c.seq for c in found] == [3, 4, 5]
+        assert (last, missed) == (5, False)
+
+    def test_clear_event(self):
+        """Test that clearing a collection is published"""
+        feed = ChangeFeed()
+        batches = Collection('production_batches', ProductionBatchRecord)
+        batches.listeners.append(feed.on_change)
+        batches.clear()
+        (change,), _, _ = feed.since(0)
+        assert json.loads(change.json) == {"seq": 1, "collection": "production_batches", "op": "clear"}
+
+    def test_waiters_wake_on_publish_from_another_thread(self):
+        """Test that many subscribers share one wakeup"""
+        feed = ChangeFeed()
+
+        async def subscribers():
+            tasks = [asyncio.ensure_future(feed.poll(0, ChangeFilter(frozenset({"recipes"})), 5))
+                     for _ in range(100)]
+            await asyncio.sleep(0.01)
+            assert len(feed._signals) == 1
+            threading.Timer(0.01, feed.publish, ("customers", 1, {})).start()
+            threading.Timer(0.05, feed.publish, ("recipes", None, {})).start()
+            start = time.perf_counter()
+            results = await asyncio.gather(*tasks)
+            return results, time.perf_counter() - start
+
+        results, elapsed = asyncio.run(subscribers())
+        assert elapsed < 2
+        assert all([c.seq for c in found] == [2] and seq == 2 for found, seq, _ in results)
+
+    def test_closed_loops_are_skipped(self):
+        """Test that a subscriber loop that has gone away does not break publishing"""
+        feed = ChangeFeed()
+        asyncio.run(feed.wait(0, 0.01))
+        assert feed._signals
+        assert feed.publish("recipes", None, {}) == 1
+        assert asyncio.run(feed.wait(0, 0.01)) is True
@@ -0,0 +1,235 @@
+"""
+Unit tests for response compression
+Coverage: Accept-Encoding negotiation, size threshold, eligibility, streamed bodies,
+compressed-variant cache, metrics
+"""
+import asyncio
+import gzip
+import zlib
+
+import pytest
+from fastapi import status
+
+import compression
+import main
+from compression import Compression, CompressionMiddleware, VariantCache, negotiate, parse_encodings
+from tests.test_metrics import sample
+
+GOAL = {"calories": 2000, "protein": 100, "carbs": 250, "fat": 70}
+
+
+def run_app(app, headers, method="GET", path="/x"):
+    """Send one request through `app`; (start message, body messages)"""
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent[0], sent[1:]
+
+
+def asgi_app(chunks, content_type=b"application/json", extra_headers=()):
+    """Minimal ASGI app sending `chunks` as its body messages"""
+    async def app(scope, receive, send):
+        headers = [(b"content-type", content_type), *extra_headers]
+        if len(chunks) == 1:
+            headers.append((b"content-length", str(len(chunks[0])).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+    return app
+
+
+def header(start, name):
+    return dict(start["headers"]).get(name)
+
+
+class TestNegotiation:
+    """Test Accept-Encoding parsing and encoding selection"""
+
+    def test_prefers_server_order_among_equal_weights(self):
+        """Test that ties go to the server's preference order"""
+        assert negotiate("gzip, br, zstd", ("zstd", "br", "gzip")) == "zstd"
+        assert negotiate("gzip, br", ("zstd", "br", "gzip")) == "br"
+
+    def test_quality_values(self):
+        """Test that a higher q wins and q=0 forbids an encoding"""
+        assert negotiate("br;q=0.5, gzip;q=0.9", ("br", "gzip")) == "gzip"
+        assert negotiate("gzip;q=0", ("gzip",)) is None
+        assert negotiate("gzip;q=oops", ("gzip",)) is None
+
+    def test_wildcard(self):
+        """Test that * covers encodings not listed explicitly"""
+        assert negotiate("*", ("br", "gzip")) == "br"
+        assert negotiate("br;q=0, *;q=0.5", ("br", "gzip")) == "gzip"
+
+    def test_nothing_acceptable(self):
+        """Test that identity (or an unknown coding) leaves the response uncompressed"""
+        assert negotiate("identity", ("gzip",)) is None
+        assert negotiate("deflate, , compress", ("gzip",)) is None
+
+    def test_parse_encodings(self):
+        """Test the DIET_API_COMPRESSION setting"""
+        assert parse_encodings("") == compression.AVAILABLE
+        assert parse_encodings("identity") == ()
+        assert parse_encodings(" GZIP ") == ("gzip",)
+        assert "gzip" in parse_encodings("zstd,br,gzip")
+        with pytest.raises(ValueError):
+            parse_encodings("deflate")
+
+
+class TestCompressionMiddleware:
+    """Test the middleware on raw ASGI responses"""
+
+    def middleware(self, chunks, **kwargs):
+        return CompressionMiddleware(asgi_app(chunks, **kwargs), Compression(minimum_size=100))
+
+    def test_large_body_is_compressed(self):
+        """Test that a body over the threshold is gzipped with a matching Content-Length"""
+        body = b'{"data":"' + b"a" * 1000 + b'"}'
+        start, messages = run_app(self.middleware([body]), {"Accept-Encoding": "gzip"})
+        assert header(start, b"content-encoding") == b"gzip"
+        assert header(start, b"vary") == b"Accept-Encoding"
+        assert int(header(start, b"content-length")) == len(messages[0]["body"])
+        assert gzip.decompress(messages[0]["body"]) == body
+
+    def test_small_body_is_sent_as_is(self):
+        """Test that bodies under the threshold are not compressed but still vary"""
+        start, messages = run_app(self.middleware([b"{}"]), {"Accept-Encoding": "gzip"})
+        assert header(start, b"content-encoding") is None
+        assert header(start, b"vary") == b"Accept-Encoding"
+        assert messages[0]["body"] == b"{}"
+
+    def test_without_accept_encoding(self):
+        """Test that clients not asking for compression get the original response"""
+        body = b"x" * 1000
+        start, messages = run_app(self.middleware([body]), {})
+        assert header(start, b"content-encoding") is None
+        assert messages[0]["body"] == body
+
+    def test_ineligible_responses_pass_through(self):
+        """Test that binary and already-encoded bodies are left alone"""
+        body = b"x" * 1000
+        for app in (self.middleware([body], content_type=b"image/png"),
+                    self.middleware([body], extra_headers=[(b"content-encoding", b"br")])):
+            start, messages = run_app(app, {"Accept-Encoding": "gzip"})
+            assert header(start, b"content-encoding") != b"gzip"
+            assert header(start, b"vary") is None
+            assert messages[0]["body"] == body
+
+    def test_existing_vary_is_extended(self):
+        """Test that Accept-Encoding is appended to an existing Vary header"""
+        app = self.middleware([b"x" * 1000], extra_headers=[(b"vary", b"Origin")])
+        start, _ = run_app(app, {"Accept-Encoding": "gzip"})
+        assert header(start, b"vary") == b"Origin, Accept-Encoding"
+
+    def test_streamed_chunks_are_flushed(self):
+        """Test that each streamed chunk is decodable as soon as it arrives"""
+        chunks = [b"event: change\ndata: {}\n\n"] * 3 + [b""]
+        start, messages = run_app(self.middleware(chunks, content_type=b"text/event-stream"),
+                                  {"Accept-Encoding": "gzip"})
+        assert header(start, b"content-encoding") == b"gzip"
+        assert header(start, b"content-length") is None
+        decoder = zlib.decompressobj(31)
+        for chunk, message in zip(chunks, messages):
+            assert decoder.decompress(message["body"]) == chunk
+        assert [m["more_body"] for m in messages] == [True, True, True, False]
+        assert decoder.eof
+
+    def test_large_body_is_compressed_off_the_event_loop(self):
+        """Test that bodies over OFFLOAD_SIZE still round-trip"""
+        body = b"[" + b'{"id":1},' * (compression.OFFLOAD_SIZE // 9) + b"{}]"
+        start, messages = run_app(self.middleware([body]), {"Accept-Encoding": "gzip"})
+        assert gzip.decompress(messages[0]["body"]) == body
+
+    def test_etag_variants_are_cached(self):
+        """Test that a repeated response with the same ETag reuses the compressed bytes"""
+        settings = Compression(minimum_size=100)
+        app = CompressionMiddleware(asgi_app([b"y" * 1000], extra_headers=[(b"etag", b'"v1"')]), settings)
+        first = run_app(app, {"Accept-Encoding": "gzip"})[1][0]["body"]
+        second = run_app(app, {"Accept-Encoding": "gzip"})[1][0]["body"]
+        assert first == second
+        assert settings.cache.hits == 1
+        assert settings.responses == {"gzip": 1}
+
+
+class TestVariantCache:
+    """Test the byte-bounded LRU"""
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest unused variant goes first when over the byte cap"""
+        cache = VariantCache(max_bytes=10)
+        cache.put("a", b"1234")
+        cache.put("b", b"1234")
+        cache.get("a")
+        cache.put("c", b"1234")
+        assert cache.get("b") is None
+        assert cache.get("a") == b"1234" and cache.get("c") == b"1234"
+        assert cache.bytes == 8
+
+    def test_replace_and_oversized(self):
+        """Test that replacing a key re-counts its bytes and huge bodies are not cached"""
+        cache = VariantCache(max_bytes=10)
+        cache.put("a", b"1234")
+        cache.put("a", b"12")
+        cache.put("big", b"x" * 11)
+        assert len(cache) == 1 and cache.bytes == 2
+
+
+class TestCompressedEndpoints:
+    """Test compression through the API"""
+
+    def create_recipes(self, client, auth_headers, n=10):
+        for i in range(n):
+            response = client.post("/recipes", json={
+                "name": f"Compressed recipe {i}", "ingredients": ["chicken breast", "brown rice", "broccoli"],
+                "nutrition": {"calories": 500, "protein": 40, "carbs": 50, "fat": 12},
+            }, headers=auth_headers)
+            assert response.status_code == status.HTTP_201_CREATED
+
+    def test_list_is_compressed_and_cached(self, client, auth_headers):
+        """Test that a large list is gzipped, carries an ETag and reuses its variant"""
+        self.create_recipes(client, auth_headers)
+        headers = {**auth_headers, "Accept-Encoding": "gzip"}
+        first = client.get("/recipes", headers=headers)
+        second = client.get("/recipes", headers=headers)
+        assert first.headers["content-encoding"] == "gzip"
+        assert first.headers["etag"] == second.headers["etag"]
+        assert first.json() == second.json()
+        assert main.compression.cache.hits == 1
+
+    def test_write_changes_etag(self, client, auth_headers):
+        """Test that a write yields a new ETag, so no stale variant is served"""
+        self.create_recipes(client, auth_headers)
+        headers = {**auth_headers, "Accept-Encoding": "gzip"}
+        before = client.get("/recipes", headers=headers)
+        self.create_recipes(client, auth_headers, n=1)
+        after = client.get("/recipes", headers=headers)
+        assert before.headers["etag"] != after.headers["etag"]
+        assert len(after.json()) == len(before.json()) + 1
+        assert main.compression.cache.hits == 0
+
+    def test_identity_request(self, client, auth_headers):
+        """Test that Accept-Encoding: identity gets an uncompressed body"""
+        self.create_recipes(client, auth_headers)
+        response = client.get("/recipes", headers={**auth_headers, "Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.json()
+
+    def test_metrics(self, client, auth_headers):
+        """Test that bytes in/out per encoding are exported"""
+        self.create_recipes(client, auth_headers)
+        client.get("/recipes", headers={**auth_headers, "Accept-Encoding": "gzip"})
+        text = client.get("/metrics").text
+        raw = sample(text, "diet_api_compression_bytes_total", encoding="gzip", direction="in")
+        packed = sample(text, "diet_api_compression_bytes_total", encoding="gzip", direction="out")
+        assert raw > packed > 0
+        assert sample(text, "diet_api_compressed_responses_total", encoding="gzip") >= 1
@@ -225,6 +225,20 @@ class TestDietPlans:
         assert response.status_code == status.HTTP_201_CREATED
         data = response.json()
         assert len(data["meals"]) == 5
+
+    def test_diet_plan_any_number_of_meal_types(self, client, auth_headers, reset_data):
+        """Test that other meal types are stored as given, however many there are"""
+        for n in range(300):
+            plan = {"customerId": 1, "date": "2025-12-18", "meals": [{"type": f"T{n}", "recipeId": 1}]}
+            response = client.post("/diet-plans", json=plan, headers=auth_headers)
+            assert response.status_code == status.HTTP_201_CREATED
+        assert response.json()["meals"][0]["type"] == "T299"
+
+    def test_diet_plan_recipe_id_out_of_range(self, client, auth_headers, reset_data):
+        """Test that a recipeId beyond int64 is a 422, not a server error"""
+        plan = {"customerId": 1, "date": "2025-12-18", "meals": [{"type": "LUNCH", "recipeId": 2**63}]}
+        response = client.post("/diet-plans", json=plan, headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
     
     def test_diet_plan_validation_business_rule(self, client, auth_headers, reset_data):
         """Test BC1: Diet plan validation against nutritional goals"""
@@ -0,0 +1,182 @@
+"""
+Unit tests for the production demand forecast
+Coverage: per-day portions, ingredient demand, incremental plan/recipe changes, range checks
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import status
+
+from forecast import MAX_RECIPE_ID, ForecastIndex
+from records import DietPlanRecord, RecipeRecord
+from store import Collection
+
+
+def plan(plan_id, day, meals):
+    fields = DietPlanRecord.meal_fields(('LUNCH', recipe_id, portion) for recipe_id, portion in meals)
+    return DietPlanRecord(plan_id, 1, day, **fields)
+
+
+@pytest.fixture
+def planned(client, auth_headers):
+    """Two recipes sharing an ingredient, planned on 2030-05-01 and 2030-05-02"""
+    recipe_ids = []
+    for ingredients in (["oats", "milk"], ["oats", "banana"]):
+        response = client.post("/recipes", json={
+            "name": "Forecast", "ingredients": ingredients,
+            "nutrition": {"calories": 400, "protein": 20, "carbs": 50, "fat": 10}
+        }, headers=auth_headers)
+        recipe_ids.append(response.json()["id"])
+    oats_milk, oats_banana = recipe_ids
+    plan_ids = []
+    for day, meals in (("2030-05-01", [(oats_milk, 2), (oats_banana, 1)]), ("2030-05-02", [(oats_banana, 3)])):
+        response = client.post("/diet-plans", json={
+            "customerId": 2, "date": day,
+            "meals": [{"type": "LUNCH", "recipeId": r, "portion": p} for r, p in meals]
+        }, headers=auth_headers)
+        plan_ids.append(response.json()["id"])
+    return recipe_ids, plan_ids
+
+
+def get_forecast(client, auth_headers, query="from=2030-05-01&to=2030-05-03"):
+    response = client.get(f"/production/forecast?{query}", headers=auth_headers)
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()
+
+
+class TestProductionForecast:
+    """Test the production forecast endpoint"""
+
+    def test_portions_per_day(self, client, auth_headers, planned):
+        """Test recipe portions and ingredient demand for each day and in total"""
+        (oats_milk, oats_banana), _ = planned
+        result = get_forecast(client, auth_headers)
+        assert (result["from"], result["to"]) == ("2030-05-01", "2030-05-03")
+
+        first, second = result["days"]
+        assert first["date"] == "2030-05-01"
+        assert first["plans"] == 1
+        assert dict(zip(first["recipeIds"], first["portions"])) == {oats_milk: 2, oats_banana: 1}
+        assert first["ingredients"] == {"banana": 1, "milk": 2, "oats": 3}
+        assert second["ingredients"] == {"banana": 3, "oats": 3}
+
+        total = result["total"]
+        assert total["plans"] == 2
+        assert dict(zip(total["recipeIds"], total["portions"])) == {oats_milk: 2, oats_banana: 4}
+        assert total["ingredients"] == {"banana": 4, "milk": 2, "oats": 6}
+
+    def test_plan_changes_are_incremental(self, client, auth_headers, planned):
+        """Test that plan create, update and delete adjust the forecast"""
+        (oats_milk, oats_banana), plan_ids = planned
+        get_forecast(client, auth_headers)
+        client.put(f"/diet-plans/{plan_ids[0]}", json={
+            "customerId": 2, "date": "2030-05-02",
+            "meals": [{"type": "DINNER", "recipeId": oats_milk, "portion": 1}]
+        }, headers=auth_headers)
+        client.delete(f"/diet-plans/{plan_ids[1]}", headers=auth_headers)
+        client.post("/diet-plans", json={
+            "customerId": 2, "date": "2030-05-03",
+            "meals": [{"type": "LUNCH", "recipeId": oats_banana, "portion": 5}]
+        }, headers=auth_headers)
+
+        days = get_forecast(client, auth_headers)["days"]
+        assert [(d["date"], d["plans"], d["ingredients"]) for d in days] == [
+            ("2030-05-02", 1, {"milk": 1, "oats": 1}),
+            ("2030-05-03", 1, {"banana": 5, "oats": 5}),
+        ]
+
+    def test_recipe_change_updates_ingredients(self, client, auth_headers, planned):
+        """Test that editing a recipe's ingredients is reflected in demand"""
+        (oats_milk, _), _ = planned
+        get_forecast(client, auth_headers)
+        client.put(f"/recipes/{oats_milk}", json={
+            "name": "Forecast", "ingredients": ["rice"],
+            "nutrition": {"calories": 400, "protein": 20, "carbs": 50, "fat": 10}
+        }, headers=auth_headers)
+        first = get_forecast(client, auth_headers)["days"][0]
+        assert first["ingredients"] == {"banana": 1, "oats": 1, "rice": 2}
+
+    def test_empty_and_default_range(self, client, auth_headers):
+        """Test a range without plans and the default next 7 days"""
+        result = get_forecast(client, auth_headers, "from=2031-01-01&to=2031-01-31")
+        assert result["days"] == []
+        assert result["total"] == {"plans": 0, "recipeIds": [], "portions": [], "ingredients": {}}
+
+        result = get_forecast(client, auth_headers, "")
+        today = datetime.utcnow().date()
+        assert (result["from"], result["to"]) == (today.isoformat(), (today + timedelta(days=6)).isoformat())
+
+    def test_default_horizon_ends_at_date_max(self, client, auth_headers):
+        """Test that the default 7-day horizon is clamped to 9999-12-31, not a 500"""
+        result = get_forecast(client, auth_headers, "from=9999-12-31")
+        assert (result["from"], result["to"]) == ("9999-12-31", "9999-12-31")
+
+    def test_errors(self, client, auth_headers):
+        """Test reversed and oversized ranges, bad dates and missing auth"""
+        response = client.get("/production/forecast?from=2030-02-01&to=2030-01-01", headers=auth_headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = client.get("/production/forecast?from=2030-01-01&to=2031-06-01", headers=auth_headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = client.get("/production/forecast?from=soon", headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = client.get("/production/forecast")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestForecastIndex:
+    """Test the per-day portion columns"""
+
+    def test_incremental_maintenance(self):
+        """Test inserts, in-place updates, deletes, column growth and clear"""
+        recipes = Collection('recipes', RecipeRecord, [
+            RecipeRecord(1, 'A', ('oats',), (0, 0, 0, 0)),
+            RecipeRecord(100, 'B', ('milk',), (0, 0, 0, 0)),
+        ])
+        plans = Collection('diet_plans', DietPlanRecord, [plan(1, '2025-01-01', [(1, 2)])])
+        index = ForecastIndex(recipes, plans)
+        plans.listeners.append(index.on_change)
+        recipes.listeners.append(index.on_recipe_change)
+
+        assert index.forecast('2025-01-01', '2025-01-01')['total']['ingredients'] == {'oats': 2}
+        plans.insert(plan(2, '2025-01-01', [(100, 1), (MAX_RECIPE_ID, 9), (-1, 9)]))
+        assert index.width == 128
+        total = index.forecast('2025-01-01', '2025-01-01')['total']
+        assert (total['recipeIds'], total['portions']) == ([1, 100], [2, 1])
+        assert total['ingredients'] == {'milk': 1, 'oats': 2}
+
+        plans.update(1, {'date': '2025-01-02', **DietPlanRecord.meal_fields([('LUNCH', 100, 4)])})
+        result = index.forecast('2025-01-01', '2025-01-31')
+        assert [(d['date'], d['ingredients']) for d in result['days']] == [
+            ('2025-01-01', {'milk': 1}), ('2025-01-02', {'milk': 4})
+        ]
+
+        recipes.insert(RecipeRecord(500, 'C', ('milk',), (0, 0, 0, 0)))
+        assert index.forecast('2025-01-02', '2025-01-02')['total']['ingredients'] == {'milk': 4}
+
+        plans.delete(2)
+        assert index.dates == ['2025-01-02']
+        plans.clear()
+        assert index.forecast('2025-01-01', '2025-01-31')['days'] == []
+
+    def test_unknown_recipe_ids_stay_sparse(self):
+        """Test that meals naming no known recipe do not widen the columns until the recipe exists"""
+        recipes = Collection('recipes', RecipeRecord, [RecipeRecord(1, 'A', ('oats',), (0, 0, 0, 0))])
+        plans = Collection('diet_plans', DietPlanRecord, [plan(1, '2025-01-01', [(1, 1)])])
+        index = ForecastIndex(recipes, plans)
+        plans.listeners.append(index.on_change)
+        recipes.listeners.append(index.on_recipe_change)
+        index.forecast('2025-01-01', '2025-01-01')
+        plans.insert(plan(2, '2025-01-01', [(MAX_RECIPE_ID - 1, 2), (300, 1.5)]))
+        assert index.width == 64 and len(index.days['2025-01-01'].portions) == 64
+        total = index.forecast('2025-01-01', '2025-01-01')['total']
+        assert (total['recipeIds'], total['portions']) == ([1, 300, MAX_RECIPE_ID - 1], [1, 1.5, 2])
+        assert total['ingredients'] == {'oats': 1}
+
+        recipes.insert(RecipeRecord(300, 'B', ('milk', 'milk'), (0, 0, 0, 0)))
+        assert index.width == 512 and index.days['2025-01-01'].extra == {MAX_RECIPE_ID - 1: 2000}
+        assert index.forecast('2025-01-01', '2025-01-01')['total']['ingredients'] == {'milk': 1.5, 'oats': 1}
+        recipes.delete(300)
+        assert index.forecast('2025-01-01', '2025-01-01')['total']['ingredients'] == {'oats': 1}
+        recipes.clear()
+        recipes.insert(RecipeRecord(1, 'A', ('rice',), (0, 0, 0, 0)))
+        assert index.forecast('2025-01-01', '2025-01-01')['total']['ingredients'] == {'rice': 1}
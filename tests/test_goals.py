@@ -0,0 +1,152 @@
+"""
+Unit tests for customer goal rules
+Coverage: rule DSL whitelist, compiled checks, per-customer cache, tolerances,
+bounds and per-meal caps in plan, batch and adherence validation
+"""
+import pytest
+from fastapi import status
+
+from goals import GoalCheck, GoalChecks, RuleError, check_rule
+from records import CustomerRecord
+from store import Collection
+
+GOAL = (2000, 100, 250, 70)
+GOAL_DICT = {"calories": 2000, "protein": 100, "carbs": 250, "fat": 70}
+
+
+def customer(customer_id, tolerance=0.1, rules=()):
+    return CustomerRecord(customer_id, **CustomerRecord.fields('C', 'c@example.com', '', [], GOAL, tolerance, rules))
+
+
+class TestGoalCheck:
+    """Test rules compiled on their own"""
+
+    def test_band_matches_fixed_tolerance(self):
+        """Test that the default band accepts exactly 10% off and refuses more"""
+        check = GoalCheck(GOAL, 0.1)
+        assert check.failures((2200, 90, 275, 63), None, 1) == ()
+        assert check.failures((2201, 100, 250, 70), None, 1) == ('abs(calories - goal.calories) <= 0.1 * goal.calories',)
+        assert not check.uses_meals and check.within((2200, 90, 275, 63))
+
+    def test_bounds_caps_and_custom_rules(self):
+        """Test that every failed rule is reported, in order"""
+        check = GoalCheck(GOAL, 1, ['calories >= 1900 and calories <= 2100', 'max(meal.calories) <= 800',
+                                    'meals >= 3', 'protein * 4 >= 0.2 * calories', 'min(fat, carbs) / 2 > 10'])
+        assert check.uses_meals
+        meals = [[700, 700, 600], [30, 30, 40], [80, 80, 90], [20, 20, 30]]
+        assert check.failures((2000, 100, 250, 70), meals, 3) == ()
+        meals = [[900, 1000], [50, 50], [125, 125], [35, 35]]
+        assert check.failures((1900, 100, 250, 70), meals, 2) == (
+            'max(meal.calories) <= 800', 'meals >= 3')
+        assert check.failures((2500, 100, 250, 70), [[], [], [], []], 0) == (
+            'calories >= 1900 and calories <= 2100', 'meals >= 3', 'protein * 4 >= 0.2 * calories')
+        # a day has no meals: only the rules on totals count
+        assert check.within((2000, 100, 250, 70)) and not check.within((2500, 100, 250, 70))
+
+    @pytest.mark.parametrize('rule', [
+        'calories', 'calories + 1', '__import__("os").system("x") > 0', 'calories.__class__ > 1',
+        'meal.fat > 1', 'calories / fat > 1', 'calories / 0 > 1', 'sodium > 1', 'sum(calories) > 1',
+        'max(meal.fat, key=abs) > 0', 'abs(1, 2) > 0', 'calories ** 2 > 0', '"a" < "b"', 'True == calories',
+        'calories in (1, 2)', 'calories >', 'x' * 501,
+    ])
+    def test_rejected_rules(self, rule):
+        """Test that anything outside the DSL is refused"""
+        with pytest.raises(RuleError):
+            check_rule(rule)
+
+
+class TestGoalChecks:
+    """Test the per-customer cache of compiled checks"""
+
+    def test_cached_until_the_goal_changes(self):
+        """Test that checks are compiled once and dropped on goal changes, deletes and clears"""
+        customers = Collection('customers', CustomerRecord, [customer(1), customer(2, rules=['meals >= 2'])])
+        checks = GoalChecks(customers)
+        customers.listeners.append(checks.on_change)
+        first = checks.get(customers.get(1))
+        assert checks.get(customers.get(1)) is first and checks.compiled == 1
+        customers.update(1, {'name': 'Renamed'})
+        assert checks.get(customers.get(1)) is first
+        customers.update(1, {'tolerance': 0.2})
+        assert checks.get(customers.get(1)) is not first
+        assert checks.get(customers.get(1)).rules[0].endswith('<= 0.2 * goal.calories')
+        assert checks.get(customers.get(2)).rules[-1] == 'meals >= 2'
+        customers.delete(2)
+        assert 2 not in checks.checks
+        customers.clear()
+        assert not checks.checks and 'diet_api_goal_rules_compiled_total 3' in checks.render()
+
+
+class TestGoalRulesApi:
+    """Test goal rules through the API"""
+
+    @pytest.fixture
+    def strict(self, client, auth_headers, reset_data):
+        """A customer with a 50% band, calorie bounds and a per-meal cap"""
+        goal = {**GOAL_DICT, "tolerance": 0.5,
+                "rules": ["calories >= 1800 and calories <= 2100", "max(meal.calories) <= 900"]}
+        response = client.post("/customers", json={"name": "Strict", "email": "s@example.com", "goal": goal},
+                               headers=auth_headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json()["goal"] == goal
+        recipe = client.post("/recipes", json={"name": "Big", "nutrition": {
+            "calories": 1000, "protein": 50, "carbs": 125, "fat": 35}}, headers=auth_headers).json()
+        return response.json()["id"], recipe["id"]
+
+    def create_plan(self, client, auth_headers, customer_id, meals, day="2030-07-01"):
+        response = client.post("/diet-plans", json={
+            "customerId": customer_id, "date": day,
+            "meals": [{"type": "LUNCH", "recipeId": r, "portion": p} for r, p in meals]
+        }, headers=auth_headers)
+        return response.json()["id"]
+
+    def test_plan_validation_reports_violations(self, client, auth_headers, strict):
+        """Test that single and batch validation apply the customer's rules"""
+        customer_id, recipe_id = strict
+        ok = self.create_plan(client, auth_headers, customer_id, [(recipe_id, 0.9), (recipe_id, 0.9)])
+        capped = self.create_plan(client, auth_headers, customer_id, [(recipe_id, 2)])
+        result = client.post(f"/diet-plans/{ok}/validate", headers=auth_headers).json()
+        assert result["valid"] and result["violations"] == []
+        result = client.post(f"/diet-plans/{capped}/validate", headers=auth_headers).json()
+        assert not result["valid"] and result["violations"] == ["max(meal.calories) <= 900"]
+        batch = client.post("/diet-plans/validate", json={"planIds": [ok, capped]}, headers=auth_headers).json()
+        assert [r["valid"] for r in batch["results"]] == [True, False]
+
+    def test_rules_follow_customer_updates(self, client, auth_headers, strict):
+        """Test that PATCHing the goal recompiles the checks; null restores the default band"""
+        customer_id, recipe_id = strict
+        plan_id = self.create_plan(client, auth_headers, customer_id, [(recipe_id, 1.5)])
+        assert client.post(f"/diet-plans/{plan_id}/validate", headers=auth_headers).json()["valid"] is False
+        client.patch(f"/customers/{customer_id}", content=b'{"goal": {"rules": ["meals >= 1"]}}',
+                     headers={**auth_headers, "Content-Type": "application/merge-patch+json"})
+        assert client.post(f"/diet-plans/{plan_id}/validate", headers=auth_headers).json()["valid"] is True
+        response = client.patch(f"/customers/{customer_id}", content=b'{"goal": {"tolerance": null, "rules": null}}',
+                                headers={**auth_headers, "Content-Type": "application/merge-patch+json"})
+        assert response.json()["goal"] == GOAL_DICT
+        result = client.post(f"/diet-plans/{plan_id}/validate", headers=auth_headers).json()
+        assert result["violations"] == ["abs(calories - goal.calories) <= 0.1 * goal.calories",
+                                        "abs(protein - goal.protein) <= 0.1 * goal.protein",
+                                        "abs(carbs - goal.carbs) <= 0.1 * goal.carbs",
+                                        "abs(fat - goal.fat) <= 0.1 * goal.fat"]
+
+    def test_adherence_uses_rules_on_totals(self, client, auth_headers, strict):
+        """Test that days are checked against the band and the rules that need no meals"""
+        customer_id, recipe_id = strict
+        self.create_plan(client, auth_headers, customer_id, [(recipe_id, 2)], day="2030-07-01")
+        self.create_plan(client, auth_headers, customer_id, [(recipe_id, 2.5)], day="2030-07-02")
+        response = client.get(f"/customers/{customer_id}/adherence?from=2030-07-01&to=2030-07-02",
+                              headers=auth_headers)
+        assert [day["within_goal"] for day in response.json()["days"]] == [True, False]
+
+    def test_invalid_rules_are_refused(self, client, auth_headers, reset_data):
+        """Test that rules outside the DSL and negative tolerances are a 422"""
+        for goal in ({**GOAL_DICT, "rules": ["__import__('os') > 0"]}, {**GOAL_DICT, "tolerance": -1},
+                     {**GOAL_DICT, "rules": ["meals > 0"] * 51}):
+            response = client.post("/customers", json={"name": "Bad", "email": "b@example.com", "goal": goal},
+                                   headers=auth_headers)
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_metrics(self, client, auth_headers, strict):
+        """Test that compiled rule sets are counted"""
+        response = client.get("/metrics")
+        assert "diet_api_goal_rules_compiled_total" in response.text
@@ -0,0 +1,172 @@
+"""
+Unit tests for Idempotency-Key handling on create endpoints
+Coverage: replay, key scoping, body mismatch, TTL/LRU eviction, coalescing of concurrent duplicates
+"""
+import threading
+
+import pytest
+from fastapi import status
+
+import idempotency as idempotency_module
+import main
+from idempotency import IdempotencyCache, IdempotencyKeyReused
+
+PLAN = {"customerId": 2, "date": "2025-08-01", "meals": [{"type": "LUNCH", "recipeId": 1, "portion": 2}]}
+
+
+def post(client, auth_headers, path, body, key):
+    return client.post(path, json=body, headers={**auth_headers, "Idempotency-Key": key})
+
+
+class TestIdempotentCreates:
+    """Test Idempotency-Key on the POST endpoints"""
+
+    @pytest.mark.parametrize("path, body", [
+        ("/customers", {"name": "Once", "email": "once@example.com",
+                        "goal": {"calories": 1, "protein": 1, "carbs": 1, "fat": 1}}),
+        ("/recipes", {"name": "Once", "nutrition": {"calories": 1, "protein": 1, "carbs": 1, "fat": 1}}),
+        ("/diet-plans", PLAN),
+        ("/production-batches", {"productionDate": "2025-08-01", "dietPlans": [1],
+                                 "recipeBatches": [{"recipeId": 1, "portions": 5}]}),
+    ])
+    def test_retry_replays_response(self, client, auth_headers, path, body):
+        """Test that a retried create returns the first response and creates nothing"""
+        count = len(client.get(path, headers=auth_headers).json())
+        first = post(client, auth_headers, path, body, "retry-1")
+        second = post(client, auth_headers, path, body, "retry-1")
+        assert first.status_code == second.status_code == status.HTTP_201_CREATED
+        assert second.json() == first.json()
+        assert second.headers["Idempotent-Replayed"] == "true"
+        assert "Idempotent-Replayed" not in first.headers
+        assert len(client.get(path, headers=auth_headers).json()) == count + 1
+
+    def test_keys_are_scoped(self, client, auth_headers):
+        """Test that the same key on another route or without a key creates again"""
+        first = post(client, auth_headers, "/diet-plans", PLAN, "shared")
+        other = post(client, auth_headers, "/recipes", {
+            "name": "R", "nutrition": {"calories": 1, "protein": 1, "carbs": 1, "fat": 1}
+        }, "shared")
+        assert other.status_code == status.HTTP_201_CREATED
+        plain = client.post("/diet-plans", json=PLAN, headers=auth_headers)
+        assert plain.json()["id"] == first.json()["id"] + 1
+
+    def test_reused_key_with_other_body(self, client, auth_headers):
+        """Test that a key cannot be reused for a different request"""
+        post(client, auth_headers, "/diet-plans", PLAN, "reused")
+        response = post(client, auth_headers, "/diet-plans", {**PLAN, "date": "2025-08-02"}, "reused")
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_failures_are_not_stored(self, client, auth_headers):
+        """Test that an error response is not replayed"""
+        body = {**PLAN, "customerId": 999}
+        assert post(client, auth_headers, "/diet-plans", body, "failing").status_code == 404
+        assert post(client, auth_headers, "/diet-plans", body, "failing").status_code == 404
+        assert len(main.idempotency) == 0
+
+    def test_invalid_key(self, client, auth_headers):
+        """Test the key length limit"""
+        response = post(client, auth_headers, "/diet-plans", PLAN, "k" * 256)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_metrics(self, client, auth_headers):
+        """Test that replays are exported"""
+        post(client, auth_headers, "/diet-plans", PLAN, "metered")
+        post(client, auth_headers, "/diet-plans", PLAN, "metered")
+        text = client.get("/metrics").text
+        assert "diet_api_idempotency_entries 1" in text
+        assert "diet_api_idempotency_replays_total" in text
+
+
+class TestIdempotencyCache:
+    """Test storage bounds and coalescing"""
+
+    def test_ttl(self, monkeypatch):
+        """Test that stored responses expire"""
+        now = [100.0]
+        monkeypatch.setattr(idempotency_module.time, "monotonic", lambda: now[0])
+        cache = IdempotencyCache(ttl=10)
+        calls = []
+        create = lambda: calls.append(1) or {"n": len(calls)}
+        assert cache.run("k", "f", create) == (b'{"n":1}', False)
+        now[0] += 9
+        assert cache.run("k", "f", create) == (b'{"n":1}', True)
+        now[0] += 2
+        assert cache.run("k", "f", create) == (b'{"n":2}', False)
+        assert cache.bytes == len(b'{"n":2}') + cache.ENTRY_OVERHEAD
+
+    def test_lru_byte_cap(self):
+        """Test that the least recently used responses go first once over the cap"""
+        cache = IdempotencyCache(max_bytes=3 * (10 + IdempotencyCache.ENTRY_OVERHEAD))
+        for key in "abc":
+            cache.run(key, key, lambda: "x" * 8)  # 10 bytes serialized
+        cache.run("a", "a", lambda: None)  # touch a
+        cache.run("d", "d", lambda: "x" * 8)
+        assert list(cache._stored) == ["c", "a", "d"]
+        assert cache.bytes <= cache.max_bytes
+
+    def test_mismatch(self):
+        """Test that stored and in-flight keys check the fingerprint"""
+        cache = IdempotencyCache()
+        cache.run("k", "f", dict)
+        with pytest.raises(IdempotencyKeyReused):
+            cache.run("k", "other", dict)
+
+    def test_concurrent_duplicates_run_once(self):
+        """Test that a duplicate arriving mid-flight waits and replays"""
+        cache = IdempotencyCache()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_create():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"id": 1}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(cache.run("k", "f", slow_create)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(cache.run("k", "f", slow_create)))
+        follower.start()
+        while not cache.coalesced:
+            pass
+        with pytest.raises(IdempotencyKeyReused):
+            cache.run("k", "other", slow_create)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        assert calls == [1]
+        assert sorted(results, key=lambda r: r[1]) == [(b'{"id":1}', False), (b'{"id":1}', True)]
+
+    def test_waiter_takes_over_after_failure(self):
+        """Test that a waiter runs the create itself when the first attempt fails"""
+        cache = IdempotencyCache()
+        started, release = threading.Event(), threading.Event()
+
+        def failing():
+            started.set()
+            release.wait(5)
+            raise RuntimeError("boom")
+
+        errors = []
+
+        def lead():
+            try:
+                cache.run("k", "f", failing)
+            except RuntimeError as exc:
+                errors.append(exc)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait(5)
+        results = []
+        follower = threading.Thread(target=lambda: results.append(cache.run("k", "f", lambda: "ok")))
+        follower.start()
+        while not cache.coalesced:
+            pass
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        assert len(errors) == 1
+        assert results == [(b'"ok"', False)]
@@ -0,0 +1,125 @@
+"""
+Unit tests for JWT signing keys
+Coverage: kid headers, legacy tokens, ES256 key files, rotation and retirement,
+verify-only rings from a JWKS, the JWKS and key rotation endpoints
+"""
+import os
+
+import pytest
+from fastapi import status
+from jose import JWTError, jwt
+
+import main
+from keys import KeyRing
+
+
+class TestKeyRing:
+    """Test the key ring on its own"""
+
+    def test_hs256(self):
+        """Test that HS256 tokens carry a kid and verify, also without one"""
+        ring = KeyRing("HS256", "secret")
+        token = ring.sign({"sub": "alice"})
+        assert jwt.get_unverified_header(token)["kid"] == ring.kids[0]
+        assert ring.verify(token) == {"sub": "alice"}
+        assert ring.verify(jwt.encode({"sub": "old"}, "secret", algorithm="HS256")) == {"sub": "old"}
+        assert ring.jwks() == {"keys": []}
+        with pytest.raises(ValueError):
+            ring.rotate()
+
+    def test_invalid_configuration(self):
+        """Test that unknown algorithms and HS256 without a secret are refused"""
+        with pytest.raises(ValueError):
+            KeyRing("RS256", "secret")
+        with pytest.raises(ValueError):
+            KeyRing("HS256")
+
+    def test_unknown_kid_and_bad_signature(self):
+        """Test that tokens from another key are rejected"""
+        ring, other = KeyRing("ES256"), KeyRing("ES256")
+        with pytest.raises(JWTError):
+            ring.verify(other.sign({"sub": "alice"}))
+        forged = jwt.encode({"sub": "alice"}, "secret", algorithm="HS256", headers={"kid": ring.kids[0]})
+        with pytest.raises(JWTError):
+            ring.verify(forged)
+
+    @pytest.mark.parametrize("kid", [[1], {"a": 1}, 1])
+    def test_non_string_kid(self, kid):
+        """Test that a kid that is not a string is a JWTError, not a TypeError"""
+        ring = KeyRing("HS256", "secret")
+        token = jwt.encode({"sub": "alice"}, "secret", algorithm="HS256", headers={"kid": kid})
+        with pytest.raises(JWTError):
+            ring.verify(token)
+
+    def test_es256_keys_persist(self, tmp_path):
+        """Test that the signing key is written once and reloaded by the next process"""
+        ring = KeyRing("ES256", directory=str(tmp_path))
+        token = ring.sign({"sub": "alice"})
+        (name,) = os.listdir(tmp_path)
+        assert name == ring.kids[0] + ".pem"
+        assert os.stat(tmp_path / name).st_mode & 0o777 == 0o600
+        assert KeyRing("ES256", directory=str(tmp_path)).verify(token) == {"sub": "alice"}
+
+    def test_rotation_retires_oldest(self, tmp_path):
+        """Test that rotation signs with the new key and keeps only the newest `keep` keys"""
+        ring = KeyRing("ES256", directory=str(tmp_path), keep=2)
+        first = ring.sign({"sub": "first"})
+        first_kid = ring.kids[0]
+        second_kid = ring.rotate()
+        second = ring.sign({"sub": "second"})
+        assert jwt.get_unverified_header(second)["kid"] == second_kid
+        assert ring.verify(first) == {"sub": "first"}
+        ring.rotate()
+        assert first_kid not in ring.kids and len(ring.kids) == 2
+        assert sorted(os.listdir(tmp_path)) == [kid + ".pem" for kid in ring.kids]
+        with pytest.raises(JWTError):
+            ring.verify(first)
+        assert ring.verify(second) == {"sub": "second"}
+        assert [key["kid"] for key in ring.jwks()["keys"]] == ring.kids
+
+    def test_verify_only_ring_from_jwks(self):
+        """Test that a JWKS is enough to verify, and not to sign"""
+        ring = KeyRing("ES256")
+        sidecar = KeyRing.from_jwks(ring.jwks())
+        assert sidecar.verify(ring.sign({"sub": "alice"})) == {"sub": "alice"}
+        assert "d" not in ring.jwks()["keys"][0]  # no private key material
+        with pytest.raises(ValueError):
+            sidecar.sign({"sub": "alice"})
+
+
+class TestKeyEndpoints:
+    """Test JWKS publication and rotation through the API"""
+
+    @pytest.fixture
+    def es256(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "keyring", KeyRing("ES256", directory=str(tmp_path)))
+
+    def login(self, client):
+        return client.post("/login", data={"username": "admin", "password": "secret"}).json()["access_token"]
+
+    def test_hs256_publishes_nothing(self, client, auth_headers):
+        """Test the default: empty JWKS, rotation refused"""
+        response = client.get("/.well-known/jwks.json")
+        assert response.json() == {"keys": []}
+        assert response.headers["cache-control"] == f"public, max-age={main.JWKS_MAX_AGE}"
+        rotate = client.post("/admin/keys/rotate", headers=auth_headers)
+        assert rotate.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_es256_tokens_verify_at_the_edge(self, client, reset_data, es256):
+        """Test that ES256 access tokens work and verify against the published JWKS alone"""
+        token = self.login(client)
+        assert jwt.get_unverified_header(token)["alg"] == "ES256"
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.get("/users/me", headers=headers).json()["username"] == "admin"
+        sidecar = KeyRing.from_jwks(client.get("/.well-known/jwks.json").json())
+        assert sidecar.verify(token)["sub"] == "admin"
+
+    def test_rotation_keeps_old_tokens_valid(self, client, reset_data, es256):
+        """Test that tokens signed before a rotation still authenticate"""
+        old = {"Authorization": f"Bearer {self.login(client)}"}
+        response = client.post("/admin/keys/rotate", headers=old)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["kid"] == response.json()["keys"][-1] and len(response.json()["keys"]) == 2
+        assert jwt.get_unverified_header(self.login(client))["kid"] == response.json()["kid"]
+        assert client.get("/users/me", headers=old).status_code == status.HTTP_200_OK
+        assert len(client.get("/.well-known/jwks.json").json()["keys"]) == 2
@@ -0,0 +1,119 @@
+"""
+Unit tests for request metrics and the /metrics endpoint
+Coverage: histogram bucketing, route instrumentation, internal timers, exposition
+"""
+import re
+
+import pytest
+from fastapi import status
+
+from metrics import Histogram, Metrics, bucket_index, bucket_upper
+
+
+def sample(text, name, **labels):
+    """Value of the first exposition line for `name` carrying `labels`"""
+    for line in text.splitlines():
+        if line.startswith(name + '{') and all(f'{k}="{v}"' in line for k, v in labels.items()):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+class TestHistogram:
+    """Test HDR-style bucketing"""
+
+    @pytest.mark.parametrize('value', [0, 1, 15, 16, 17, 1000, 123_456, 10 ** 9, 2 ** 40 - 1])
+    def test_value_within_bucket(self, value):
+        """Test that each value falls inside its bucket with bounded error"""
+        index = bucket_index(value)
+        upper = bucket_upper(index)
+        assert value < upper
+        assert upper - value <= max(1, value / 16)
+
+    def test_huge_values_are_clamped(self):
+        """Test that out-of-range values land in the last bucket"""
+        histogram = Histogram()
+        histogram.record(2 ** 60)
+        assert histogram.counts[-1] == 1
+
+    def test_quantiles(self):
+        """Test approximate quantiles from recorded latencies"""
+        histogram = Histogram()
+        assert histogram.quantile(0.5) == 0.0
+        for us in range(1, 101):
+            histogram.record(us * 1000)
+        assert histogram.quantile(0.5) == pytest.approx(50e-6, rel=0.07)
+        assert histogram.quantile(0.99) == pytest.approx(99e-6, rel=0.07)
+
+    def test_cumulative_buckets(self):
+        """Test that exported buckets are cumulative and end with +Inf"""
+        histogram = Histogram()
+        for value in (500, 2_000, 3_000_000, 10 ** 12):
+            histogram.record(value)
+        buckets, count, total = histogram.cumulative()
+        assert buckets[0] == ('1.024e-06', 1)
+        assert buckets[-1] == ('+Inf', 4)
+        counts = [n for _, n in buckets]
+        assert counts == sorted(counts)
+        assert buckets[-2][1] == 3
+        assert count == 4 and total == 10 ** 12 + 3_002_500
+
+
+class TestMetricsRegistry:
+    """Test rendering of a standalone registry"""
+
+    def test_render(self):
+        """Test Prometheus text for routes and operations"""
+        registry = Metrics()
+        stats = registry.route('GET', '/items/{item_id}')
+        stats.start()
+        assert 'diet_api_requests_in_flight{method="GET",route="/items/{item_id}"} 1' in registry.render()
+        stats.finish(200, 5_000)
+        with registry.timer('op "quoted"'):
+            pass
+        text = registry.render()
+        assert sample(text, 'diet_api_requests_total', route='/items/{item_id}', status='200') == 1
+        assert sample(text, 'diet_api_requests_in_flight', route='/items/{item_id}') == 0
+        assert sample(text, 'diet_api_request_duration_seconds_count', route='/items/{item_id}') == 1
+        assert 'op="op \\"quoted\\""' in text
+
+        registry.reset()
+        assert 'route=' not in registry.render()
+
+
+class TestMetricsEndpoint:
+    """Test instrumentation of the API"""
+
+    def test_routes_are_recorded_by_template(self, client, auth_headers):
+        """Test counts per route template and status code"""
+        before = client.get("/metrics").text
+        client.get("/customers/1", headers=auth_headers)
+        client.get("/customers/2", headers=auth_headers)
+        client.get("/customers/999", headers=auth_headers)
+        response = client.get("/metrics")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+        text = response.text
+        route = '/customers/{customer_id}'
+        ok_before = sample(before, 'diet_api_requests_total', method='GET', route=route, status='200') or 0
+        missing_before = sample(before, 'diet_api_requests_total', method='GET', route=route, status='404') or 0
+        assert sample(text, 'diet_api_requests_total', method='GET', route=route, status='200') == ok_before + 2
+        assert sample(text, 'diet_api_requests_total', method='GET', route=route, status='404') == missing_before + 1
+        assert sample(text, 'diet_api_requests_in_flight', route=route) == 0
+        assert re.search(r'diet_api_request_duration_seconds_bucket\{method="GET",'
+                         r'route="/customers/\{customer_id\}",le="\+Inf"\} \d+', text)
+
+    def test_unauthorized_and_invalid_requests(self, client, auth_headers):
+        """Test that 401 and 422 responses are counted"""
+        client.get("/recipes")
+        client.post("/recipes", json={"name": "No nutrition"}, headers=auth_headers)
+        text = client.get("/metrics").text
+        assert sample(text, 'diet_api_requests_total', method='GET', route='/recipes', status='401') >= 1
+        assert sample(text, 'diet_api_requests_total', method='POST', route='/recipes', status='422') >= 1
+
+    def test_internal_operations_are_timed(self, client, auth_headers):
+        """Test timers around auth, lookups, validation and serialization"""
+        client.post("/diet-plans/1/validate", headers=auth_headers)
+        text = client.get("/metrics").text
+        for op in ('bcrypt_verify', 'jwt_decode', 'store_lookup', 'plan_validation', 'serialize'):
+            assert sample(text, 'diet_api_operation_duration_seconds_count', op=op) >= 1
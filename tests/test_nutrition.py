@@ -0,0 +1,146 @@
+"""
+Unit tests for fractional portions and the nutrition columns
+Coverage: per-recipe float columns, fixed-point totals, gram-based meals,
+non-finite values, batch validation, fractional forecasts and adherence
+"""
+from fastapi import status
+
+from nutrition import NutritionTable, rounded
+from records import DietPlanRecord, RecipeRecord
+from store import Collection
+
+RECIPE = {"name": "Porridge", "ingredients": ["oats"],
+          "nutrition": {"calories": 300, "protein": 10.5, "carbs": 50, "fat": 6}, "portionGrams": 250}
+
+
+def units(*meals):
+    fields = DietPlanRecord.meal_fields(('LUNCH', recipe_id, portion) for recipe_id, portion in meals)
+    return fields['meal_recipes'], fields['meal_portions']
+
+
+class TestNutritionTable:
+    """Test the per-recipe columns on their own"""
+
+    def test_totals(self):
+        """Test fractional portions, unknown recipe ids and the reported rounding"""
+        table = NutritionTable(Collection('recipes', RecipeRecord, [
+            RecipeRecord(1, 'A', (), (100, 10.5, 20, 1)), RecipeRecord(3, 'B', (), (50, 0, 5, 0.25))]))
+        assert table.totals(*units((1, 1.5), (3, 2))) == (250.0, 15.75, 40.0, 2.0)
+        assert table.totals(*units((2, 1), (99, 1), (3, 1))) == (50.0, 0.0, 5.0, 0.25)
+        assert table.totals(*units()) == (0.0, 0.0, 0.0, 0.0)
+        assert rounded((250.0, 1 / 3, -2.0, 7)) == (250, 0.33, -2, 7)
+        assert type(rounded((250.0,))[0]) is int
+
+    def test_follows_recipe_changes(self):
+        """Test that inserts (growing the columns), updates, deletes and clears are picked up"""
+        recipes = Collection('recipes', RecipeRecord, [RecipeRecord(1, 'A', (), (100, 0, 0, 0))])
+        table = NutritionTable(recipes)
+        recipes.listeners.append(table.on_change)
+        assert table.totals(*units((1, 1)))[0] == 100
+        recipes.insert(RecipeRecord(500, 'B', (), (40, 0, 0, 0)))
+        recipes.update(1, {'nutrition': (200, 0, 0, 0)})
+        assert table.totals(*units((1, 1), (500, 0.5)))[0] == 220
+        recipes.delete(500)
+        assert table.totals(*units((500, 1)))[0] == 0
+        recipes.clear()
+        recipes.extend([RecipeRecord(1, 'C', (), (7, 0, 0, 0))])
+        assert table.totals(*units((1, 1)))[0] == 7
+
+
+class TestFractionalPortions:
+    """Test fractional and gram-based meals through the API"""
+
+    def create_recipe(self, client, auth_headers, **changes):
+        response = client.post("/recipes", json={**RECIPE, **changes}, headers=auth_headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        return response.json()
+
+    def create_plan(self, client, auth_headers, meals, day="2030-06-01"):
+        return client.post("/diet-plans", json={"customerId": 2, "date": day, "meals": meals}, headers=auth_headers)
+
+    def test_fractional_portion(self, client, auth_headers, reset_data):
+        """Test that 1.5 portions are stored, returned and counted exactly"""
+        recipe = self.create_recipe(client, auth_headers)
+        assert recipe["nutrition"]["protein"] == 10.5 and recipe["portionGrams"] == 250
+        response = self.create_plan(client, auth_headers, [{"type": "LUNCH", "recipeId": recipe["id"], "portion": 1.5}])
+        assert response.json()["meals"][0]["portion"] == 1.5
+        result = client.post(f"/diet-plans/{response.json()['id']}/validate", headers=auth_headers).json()
+        assert result["total_nutrition"] == {"calories": 450, "protein": 15.75, "carbs": 75, "fat": 9}
+        assert result["differences"]["calories"] == 2000 - 450
+
+    def test_gram_based_meal(self, client, auth_headers, reset_data):
+        """Test that grams become portions of the recipe's portion weight"""
+        recipe = self.create_recipe(client, auth_headers)
+        response = self.create_plan(client, auth_headers, [{"type": "LUNCH", "recipeId": recipe["id"], "grams": 375}])
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json()["meals"][0]["portion"] == 1.5
+
+    def test_gram_based_meal_needs_portion_weight(self, client, auth_headers, reset_data):
+        """Test that grams are refused for recipes without portionGrams, and together with portion"""
+        response = self.create_plan(client, auth_headers, [{"type": "LUNCH", "recipeId": 1, "grams": 100}])
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert "portionGrams" in response.json()["detail"]
+        recipe = self.create_recipe(client, auth_headers)
+        both = self.create_plan(client, auth_headers, [{"type": "LUNCH", "recipeId": recipe["id"], "portion": 1,
+                                                        "grams": 100}])
+        assert both.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        huge = self.create_plan(client, auth_headers, [{"type": "LUNCH", "recipeId": recipe["id"], "grams": 1e9}])
+        assert huge.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_non_finite_and_invalid_portions(self, client, auth_headers, reset_data):
+        """Test that NaN/Infinity nutrition and zero or negative portions are refused"""
+        body = b'{"name": "Bad", "nutrition": {"calories": NaN, "protein": 1, "carbs": 1, "fat": 1}}'
+        response = client.post("/recipes", content=body, headers={**auth_headers, "Content-Type": "application/json"})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert response.json()["detail"][0]["input"] == "nan"
+        for portion in (0, -1, 0.0004):
+            response = self.create_plan(client, auth_headers, [{"type": "LUNCH", "recipeId": 1, "portion": portion}])
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        recipe = self.create_recipe(client, auth_headers)
+        tiny = self.create_plan(client, auth_headers, [{"type": "LUNCH", "recipeId": recipe["id"], "grams": 0.1}])
+        assert tiny.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_nutrition_is_bounded(self, client, auth_headers, reset_data):
+        """Test that nutrition and goals too large to total as finite floats are refused"""
+        huge = {"name": "Huge", "nutrition": {"calories": 1e308, "protein": 1, "carbs": 1, "fat": 1}}
+        response = client.post("/recipes", json=huge, headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        goal = {"calories": 10 ** 400, "protein": 1, "carbs": 1, "fat": 1}
+        response = client.post("/customers", json={"name": "Big", "email": "b@example.com", "goal": goal},
+                               headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_fractional_forecast_and_adherence(self, client, auth_headers, reset_data):
+        """Test that fractional portions add up exactly in the forecast and daily totals"""
+        recipe = self.create_recipe(client, auth_headers)
+        for portion in (0.1, 0.2):
+            self.create_plan(client, auth_headers, [{"type": "LUNCH", "recipeId": recipe["id"], "portion": portion}])
+        forecast = client.get("/production/forecast?from=2030-06-01&to=2030-06-01", headers=auth_headers).json()
+        assert forecast["total"]["portions"] == [0.3] and forecast["total"]["ingredients"] == {"oats": 0.3}
+        adherence = client.get("/customers/2/adherence?from=2030-06-01&to=2030-06-01", headers=auth_headers).json()
+        assert adherence["days"][0]["total_nutrition"] == {"calories": 90, "protein": 3.15, "carbs": 15, "fat": 1.8}
+
+
+class TestBatchValidation:
+    """Test POST /diet-plans/validate"""
+
+    def test_matches_single_validation(self, client, auth_headers, reset_data):
+        """Test that every plan gets the result of the single-plan endpoint; unknown ids are listed"""
+        plan_id = client.post("/diet-plans", json={
+            "customerId": 2, "date": "2030-06-01", "meals": [{"type": "LUNCH", "recipeId": 2, "portion": 2.5}]
+        }, headers=auth_headers).json()["id"]
+        response = client.post("/diet-plans/validate", json={"planIds": [1, plan_id, 9999, plan_id]},
+                               headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        body = response.json()
+        assert [r["id"] for r in body["results"]] == [1, plan_id] and body["missing"] == [9999]
+        for result in body["results"]:
+            single = client.post(f"/diet-plans/{result['id']}/validate", headers=auth_headers).json()
+            assert {k: v for k, v in result.items() if k not in ("id", "customerId")} == single
+
+    def test_batch_limit(self, client, auth_headers):
+        """Test that oversized batches and missing ids are refused"""
+        response = client.post("/diet-plans/validate", json={"planIds": list(range(10_001))}, headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = client.post("/diet-plans/validate", json={}, headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
@@ -0,0 +1,229 @@
+"""
+Unit tests for date-partitioned collections and retention
+Coverage: partition placement, range reads, drops and their listeners, WAL replay,
+date validation, range endpoints, retention endpoint
+"""
+import pytest
+from fastapi import status
+
+import main
+from changes import ChangeFeed
+from forecast import ForecastIndex
+from indexes import BatchIndex, PlanIndex
+from partitions import PartitionedCollection
+from persistence import Persistence
+from records import DietPlanRecord, ProductionBatchRecord, RecipeRecord
+from store import Collection
+
+
+def plan(plan_id, day, customer_id=1, recipe_ids=(1,)):
+    meals = [('LUNCH', recipe_id, 1) for recipe_id in recipe_ids]
+    return DietPlanRecord(plan_id, customer_id, day, **DietPlanRecord.meal_fields(meals))
+
+
+def batch(batch_id, day, plan_ids=(1,)):
+    return ProductionBatchRecord(batch_id, **ProductionBatchRecord.fields(day, list(plan_ids), [(1, 5)]))
+
+
+def plans(*records):
+    return PartitionedCollection('diet_plans', DietPlanRecord, 'date', records)
+
+
+class TestPartitionedCollection:
+    """Test per-day placement and range reads"""
+
+    def test_records_are_partitioned_by_day(self):
+        """Test that records land in sorted day partitions"""
+        collection = plans(plan(1, '2025-03-02'), plan(2, '2025-03-01'), plan(3, '2025-03-02'))
+        assert collection.days == ['2025-03-01', '2025-03-02']
+        assert collection.partition_sizes() == [('2025-03-01', 1), ('2025-03-02', 2)]
+        assert [p.id for p in collection] == [1, 2, 3]
+
+    def test_between_reads_only_days_in_range(self):
+        """Test inclusive, open-ended ranges ordered by day"""
+        collection = plans(*(plan(i, f'2025-03-{i:02d}') for i in range(1, 11)))
+        assert [p.id for p in collection.between('2025-03-03', '2025-03-05')] == [3, 4, 5]
+        assert [p.id for p in collection.between(None, '2025-03-02')] == [1, 2]
+        assert [p.id for p in collection.between('2025-03-09')] == [9, 10]
+        assert collection.between('2025-04-01', '2025-04-30') == []
+
+    def test_update_moves_record_between_days(self):
+        """Test that changing the day moves the record and empty days disappear"""
+        collection = plans(plan(1, '2025-03-01'))
+        collection.update(1, {'date': '2025-03-05'})
+        assert collection.days == ['2025-03-05']
+        assert collection.between('2025-03-05', '2025-03-05')[0].id == 1
+        collection.update(1, {'customerId': 2})
+        assert collection.days == ['2025-03-05']
+
+    def test_delete_insert_replace_and_clear(self):
+        """Test that every write keeps the partitions in step with the id map"""
+        collection = plans(plan(1, '2025-03-01'), plan(2, '2025-03-02'))
+        collection.delete(1)
+        assert collection.days == ['2025-03-02']
+        collection.insert(plan(2, '2025-03-03'))
+        assert collection.partition_sizes() == [('2025-03-03', 1)]
+        collection.extend([plan(3, '2025-03-01')])
+        assert collection.days == ['2025-03-01', '2025-03-03']
+        collection.clear()
+        assert collection.days == [] and collection.partitions == {} and len(collection) == 0
+
+    def test_defer_is_not_supported(self):
+        """Test that partitioned collections cannot be lazily loaded"""
+        with pytest.raises(NotImplementedError):
+            plans().defer(list)
+
+
+class TestDrop:
+    """Test dropping whole days"""
+
+    def test_drop_prefix_and_middle(self):
+        """Test that dropped days leave the store, versions and day list"""
+        collection = plans(*(plan(i, f'2025-03-{i:02d}') for i in range(1, 6)))
+        collection.update(1, {'customerId': 9})
+        assert collection.days_before('2025-03-03') == ['2025-03-01', '2025-03-02']
+        dropped = collection.drop(collection.days_before('2025-03-03'))
+        assert list(dropped) == ['2025-03-01', '2025-03-02']
+        assert [p.id for p in collection] == [3, 4, 5]
+        assert collection.version(1) == 1
+        collection.drop(['2025-03-04', '2025-01-01'])
+        assert collection.days == ['2025-03-03', '2025-03-05']
+        assert collection.drop(['2025-01-01']) == {}
+
+    def test_one_notification_per_drop(self):
+        """Test that listeners see a single 'drop' with the detached partitions"""
+        collection = plans(plan(1, '2025-03-01'), plan(2, '2025-03-01'), plan(3, '2025-03-02'))
+        seen = []
+        collection.listeners.append(lambda c, op, record: seen.append((op, record, [r.id for r in c.dropped_records()])))
+        generation = collection.generation
+        collection.drop(['2025-03-01'])
+        assert seen == [('drop', None, [1, 2])]
+        assert collection.generation == generation + 1
+        assert collection.dropped is None
+
+    def test_indexes_follow_drops(self):
+        """Test that plan, batch and forecast indexes forget dropped records"""
+        collection = plans(plan(1, '2025-03-01', 5, (1,)), plan(2, '2025-03-02', 5, (2,)))
+        plan_index = PlanIndex()
+        plan_index.rebuild(collection)
+        forecast = ForecastIndex(Collection('recipes', RecipeRecord))
+        forecast.rebuild(collection)
+        changed = []
+        plan_index.listeners.append(lambda *key: changed.append(key))
+        collection.listeners += [plan_index.on_change, forecast.on_change]
+        collection.drop(['2025-03-01'])
+        assert plan_index.plan_ids(5) == [('2025-03-02', {2})]
+        assert plan_index.plans_using_recipe(1) == set()
+        assert changed == [(5, '2025-03-01')]
+        assert forecast.dates == ['2025-03-02']
+
+        batches = PartitionedCollection('production_batches', ProductionBatchRecord, 'productionDate',
+                                        [batch(1, '2025-03-01', (1,)), batch(2, '2025-03-02', (2,))])
+        batch_index = BatchIndex()
+        batch_index.rebuild(batches)
+        batches.listeners.append(batch_index.on_change)
+        batches.drop(['2025-03-01'])
+        assert batch_index.batches_with_plan(1) == set()
+        assert batch_index.batches_with_plan(2) == {2}
+
+    def test_change_feed_publishes_days(self):
+        """Test that a drop is one change event naming the days"""
+        collection = plans(plan(1, '2025-03-01'))
+        feed = ChangeFeed(capacity=4)
+        collection.listeners.append(feed.on_change)
+        collection.drop(['2025-03-01'])
+        found, _, _ = feed.since(0)
+        assert '"op":"drop","days":["2025-03-01"]' in found[0].json
+
+    def test_drop_is_replayed_from_the_log(self, tmp_path):
+        """Test that a logged drop is applied again on recovery"""
+        collection = plans(plan(1, '2025-03-01'), plan(2, '2025-03-02'))
+        persistence = Persistence(str(tmp_path), [collection])
+        persistence.recover({'diet_plans': 3})
+        collection.insert(plan(3, '2025-03-01'))
+        collection.drop(['2025-03-01'])
+        persistence.close(snapshot=False)
+
+        collection = plans()
+        persistence = Persistence(str(tmp_path), [collection])
+        persistence.recover({'diet_plans': 1})
+        assert [p.id for p in collection] == [2]
+        assert collection.days == ['2025-03-02']
+        persistence.close(snapshot=False)
+
+
+class TestDateEndpoints:
+    """Test date validation and range queries on the API"""
+
+    def create_plans(self, client, auth_headers, days):
+        for day in days:
+            response = client.post("/diet-plans", json={"customerId": 1, "date": day, "meals": []}, headers=auth_headers)
+            assert response.status_code == status.HTTP_201_CREATED
+
+    def test_dates_are_validated(self, client, auth_headers):
+        """Test that non-dates are rejected and dates are stored as ISO text"""
+        bad = client.post("/diet-plans", json={"customerId": 1, "date": "17/11/2025"}, headers=auth_headers)
+        assert bad.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        bad = client.post("/production-batches", json={"productionDate": "2025-02-30"}, headers=auth_headers)
+        assert bad.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        created = client.post("/diet-plans", json={"customerId": 1, "date": "2025-03-01"}, headers=auth_headers)
+        assert created.json()["date"] == "2025-03-01"
+        patched = client.patch(f"/diet-plans/{created.json()['id']}", json={"date": "2025-03-04"},
+                               headers={**auth_headers, "Content-Type": main.MERGE_PATCH})
+        assert patched.json()["date"] == "2025-03-04"
+        assert "2025-03-04" in main.diet_plans.days and "2025-03-01" not in main.diet_plans.days
+
+    def test_diet_plan_range(self, client, auth_headers):
+        """Test from/to on the diet plan list, alone and with a customer"""
+        self.create_plans(client, auth_headers, ["2025-03-01", "2025-03-02", "2025-03-03"])
+        response = client.get("/diet-plans?from=2025-03-02&to=2025-03-03", headers=auth_headers)
+        assert [p["date"] for p in response.json()] == ["2025-03-02", "2025-03-03"]
+        response = client.get("/diet-plans?customerId=1&to=2025-03-01", headers=auth_headers)
+        assert [p["date"] for p in response.json()] == ["2025-03-01"]
+        everything = client.get("/diet-plans", headers=auth_headers)
+        assert len(everything.json()) == 4
+        assert everything.headers["etag"] != response.headers["etag"]
+        reversed_range = client.get("/diet-plans?from=2025-03-03&to=2025-03-01", headers=auth_headers)
+        assert reversed_range.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_production_batch_range(self, client, auth_headers):
+        """Test from/to on the production batch list"""
+        client.post("/production-batches", json={"productionDate": "2025-03-01"}, headers=auth_headers)
+        response = client.get("/production-batches?from=2025-03-01&to=2025-03-31", headers=auth_headers)
+        assert [b["productionDate"] for b in response.json()] == ["2025-03-01"]
+
+
+class TestRetentionEndpoint:
+    """Test POST /admin/retention"""
+
+    def test_drops_old_days(self, client, auth_headers):
+        """Test that plans and batches before the cutoff are dropped from RAM"""
+        TestDateEndpoints().create_plans(client, auth_headers, ["2001-03-01", "2001-03-01", "2001-03-02"])
+        response = client.post("/admin/retention?before=2001-03-02", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {
+            "before": "2001-03-02", "archived": False,
+            "diet_plans": {"days": 1, "records": 2, "segments": 0},
+            "production_batches": {"days": 0, "records": 0, "segments": 0},
+        }
+        assert main.diet_plans.days[0] == "2001-03-02"
+        assert main.plan_index.customer_plans(1) & {2, 3, 4} == {4}
+
+    def test_default_cutoff_and_no_archive(self, client, auth_headers, monkeypatch):
+        """Test the DIET_API_RETENTION_DAYS default and dropping without an archive"""
+        monkeypatch.setattr(main, "RETENTION_DAYS", 0)
+        assert client.post("/admin/retention", headers=auth_headers).status_code == status.HTTP_400_BAD_REQUEST
+        assert client.post("/admin/retention?before=2025-01-01&archive=true",
+                           headers=auth_headers).status_code == status.HTTP_400_BAD_REQUEST
+        monkeypatch.setattr(main, "RETENTION_DAYS", 1)
+        response = client.post("/admin/retention", headers=auth_headers)
+        assert response.json()["archived"] is False
+        assert response.json()["production_batches"] == {"days": 1, "records": 1, "segments": 0}
+        assert len(main.diet_plans) == 0
+
+    def test_requires_admin(self, client, auth_headers):
+        """Test that only admin users may drop data"""
+        client.post("/register", json={"username": "keeper", "password": "pw"})
+        token = client.post("/login", data={"username": "keeper", "password": "pw"}).json()["access_token"]
+        response = client.post("/admin/retention?before=2025-01-01", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == status.HTTP_403_FORBIDDEN
@@ -0,0 +1,204 @@
+"""
+Unit tests for partial updates and optimistic concurrency
+Coverage: JSON Merge Patch, PATCH endpoints, field-level change detection, ETag / If-Match
+"""
+import pytest
+from fastapi import status
+
+import main
+from patch import merge_patch
+from records import RecipeRecord
+from store import Collection
+
+MERGE_PATCH = {"Content-Type": "application/merge-patch+json"}
+NUTRITION = {"calories": 500, "protein": 25, "carbs": 60, "fat": 15}
+
+
+@pytest.fixture
+def customer_id(client, auth_headers):
+    response = client.post("/customers", json={
+        "name": "Patchy", "email": "patchy@example.com", "phone": "555-0101",
+        "restrictions": [{"type": "Allergy", "description": "Peanuts"}],
+        "goal": {"calories": 2000, "protein": 100, "carbs": 250, "fat": 70}
+    }, headers=auth_headers)
+    return response.json()["id"]
+
+
+@pytest.fixture
+def recipe_id(client, auth_headers):
+    response = client.post("/recipes", json={
+        "name": "Patch Bowl", "ingredients": ["rice"], "nutrition": NUTRITION
+    }, headers=auth_headers)
+    return response.json()["id"]
+
+
+def patch(client, auth_headers, path, body, **headers):
+    return client.patch(path, json=body, headers={**auth_headers, **MERGE_PATCH, **headers})
+
+
+class TestMergePatch:
+    """Test RFC 7386 merge semantics"""
+
+    @pytest.mark.parametrize('target, patch_doc, expected', [
+        ({"a": "b"}, {"a": "c"}, {"a": "c"}),
+        ({"a": "b"}, {"b": "c"}, {"a": "b", "b": "c"}),
+        ({"a": "b"}, {"a": None}, {}),
+        ({"a": [{"b": "c"}]}, {"a": [1]}, {"a": [1]}),
+        ({"a": {"b": "c", "d": "e"}}, {"a": {"b": None, "f": 1}}, {"a": {"d": "e", "f": 1}}),
+        ({"a": "b"}, ["c"], ["c"]),
+        ("text", {"a": {"b": None}}, {"a": {}}),
+    ])
+    def test_rfc_examples(self, target, patch_doc, expected):
+        """Test examples from the RFC"""
+        assert merge_patch(target, patch_doc) == expected
+
+    def test_inputs_are_not_modified(self):
+        """Test that neither document is mutated"""
+        target = {"goal": {"calories": 1}}
+        merge_patch(target, {"goal": {"calories": 2}})
+        assert target == {"goal": {"calories": 1}}
+
+
+class TestPatchEndpoints:
+    """Test PATCH on customers, recipes and diet plans"""
+
+    def test_patch_customer(self, client, auth_headers, customer_id):
+        """Test that nested fields merge and other fields are kept"""
+        response = patch(client, auth_headers, f"/customers/{customer_id}",
+                         {"goal": {"calories": 1800}, "phone": None})
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["goal"] == {"calories": 1800, "protein": 100, "carbs": 250, "fat": 70}
+        assert data["phone"] == ""
+        assert data["name"] == "Patchy"
+        assert data["restrictions"] == [{"type": "Allergy", "description": "Peanuts"}]
+
+    def test_patch_recipe(self, client, auth_headers, recipe_id):
+        """Test that arrays are replaced"""
+        response = patch(client, auth_headers, f"/recipes/{recipe_id}", {"ingredients": ["quinoa", "kale"]})
+        assert response.json()["ingredients"] == ["quinoa", "kale"]
+        assert response.json()["nutrition"] == NUTRITION
+        found = client.get("/recipes/search?ingredient=kale", headers=auth_headers).json()
+        assert recipe_id in [r["id"] for r in found]
+
+    def test_patch_diet_plan(self, client, auth_headers, customer_id, recipe_id):
+        """Test moving a plan to another day and customer"""
+        plan_id = client.post("/diet-plans", json={
+            "customerId": 2, "date": "2025-05-01",
+            "meals": [{"type": "LUNCH", "recipeId": recipe_id, "portion": 1}]
+        }, headers=auth_headers).json()["id"]
+        response = patch(client, auth_headers, f"/diet-plans/{plan_id}",
+                         {"date": "2025-05-02", "customerId": customer_id})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["meals"] == [{"type": "LUNCH", "recipeId": recipe_id, "portion": 1}]
+        plans = client.get(f"/diet-plans?customerId={customer_id}", headers=auth_headers).json()
+        assert [p["date"] for p in plans] == ["2025-05-02"]
+        adherence = client.get(f"/customers/{customer_id}/adherence?from=2025-05-02&to=2025-05-02",
+                               headers=auth_headers).json()
+        assert adherence["days"][0]["total_nutrition"]["calories"] == 500
+
+        response = patch(client, auth_headers, f"/diet-plans/{plan_id}", {"customerId": 999})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_invalid_patches(self, client, auth_headers, customer_id):
+        """Test that the patched document must still be valid"""
+        response = patch(client, auth_headers, f"/customers/{customer_id}", {"name": None})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        response = patch(client, auth_headers, f"/customers/{customer_id}", {"goal": {"fat": "lots"}})
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert client.get(f"/customers/{customer_id}", headers=auth_headers).json()["name"] == "Patchy"
+
+    def test_not_found(self, client, auth_headers):
+        """Test patching missing records"""
+        for path in ("/customers/999", "/recipes/999", "/diet-plans/999"):
+            assert patch(client, auth_headers, path, {"name": "x"}).status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestChangeDetection:
+    """Test that only changed fields are written and reported"""
+
+    def test_collection_diff(self):
+        """Test that listeners see only changed slots and no-op updates notify nobody"""
+        recipes = Collection('recipes', RecipeRecord, [RecipeRecord(1, 'A', ('rice',), (1, 2, 3, 4))])
+        seen = []
+        recipes.listeners.append(lambda c, op, r: seen.append((op, c.changes, c.changed(op, 'nutrition'))))
+
+        recipes.update(1, RecipeRecord.fields('A', ['rice'], (1, 2, 3, 4)))
+        assert seen == []
+        assert recipes.version(1) == 1
+
+        recipes.update(1, RecipeRecord.fields('B', ['rice'], (1, 2, 3, 4)))
+        assert seen == [('update', {'name': 'B'}, False)]
+        assert recipes.changes is None
+        assert recipes.version(1) == 2
+
+        recipes.delete(1)
+        assert seen[-1] == ('delete', None, True)
+        assert recipes.versions == {}
+
+    def test_rename_keeps_cached_totals(self, client, auth_headers, customer_id, recipe_id):
+        """Test that renaming a recipe does not drop nutrition caches, changing nutrition does"""
+        client.post("/diet-plans", json={
+            "customerId": customer_id, "date": "2025-05-01",
+            "meals": [{"type": "LUNCH", "recipeId": recipe_id, "portion": 1}]
+        }, headers=auth_headers)
+        query = f"/customers/{customer_id}/adherence?from=2025-05-01&to=2025-05-01"
+        client.get(query, headers=auth_headers)
+        assert (customer_id, "2025-05-01") in main.daily_totals.cache
+
+        patch(client, auth_headers, f"/recipes/{recipe_id}", {"name": "Renamed Bowl"})
+        assert (customer_id, "2025-05-01") in main.daily_totals.cache
+
+        patch(client, auth_headers, f"/recipes/{recipe_id}", {"nutrition": {"calories": 450}})
+        assert (customer_id, "2025-05-01") not in main.daily_totals.cache
+        days = client.get(query, headers=auth_headers).json()["days"]
+        assert days[0]["total_nutrition"]["calories"] == 450
+
+
+class TestOptimisticConcurrency:
+    """Test ETag and If-Match"""
+
+    def test_etag_changes_only_on_real_updates(self, client, auth_headers, customer_id):
+        """Test that the ETag moves with each effective write"""
+        etag = client.get(f"/customers/{customer_id}", headers=auth_headers).headers["ETag"]
+        response = patch(client, auth_headers, f"/customers/{customer_id}", {"name": "Patchy"})
+        assert response.headers["ETag"] == etag
+        response = patch(client, auth_headers, f"/customers/{customer_id}", {"name": "Renamed"})
+        assert response.headers["ETag"] != etag
+        assert client.get(f"/customers/{customer_id}", headers=auth_headers).headers["ETag"] == \
+            response.headers["ETag"]
+
+    def test_if_match_prevents_lost_updates(self, client, auth_headers, recipe_id):
+        """Test that a write based on a stale ETag is refused"""
+        etag = client.get(f"/recipes/{recipe_id}", headers=auth_headers).headers["ETag"]
+        first = patch(client, auth_headers, f"/recipes/{recipe_id}", {"name": "First"}, **{"If-Match": etag})
+        assert first.status_code == status.HTTP_200_OK
+        second = patch(client, auth_headers, f"/recipes/{recipe_id}", {"name": "Second"}, **{"If-Match": etag})
+        assert second.status_code == status.HTTP_412_PRECONDITION_FAILED
+        assert client.get(f"/recipes/{recipe_id}", headers=auth_headers).json()["name"] == "First"
+
+        body = {"name": "Put", "ingredients": [], "nutrition": NUTRITION}
+        response = client.put(f"/recipes/{recipe_id}", json=body, headers={**auth_headers, "If-Match": etag})
+        assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+        current = f'"x", {first.headers["ETag"]}'
+        response = client.put(f"/recipes/{recipe_id}", json=body, headers={**auth_headers, "If-Match": current})
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_if_match_on_delete(self, client, auth_headers, customer_id, recipe_id):
+        """Test conditional deletes, including the '*' wildcard"""
+        plan_id = client.post("/diet-plans", json={"customerId": customer_id, "date": "2025-05-01"},
+                              headers=auth_headers).json()["id"]
+        for path in (f"/customers/{customer_id}", f"/recipes/{recipe_id}", f"/diet-plans/{plan_id}"):
+            response = client.delete(path, headers={**auth_headers, "If-Match": '"stale"'})
+            assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+        response = client.delete(f"/diet-plans/{plan_id}", headers={**auth_headers, "If-Match": "*"})
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_put_diet_plan_etag(self, client, auth_headers):
+        """Test that PUT returns the new ETag"""
+        plan = client.post("/diet-plans", json={"customerId": 2, "date": "2025-05-01"}, headers=auth_headers).json()
+        etag = client.get(f"/diet-plans/{plan['id']}", headers=auth_headers).headers["ETag"]
+        response = client.put(f"/diet-plans/{plan['id']}", json={**plan, "date": "2025-12-01"},
+                              headers={**auth_headers, "If-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["ETag"] != etag
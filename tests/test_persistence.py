@@ -0,0 +1,305 @@
+"""
+Unit tests for the write-ahead log and snapshots
+Coverage: framing, group commit, recovery, snapshot rotation, durable responses,
+app integration
+"""
+import asyncio
+import os
+import threading
+
+import pytest
+from fastapi import status
+
+from persistence import SNAPSHOT_FILE, DurableWritesMiddleware, Persistence, WriteAheadLog, encode_frame, read_frames
+from records import CustomerRecord, DietPlanRecord, ProductionBatchRecord, RecipeRecord
+from store import Collection
+
+GOAL = (1800, 90, 200, 60)
+
+
+def customer(id, name):
+    return CustomerRecord(id, **CustomerRecord.fields(name, f'{name}@example.com', '', [], GOAL))
+
+
+def recipe(id, name):
+    return RecipeRecord(id, **RecipeRecord.fields(name, ['water'], (10, 1, 1, 0)))
+
+
+def empty_collections():
+    return [Collection('customers', CustomerRecord), Collection('recipes', RecipeRecord)]
+
+
+def make_collections():
+    customers, recipes = empty_collections()
+    customers.insert(customer(1, 'Alma'))
+    return [customers, recipes]
+
+
+class TestWriteAheadLog:
+    """Test log framing and group commit"""
+
+    def test_frames_roundtrip(self, tmp_path):
+        """Test that appended entries are read back in order"""
+        wal = WriteAheadLog(str(tmp_path))
+        wal.append('customers', 'insert', {'id': 1, 'name': 'Alma'})
+        wal.append('customers', 'delete', 1)
+        wal.close()
+
+        entries = read_frames(str(tmp_path / 'wal-00000000000000000001.log'))
+        assert entries == [
+            [1, 'customers', 'insert', {'id': 1, 'name': 'Alma'}],
+            [2, 'customers', 'delete', 1],
+        ]
+
+    def test_torn_tail_is_ignored(self, tmp_path):
+        """Test that a partially written last frame does not break replay"""
+        path = tmp_path / 'wal-00000000000000000001.log'
+        frame = encode_frame([1, 'customers', 'delete', 1])
+        path.write_bytes(frame + encode_frame([2, 'customers', 'delete', 2])[:-3])
+        assert read_frames(str(path)) == [[1, 'customers', 'delete', 1]]
+
+    def test_corrupt_frame_stops_replay(self, tmp_path):
+        """Test that a checksum mismatch ends the readable log"""
+        path = tmp_path / 'wal-00000000000000000001.log'
+        frame = bytearray(encode_frame([1, 'customers', 'delete', 1]))
+        frame[-1] ^= 0xFF
+        path.write_bytes(bytes(frame))
+        assert read_frames(str(path)) == []
+
+    def test_concurrent_appends_group_commit(self, tmp_path):
+        """Test that concurrent writers all become durable with unique seqs"""
+        wal = WriteAheadLog(str(tmp_path))
+        seqs = []
+
+        def writer(n):
+            for i in range(50):
+                seqs.append(wal.append('recipes', 'delete', n * 100 + i))
+                wal.wait(seqs[-1])
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert wal.durable_seq == 400
+        wal.close()
+
+        assert sorted(seqs) == list(range(1, 401))
+        entries = read_frames(str(tmp_path / 'wal-00000000000000000001.log'))
+        assert [e[0] for e in entries] == list(range(1, 401))
+
+    def test_async_mode_flush(self, tmp_path):
+        """Test that non-sync appends are durable after flush"""
+        wal = WriteAheadLog(str(tmp_path), sync=False)
+        wal.append('recipes', 'delete', 1)
+        wal.flush()
+        assert wal.durable_seq == 1
+        wal.close()
+
+    def test_append_after_close_fails(self, tmp_path):
+        """Test that a closed log rejects writes"""
+        wal = WriteAheadLog(str(tmp_path))
+        wal.close()
+        with pytest.raises(RuntimeError):
+            wal.append('recipes', 'delete', 1)
+
+
+class TestPersistence:
+    """Test recovery and snapshotting of collections"""
+
+    def test_first_start_snapshots_current_data(self, tmp_path):
+        """Test that an empty directory keeps the seed data"""
+        customers, recipes = make_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        counters = persistence.recover({'customers': 2, 'recipes': 1})
+        assert counters == {'customers': 2, 'recipes': 1}
+        assert (tmp_path / SNAPSHOT_FILE).exists()
+        persistence.close(snapshot=False)
+
+        customers, recipes = empty_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        persistence.recover({'customers': 1, 'recipes': 1})
+        assert customers.get(1) == customer(1, 'Alma')
+        persistence.close(snapshot=False)
+
+    def test_replay_after_crash(self, tmp_path):
+        """Test that logged mutations survive without a final snapshot"""
+        customers, recipes = make_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        persistence.recover({'customers': 2, 'recipes': 1})
+        customers.insert(customer(2, 'Felicia'))
+        customers.update(1, {'name': 'Alma B'})
+        recipes.insert(recipe(7, 'Soup'))
+        recipes.delete(7)
+        persistence.close(snapshot=False)
+
+        customers, recipes = empty_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        counters = persistence.recover({'customers': 1, 'recipes': 1})
+        assert [c.name for c in customers] == ['Alma B', 'Felicia']
+        assert len(recipes) == 0
+        assert counters == {'customers': 3, 'recipes': 8}
+        persistence.close(snapshot=False)
+
+    def test_snapshot_drops_old_segments(self, tmp_path):
+        """Test that a snapshot supersedes earlier log segments"""
+        customers, recipes = make_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        persistence.recover({'customers': 2, 'recipes': 1})
+        customers.insert(customer(2, 'Felicia'))
+        persistence.snapshot()
+        customers.insert(customer(3, 'Vielrizki'))
+        persistence.close(snapshot=False)
+
+        segments = sorted(n for n in os.listdir(tmp_path) if n.startswith('wal-'))
+        assert segments == ['wal-00000000000000000002.log']
+
+        customers, recipes = empty_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        persistence.recover({'customers': 1, 'recipes': 1})
+        assert [c.id for c in customers] == [1, 2, 3]
+        persistence.close()
+
+    def test_snapshot_serializes_without_locks(self, tmp_path, monkeypatch):
+        """Test that writes can proceed while a snapshot serializes, and recovery still has them"""
+        customers, recipes = make_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        persistence.recover({'customers': 2, 'recipes': 1})
+        to_state = CustomerRecord.to_state
+        writers = []
+
+        def write_meanwhile(record):
+            if not writers:
+                writers.append(threading.Thread(target=lambda: (customers.insert(customer(2, 'Felicia')),
+                                                                customers.delete(1))))
+                writers[0].start()
+                writers[0].join(5)
+                assert not writers[0].is_alive()  # the collection lock is free while serializing
+            return to_state(record)
+
+        monkeypatch.setattr(CustomerRecord, 'to_state', write_meanwhile)
+        persistence.snapshot()
+        monkeypatch.undo()
+        persistence.close(snapshot=False)
+
+        customers, recipes = empty_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        persistence.recover({'customers': 1, 'recipes': 1})
+        assert [c.id for c in customers] == [2]
+        persistence.close(snapshot=False)
+
+    def test_clear_is_logged(self, tmp_path):
+        """Test that clearing a collection is replayed"""
+        customers, recipes = make_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        persistence.recover({'customers': 2, 'recipes': 1})
+        customers.clear()
+        persistence.close(snapshot=False)
+
+        customers, recipes = make_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        persistence.recover({'customers': 2, 'recipes': 1})
+        assert len(customers) == 0
+        persistence.close(snapshot=False)
+
+    def test_periodic_snapshot(self, tmp_path):
+        """Test that a snapshot is taken every `snapshot_every` mutations"""
+        customers, recipes = make_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes], snapshot_every=5)
+        persistence.recover({'customers': 2, 'recipes': 1})
+        for i in range(2, 8):
+            customers.insert(customer(i, f'c{i}'))
+        persistence._snapshot_thread.join()
+        persistence.close(snapshot=False)
+
+        segments = [n for n in os.listdir(tmp_path) if n.startswith('wal-')]
+        assert 'wal-00000000000000000001.log' not in segments
+
+    def test_invalid_snapshot_file(self, tmp_path):
+        """Test that a foreign snapshot file is rejected"""
+        (tmp_path / SNAPSHOT_FILE).write_bytes(b'not a snapshot')
+        persistence = Persistence(str(tmp_path), make_collections())
+        with pytest.raises(ValueError):
+            persistence.recover({})
+
+
+class TestDurableWrites:
+    """Test that requests wait for their fsync after releasing the collection locks"""
+
+    def test_response_waits_for_shared_fsync(self, tmp_path, monkeypatch):
+        """Test that writes in a request only queue, share fsyncs and are durable before the response"""
+        customers, recipes = make_collections()
+        persistence = Persistence(str(tmp_path), [customers, recipes])
+        persistence.recover({'customers': 2, 'recipes': 1})
+        gate = threading.Event()
+        real_fsync = os.fsync
+        monkeypatch.setattr(os, 'fsync', lambda fd: gate.wait() or real_fsync(fd))
+        sent = []
+
+        async def app(scope, receive, send):
+            for i in range(1, 11):
+                recipes.insert(recipe(i, f'R{i}'))  # the first fsync is held: inserts must not wait for it
+            gate.set()
+            await send({'type': 'http.response.start', 'status': 201, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def send(message):
+            sent.append((message['type'], persistence.wal.durable_seq))
+
+        asyncio.run(DurableWritesMiddleware(app)({'type': 'http'}, None, send))
+        assert sent == [('http.response.start', 10), ('http.response.body', 10)]
+        assert persistence.wal.fsyncs <= 2
+        persistence.close(snapshot=False)
+
+
+class TestAppPersistence:
+    """Test that API handlers write through the log"""
+
+    def test_handlers_are_logged(self, client, auth_headers, reset_data, tmp_path):
+        """Test that mutations made through the API are recovered"""
+        import main
+        main.enable_persistence(str(tmp_path))
+        try:
+            new_recipe = {
+                "name": "Logged Recipe",
+                "nutrition": {"calories": 100, "protein": 5, "carbs": 10, "fat": 2}
+            }
+            response = client.post("/recipes", json=new_recipe, headers=auth_headers)
+            assert response.status_code == status.HTTP_201_CREATED
+            client.delete("/customers/3", headers=auth_headers)
+        finally:
+            main.disable_persistence()
+
+        collections = [
+            Collection('customers', CustomerRecord),
+            Collection('recipes', RecipeRecord),
+            Collection('diet_plans', DietPlanRecord),
+            Collection('production_batches', ProductionBatchRecord),
+        ]
+        persistence = Persistence(str(tmp_path), collections)
+        counters = persistence.recover({})
+        assert collections[1].get(4).name == 'Logged Recipe'
+        assert collections[2].get(1) == main.diet_plans.get(1)
+        assert 3 not in collections[0]
+        assert counters['recipes'] == 5
+        persistence.close(snapshot=False)
+
+    def test_recovery_is_not_published(self, client, auth_headers, reset_data, tmp_path):
+        """Test that replaying the log adds nothing to the change feed, and writes after it still do"""
+        import main
+        main.enable_persistence(str(tmp_path))
+        try:
+            for n in range(20):
+                client.post("/recipes", json={"name": f"R{n}", "nutrition": {
+                    "calories": 1, "protein": 1, "carbs": 1, "fat": 1}}, headers=auth_headers)
+        finally:
+            main.persistence.close(snapshot=False)
+            main.persistence = None
+        seq = main.change_feed.seq
+        main.enable_persistence(str(tmp_path))
+        try:
+            assert len(main.recipes) >= 20 and main.change_feed.seq == seq
+            client.delete("/recipes/1", headers=auth_headers)
+            assert main.change_feed.seq == seq + 1
+        finally:
+            main.disable_persistence()
@@ -157,6 +157,14 @@ class TestProductionBatches:
         }
         response = client.post("/production-batches", json=invalid_batch, headers=auth_headers)
         assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_production_batch_ids_out_of_range(self, client, auth_headers, reset_data):
+        """Test that ids and portions beyond int64 are a 422, not a server error"""
+        for plans, line in (([2**63], {"recipeId": 1, "portions": 1}), ([1], {"recipeId": 2**63, "portions": 1}),
+                            ([1], {"recipeId": 1, "portions": 2**63}), ([1], {"recipeId": 1, "portions": -1})):
+            batch = {"productionDate": "2025-12-20", "dietPlans": plans, "recipeBatches": [line]}
+            response = client.post("/production-batches", json=batch, headers=auth_headers)
+            assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
     
     def test_production_batch_business_rule_bc4(self, client, auth_headers, reset_data):
         """Test BC4: Daily Production Fulfillment"""
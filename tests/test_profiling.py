@@ -0,0 +1,146 @@
+"""
+Unit tests for the sampling profiler and request tracing
+Coverage: collapsed stacks, ring buffer, admin-only debug endpoints
+"""
+import threading
+import time
+
+import pytest
+from fastapi import status
+
+from profiling import Profiler, Tracer, sample_stacks
+
+
+@pytest.fixture
+def tracing():
+    """Trace every request for the duration of a test"""
+    import main
+    main.tracer.configure(1.0)
+    main.tracer.clear()
+    yield main.tracer
+    main.tracer.configure(0.0)
+    main.tracer.clear()
+
+
+@pytest.fixture
+def user_headers(client, reset_data):
+    """Authorization headers of a registered non-admin user"""
+    client.post("/register", json={"username": "cook", "password": "pass123"})
+    response = client.post("/login", data={"username": "cook", "password": "pass123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+class TestSampler:
+    """Test stack sampling"""
+
+    def test_collapsed_stacks_include_busy_thread(self):
+        """Test that a spinning thread shows up root-first"""
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_loop, args=(stop,), name='busy')
+        worker.start()
+        try:
+            counts = sample_stacks(0.05, 0.005)
+        finally:
+            stop.set()
+            worker.join()
+        busy = [stack for stack in counts if stack.startswith('busy;')]
+        assert busy
+        assert any(stack.endswith('busy_loop (test_profiling.py)') for stack in busy)
+        assert all(n > 0 for n in counts.values())
+
+    def test_one_session_at_a_time(self):
+        """Test that a concurrent profile request is refused"""
+        profiler = Profiler()
+        results = []
+        worker = threading.Thread(target=lambda: results.append(profiler.profile(0.2, 0.01)))
+        worker.start()
+        while not profiler.running:
+            time.sleep(0.001)
+        assert profiler.profile(0.01, 0.01) is None
+        worker.join()
+        assert results[0]
+
+
+class TestTracer:
+    """Test the trace ring buffer"""
+
+    def test_sampling_and_capacity(self):
+        """Test that only sampled traces are kept, newest `capacity` of them"""
+        tracer = Tracer(0.0, capacity=2)
+        assert tracer.start('GET', '/x') is None
+
+        tracer.configure(1.0)
+        for i in range(3):
+            trace = tracer.start('GET', f'/r{i}')
+            trace.add('store_lookup', trace.start_ns, trace.start_ns + 2000)
+            tracer.finish(trace, 200, 5000)
+        dump = tracer.dump()
+        assert [t['route'] for t in dump] == ['/r1', '/r2']
+        assert dump[0]['spans'] == [{'name': 'lookup', 'op': 'store_lookup', 'start_us': 0.0, 'duration_us': 2.0}]
+        assert [t['route'] for t in tracer.dump(1)] == ['/r2']
+        assert tracer.dump(0) == []
+
+
+class TestDebugEndpoints:
+    """Test the admin-only debug endpoints"""
+
+    def test_profile_returns_collapsed_stacks(self, client, auth_headers):
+        """Test that the profile endpoint returns `stack count` lines"""
+        response = client.get("/debug/profile?seconds=0.05&interval_ms=5", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/plain")
+        lines = response.text.splitlines()
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            assert ';' in stack and int(count) > 0
+
+    def test_profile_rejects_long_sessions(self, client, auth_headers):
+        """Test that the duration is bounded"""
+        response = client.get("/debug/profile?seconds=600", headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_profile_conflict(self, client, auth_headers):
+        """Test that overlapping profiles are refused"""
+        import main
+        assert main.profiler._lock.acquire()
+        try:
+            response = client.get("/debug/profile?seconds=0.01", headers=auth_headers)
+        finally:
+            main.profiler._lock.release()
+        assert response.status_code == status.HTTP_409_CONFLICT
+
+    def test_debug_requires_admin(self, client, user_headers):
+        """Test that non-admin users cannot profile or read traces"""
+        assert client.get("/debug/profile?seconds=0.01", headers=user_headers).status_code == 403
+        assert client.get("/debug/traces", headers=user_headers).status_code == 403
+        assert client.get("/debug/traces").status_code == 401
+
+    def test_traced_request_spans(self, client, auth_headers, tracing):
+        """Test auth, lookup, compute and serialize spans of a sampled request"""
+        client.post("/diet-plans/1/validate", headers=auth_headers)
+        response = client.get("/debug/traces?clear=true", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        traces = [t for t in response.json()["traces"] if t["route"] == "/diet-plans/{plan_id}/validate"]
+        assert len(traces) == 1
+        trace = traces[0]
+        assert trace["method"] == "POST" and trace["status"] == 200
+        names = {span["name"] for span in trace["spans"]}
+        assert {"auth", "lookup", "compute", "serialize"} <= names
+        for span in trace["spans"]:
+            assert 0 <= span["start_us"] <= trace["duration_us"]
+        assert [t['route'] for t in tracing.dump()] == ['/debug/traces']
+
+    def test_set_sample_rate(self, client, auth_headers, tracing):
+        """Test changing the sample rate at runtime"""
+        response = client.put("/debug/traces/sample-rate?rate=0", headers=auth_headers)
+        assert response.json() == {"sample_rate": 0.0}
+        client.get("/customers", headers=auth_headers)
+        traces = client.get("/debug/traces", headers=auth_headers).json()["traces"]
+        assert "/customers" not in [t["route"] for t in traces]
+        assert client.put("/debug/traces/sample-rate?rate=2", headers=auth_headers).status_code == 422
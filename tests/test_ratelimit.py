@@ -0,0 +1,181 @@
+"""
+Unit tests for per-user rate limiting and admission control
+Coverage: spec parsing, token buckets, bucket pruning, admission gate, 429/503 responses, metrics
+"""
+import pytest
+from fastapi import status
+
+import ratelimit
+from ratelimit import AdmissionGate, Limit, RateLimiter, parse_limit, parse_spec
+from tests.test_metrics import sample
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def limits():
+    """Configure the app's limiter and gate for one test, then switch them off"""
+    def configure(rates='', concurrency=''):
+        ratelimit.rate_limiter.configure(rates)
+        ratelimit.admission.configure(concurrency)
+    yield configure
+    configure()
+
+
+class TestSpec:
+    """Test limit spec parsing"""
+
+    def test_parse(self):
+        """Test default and per-route entries"""
+        default, routes = parse_spec(' *=20:40, get /diet-plans=2:5 ,')
+        assert default == '20:40'
+        assert routes == {('GET', '/diet-plans'): '2:5'}
+        assert parse_spec('') == (None, {})
+
+    def test_limits(self):
+        """Test rate:burst with the burst defaulting to one second of rate"""
+        assert parse_limit('2:5') == Limit(2.0, 5)
+        assert parse_limit('0.5') == Limit(0.5, 1)
+        assert parse_limit('10') == Limit(10.0, 10)
+
+    def test_invalid(self):
+        """Test malformed entries"""
+        with pytest.raises(ValueError):
+            parse_spec('20')
+        with pytest.raises(ValueError):
+            RateLimiter().configure('*=fast')
+
+
+class TestRateLimiter:
+    """Test token buckets"""
+
+    def test_burst_then_refill(self, clock):
+        """Test that a burst is allowed, then requests wait for refill"""
+        limiter = RateLimiter()
+        limiter.configure('GET /x=2:3')
+        route = ('GET', '/x')
+        assert [limiter.acquire('ana', route) for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert limiter.acquire('ana', route) == pytest.approx(0.5)
+        clock.now += 0.5
+        assert limiter.acquire('ana', route) == 0.0
+        assert limiter.limited == {route: 1}
+
+    def test_keys_are_independent(self, clock):
+        """Test that users and routes have their own buckets, unlimited routes none"""
+        limiter = RateLimiter()
+        limiter.configure('*=1:1')
+        assert limiter.acquire('ana', ('GET', '/x')) == 0.0
+        assert limiter.acquire('ana', ('GET', '/x')) > 0
+        assert limiter.acquire('ben', ('GET', '/x')) == 0.0
+        assert limiter.acquire('ana', ('POST', '/x')) == 0.0
+
+        limiter.configure('GET /y=1:1')
+        assert all(limiter.acquire('ana', ('GET', '/x')) == 0.0 for _ in range(5))
+        assert limiter.buckets == {}
+
+    def test_zero_rate(self, clock):
+        """Test that a zero refill rate only allows the burst"""
+        limiter = RateLimiter()
+        limiter.configure('*=0:1')
+        assert limiter.acquire('ana', ('GET', '/x')) == 0.0
+        assert limiter.acquire('ana', ('GET', '/x')) == 60.0
+
+    def test_idle_buckets_are_pruned(self, clock):
+        """Test that full buckets are dropped once the bucket table is full"""
+        limiter = RateLimiter(max_buckets=2)
+        limiter.configure('*=1:1')
+        limiter.acquire('ana', ('GET', '/x'))
+        clock.now += 5
+        limiter.acquire('ben', ('GET', '/x'))
+        limiter.acquire('cy', ('GET', '/x'))
+        assert {user for user, _ in limiter.buckets} == {'ben', 'cy'}
+
+
+class TestAdmissionGate:
+    """Test the in-flight caps"""
+
+    def test_global_and_route_caps(self):
+        """Test that requests over either cap are rejected and counted"""
+        gate = AdmissionGate()
+        gate.configure('*=3,GET /slow=1')
+        slow, fast = ('GET', '/slow'), ('GET', '/fast')
+        assert gate.enter(slow)
+        assert not gate.enter(slow)
+        assert gate.enter(fast) and gate.enter(fast)
+        assert not gate.enter(fast)
+        gate.leave(slow)
+        assert gate.enter(fast)
+        assert not gate.enter(slow)
+        gate.leave(fast)
+        assert gate.enter(slow)
+        assert gate.rejected == {slow: 2, fast: 1}
+        assert gate.in_flight == 3
+
+    def test_unlimited_by_default(self):
+        """Test that an unconfigured gate admits everything"""
+        gate = AdmissionGate()
+        assert all(gate.enter(('GET', '/x')) for _ in range(100))
+
+
+class TestLoadShedding:
+    """Test 429/503 responses from the app"""
+
+    def test_rate_limited_route(self, client, auth_headers, limits):
+        """Test that a user over a route's limit gets 429 with Retry-After"""
+        limits('GET /customers=0.01:2')
+        codes = [client.get("/customers", headers=auth_headers).status_code for _ in range(3)]
+        assert codes == [200, 200, 429]
+        response = client.get("/customers", headers=auth_headers)
+        assert response.json()["detail"] == "Rate limit exceeded"
+        assert int(response.headers["Retry-After"]) >= 1
+        assert client.get("/recipes", headers=auth_headers).status_code == status.HTTP_200_OK
+
+    def test_limits_are_per_user(self, client, auth_headers, limits):
+        """Test that another user keeps their own budget"""
+        limits('*=0.01:1')
+        client.post("/register", json={
+            "username": "other", "email": "other@example.com", "password": "secret123"
+        })
+        token = client.post("/login", data={"username": "other", "password": "secret123"}).json()["access_token"]
+        assert client.get("/recipes", headers=auth_headers).status_code == status.HTTP_200_OK
+        assert client.get("/recipes", headers=auth_headers).status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        other = {"Authorization": f"Bearer {token}"}
+        assert client.get("/recipes", headers=other).status_code == status.HTTP_200_OK
+
+    def test_admission_sheds_with_503(self, client, auth_headers, limits):
+        """Test that a route at its concurrency cap answers 503"""
+        limits(concurrency='GET /recipes/{recipe_id}=1')
+        route = ('GET', '/recipes/{recipe_id}')
+        assert ratelimit.admission.enter(route)
+        try:
+            response = client.get("/recipes/1", headers=auth_headers)
+        finally:
+            ratelimit.admission.leave(route)
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers["Retry-After"] == "1"
+        assert client.get("/recipes/1", headers=auth_headers).status_code == status.HTTP_200_OK
+
+    def test_metrics(self, client, auth_headers, limits):
+        """Test that limits, rejections and shed requests are exported"""
+        limits('GET /customers=0.01:1', '*=100,GET /recipes/{recipe_id}=0')
+        client.get("/customers", headers=auth_headers)
+        client.get("/customers", headers=auth_headers)
+        text = client.get("/metrics").text
+        assert sample(text, 'diet_api_rate_limited_total', method='GET', route='/customers') == 1
+        assert sample(text, 'diet_api_rate_limit_per_second', route='/customers') == 0.01
+        assert sample(text, 'diet_api_admission_limit', method='*') == 100
+        assert sample(text, 'diet_api_requests_total', method='GET', route='/customers', status='429') >= 1
+        assert 'diet_api_admission_in_flight 1' in text
@@ -2,9 +2,15 @@
 Unit tests for recipe endpoints
 Coverage: CRUD operations, authentication, validation, edge cases
 """
+import threading
+
 import pytest
 from fastapi import status
 
+from records import RecipeRecord
+from search import RecipeIndex
+from store import Collection
+
 
 class TestRecipes:
     """Test recipe management endpoints"""
@@ -205,3 +211,108 @@ class TestRecipes:
         assert response.status_code == status.HTTP_201_CREATED
         data = response.json()
         assert data["nutrition"]["calories"] == 0
+
+
+class TestRecipeSearch:
+    """Test recipe search by ingredient and nutrition range"""
+    
+    def test_search_by_ingredient(self, client, auth_headers, reset_data):
+        """Test that ingredient tokens match inside multi-word ingredients"""
+        response = client.get("/recipes/search?ingredient=salmon", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert [r["name"] for r in data] == ["Salmon with Vegetables"]
+    
+    def test_search_ingredient_case_insensitive(self, client, auth_headers, reset_data):
+        """Test that ingredient search is normalized"""
+        response = client.get("/recipes/search?ingredient=Salmon%20FILLET", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert [r["id"] for r in response.json()] == [3]
+    
+    def test_search_by_nutrition_range(self, client, auth_headers, reset_data):
+        """Test combining calorie ceiling and protein floor"""
+        response = client.get(
+            "/recipes/search?max_calories=500&min_protein=30",
+            headers=auth_headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert sorted(r["id"] for r in response.json()) == [1, 3]
+    
+    def test_search_ingredient_and_range(self, client, auth_headers, reset_data):
+        """Test intersecting ingredient and nutrition filters"""
+        response = client.get(
+            "/recipes/search?ingredient=salmon&max_calories=400",
+            headers=auth_headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == []
+    
+    def test_search_ranked_by_matching_ingredients(self, client, auth_headers, reset_data):
+        """Test that recipes matching more ingredients rank first"""
+        new_recipe = {
+            "name": "Double Chicken",
+            "ingredients": ["chicken thigh", "chicken stock", "rice"],
+            "nutrition": {"calories": 600, "protein": 50, "carbs": 60, "fat": 15}
+        }
+        client.post("/recipes", json=new_recipe, headers=auth_headers)
+        response = client.get("/recipes/search?ingredient=chicken", headers=auth_headers)
+        assert [r["id"] for r in response.json()] == [4, 1]
+    
+    def test_search_sorted_by_field(self, client, auth_headers, reset_data):
+        """Test explicit ordering by a nutrition field"""
+        response = client.get("/recipes/search?sort=-protein&limit=2", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert [r["id"] for r in response.json()] == [1, 3]
+    
+    def test_search_invalid_sort(self, client, auth_headers, reset_data):
+        """Test that sorting by unknown field fails"""
+        response = client.get("/recipes/search?sort=sugar", headers=auth_headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+    
+    def test_search_reflects_updates_and_deletes(self, client, auth_headers, reset_data):
+        """Test that the indexes follow recipe writes"""
+        new_recipe = {
+            "name": "Tofu Poke",
+            "ingredients": ["tofu", "rice"],
+            "nutrition": {"calories": 380, "protein": 30, "carbs": 40, "fat": 10}
+        }
+        recipe_id = client.post("/recipes", json=new_recipe, headers=auth_headers).json()["id"]
+        new_recipe["ingredients"] = ["salmon", "rice"]
+        client.put(f"/recipes/{recipe_id}", json=new_recipe, headers=auth_headers)
+        response = client.get("/recipes/search?ingredient=salmon&max_calories=400", headers=auth_headers)
+        assert [r["id"] for r in response.json()] == [recipe_id]
+        
+        client.delete(f"/recipes/{recipe_id}", headers=auth_headers)
+        response = client.get("/recipes/search?ingredient=salmon", headers=auth_headers)
+        assert [r["id"] for r in response.json()] == [3]
+    
+    def test_search_without_auth(self, client, reset_data):
+        """Test that recipe search requires authentication"""
+        response = client.get("/recipes/search?ingredient=salmon")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestRecipeIndexConcurrency:
+    """Test the search index under concurrent writes"""
+
+    def test_search_during_writes(self):
+        """Test that searches running alongside inserts and deletes never see a half-updated index"""
+        recipes = Collection('recipes', RecipeRecord)
+        index = RecipeIndex(recipes)
+        recipes.listeners.append(index.on_change)
+        done = threading.Event()
+
+        def writer():
+            for n in range(2000):
+                recipes.insert(RecipeRecord(n % 50, **RecipeRecord.fields('R', ['rice'], (n, 1, 1, 1))))
+                if (n * 7) % 50 in recipes:
+                    recipes.delete((n * 7) % 50)
+            done.set()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        while not done.is_set():
+            index.search(['rice'])
+            index.search(['rice'], sort='-calories')
+        thread.join()
+        assert {r.id for r in index.search(['rice'])} == {r.id for r in recipes}
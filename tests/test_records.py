@@ -0,0 +1,122 @@
+"""
+Unit tests for the compact record types
+Coverage: dict/state roundtrips, interning, API shape at the response boundary
+"""
+from array import array
+
+import pytest
+from fastapi import status
+
+from records import (
+    GOAL_TOLERANCE, MEAL_TYPES, CustomerRecord, DietPlanRecord, ProductionBatchRecord, RecipeRecord,
+)
+
+CUSTOMER = {
+    'id': 7,
+    'name': 'Alma',
+    'email': 'alma@example.com',
+    'phone': '123-456-7890',
+    'restrictions': [{'type': 'Vegan', 'description': 'No animal products'}],
+    'goal': {'calories': 1800, 'protein': 90, 'carbs': 200, 'fat': 60}
+}
+RECIPE = {
+    'id': 8,
+    'name': 'Quinoa Bowl',
+    'ingredients': ['quinoa', 'chickpeas'],
+    'nutrition': {'calories': 420, 'protein': 18, 'carbs': 55, 'fat': 14},
+    'portionGrams': 350
+}
+DIET_PLAN = {
+    'id': 9,
+    'customerId': 7,
+    'date': '2025-11-17',
+    'meals': [
+        {'type': 'BREAKFAST', 'recipeId': 8, 'portion': 1},
+        {'type': 'DINNER', 'recipeId': 3, 'portion': 2}
+    ]
+}
+PRODUCTION_BATCH = {
+    'id': 10,
+    'productionDate': '2025-11-17',
+    'dietPlans': [9],
+    'recipeBatches': [{'recipeId': 8, 'portions': 12}]
+}
+
+
+class TestRecords:
+    """Test record conversions"""
+
+    @pytest.mark.parametrize('record_type, data', [
+        (CustomerRecord, CUSTOMER),
+        (CustomerRecord, {**CUSTOMER, 'goal': {**CUSTOMER['goal'], 'tolerance': 0.05, 'rules': ['meals >= 3']}}),
+        (RecipeRecord, RECIPE),
+        (DietPlanRecord, DIET_PLAN),
+        (ProductionBatchRecord, PRODUCTION_BATCH),
+    ])
+    def test_roundtrip(self, record_type, data):
+        """Test that dict and persisted state conversions are lossless"""
+        record = record_type.from_dict(data)
+        assert record.to_dict() == data
+        assert record_type.from_state(record.to_state()) == record
+        assert not hasattr(record, '__dict__')
+
+    def test_meal_columns(self):
+        """Test that meals are stored column-wise with one byte per type"""
+        plan = DietPlanRecord.from_dict(DIET_PLAN)
+        assert plan.meal_types == bytes([MEAL_TYPES.index('BREAKFAST'), MEAL_TYPES.index('DINNER')])
+        assert plan.meal_recipes.tolist() == [8, 3]
+        assert list(plan.meals) == [('BREAKFAST', 8, 1), ('DINNER', 3, 2)]
+
+    def test_fractional_portions_are_fixed_point(self):
+        """Test that portions are stored in thousandths and whole ones keep their JSON shape"""
+        plan = DietPlanRecord.from_dict({**DIET_PLAN, 'meals': [{'type': 'LUNCH', 'recipeId': 8, 'portion': 1.25},
+                                                                 {'type': 'DINNER', 'recipeId': 3, 'portion': 2.0}]})
+        assert plan.meal_portions.tolist() == [1250, 2000]
+        assert [m['portion'] for m in plan.to_dict()['meals']] == [1.25, 2]
+        assert type(plan.to_dict()['meals'][1]['portion']) is int
+
+    def test_state_before_fractional_portions(self):
+        """Test that persisted states of whole portions and without portionGrams still load"""
+        plan = DietPlanRecord.from_dict(DIET_PLAN)
+        legacy = plan.to_state()[:-1]
+        legacy[5] = array('q', [1, 2]).tobytes()  # whole portions
+        assert DietPlanRecord.from_state(legacy) == plan
+        recipe = RecipeRecord.from_state(RecipeRecord.from_dict(RECIPE).to_state()[:4])
+        assert recipe.portionGrams is None and recipe.nutrition == (420, 18, 55, 14)
+
+    def test_state_before_goal_rules(self):
+        """Test that persisted customers without tolerance and rules get the default band"""
+        customer = CustomerRecord.from_dict(CUSTOMER)
+        assert CustomerRecord.from_state(customer.to_state()[:6]) == customer
+        assert (customer.tolerance, customer.rules) == (GOAL_TOLERANCE, ())
+        assert 'tolerance' not in customer.to_dict()['goal']
+
+    def test_other_meal_types_are_kept_by_name(self):
+        """Test that a plan with a type outside the usual ones stores names, without a shared type table"""
+        meals = [{'type': 'BRUNCH', 'recipeId': 1}, {'type': 'LUNCH', 'recipeId': 2}]
+        plan = DietPlanRecord.from_dict({'id': 1, 'customerId': 2, 'date': '2030-01-01', 'meals': meals})
+        assert plan.meal_types == ('BRUNCH', 'LUNCH') and 'BRUNCH' not in MEAL_TYPES
+        assert DietPlanRecord.from_state(plan.to_state()) == plan
+        assert [m['type'] for m in plan.to_dict()['meals']] == ['BRUNCH', 'LUNCH']
+
+    def test_update_in_place(self):
+        """Test that update changes slots on the same object"""
+        recipe = RecipeRecord.from_dict(RECIPE)
+        recipe.update(RecipeRecord.fields('Bowl', ['rice'], (1, 2, 3, 4)))
+        assert recipe.to_dict()['nutrition'] == {'calories': 1, 'protein': 2, 'carbs': 3, 'fat': 4}
+        assert recipe != RecipeRecord.from_dict(RECIPE)
+        assert 'Bowl' in repr(recipe)
+
+
+class TestRecordsThroughApi:
+    """Test that endpoints still speak the original JSON shape"""
+
+    def test_diet_plan_roundtrip(self, client, auth_headers):
+        """Test that a created diet plan is returned unchanged"""
+        body = dict({k: v for k, v in DIET_PLAN.items() if k != 'id'}, customerId=2)
+        response = client.post("/diet-plans", json=body, headers=auth_headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        plan_id = response.json()["id"]
+
+        response = client.get(f"/diet-plans/{plan_id}", headers=auth_headers)
+        assert response.json() == dict(body, id=plan_id)
@@ -0,0 +1,187 @@
+"""
+Unit tests for reverse references and delete policies
+Coverage: recipe usage, restrict/cascade/allow deletes, batch index
+"""
+import threading
+
+import pytest
+from fastapi import status
+
+import main
+from indexes import BatchIndex
+from records import ProductionBatchRecord
+from store import Collection
+
+NUTRITION = {"calories": 500, "protein": 25, "carbs": 60, "fat": 15}
+
+
+@pytest.fixture
+def linked(client, auth_headers):
+    """A customer with a plan using two recipes, and a batch for that plan"""
+    response = client.post("/customers", json={
+        "name": "Linked", "email": "linked@example.com", "restrictions": [], "goal": NUTRITION
+    }, headers=auth_headers)
+    customer_id = response.json()["id"]
+    recipe_ids = [
+        client.post("/recipes", json={"name": name, "nutrition": NUTRITION}, headers=auth_headers).json()["id"]
+        for name in ("Kept", "Dropped")
+    ]
+    response = client.post("/diet-plans", json={
+        "customerId": customer_id, "date": "2025-04-01",
+        "meals": [{"type": "LUNCH", "recipeId": r, "portion": 1} for r in recipe_ids]
+    }, headers=auth_headers)
+    plan_id = response.json()["id"]
+    response = client.post("/production-batches", json={
+        "productionDate": "2025-04-01", "dietPlans": [plan_id, 1],
+        "recipeBatches": [{"recipeId": r, "portions": 3} for r in recipe_ids]
+    }, headers=auth_headers)
+    return customer_id, recipe_ids, plan_id, response.json()["id"]
+
+
+class TestRecipeUsage:
+    """Test the recipe usage endpoint"""
+
+    def test_usage(self, client, auth_headers, linked):
+        """Test plans and batches referencing a recipe"""
+        _, (kept, _), plan_id, batch_id = linked
+        response = client.get(f"/recipes/{kept}/usage", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {
+            "recipeId": kept, "inUse": True, "dietPlans": [plan_id], "productionBatches": [batch_id]
+        }
+
+    def test_unused_and_unknown(self, client, auth_headers):
+        """Test a recipe nobody references and a missing recipe"""
+        recipe_id = client.post("/recipes", json={"name": "Lonely", "nutrition": NUTRITION},
+                                headers=auth_headers).json()["id"]
+        usage = client.get(f"/recipes/{recipe_id}/usage", headers=auth_headers).json()
+        assert (usage["inUse"], usage["dietPlans"], usage["productionBatches"]) == (False, [], [])
+        response = client.get("/recipes/999/usage", headers=auth_headers)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestDeletePolicies:
+    """Test allow/restrict/cascade deletes"""
+
+    def test_default_allows_dangling_references(self, client, auth_headers, linked):
+        """Test that without a policy deletes behave as before"""
+        _, (kept, _), plan_id, _ = linked
+        response = client.delete(f"/recipes/{kept}", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        meals = client.get(f"/diet-plans/{plan_id}", headers=auth_headers).json()["meals"]
+        assert kept in [m["recipeId"] for m in meals]
+
+    def test_restrict(self, client, auth_headers, linked):
+        """Test that restrict refuses referenced records and keeps them"""
+        customer_id, (kept, _), plan_id, _ = linked
+        for path in (f"/recipes/{kept}", f"/customers/{customer_id}", f"/diet-plans/{plan_id}"):
+            response = client.delete(f"{path}?references=restrict", headers=auth_headers)
+            assert response.status_code == status.HTTP_409_CONFLICT
+            assert "referenced by 1" in response.json()["detail"]
+            assert client.get(path, headers=auth_headers).status_code == status.HTTP_200_OK
+
+        recipe_id = client.post("/recipes", json={"name": "Free", "nutrition": NUTRITION},
+                                headers=auth_headers).json()["id"]
+        response = client.delete(f"/recipes/{recipe_id}?references=restrict", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.parametrize("write", ["create", "patch"])
+    def test_restrict_racing_plan_writes(self, client, auth_headers, linked, monkeypatch, write):
+        """Test that a restrict delete of a customer cannot slip in while a plan is being pointed at them"""
+        _, _, plan_id, _ = linked
+        customer_id = client.post("/customers", json={
+            "name": "Racing", "email": "racing@example.com", "goal": NUTRITION}, headers=auth_headers).json()["id"]
+        paused, resume = threading.Event(), threading.Event()
+        meal_fields = main.meal_fields
+
+        def pausing_meal_fields(plan):  # runs after the customer check, before the plan is written
+            paused.set()
+            resume.wait(5)
+            return meal_fields(plan)
+
+        monkeypatch.setattr(main, "meal_fields", pausing_meal_fields)
+        responses = {}
+        if write == "create":
+            request = lambda: client.post("/diet-plans", json={
+                "customerId": customer_id, "date": "2025-04-02", "meals": []}, headers=auth_headers)
+        else:
+            request = lambda: client.patch(f"/diet-plans/{plan_id}", json={"customerId": customer_id},
+                                           headers={**auth_headers, "Content-Type": main.MERGE_PATCH})
+        writer = threading.Thread(target=lambda: responses.update(write=request()))
+        deleter = threading.Thread(target=lambda: responses.update(delete=client.delete(
+            f"/customers/{customer_id}?references=restrict", headers=auth_headers)))
+        writer.start()
+        assert paused.wait(5)
+        deleter.start()
+        deleter.join(0.2)
+        resume.set()
+        writer.join()
+        deleter.join()
+        assert responses["write"].status_code in (status.HTTP_200_OK, status.HTTP_201_CREATED)
+        assert responses["delete"].status_code == status.HTTP_409_CONFLICT
+
+    def test_cascade_recipe(self, client, auth_headers, linked):
+        """Test that cascading a recipe drops its meals and batch lines"""
+        _, (kept, dropped), plan_id, batch_id = linked
+        response = client.delete(f"/recipes/{dropped}?references=cascade", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        plan = client.get(f"/diet-plans/{plan_id}", headers=auth_headers).json()
+        assert [m["recipeId"] for m in plan["meals"]] == [kept]
+        batch = client.get(f"/production-batches/{batch_id}", headers=auth_headers).json()
+        assert batch["recipeBatches"] == [{"recipeId": kept, "portions": 3}]
+
+    def test_cascade_customer(self, client, auth_headers, linked):
+        """Test that cascading a customer deletes their plans and unlists them from batches"""
+        customer_id, (kept, _), plan_id, batch_id = linked
+        response = client.delete(f"/customers/{customer_id}?references=cascade", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert client.get(f"/diet-plans/{plan_id}", headers=auth_headers).status_code == 404
+        batch = client.get(f"/production-batches/{batch_id}", headers=auth_headers).json()
+        assert batch["dietPlans"] == [1]
+        assert client.get(f"/recipes/{kept}/usage", headers=auth_headers).json()["dietPlans"] == []
+
+    def test_server_default_policy(self, client, auth_headers, linked, monkeypatch):
+        """Test DIET_API_DELETE_POLICY and overriding it per request"""
+        _, _, plan_id, _ = linked
+        monkeypatch.setattr(main, "DELETE_POLICY", "restrict")
+        response = client.delete(f"/diet-plans/{plan_id}", headers=auth_headers)
+        assert response.status_code == status.HTTP_409_CONFLICT
+        response = client.delete(f"/diet-plans/{plan_id}?references=allow", headers=auth_headers)
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_errors(self, client, auth_headers):
+        """Test unknown records and an invalid policy"""
+        for path in ("/customers/999", "/recipes/999", "/diet-plans/999"):
+            response = client.delete(f"{path}?references=cascade", headers=auth_headers)
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+        response = client.delete("/recipes/1?references=sometimes", headers=auth_headers)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestBatchIndex:
+    """Test the production batch reverse indexes"""
+
+    def test_incremental_maintenance(self):
+        """Test inserts, in-place updates, deletes and clear"""
+        def batch(batch_id, plan_ids, recipe_ids):
+            fields = ProductionBatchRecord.fields('2025-01-01', plan_ids, [(r, 1) for r in recipe_ids])
+            return ProductionBatchRecord(batch_id, **fields)
+
+        batches = Collection('production_batches', ProductionBatchRecord, [batch(1, [1, 2], [5])])
+        index = BatchIndex(batches)
+        batches.listeners.append(index.on_change)
+
+        assert index.batches_with_plan(2) == {1}
+        batches.insert(batch(2, [2], [5, 6]))
+        assert index.batches_with_plan(2) == {1, 2}
+        assert index.batches_using_recipe(5) == {1, 2}
+
+        batches.update(1, ProductionBatchRecord.fields('2025-01-01', [3], []))
+        assert index.batches_with_plan(1) == set()
+        assert index.batches_using_recipe(5) == {2}
+
+        batches.delete(2)
+        assert index.by_plan == {3: {1}}
+        assert index.by_recipe == {}
+        batches.clear()
+        assert index.batches_with_plan(3) == set()
@@ -0,0 +1,159 @@
+"""
+Unit tests for the memory-mapped columnar seed snapshot
+Coverage: file roundtrip, lazy collections, app startup wiring, deferred imports
+"""
+import subprocess
+import sys
+
+import pytest
+from fastapi import status
+
+from columnar import ColumnarSnapshot, write_snapshot
+from records import RecipeRecord
+from search import RecipeIndex
+from store import Collection
+
+SEED = {
+    'customers': [
+        {
+            'id': 10,
+            'name': 'Seeded',
+            'email': 'seeded@example.com',
+            'phone': '555-0100',
+            'restrictions': [
+                {'type': 'Vegan', 'description': 'No animal products'},
+                {'type': 'Allergy', 'description': 'Peanut allergy'}
+            ],
+            'goal': {'calories': 2100, 'protein': 90, 'carbs': 260, 'fat': 70,
+                     'tolerance': 0.15, 'rules': ['max(meal.calories) <= 800']}
+        },
+        {
+            'id': 11,
+            'name': 'Ünicode',
+            'email': 'u@example.com',
+            'phone': '',
+            'restrictions': [],
+            'goal': {'calories': 1500, 'protein': 70, 'carbs': 150, 'fat': 50, 'tolerance': None, 'rules': []}
+        }
+    ],
+    'recipes': [
+        {
+            'id': 20,
+            'name': 'Seeded Salmon',
+            'ingredients': ['salmon fillet', 'rice'],
+            'nutrition': {'calories': 480, 'protein': 35, 'carbs': 40, 'fat': 18.5},
+            'portionGrams': 320
+        },
+        {
+            'id': 21,
+            'name': 'Plain Water',
+            'ingredients': [],
+            'nutrition': {'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0},
+            'portionGrams': None
+        }
+    ]
+}
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / 'seed.col')
+    write_snapshot(path, SEED)
+    return path
+
+
+class TestColumnarSnapshot:
+    """Test the snapshot file format"""
+
+    def test_roundtrip(self, snapshot_path):
+        """Test that materialized rows equal the written records"""
+        snapshot = ColumnarSnapshot(snapshot_path)
+        assert snapshot['customers'].materialize() == SEED['customers']
+        assert snapshot['recipes'].materialize() == SEED['recipes']
+        assert len(snapshot['recipes']) == 2
+        assert snapshot['customers'].max_id == 11
+        snapshot.close()
+
+    def test_partial_snapshot(self, tmp_path):
+        """Test a snapshot holding only some tables"""
+        path = str(tmp_path / 'recipes.col')
+        write_snapshot(path, {'recipes': SEED['recipes']})
+        snapshot = ColumnarSnapshot(path)
+        assert 'recipes' in snapshot
+        assert 'customers' not in snapshot
+        snapshot.close()
+
+    def test_invalid_file(self, tmp_path):
+        """Test that a non-snapshot file is rejected"""
+        path = tmp_path / 'bogus.col'
+        path.write_bytes(b'not columnar at all')
+        with pytest.raises(ValueError):
+            ColumnarSnapshot(str(path))
+
+
+class TestLazyCollection:
+    """Test collections that decode their records on first access"""
+
+    def test_loader_runs_on_first_access(self):
+        """Test that the loader is deferred until the collection is read"""
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return map(RecipeRecord.from_dict, SEED['recipes'])
+
+        recipes = Collection('recipes', RecipeRecord, loader=loader)
+        assert not recipes.loaded
+        assert calls == []
+        assert recipes.get(20).name == 'Seeded Salmon'
+        assert len(recipes) == 2
+        assert recipes.loaded
+        assert calls == [1]
+
+    def test_index_builds_from_deferred_source(self):
+        """Test that a lazy recipe index sees records loaded later"""
+        tofu = RecipeRecord(1, **RecipeRecord.fields('Tofu', ['tofu'], (0, 0, 0, 0)))
+        recipes = Collection('recipes', RecipeRecord, [tofu])
+        index = RecipeIndex(recipes)
+        recipes.listeners.append(index.on_change)
+        assert [r.id for r in index.search(['tofu'])] == [1]
+
+        recipes.defer(lambda: map(RecipeRecord.from_dict, SEED['recipes']))
+        assert not recipes.loaded
+        assert [r.id for r in index.search(['salmon'])] == [20]
+        assert len(index) == 2
+
+
+class TestAppSeedSnapshot:
+    """Test serving seed data from a snapshot"""
+
+    def test_load_seed_snapshot(self, client, auth_headers, reset_data, snapshot_path):
+        """Test that the API serves and extends snapshot data"""
+        import main
+        snapshot = main.load_seed_snapshot(snapshot_path)
+        try:
+            assert not main.recipes.loaded
+            response = client.get("/recipes/search?ingredient=salmon", headers=auth_headers)
+            assert [r["id"] for r in response.json()] == [20]
+
+            response = client.get("/customers/10", headers=auth_headers)
+            assert response.json()["restrictions"][1]["description"] == "Peanut allergy"
+            assert response.json()["goal"]["rules"] == ["max(meal.calories) <= 800"]
+            assert "tolerance" not in client.get("/customers/11", headers=auth_headers).json()["goal"]
+
+            new_recipe = {
+                "name": "After Seed",
+                "nutrition": {"calories": 100, "protein": 5, "carbs": 10, "fat": 2}
+            }
+            response = client.post("/recipes", json=new_recipe, headers=auth_headers)
+            assert response.status_code == status.HTTP_201_CREATED
+            assert response.json()["id"] == 22
+        finally:
+            main.seed_snapshot = None
+            snapshot.close()
+
+    def test_heavy_imports_deferred(self):
+        """Test that importing the app does not load jose or passlib"""
+        code = "import sys, main; print('jose' in sys.modules, 'passlib.context' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        assert result.stdout.split() == ["False", "False"]
@@ -0,0 +1,142 @@
+"""
+Unit tests for rotating refresh tokens
+Coverage: issue/rotate, reuse detection, revocation, expiry and purge,
+the /token/refresh and /token/revoke endpoints, logout everywhere
+"""
+import pytest
+from fastapi import status
+
+import main
+import sessions
+from sessions import InvalidRefreshToken, RefreshTokenStore
+
+
+class TestRefreshTokenStore:
+    """Test the store on its own"""
+
+    def test_rotate(self):
+        """Test that a token is exchanged once for a replacement in the same session"""
+        store = RefreshTokenStore()
+        first = store.issue("alice")
+        username, second = store.rotate(first)
+        assert username == "alice" and second != first
+        assert store.rotate(second)[0] == "alice"
+        assert store.sessions("alice") == 1 and store.rotated == 2
+
+    def test_only_digests_are_stored(self):
+        """Test that the database never holds the token itself"""
+        store = RefreshTokenStore()
+        token = store.issue("alice")
+        rows = store._db.execute("SELECT * FROM refresh_tokens").fetchall()
+        assert token not in str(rows) and token.encode() not in rows[0]
+
+    def test_reuse_revokes_session(self):
+        """Test that presenting a spent token ends the whole session, other sessions untouched"""
+        store = RefreshTokenStore()
+        stolen = store.issue("alice")
+        other = store.issue("alice")
+        _, current = store.rotate(stolen)
+        with pytest.raises(InvalidRefreshToken):
+            store.rotate(stolen)
+        with pytest.raises(InvalidRefreshToken):
+            store.rotate(current)
+        assert store.reused == 1 and store.sessions("alice") == 1
+        assert store.rotate(other)[0] == "alice"
+
+    def test_revoke(self):
+        """Test ending one session and every session of a user"""
+        store = RefreshTokenStore()
+        a1, a2, b = store.issue("alice"), store.issue("alice"), store.issue("bob")
+        assert store.revoke(a1) is True and store.revoke(a1) is False
+        with pytest.raises(InvalidRefreshToken):
+            store.rotate(a1)
+        store.issue("alice")
+        assert store.revoke_user("alice") == 2
+        with pytest.raises(InvalidRefreshToken):
+            store.rotate(a2)
+        assert store.sessions() == 1 and store.rotate(b)[0] == "bob"
+
+    def test_expiry_and_purge(self, monkeypatch):
+        """Test that expired tokens are refused and purged through the expiry index"""
+        store = RefreshTokenStore(ttl=60)
+        token = store.issue("alice")
+        now = sessions.time.time()
+        monkeypatch.setattr(sessions.time, "time", lambda: now + 61)
+        with pytest.raises(InvalidRefreshToken):
+            store.rotate(token)
+        store.issue("bob")
+        assert store._db.execute("SELECT COUNT(*) FROM refresh_tokens").fetchone()[0] == 1
+        plan = store._db.execute("EXPLAIN QUERY PLAN DELETE FROM refresh_tokens WHERE expires <= 0").fetchall()
+        assert "refresh_tokens_expires" in str(plan)
+
+    def test_persistent_file(self, tmp_path):
+        """Test that sessions survive reopening the database file"""
+        path = str(tmp_path / "users.sqlite3")
+        token = RefreshTokenStore(path).issue("alice")
+        assert RefreshTokenStore(path).rotate(token)[0] == "alice"
+
+
+class TestRefreshEndpoints:
+    """Test the refresh flow through the API"""
+
+    def login(self, client, username="admin", password="secret"):
+        return client.post("/login", data={"username": username, "password": password}).json()
+
+    def test_login_returns_refresh_token(self, client, reset_data):
+        """Test that /login starts a session"""
+        tokens = self.login(client)
+        assert tokens["refresh_token"] and tokens["token_type"] == "bearer"
+        assert main.refresh_tokens.sessions("admin") == 1
+
+    def test_refresh_without_password_hash(self, client, reset_data, monkeypatch):
+        """Test that refreshing rotates the tokens and never verifies a password"""
+        tokens = self.login(client)
+        monkeypatch.setattr(main, "verify_password", lambda *args: pytest.fail("bcrypt on refresh"))
+        response = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+        assert response.status_code == status.HTTP_200_OK
+        renewed = response.json()
+        assert renewed["refresh_token"] != tokens["refresh_token"]
+        headers = {"Authorization": f"Bearer {renewed['access_token']}"}
+        assert client.get("/users/me", headers=headers).json()["username"] == "admin"
+
+    def test_replayed_token_is_rejected(self, client, reset_data):
+        """Test that replaying a spent refresh token gets 401 and logs the session out"""
+        tokens = self.login(client)
+        renewed = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]}).json()
+        replay = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+        assert replay.status_code == status.HTTP_401_UNAUTHORIZED
+        again = client.post("/token/refresh", json={"refresh_token": renewed["refresh_token"]})
+        assert again.status_code == status.HTTP_401_UNAUTHORIZED
+        assert "diet_api_refresh_reuse_total" in client.get("/metrics").text
+
+    def test_invalid_token(self, client, reset_data):
+        """Test that unknown tokens get 401 and a missing one 422"""
+        response = client.post("/token/refresh", json={"refresh_token": "nope"})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        assert client.post("/token/refresh", json={}).status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_disabled_user_cannot_refresh(self, client, reset_data):
+        """Test that a disabled account loses its session on the next refresh"""
+        client.post("/register", json={"username": "temp", "password": "pw"})
+        tokens = self.login(client, "temp", "pw")
+        main.users_db["temp"] = {**main.users_db["temp"], "disabled": True}
+        response = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        assert main.refresh_tokens.sessions("temp") == 0
+
+    def test_logout(self, client, reset_data):
+        """Test that /token/revoke ends the session and ignores unknown tokens"""
+        tokens = self.login(client)
+        assert client.post("/token/revoke", json=tokens).status_code == status.HTTP_204_NO_CONTENT
+        assert client.post("/token/revoke", json=tokens).status_code == status.HTTP_204_NO_CONTENT
+        response = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_logout_everywhere(self, client, reset_data):
+        """Test that DELETE /users/me/sessions ends every session of the user"""
+        first, second = self.login(client), self.login(client)
+        headers = {"Authorization": f"Bearer {second['access_token']}"}
+        assert client.delete("/users/me/sessions", headers=headers).json() == {"revoked": 2}
+        for tokens in (first, second):
+            response = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+            assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -0,0 +1,151 @@
+"""
+Unit tests for request coalescing
+Coverage: shared execution and errors, generation keys, coalesced endpoints, metrics
+"""
+import threading
+import time
+
+import main
+from records import RecipeRecord
+from singleflight import SingleFlight
+from store import Collection
+from tests.test_metrics import sample
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def run_concurrently(n, target):
+    results = [None] * n
+
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as exc:  # surfaced in the assertions
+            results[i] = exc
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+class TestSingleFlight:
+    """Test the single-flight primitive"""
+
+    def test_concurrent_calls_share_one_execution(self):
+        """Test that callers arriving mid-flight get the leader's result"""
+        flight = SingleFlight()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            wait_for(lambda: flight.coalesced.get('op') == 4)
+            return {'answer': 42}
+
+        results = run_concurrently(5, lambda: flight.do('op', 'k', compute))
+        assert calls == [1]
+        assert all(r is results[0] for r in results)
+        assert (flight.executed, flight.coalesced) == ({'op': 1}, {'op': 4})
+        assert flight.do('op', 'k', compute) == {'answer': 42}
+        assert calls == [1, 1]
+
+    def test_errors_are_shared(self):
+        """Test that waiters see the leader's exception"""
+        flight = SingleFlight()
+
+        def failing():
+            wait_for(lambda: flight.coalesced.get('op') == 2)
+            raise ValueError('boom')
+
+        results = run_concurrently(3, lambda: flight.do('op', 'k', failing))
+        assert all(isinstance(r, ValueError) for r in results)
+        assert flight._calls == {}
+
+    def test_keys_are_separate(self):
+        """Test that different keys or ops do not coalesce"""
+        flight = SingleFlight()
+        assert flight.do('a', 1, lambda: 1) == 1
+        assert flight.do('a', 2, lambda: 2) == 2
+        assert flight.do('b', 1, lambda: 3) == 3
+        assert flight.coalesced == {}
+        flight.reset()
+        assert flight.executed == {}
+
+
+class TestGeneration:
+    """Test collection write generations"""
+
+    def test_every_write_bumps_generation(self):
+        """Test inserts, effective updates, deletes and bulk loads"""
+        recipes = Collection('recipes', RecipeRecord)
+        recipes.extend([RecipeRecord(1, 'A', (), (0, 0, 0, 0))])
+        assert recipes.generation == 1
+        recipes.listeners.append(lambda *args: None)
+        recipes.insert(RecipeRecord(2, 'B', (), (0, 0, 0, 0)))
+        recipes.update(2, {'name': 'B'})
+        assert recipes.generation == 2
+        recipes.update(2, {'name': 'C'})
+        recipes.delete(1)
+        recipes.clear()
+        assert recipes.generation == 5
+
+
+class TestCoalescedEndpoints:
+    """Test coalescing through the API"""
+
+    def test_concurrent_validations(self, client, auth_headers, monkeypatch):
+        """Test that simultaneous validations of one plan evaluate it once"""
+        original = main.evaluate_plan
+        before = main.single_flight.coalesced.get('validate', 0)
+        calls = []
+
+        def slow_evaluate(plan, customer):
+            calls.append(plan.id)
+            wait_for(lambda: main.single_flight.coalesced.get('validate', 0) - before >= 3)
+            return original(plan, customer)
+
+        monkeypatch.setattr(main, 'evaluate_plan', slow_evaluate)
+        responses = run_concurrently(4, lambda: client.post("/diet-plans/1/validate", headers=auth_headers))
+        assert [r.status_code for r in responses] == [200] * 4
+        assert all(r.json() == responses[0].json() for r in responses)
+        assert calls == [1]
+
+    def test_lists_follow_writes(self, client, auth_headers):
+        """Test that a list requested after a write includes it"""
+        before = client.get("/recipes", headers=auth_headers).json()
+        created = client.post("/recipes", json={
+            "name": "Fresh", "nutrition": {"calories": 1, "protein": 1, "carbs": 1, "fat": 1}
+        }, headers=auth_headers).json()
+        after = client.get("/recipes", headers=auth_headers).json()
+        assert after == before + [created]
+        plans = client.get("/diet-plans?customerId=1", headers=auth_headers).json()
+        assert plans and all(p["customerId"] == 1 for p in plans)
+
+    def test_list_body_is_kept_until_a_write(self, client, auth_headers):
+        """Test that repeated list reads reuse the serialized body of the current generation"""
+        first = client.get("/customers", headers=auth_headers)
+        executed = main.single_flight.executed.get('list_customers', 0)
+        second = client.get("/customers", headers=auth_headers)
+        assert second.content == first.content
+        assert main.single_flight.executed.get('list_customers', 0) == executed
+        client.post("/customers", json={"name": "New", "email": "new@example.com",
+                                        "goal": {"calories": 1, "protein": 1, "carbs": 1, "fat": 1}},
+                    headers=auth_headers)
+        third = client.get("/customers", headers=auth_headers)
+        assert len(third.json()) == len(first.json()) + 1
+        assert main.single_flight.executed['list_customers'] == executed + 1
+
+    def test_metrics(self, client, auth_headers):
+        """Test that executed and coalesced calls are exported per operation"""
+        client.get("/production-batches", headers=auth_headers)
+        text = client.get("/metrics").text
+        assert sample(text, 'diet_api_singleflight_calls_total', op='list_production_batches',
+                      result='executed') >= 1
+        assert sample(text, 'diet_api_singleflight_calls_total', op='list_production_batches',
+                      result='coalesced') is not None
@@ -0,0 +1,135 @@
+"""
+Unit tests for the SQLite user store
+Coverage: mapping interface, email index, persistence across reopen, user cache,
+concurrent registration, app integration
+"""
+import threading
+
+import pytest
+from fastapi import status
+
+import main
+from users import UserStore
+
+ALICE = {"username": "alice", "email": "alice@example.com", "full_name": "Alice",
+         "hashed_password": "h1", "disabled": False}
+
+
+class TestUserStore:
+    """Test the store on its own"""
+
+    def test_mapping_interface(self):
+        """Test that the store behaves like the old username -> fields dict"""
+        store = UserStore()
+        store["alice"] = ALICE
+        assert "alice" in store and "bob" not in store
+        assert store["alice"] == ALICE
+        assert dict(store) == {"alice": ALICE}
+        store.update({"bob": {**ALICE, "username": "bob", "disabled": True}})
+        assert list(store) == ["alice", "bob"] and len(store) == 2
+        assert store["bob"]["disabled"] is True
+        del store["alice"]
+        with pytest.raises(KeyError):
+            del store["alice"]
+        with pytest.raises(KeyError):
+            store["alice"]
+        store.clear()
+        assert len(store) == 0
+
+    def test_failed_bulk_update_is_rolled_back(self):
+        """Test that update() applies all rows or none"""
+        store = UserStore()
+        with pytest.raises(KeyError):
+            store.update({"alice": ALICE, "bad": {"username": "bad"}})
+        assert len(store) == 0
+
+    def test_find_by_email(self):
+        """Test the email index"""
+        store = UserStore()
+        store.add(ALICE)
+        assert store.find_by_email("alice@example.com")["username"] == "alice"
+        assert store.find_by_email("nobody@example.com") is None
+        plan = store._db.execute("EXPLAIN QUERY PLAN SELECT * FROM users WHERE email = ?", ("x",)).fetchall()
+        assert "users_email" in str(plan)
+
+    def test_add_does_not_overwrite(self):
+        """Test that add() is insert-if-absent"""
+        store = UserStore()
+        assert store.add(ALICE) is True
+        assert store.add({**ALICE, "hashed_password": "other"}) is False
+        assert store["alice"]["hashed_password"] == "h1"
+
+    def test_persistent_file(self, tmp_path):
+        """Test that users survive reopening the database file"""
+        path = str(tmp_path / "users.sqlite3")
+        store = UserStore(path)
+        store.add(ALICE)
+        store.close()
+        assert UserStore(path)["alice"] == ALICE
+
+    def test_cache(self):
+        """Test that parsed users are cached, bounded and invalidated by writes"""
+        built = []
+        store = UserStore(factory=lambda fields: built.append(fields) or fields, cache_size=1)
+        store.add(ALICE)
+        store.add({**ALICE, "username": "bob"})
+        assert store.get_user("alice") is store.get_user("alice")
+        assert (store.hits, store.misses, len(built)) == (1, 1, 1)
+        assert "alice" in store
+        store["alice"] = {**ALICE, "full_name": "Alice B"}
+        assert store.get_user("alice")["full_name"] == "Alice B"
+        store.get_user("bob")
+        assert list(store._cache) == ["bob"]
+        assert store.get_user("nobody") is None
+        del store["bob"]
+        assert store.get_user("bob") is None
+
+    def test_concurrent_adds(self):
+        """Test that exactly one of many concurrent registrations of a name wins"""
+        store = UserStore()
+        results = []
+        barrier = threading.Barrier(8)
+
+        def register(i):
+            barrier.wait()
+            results.append(store.add({**ALICE, "hashed_password": f"h{i}"}))
+
+        threads = [threading.Thread(target=register, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results.count(True) == 1 and len(store) == 1
+
+
+class TestAppUsers:
+    """Test the store behind the auth endpoints"""
+
+    def test_auth_uses_cached_user(self, client, auth_headers):
+        """Test that repeated authenticated requests hit the user cache"""
+        client.get("/users/me", headers=auth_headers)
+        before = main.users_db.hits
+        for _ in range(3):
+            assert client.get("/users/me", headers=auth_headers).json()["username"] == "admin"
+        assert main.users_db.hits >= before + 3
+        assert f"diet_api_user_cache_hits_total {main.users_db.hits}\n" in client.get("/metrics").text
+
+    def test_register_race_is_rejected(self, client, reset_data, monkeypatch):
+        """Test that a username taken while the password was hashed gets 400, not an overwrite"""
+        def hash_and_lose_race(password):
+            main.users_db["racer"] = {**ALICE, "username": "racer"}
+            return "hashed"
+
+        monkeypatch.setattr(main, "get_password_hash", hash_and_lose_race)
+        response = client.post("/register", json={"username": "racer", "password": "pw"})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert main.users_db["racer"]["hashed_password"] == "h1"
+
+    def test_disabled_user_after_update(self, client, reset_data):
+        """Test that writes through the mapping invalidate the cached user"""
+        client.post("/register", json={"username": "temp", "password": "pw"})
+        token = client.post("/login", data={"username": "temp", "password": "pw"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.get("/users/me", headers=headers).status_code == status.HTTP_200_OK
+        main.users_db["temp"] = {**main.users_db["temp"], "disabled": True}
+        assert client.get("/users/me", headers=headers).status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,149 @@
+"""
+Unit tests for MessagePack content negotiation
+Coverage: Accept negotiation, msgpack responses and request bodies, pre-serialized paths, errors,
+typed response models on the stored-record fast path
+"""
+import fastapi.routing
+import msgpack
+import pytest
+from fastapi import status
+
+import main
+from idempotency import serialize
+from wire import JSON, MSGPACK, negotiate
+
+GOAL = {"calories": 2000, "protein": 100, "carbs": 250, "fat": 70}
+CUSTOMER = {"name": "Packed", "email": "packed@example.com", "goal": GOAL}
+ACCEPT = {"Accept": MSGPACK}
+SEND = {"Content-Type": MSGPACK}
+
+
+def unpack(response):
+    assert response.headers["content-type"] == MSGPACK
+    return msgpack.unpackb(response.content)
+
+
+class TestNegotiation:
+    """Test choosing the response format from Accept"""
+
+    @pytest.mark.parametrize("accept, expected", [
+        ("", JSON),
+        ("*/*", JSON),
+        ("application/json", JSON),
+        ("application/msgpack", MSGPACK),
+        ("application/x-msgpack", MSGPACK),
+        ("application/msgpack, application/json", MSGPACK),
+        ("application/json, application/msgpack;q=0.5", JSON),
+        ("application/json;q=0.5, application/vnd.msgpack", MSGPACK),
+        ("application/msgpack;q=0", JSON),
+        ("application/msgpack;q=x", JSON),
+    ])
+    def test_negotiate(self, accept, expected):
+        """Test that msgpack is used only when asked for at least as much as JSON"""
+        assert negotiate(accept) == expected
+
+
+class TestMsgpackEndpoints:
+    """Test MessagePack on the API"""
+
+    def test_get_by_id(self, client, auth_headers):
+        """Test that a record comes back as the same document in MessagePack"""
+        as_json = client.get("/customers/1", headers=auth_headers)
+        packed = client.get("/customers/1", headers={**auth_headers, **ACCEPT})
+        assert unpack(packed) == as_json.json()
+        assert "Accept" in packed.headers["vary"]
+
+    def test_list_has_own_etag(self, client, auth_headers):
+        """Test that list endpoints serialize per format, with distinct ETags"""
+        as_json = client.get("/recipes", headers=auth_headers)
+        packed = client.get("/recipes", headers={**auth_headers, **ACCEPT})
+        assert unpack(packed) == as_json.json()
+        assert packed.headers["etag"] != as_json.headers["etag"]
+
+    def test_create_from_msgpack(self, client, auth_headers):
+        """Test that a MessagePack body is validated by the same model as JSON"""
+        response = client.post("/customers", content=msgpack.packb(CUSTOMER), headers={**auth_headers, **SEND})
+        assert response.status_code == status.HTTP_201_CREATED
+        created = response.json()
+        assert created["name"] == "Packed" and created["goal"] == GOAL
+        assert main.customers.get(created["id"]).email == "packed@example.com"
+
+    def test_round_trip(self, client, auth_headers):
+        """Test a MessagePack request with a MessagePack response"""
+        plan = {"customerId": 1, "date": "2025-09-01", "meals": [{"type": "LUNCH", "recipeId": 1, "portion": 2}]}
+        response = client.post("/diet-plans", content=msgpack.packb(plan),
+                               headers={**auth_headers, **SEND, **ACCEPT})
+        assert response.status_code == status.HTTP_201_CREATED
+        assert unpack(response)["meals"] == plan["meals"]
+
+    def test_patch_from_msgpack(self, client, auth_headers):
+        """Test that merge patches can be sent as MessagePack"""
+        created = client.post("/customers", json={**CUSTOMER, "email": "patch@example.com"}, headers=auth_headers)
+        response = client.patch(f"/customers/{created.json()['id']}", content=msgpack.packb({"phone": "555"}),
+                                headers={**auth_headers, **SEND})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["phone"] == "555"
+
+    def test_invalid_bodies(self, client, auth_headers):
+        """Test that undecodable and invalid MessagePack bodies get JSON errors"""
+        garbage = client.post("/customers", content=b"\xc1", headers={**auth_headers, **SEND})
+        assert garbage.status_code == status.HTTP_400_BAD_REQUEST
+        invalid = client.post("/customers", content=msgpack.packb({"name": "No goal"}),
+                              headers={**auth_headers, **SEND, **ACCEPT})
+        assert invalid.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert invalid.headers["content-type"] == JSON
+
+    @pytest.mark.parametrize("body", [
+        {**CUSTOMER, "name": b"\xff"},
+        {**CUSTOMER, "restrictions": [{"type": msgpack.ExtType(5, b"x"), "description": "d"}]},
+        {**CUSTOMER, "name": msgpack.Timestamp(0)},
+        {**CUSTOMER, "goal": {1: 2}},
+    ])
+    def test_non_json_values(self, client, auth_headers, body):
+        """Test that bin, ext and timestamp values and non-string keys are a 400, not a server error"""
+        response = client.post("/customers", content=msgpack.packb(body),
+                               headers={**auth_headers, **SEND})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_idempotent_replay(self, client, auth_headers):
+        """Test that a stored create response is replayed in the requested format"""
+        headers = {**auth_headers, **SEND, "Idempotency-Key": "packed-1"}
+        body = msgpack.packb({**CUSTOMER, "email": "replay@example.com"})
+        first = client.post("/customers", content=body, headers=headers)
+        replay = client.post("/customers", content=body, headers={**headers, **ACCEPT})
+        assert replay.headers["Idempotent-Replayed"] == "true"
+        assert unpack(replay) == first.json()
+
+    def test_change_poll(self, client, auth_headers):
+        """Test that long-poll results can be MessagePack"""
+        since = main.change_feed.seq
+        client.post("/customers", json={**CUSTOMER, "email": "feed@example.com"}, headers=auth_headers)
+        response = client.get(f"/changes?since={since}&timeout=0", headers={**auth_headers, **ACCEPT})
+        result = unpack(response)
+        assert result["missed"] is False
+        assert result["events"][0]["data"]["email"] == "feed@example.com"
+
+
+class TestTypedResponses:
+    """Test response models on the stored-record fast path"""
+
+    def test_response_models_are_documented(self, client):
+        """Test that record endpoints declare their response schema"""
+        paths = client.get("/openapi.json").json()["paths"]
+        schema = paths["/customers/{customer_id}"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert schema == {"$ref": "#/components/schemas/Customer"}
+        listed = paths["/recipes"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert listed["items"] == {"$ref": "#/components/schemas/Recipe"}
+
+    def test_stored_records_skip_response_validation(self, client, auth_headers, monkeypatch):
+        """Test that stored records bypass response-model validation and the generic encoder"""
+        async def fail(*args, **kwargs):
+            raise AssertionError("response went through serialize_response")
+
+        monkeypatch.setattr(fastapi.routing, "serialize_response", fail)
+        for path in ("/customers/1", "/recipes/1", "/diet-plans/1", "/production-batches/1", "/recipes"):
+            response = client.get(path, headers=auth_headers)
+            assert response.status_code == status.HTTP_200_OK
+        assert response.json()
+        single = client.get("/customers/1", headers=auth_headers)
+        assert single.content == serialize(main.customers.get(1).to_dict())
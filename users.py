@@ -0,0 +1,164 @@
+"""
+User accounts in SQLite, with a hot cache of parsed user objects
+
+`UserStore` keeps the accounts in a `users` table (primary key username,
+secondary index on email), in a file when given a path so accounts survive
+restarts, or in memory otherwise. It still behaves like the old
+`users_db` dict of username -> user fields (a MutableMapping), so callers
+and test fixtures did not have to change.
+
+Every authenticated request looks its user up, so `get_user` keeps the
+objects built by `factory` (UserInDB in the app) in a bounded LRU and only
+goes to SQLite on a miss; writes invalidate the cached entry. `add` is an
+atomic insert-if-absent, so concurrent registrations of the same username
+cannot overwrite each other.
+"""
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterator, Optional
+
+FIELDS = ('username', 'email', 'full_name', 'hashed_password', 'disabled')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    email TEXT,
+    full_name TEXT,
+    hashed_password TEXT NOT NULL,
+    disabled INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS users_email ON users (email);
+"""
+
+
+def _row(user: dict) -> tuple:
+    return (user['username'], user.get('email'), user.get('full_name'), user['hashed_password'],
+            int(bool(user.get('disabled'))))
+
+
+def _fields(row: tuple) -> dict:
+    return dict(zip(FIELDS, row[:4] + (bool(row[4]),)))
+
+
+class UserStore(MutableMapping):
+    """username -> user fields, stored in SQLite and read through a cache of `factory(fields)`"""
+
+    def __init__(self, path: str = ':memory:', factory: Callable[[dict], Any] = dict, cache_size: int = 10_000):
+        self.path = path
+        self.factory = factory
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        self._cache: 'OrderedDict[str, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def _select(self, where: str, value) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(f'SELECT {", ".join(FIELDS)} FROM users WHERE {where} = ?', (value,)).fetchone()
+        return None if row is None else _fields(row)
+
+    def get_user(self, username: str):
+        """factory(fields) for the user, or None; cached"""
+        with self._lock:
+            user = self._cache.get(username)
+            if user is not None:
+                self._cache.move_to_end(username)
+                self.hits += 1
+                return user
+            self.misses += 1
+            # read and cache under the lock, so a concurrent write cannot be cached over
+            row = self._db.execute(f'SELECT {", ".join(FIELDS)} FROM users WHERE username = ?', (username,)).fetchone()
+            if row is None:
+                return None
+            user = self._cache[username] = self.factory(_fields(row))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return user
+
+    def find_by_email(self, email: str) -> Optional[dict]:
+        return self._select('email', email)
+
+    def add(self, user: dict) -> bool:
+        """Insert unless the username is taken; False if it was"""
+        with self._lock:
+            cursor = self._db.execute('INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?)', _row(user))
+            self._cache.pop(user['username'], None)
+            return cursor.rowcount == 1
+
+    # MutableMapping, as the old dict
+
+    def __getitem__(self, username: str) -> dict:
+        fields = self._select('username', username)
+        if fields is None:
+            raise KeyError(username)
+        return fields
+
+    def __contains__(self, username) -> bool:
+        with self._lock:
+            if username in self._cache:
+                return True
+            return self._db.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone() is not None
+
+    def __setitem__(self, username: str, user: dict):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?)', _row({**user, 'username': username}))
+            self._cache.pop(username, None)
+
+    def __delitem__(self, username: str):
+        with self._lock:
+            cursor = self._db.execute('DELETE FROM users WHERE username = ?', (username,))
+            self._cache.pop(username, None)
+        if cursor.rowcount == 0:
+            raise KeyError(username)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            usernames = [row[0] for row in self._db.execute('SELECT username FROM users ORDER BY username')]
+        return iter(usernames)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM users')
+            self._cache.clear()
+
+    def update(self, other=(), **kwargs):
+        """Bulk upsert in one transaction"""
+        items = list(other.items() if hasattr(other, 'items') else other) + list(kwargs.items())
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?)',
+                                     [_row({**user, 'username': username}) for username, user in items])
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            for username, _ in items:
+                self._cache.pop(username, None)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def render(self) -> str:
+        return '\n'.join([
+            '# HELP diet_api_user_cache_hits_total User lookups answered from the in-memory cache.',
+            '# TYPE diet_api_user_cache_hits_total counter',
+            f'diet_api_user_cache_hits_total {self.hits}',
+            '# HELP diet_api_user_cache_misses_total User lookups that read the user store.',
+            '# TYPE diet_api_user_cache_misses_total counter',
+            f'diet_api_user_cache_misses_total {self.misses}',
+            '# HELP diet_api_user_cache_entries Users held in the cache.',
+            '# TYPE diet_api_user_cache_entries gauge',
+            f'diet_api_user_cache_entries {len(self._cache)}',
+        ]) + '\n'
@@ -0,0 +1,141 @@
+"""
+Wire formats: JSON by default, MessagePack when the client asks for it
+
+`Accept: application/msgpack` (or application/x-msgpack / vnd.msgpack)
+switches the response body of every endpoint to MessagePack, and a
+request body sent with one of those content types is decoded from
+MessagePack. Both sides go through the same Pydantic models as JSON; only
+the bytes differ, and a request body may only hold what JSON can (no bin,
+ext or timestamp values, string map keys). Error responses stay JSON.
+
+`WireFormatRoute` picks the format per request and keeps it in the
+`wire_format` context variable, which `NegotiatedResponse` (the default
+response class) and handlers returning pre-serialized bodies consult.
+"""
+import json
+from contextvars import ContextVar
+from typing import Any
+
+import msgpack
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+
+from idempotency import serialize
+from metrics import metrics
+from ratelimit import AdmissionRoute
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+MSGPACK_TYPES = frozenset({MSGPACK, 'application/x-msgpack', 'application/vnd.msgpack'})
+
+wire_format: ContextVar[str] = ContextVar('wire_format', default=JSON)
+
+
+def negotiate(accept: str) -> str:
+    """MSGPACK if the client accepts it at least as much as JSON (when that is listed), else JSON"""
+    packed = listed_json = None
+    for item in accept.split(','):
+        media, *params = item.strip().split(';')
+        media = media.strip().lower()
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media in MSGPACK_TYPES:
+            packed = max(q, packed or 0.0)
+        elif media == JSON:
+            listed_json = q
+    if packed and (listed_json is None or packed >= listed_json):
+        return MSGPACK
+    return JSON
+
+
+def encode(content: Any, media_type: str) -> bytes:
+    """`content` as compact JSON (see idempotency.serialize) or MessagePack"""
+    if media_type == MSGPACK:
+        return msgpack.packb(content, use_bin_type=True)
+    return serialize(content)
+
+
+def transcode(body: bytes, media_type: str) -> bytes:
+    """Stored JSON bytes in the requested format"""
+    return body if media_type == JSON else encode(json.loads(body), media_type)
+
+
+class NegotiatedResponse(JSONResponse):
+    """Response in the negotiated wire format, encoding timed as the `serialize` operation.
+
+    JSON goes through pydantic-core's serializer rather than json.dumps:
+    same output for the plain data the handlers return, a few times faster.
+    """
+
+    def render(self, content) -> bytes:
+        self.media_type = wire_format.get()
+        with metrics.timer('serialize'):
+            return encode(content, self.media_type)
+
+
+def _no_ext(code: int, data: bytes):
+    raise ValueError(f'MessagePack ext type {code} is not allowed')
+
+
+def _json_types_only(value) -> bool:
+    """Whether a decoded body holds only JSON types (bin decodes to bytes, timestamps to Timestamp)"""
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if not all(type(key) is str for key in value):
+                return False
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif not isinstance(value, (str, int, float, type(None))):
+            return False
+    return True
+
+
+class MsgpackRequest(Request):
+    """Request whose MessagePack body FastAPI validates as if it had been JSON"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, '_json'):
+            try:
+                body = msgpack.unpackb(await self.body(), raw=False, ext_hook=_no_ext)
+            except (ValueError, msgpack.UnpackException):
+                raise HTTPException(status_code=400, detail='Invalid MessagePack body')
+            if not _json_types_only(body):
+                raise HTTPException(status_code=400, detail='MessagePack body may only hold JSON types')
+            self._json = body
+        return self._json
+
+
+def as_json_request(request: Request) -> MsgpackRequest:
+    """Same request, labelled as JSON so FastAPI hands its body to MsgpackRequest.json()"""
+    headers = [(k, JSON.encode() if k == b'content-type' else v) for k, v in request.scope['headers']]
+    return MsgpackRequest({**request.scope, 'headers': headers}, request.receive)
+
+
+class WireFormatRoute(AdmissionRoute):
+    """AdmissionRoute that negotiates the wire format of each request"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def negotiated(request):
+            content_type = request.headers.get('content-type', '').partition(';')[0].strip().lower()
+            if content_type in MSGPACK_TYPES:
+                request = as_json_request(request)
+            token = wire_format.set(negotiate(request.headers.get('accept', '')))
+            try:
+                response = await handler(request)
+            finally:
+                wire_format.reset(token)
+            response.headers.append('Vary', 'Accept')
+            return response
+
+        return negotiated